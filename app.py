@@ -76,14 +76,21 @@ def unauthorized():
         # Redirect to admin login
         return redirect(url_for('auth.admin_login', next=request.url))
 
-with app.app_context():
-    # Import models to ensure tables are created
-    import models
-    db.create_all()
-    
-    # Seed default data (idempotent - safe to run on every startup)
-    from seed_data import seed_all
-    seed_all()
+def init_database():
+    """Crea le tabelle mancanti e carica i dati di default (idempotente)"""
+    with app.app_context():
+        # Import models to ensure tables are created
+        import models
+        db.create_all()
+        
+        # Seed default data (idempotent - safe to run multiple times)
+        from seed_data import seed_all
+        seed_all()
+
+# Con INIT_DB_ON_STARTUP=False i worker partono senza round-trip al database:
+# schema e seed vengono eseguiti una volta al deploy con 'flask init-db'
+if app.config['INIT_DB_ON_STARTUP']:
+    init_database()
 
 # Register tenant context middleware
 from middleware_tenant import load_tenant_context
@@ -201,11 +208,8 @@ def inject_unread_messages_count():
     from flask_login import current_user
     
     if current_user.is_authenticated and (current_user.can_send_messages() or current_user.can_view_messages()):
-        from models import InternalMessage
-        unread_count = InternalMessage.query.filter_by(
-            recipient_id=current_user.id,
-            is_read=False
-        ).count()
-        return dict(unread_messages_count=unread_count)
+        # Riga del contatore per utente, aggiornata a invio e lettura dei messaggi
+        from services.message_inbox import unread_count
+        return dict(unread_messages_count=unread_count(current_user.id))
     
     return dict(unread_messages_count=0)
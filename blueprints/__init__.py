@@ -3,17 +3,59 @@
 # Modular organization of Life routes using Flask Blueprints
 # =============================================================================
 
+from importlib import import_module
+
 from flask import Flask
 
-def register_blueprints(app: Flask):
-    """Register all blueprints with the Flask application"""
-    
-    # Import and register authentication blueprint
-    from .auth import auth_bp
-    app.register_blueprint(auth_bp)
+# Blueprint dell'applicazione: (modulo, nome dell'oggetto Blueprint), in ordine di registrazione.
+# Le librerie pesanti (openpyxl, reportlab, PIL, qrcode, pandas, googlemaps) sono importate
+# dentro le route che le usano, così importare un blueprint costa solo il suo modulo.
+BLUEPRINTS = (
+    ('blueprints.auth', 'auth_bp'),
+    ('blueprints.holidays', 'holidays_bp'),
+    ('blueprints.dashboard', 'dashboard_bp'),
+    ('blueprints.attendance', 'attendance_bp'),
+    ('blueprints.shifts', 'shifts_bp'),
+    ('blueprints.leave', 'leave_bp'),
+    ('blueprints.messages', 'messages_bp'),
+    ('blueprints.reperibilita', 'reperibilita_bp'),
+    ('blueprints.reports', 'reports_bp'),
+    ('blueprints.expense', 'expense_bp'),
+    ('blueprints.user_management', 'user_management_bp'),
+    ('blueprints.hr', 'hr_bp'),
+    ('blueprints.mansioni', 'mansioni_bp'),
+    ('blueprints.ccnl', 'ccnl_bp'),
+    ('blueprints.admin', 'admin_bp'),
+    ('blueprints.presidio', 'presidio_bp'),
+    ('blueprints.export', 'export_bp'),
+    ('blueprints.qr', 'qr_bp'),
+    ('blueprints.interventions', 'interventions_bp'),
+    ('blueprints.aci', 'aci_bp'),
+    ('blueprints.api', 'api_bp'),
+    ('blueprints.session_api', 'session_api_bp'),
+    ('blueprints.banca_ore', 'banca_ore_bp'),
+    ('blueprints.companies', 'companies_bp'),
+    ('blueprints.commesse', 'commesse_bp'),
+    ('blueprints.social_safety', 'social_safety_bp'),
+    ('blueprints.calendar', 'calendar_bp'),
     
-    # Import and register holidays blueprint  
-    from .holidays import holidays_bp
-    app.register_blueprint(holidays_bp)
+    # CIRCLE Blueprints
+    ('blueprints.circle_home', 'bp'),
+    ('blueprints.circle_news', 'bp'),
+    ('blueprints.circle_communications', 'bp'),
+    ('blueprints.circle_groups', 'bp'),
+    ('blueprints.circle_polls', 'bp'),
+    ('blueprints.circle_calendar', 'bp'),
+    ('blueprints.circle_documents', 'bp'),
+    ('blueprints.circle_tools', 'bp'),
+    ('blueprints.circle_channels', 'bp'),
     
-    print(f"✓ Registered {len(app.blueprints)} blueprints")
\ No newline at end of file
+    # Legal/GDPR Blueprints
+    ('blueprints.legal', 'bp'),
+)
+
+
+def register_blueprints(app: Flask):
+    """Register all blueprints with the Flask application"""
+    for module_name, attribute in BLUEPRINTS:
+        app.register_blueprint(getattr(import_module(module_name), attribute))
@@ -12,18 +12,21 @@
 # 7. /aci_tables/bulk_delete (POST) - Cancellazione in massa per tipologia
 # 8. /api/aci/marcas (GET) - API marche filtrate per tipologia
 # 9. /api/aci/modelos (GET) - API modelli filtrati per tipologia e marca
+# 10. /aci_tables/upload/jobs/<job_id> (GET) - Stato importazione in background
 #
-# Total routes: 9 ACI management routes
+# Total routes: 10 ACI management routes
 # =============================================================================
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response
 from flask_login import login_required, current_user
 from datetime import datetime
 from functools import wraps
+import hashlib
 from app import db
 from models import ACITable
 from forms import ACIFilterForm, ACIUploadForm, ACIRecordForm
 from utils_tenant import filter_by_company, set_company_on_create, get_user_company_id
+from services import aci_lookup
 
 # Create blueprint
 aci_bp = Blueprint('aci', __name__, url_prefix='/aci')
@@ -88,7 +91,7 @@ def tables():
 @login_required
 @admin_required
 def upload():
-    """Upload e importazione file Excel ACI"""
+    """Upload file Excel ACI - l'importazione gira in background con avanzamento su background_job"""
     form = ACIUploadForm()
     
     if form.validate_on_submit():
@@ -96,117 +99,47 @@ def upload():
         tipologia = form.tipologia.data
         
         try:
-            # Salva file temporaneo
             import tempfile
             import os
-            import pandas as pd
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
-                file.save(tmp_file.name)
-                
-                # Leggi file Excel con ottimizzazioni per file grandi
-                df = pd.read_excel(tmp_file.name, engine='openpyxl', 
-                                 usecols=[0, 1, 2],  # Leggi solo colonne A, B, C
-                                 dtype={0: 'str', 1: 'str', 2: 'float64'},  # Forza tipi di dato
-                                 na_filter=True)
-                
-                # Pulisci file temporaneo
-                os.unlink(tmp_file.name)
-            
-            # Verifica struttura file Excel - richiede almeno 3 colonne (A, B, C)
-            if len(df.columns) < 3:
-                flash(f"Errore: Il file Excel deve avere almeno 3 colonne (MARCA, MODELLO, COSTO KM). Trovate {len(df.columns)} colonne.", "danger")
-                return render_template("aci_upload.html", form=form)
-            
-            # Log struttura per debug
-            import logging
-            logging.info(f"Colonne Excel trovate: {list(df.columns)}")
-            logging.info(f"Utilizzo solo colonne A, B, C - ignorando tutte le altre")
+            from services.aci_import import run_import_job
+            from services.background_jobs import create_job, run_in_background
             
             # Usa il nome del file come tipologia se non specificata esplicitamente
-            if not tipologia.strip():
-                # Estrae nome file senza estensione
-                import os
+            if not (tipologia or '').strip():
                 filename = file.filename or "Excel_File"
                 tipologia = os.path.splitext(filename)[0]
             
-            # Processa dati Excel - SOLO COLONNE A, B, C con ottimizzazione per file grandi
-            imported_count = 0
-            skipped_count = 0
-            batch_size = 100  # Processa a lotti per evitare timeout
-            
-            # Converti DataFrame in lista per processamento più veloce
-            rows_data = []
-            for index, row in df.iterrows():
-                # UTILIZZO SOLO LE PRIME 3 COLONNE (A, B, C)
-                marca = str(row.iloc[0]).strip() if pd.notna(row.iloc[0]) else ""
-                modello = str(row.iloc[1]).strip() if pd.notna(row.iloc[1]) else ""
-                costo_km = row.iloc[2] if pd.notna(row.iloc[2]) else None
-                
-                # Skip righe vuote o incomplete
-                if not marca or not modello or modello == 'nan' or costo_km is None:
-                    skipped_count += 1
-                    continue
-                    
-                rows_data.append((marca, modello, costo_km))
-            
-            logging.info(f"Processando {len(rows_data)} righe valide in batch da {batch_size}")
+            # Salva file temporaneo (eliminato dal job al termine della lettura)
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
+                file.save(tmp_file.name)
             
-            # Processa in batch per evitare timeout
-            for i in range(0, len(rows_data), batch_size):
-                batch = rows_data[i:i + batch_size]
-                
-                for marca, modello, costo_km in batch:
-                    # Verifica duplicati esistenti (con filtro company)
-                    existing_query = filter_by_company(ACITable.query).filter_by(
-                        tipologia=tipologia,
-                        marca=marca,
-                        modello=modello
-                    )
-                    existing = existing_query.first()
-                    
-                    if existing:
-                        # Aggiorna record esistente - SOLO COSTO KM
-                        existing.costo_km = float(costo_km)
-                        imported_count += 1
-                    else:
-                        # Crea nuovo record ACI con company_id
-                        aci_record = ACITable(
-                            tipologia=tipologia,
-                            marca=marca,
-                            modello=modello,
-                            costo_km=float(costo_km)
-                        )
-                        set_company_on_create(aci_record)
-                        db.session.add(aci_record)
-                        imported_count += 1
-                
-                # Commit ogni batch per liberare memoria
-                try:
-                    db.session.commit()
-                    logging.info(f"Batch {i//batch_size + 1} completato: {len(batch)} record")
-                except Exception as batch_error:
-                    db.session.rollback()
-                    logging.error(f"Errore batch {i//batch_size + 1}: {batch_error}")
-                    raise batch_error
+            job = create_job('aci_import',
+                             company_id=get_user_company_id(),
+                             created_by=current_user.id,
+                             message='In coda...')
+            run_in_background(job, run_import_job, tmp_file.name, tipologia, get_user_company_id())
             
-            # Messaggi di feedback dettagliati
-            if imported_count > 0:
-                flash(f"✅ File Excel importato con successo!", "success")
-                flash(f"📊 {imported_count} record processati (nuovi o aggiornati)", "info")
-                if skipped_count > 0:
-                    flash(f"⏭️ {skipped_count} righe saltate (intestazioni o righe vuote)", "info")
-                flash(f"🚫 Importate solo colonne A, B, C (MARCA, MODELLO, COSTO KM) - tutte le altre colonne ignorate", "info")
-            else:
-                flash("⚠️ Nessun record valido trovato nel file Excel", "warning")
-                
-            return redirect(url_for("aci.tables"))
+            flash(f"📥 Importazione di '{tipologia}' avviata. L'avanzamento è visibile qui sotto.", "info")
+            return redirect(url_for("aci.upload", job=job.id))
             
         except Exception as e:
             db.session.rollback()
             flash(f"Errore durante l'importazione del file: {str(e)}", "danger")
     
-    return render_template("aci_upload.html", form=form)
+    return render_template("aci_upload.html", form=form, job_id=request.args.get('job'))
+
+@aci_bp.route("/upload/jobs/<job_id>")
+@login_required
+@admin_required
+def upload_status(job_id):
+    """Stato di un job di importazione (polling dalla pagina di upload)"""
+    from services.background_jobs import get_job
+    
+    job = get_job(job_id, company_id=get_user_company_id())
+    if not job or job.job_type != 'aci_import':
+        return jsonify({'success': False, 'error': 'Job non trovato'}), 404
+    
+    return jsonify({'success': True, 'job': job.to_dict()})
 
 @aci_bp.route("/create", methods=["GET", "POST"])
 @login_required
@@ -227,6 +160,7 @@ def create():
             
             db.session.add(aci_record)
             db.session.commit()
+            aci_lookup.invalidate(aci_record.company_id)
             flash("Record ACI creato con successo!", "success")
             return redirect(url_for("aci.tables"))
             
@@ -252,6 +186,7 @@ def edit(record_id):
             aci_record.costo_km = form.costo_km.data
             
             db.session.commit()
+            aci_lookup.invalidate(aci_record.company_id)
             flash("Record ACI aggiornato con successo!", "success")
             return redirect(url_for("aci.tables"))
             
@@ -268,8 +203,10 @@ def delete(record_id):
     """Cancella record ACI"""
     try:
         aci_record = filter_by_company(ACITable.query).filter_by(id=record_id).first_or_404()
+        company_id = aci_record.company_id
         db.session.delete(aci_record)
         db.session.commit()
+        aci_lookup.invalidate(company_id)
         flash("Record ACI cancellato con successo!", "success")
         
     except Exception as e:
@@ -383,6 +320,7 @@ def bulk_delete():
         # Esegui la cancellazione (con filtro company)
         deleted_count = filter_by_company(ACITable.query).filter_by(tipologia=tipologia).delete()
         db.session.commit()
+        aci_lookup.invalidate(get_user_company_id())
         
         flash(f"✅ Cancellazione completata con successo!", "success")
         flash(f"📊 {deleted_count} record eliminati dalla tipologia '{tipologia}'", "info")
@@ -402,53 +340,40 @@ def bulk_delete():
 # ACI API ROUTES
 # =============================================================================
 
+def _lookup_response(payload, etag):
+    """Risposta JSON con ETag: il browser riceve 304 finché l'indice non cambia"""
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @aci_bp.route("/api/marcas")
 @login_required
 def api_marcas():
-    """API per ottenere le marche filtrate per tipologia"""
+    """API per ottenere le marche filtrate per tipologia (servita dall'indice in memoria)"""
     tipologia = request.args.get('tipologia')
     
     try:
-        # Query con filtro company
-        base_query = filter_by_company(ACITable.query)
-        query = db.session.query(ACITable.marca).distinct().filter(ACITable.id.in_(
-            db.session.query(ACITable.id).select_from(base_query.subquery())
-        ))
-        
-        if tipologia:
-            query = query.filter(ACITable.tipologia == tipologia)
-        
-        marcas = [row.marca for row in query.order_by(ACITable.marca).all()]
-        return jsonify({'success': True, 'marcas': marcas})
+        index = aci_lookup.get_index(get_user_company_id())
+        etag = f"{index.etag}-m-{hashlib.md5((tipologia or '').encode('utf-8')).hexdigest()[:8]}"
+        return _lookup_response({'success': True, 'marcas': index.marcas(tipologia)}, etag)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @aci_bp.route("/api/modelos")
 @login_required
 def api_modelos():
-    """API per ottenere i modelli filtrati per tipologia e marca con ID e costo km"""
+    """API per ottenere i modelli filtrati per tipologia e marca con ID e costo km (servita dall'indice in memoria)"""
     tipologia = request.args.get('tipologia')
     marca = request.args.get('marca')
     
     try:
-        # Query con filtro company - ritorna record completi invece di solo i nomi
-        query = filter_by_company(ACITable.query)
-        
-        if tipologia:
-            query = query.filter(ACITable.tipologia == tipologia)
-        if marca:
-            query = query.filter(ACITable.marca == marca)
-        
-        # Ritorna record completi con id, modello e costo_km
-        vehicles = query.order_by(ACITable.modello).all()
-        modelos = [
-            {
-                'id': v.id,
-                'modello': v.modello,
-                'costo_km': float(v.costo_km) if v.costo_km else 0.0
-            }
-            for v in vehicles
-        ]
-        return jsonify({'success': True, 'modelos': modelos})
+        index = aci_lookup.get_index(get_user_company_id())
+        key = f"{tipologia or ''}\x00{marca or ''}"
+        etag = f"{index.etag}-v-{hashlib.md5(key.encode('utf-8')).hexdigest()[:8]}"
+        return _lookup_response({'success': True, 'modelos': index.modelos(tipologia, marca)}, etag)
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'success': False, 'error': str(e)}), 500
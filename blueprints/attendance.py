@@ -21,12 +21,14 @@ from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta, time
 from functools import wraps
 from app import db
-from models import User, AttendanceEvent, Shift, Sede, ReperibilitaShift, Intervention, LeaveRequest, WorkSchedule, MonthlyTimesheet, AttendanceType, italian_now
+from models import User, AttendanceEvent, Shift, Sede, ReperibilitaShift, Intervention, LeaveRequest, WorkSchedule, MonthlyTimesheet, AttendanceType, italian_now, refresh_attendance_day
 from utils_tenant import get_user_company_id, filter_by_company, set_company_on_create
+from services import clock_status, holiday_calendar
 from io import StringIO
 from defusedcsv import csv
 from forms import AttendanceForm
 import io
+import uuid
 # Create blueprint
 attendance_bp = Blueprint('attendance', __name__, url_prefix='/attendance')
 # Helper functions
@@ -667,19 +669,6 @@ def clock_in():
             'message': 'Non hai i permessi per accedere alle presenze'
         }), 403
     try:
-        # Verifica se l'utente può effettuare il clock-in
-        if not AttendanceEvent.can_perform_action(current_user.id, 'clock_in'):
-            status, last_event = AttendanceEvent.get_user_status(current_user.id)
-            if status == 'in':
-                return jsonify({
-                    'success': False,
-                    'message': 'Sei già presente. Devi prima registrare l\'uscita.'
-                })
-            elif status == 'break':
-                return jsonify({
-                    'success': False,
-                    'message': 'Sei in pausa. Devi prima terminare la pausa.'
-                })
         # Ottieni la tipologia di presenza di default
         from models import AttendanceType
         default_attendance_type = filter_by_company(AttendanceType.query).filter_by(
@@ -687,18 +676,23 @@ def clock_in():
             active=True
         ).first()
         
-        # Crea nuovo evento di entrata
-        attendance_event = AttendanceEvent(
-            user_id=current_user.id,
-            event_type='clock_in',
-            timestamp=italian_now(),
-            sede_id=get_current_user_sede(current_user).id if get_current_user_sede(current_user) else None,
+        # Verifica dello stato e inserimento nella stessa transazione (serializzata per utente)
+        sede = get_current_user_sede(current_user)
+        result = clock_status.clock(
+            current_user, 'clock_in',
+            sede_id=sede.id if sede else None,
+            idempotency_key=clock_status.idempotency_key_from(request),
             attendance_type_id=default_attendance_type.id if default_attendance_type else None
         )
-        # Imposta company_id automaticamente
-        set_company_on_create(attendance_event)
-        db.session.add(attendance_event)
-        db.session.commit()
+        if not result.success:
+            if result.status == 'break':
+                message = 'Sei in pausa. Devi prima terminare la pausa.'
+            else:
+                message = 'Sei già presente. Devi prima registrare l\'uscita.'
+            return jsonify({
+                'success': False,
+                'message': message
+            })
         
         # Controlla se c'è un intervento attivo per questo utente
         active_intervention = Intervention.query.filter(
@@ -716,8 +710,8 @@ def clock_in():
             }
         return jsonify({
             'success': True,
-            'message': f'Entrata registrata alle {attendance_event.timestamp_italian.strftime("%H:%M")}',
-            'timestamp': attendance_event.timestamp_italian.strftime('%H:%M'),
+            'message': f'Entrata registrata alle {result.timestamp.strftime("%H:%M")}',
+            'timestamp': result.timestamp.strftime('%H:%M'),
             'active_intervention': intervention_info
         })
     except Exception as e:
@@ -737,27 +731,22 @@ def clock_out():
             'message': 'Non hai i permessi per accedere alle presenze'
         }), 403
     try:
-        # Verifica se l'utente può effettuare il clock-out
-        if not AttendanceEvent.can_perform_action(current_user.id, 'clock_out'):
+        # Verifica dello stato e inserimento nella stessa transazione (serializzata per utente)
+        sede = get_current_user_sede(current_user)
+        result = clock_status.clock(
+            current_user, 'clock_out',
+            sede_id=sede.id if sede else None,
+            idempotency_key=clock_status.idempotency_key_from(request)
+        )
+        if not result.success:
             return jsonify({
                 'success': False,
                 'message': 'Non puoi registrare l\'uscita in questo momento.'
             })
-        # Crea nuovo evento di uscita
-        attendance_event = AttendanceEvent(
-            user_id=current_user.id,
-            event_type='clock_out',
-            timestamp=italian_now(),
-            sede_id=get_current_user_sede(current_user).id if get_current_user_sede(current_user) else None
-        )
-        # Imposta company_id automaticamente
-        set_company_on_create(attendance_event)
-        db.session.add(attendance_event)
-        db.session.commit()
         return jsonify({
             'success': True,
-            'message': f'Uscita registrata alle {attendance_event.timestamp_italian.strftime("%H:%M")}',
-            'timestamp': attendance_event.timestamp_italian.strftime('%H:%M')
+            'message': f'Uscita registrata alle {result.timestamp.strftime("%H:%M")}',
+            'timestamp': result.timestamp.strftime('%H:%M')
         })
     except Exception as e:
         db.session.rollback()
@@ -777,27 +766,22 @@ def break_start():
             'message': 'Non hai i permessi per accedere alle presenze'
         }), 403
     try:
-        # Verifica se l'utente può iniziare la pausa
-        if not AttendanceEvent.can_perform_action(current_user.id, 'break_start'):
+        # Verifica dello stato e inserimento nella stessa transazione (serializzata per utente)
+        sede = get_current_user_sede(current_user)
+        result = clock_status.clock(
+            current_user, 'break_start',
+            sede_id=sede.id if sede else None,
+            idempotency_key=clock_status.idempotency_key_from(request)
+        )
+        if not result.success:
             return jsonify({
                 'success': False,
                 'message': 'Non puoi iniziare la pausa in questo momento.'
             })
-        # Crea nuovo evento di inizio pausa
-        attendance_event = AttendanceEvent(
-            user_id=current_user.id,
-            event_type='break_start',
-            timestamp=italian_now(),
-            sede_id=get_current_user_sede(current_user).id if get_current_user_sede(current_user) else None
-        )
-        # Imposta company_id automaticamente
-        set_company_on_create(attendance_event)
-        db.session.add(attendance_event)
-        db.session.commit()
         return jsonify({
             'success': True,
-            'message': f'Inizio pausa registrato alle {attendance_event.timestamp_italian.strftime("%H:%M")}',
-            'timestamp': attendance_event.timestamp_italian.strftime('%H:%M')
+            'message': f'Inizio pausa registrato alle {result.timestamp.strftime("%H:%M")}',
+            'timestamp': result.timestamp.strftime('%H:%M')
         })
     except Exception as e:
         db.session.rollback()
@@ -814,27 +798,22 @@ def break_end():
             'message': 'Non hai i permessi per accedere alle presenze'
         }), 403
     try:
-        # Verifica se l'utente può terminare la pausa
-        if not AttendanceEvent.can_perform_action(current_user.id, 'break_end'):
+        # Verifica dello stato e inserimento nella stessa transazione (serializzata per utente)
+        sede = get_current_user_sede(current_user)
+        result = clock_status.clock(
+            current_user, 'break_end',
+            sede_id=sede.id if sede else None,
+            idempotency_key=clock_status.idempotency_key_from(request)
+        )
+        if not result.success:
             return jsonify({
                 'success': False,
                 'message': 'Non puoi terminare la pausa in questo momento.'
             })
-        # Crea nuovo evento di fine pausa
-        attendance_event = AttendanceEvent(
-            user_id=current_user.id,
-            event_type='break_end',
-            timestamp=italian_now(),
-            sede_id=get_current_user_sede(current_user).id if get_current_user_sede(current_user) else None
-        )
-        # Imposta company_id automaticamente
-        set_company_on_create(attendance_event)
-        db.session.add(attendance_event)
-        db.session.commit()
         return jsonify({
             'success': True,
-            'message': f'Fine pausa registrata alle {attendance_event.timestamp_italian.strftime("%H:%M")}',
-            'timestamp': attendance_event.timestamp_italian.strftime('%H:%M')
+            'message': f'Fine pausa registrata alle {result.timestamp.strftime("%H:%M")}',
+            'timestamp': result.timestamp.strftime('%H:%M')
         })
     except Exception as e:
         db.session.rollback()
@@ -921,9 +900,15 @@ def quick_attendance(action):
         return redirect(url_for('dashboard.dashboard'))
     if request.method == 'POST':
         try:
-            # Verifica se l'utente può effettuare l'azione
-            if not AttendanceEvent.can_perform_action(current_user.id, action):
-                status, last_event = AttendanceEvent.get_user_status(current_user.id)
+            # Verifica dello stato e inserimento nella stessa transazione (serializzata per utente)
+            sede = get_current_user_sede(current_user)
+            result = clock_status.clock(
+                current_user, action,
+                sede_id=sede.id if sede else None,
+                idempotency_key=clock_status.idempotency_key_from(request)
+            )
+            if not result.success:
+                status = result.status
                 if action == 'clock_in' and status == 'in':
                     flash('Sei già presente. Devi prima registrare l\'uscita.', 'warning')
                 elif action == 'clock_out' and status == 'out':
@@ -935,15 +920,6 @@ def quick_attendance(action):
                 else:
                     flash('Non puoi effettuare questa azione al momento.', 'error')
                 return redirect(url_for('attendance.attendance'))
-            # Crea nuovo evento
-            attendance_event = AttendanceEvent(
-                user_id=current_user.id,
-                event_type=action,
-                timestamp=italian_now(),
-                sede_id=get_current_user_sede(current_user).id if get_current_user_sede(current_user) else None
-            )
-            db.session.add(attendance_event)
-            db.session.commit()
             
             # Messaggio di successo
             action_messages = {
@@ -953,7 +929,7 @@ def quick_attendance(action):
                 'break_end': 'Fine pausa registrata'
             }
             
-            flash(f'{action_messages[action]} alle {attendance_event.timestamp_italian.strftime("%H:%M")}', 'success')
+            flash(f'{action_messages[action]} alle {result.timestamp.strftime("%H:%M")}', 'success')
             return redirect(url_for('attendance.attendance'))
         except Exception as e:
             db.session.rollback()
@@ -970,6 +946,7 @@ def quick_attendance(action):
     return render_template('quick_attendance.html',
                          action=action,
                          action_title=action_titles.get(action, 'Azione'),
+                         idempotency_key=uuid.uuid4().hex,
                          current_time=italian_now())
 # =============================================================================
 # MANUAL TIMESHEET ROUTES
@@ -1169,6 +1146,7 @@ def save_manual_timesheet():
             AttendanceEvent.date == day_date,
             AttendanceEvent.is_manual == True
         ).delete()
+        refresh_attendance_day(current_user.id, day_date)  # DELETE massivo: fuori dall'hook di flush
         
         # Se entrambi i campi sono vuoti, elimina e basta
         if not clock_in_str and not clock_out_str:
@@ -1443,7 +1421,7 @@ def bulk_fill_timesheet():
             return jsonify({'success': False, 'message': 'Timesheet consolidato, non modificabile'}), 400
         
         # Ottieni orario di lavoro assegnato all'utente (company-level global, non più legato alla sede)
-        from models import WorkSchedule, LeaveRequest
+        from models import WorkSchedule
         work_schedule = current_user.work_schedule if current_user.work_schedule_id else None
         
         if not work_schedule:
@@ -1455,43 +1433,15 @@ def bulk_fill_timesheet():
         last_day_num = monthrange(year, month)[1]
         last_day = date(year, month, last_day_num)
         
-        # Ottieni ferie/permessi approvati e in attesa nel mese
-        leaves_query = filter_by_company(LeaveRequest.query).filter(
-            LeaveRequest.user_id == current_user.id,
-            LeaveRequest.status.in_(['Approved', 'Pending']),  # Include anche richieste in attesa
-            LeaveRequest.start_date <= last_day,
-            LeaveRequest.end_date >= first_day
-        ).all()
+        # Stato del mese caricato una volta: timbrature, ferie/permessi approvati e in attesa
+        from services.timesheet_writer import MonthTimesheetWriter, EventSpec
+        writer = MonthTimesheetWriter(current_user, company_id, year, month,
+                                      leave_statuses=('Approved', 'Pending'))
+        leave_dates = writer.leave_dates
+        dates_with_live = {d for d in writer.month_days() if writer.has_live_events(d)}
         
-        # Crea set di date con ferie/permessi
-        leave_dates = set()
-        for leave in leaves_query:
-            current_date = leave.start_date
-            while current_date <= leave.end_date:
-                if first_day <= current_date <= last_day:
-                    leave_dates.add(current_date)
-                current_date += timedelta(days=1)
-        
-        # Ottieni eventi già esistenti
-        existing_events = filter_by_company(AttendanceEvent.query).filter(
-            AttendanceEvent.user_id == current_user.id,
-            AttendanceEvent.date >= first_day,
-            AttendanceEvent.date <= last_day
-        ).all()
-        
-        # Raggruppa eventi per data e controlla se ha eventi Live
-        from collections import defaultdict
-        events_by_date = defaultdict(list)
-        dates_with_live = set()
-        
-        for event in existing_events:
-            events_by_date[event.date].append(event)
-            if not event.is_manual:  # Evento Live
-                dates_with_live.add(event.date)
-        
-        # Compila automaticamente
-        days_filled = 0
-        days_replaced = 0
+        # Compila automaticamente (in memoria): giorno -> timbrature desiderate
+        desired = {}
         today = date.today()
         
         # Ottieni ore settimanali contrattuali per distribuire le ore intelligentemente
@@ -1562,12 +1512,6 @@ def bulk_fill_timesheet():
             if work_schedule.days_of_week and day_date.weekday() not in work_schedule.days_of_week:
                 continue
             
-            # Se ha eventi manuali esistenti, cancellali prima
-            if day_date in events_by_date:
-                for event in events_by_date[day_date]:
-                    db.session.delete(event)
-                days_replaced += 1
-            
             # Calcola ore per questo giorno
             if use_contractual_hours:
                 # Ottieni ISO week per questo giorno
@@ -1624,40 +1568,19 @@ def bulk_fill_timesheet():
             # Prepara eventi per questo giorno (in memoria)
             from zoneinfo import ZoneInfo
             italy_tz = ZoneInfo('Europe/Rome')
+            event_fields = {
+                'sede_id': current_user.sede_id,
+                'entry_type': 'standard',
+                'safety_net_assignment_id': safety_net_context.get('assignment_id') if safety_net_context else None,
+                'payroll_code': safety_net_context.get('payroll_code') if safety_net_context else None
+            }
             day_proposed_events = []
             
             clock_in_datetime = datetime.combine(day_date, standard_start).replace(tzinfo=italy_tz)
             clock_out_datetime = datetime.combine(day_date, standard_end).replace(tzinfo=italy_tz)
             
-            # Crea evento entrata (in memoria)
-            clock_in_event = AttendanceEvent(
-                user_id=current_user.id,
-                date=day_date,
-                event_type='clock_in',
-                timestamp=clock_in_datetime,
-                sede_id=current_user.sede_id,
-                is_manual=True,
-                entry_type='standard',
-                safety_net_assignment_id=safety_net_context.get('assignment_id') if safety_net_context else None,
-                payroll_code=safety_net_context.get('payroll_code') if safety_net_context else None
-            )
-            set_company_on_create(clock_in_event)
-            day_proposed_events.append(clock_in_event)
-            
-            # Crea evento uscita (in memoria)
-            clock_out_event = AttendanceEvent(
-                user_id=current_user.id,
-                date=day_date,
-                event_type='clock_out',
-                timestamp=clock_out_datetime,
-                sede_id=current_user.sede_id,
-                is_manual=True,
-                entry_type='standard',
-                safety_net_assignment_id=safety_net_context.get('assignment_id') if safety_net_context else None,
-                payroll_code=safety_net_context.get('payroll_code') if safety_net_context else None
-            )
-            set_company_on_create(clock_out_event)
-            day_proposed_events.append(clock_out_event)
+            day_proposed_events.append(EventSpec.local(day_date, 'clock_in', clock_in_datetime, **event_fields))
+            day_proposed_events.append(EventSpec.local(day_date, 'clock_out', clock_out_datetime, **event_fields))
             
             # Pausa automatica: se il turno è > 5 ore, inserisci 1h di pausa
             work_duration = (clock_out_datetime - clock_in_datetime).total_seconds() / 3600  # ore
@@ -1691,35 +1614,8 @@ def bulk_fill_timesheet():
                         break_end_datetime = max_break_end
                         break_start_datetime = break_end_datetime - timedelta(hours=1)
                 
-                # Crea evento inizio pausa (in memoria)
-                break_start_event = AttendanceEvent(
-                    user_id=current_user.id,
-                    date=day_date,
-                    event_type='break_start',
-                    timestamp=break_start_datetime,
-                    sede_id=current_user.sede_id,
-                    is_manual=True,
-                    entry_type='standard',
-                    safety_net_assignment_id=safety_net_context.get('assignment_id') if safety_net_context else None,
-                    payroll_code=safety_net_context.get('payroll_code') if safety_net_context else None
-                )
-                set_company_on_create(break_start_event)
-                day_proposed_events.append(break_start_event)
-                
-                # Crea evento fine pausa (in memoria)
-                break_end_event = AttendanceEvent(
-                    user_id=current_user.id,
-                    date=day_date,
-                    event_type='break_end',
-                    timestamp=break_end_datetime,
-                    sede_id=current_user.sede_id,
-                    is_manual=True,
-                    entry_type='standard',
-                    safety_net_assignment_id=safety_net_context.get('assignment_id') if safety_net_context else None,
-                    payroll_code=safety_net_context.get('payroll_code') if safety_net_context else None
-                )
-                set_company_on_create(break_end_event)
-                day_proposed_events.append(break_end_event)
+                day_proposed_events.append(EventSpec.local(day_date, 'break_start', break_start_datetime, **event_fields))
+                day_proposed_events.append(EventSpec.local(day_date, 'break_end', break_end_datetime, **event_fields))
             
             # Valida eventi safety net prima di aggiungere al session
             if day_proposed_events:
@@ -1731,24 +1627,42 @@ def bulk_fill_timesheet():
                     logging.warning(f"Bulk fill: skipping {day_date} for user {current_user.id}: {error_msg}")
                     continue
                 
-                # Validazione OK: aggiungi eventi al session
-                for event in day_proposed_events:
-                    db.session.add(event)
-                
-                days_filled += 1
+                # Validazione OK: giorno da scrivere
+                desired[day_date] = day_proposed_events
         
-        # Aggiorna timestamp timesheet
-        timesheet.updated_at = italian_now()
+        # Limite settimanale contrattuale: una validazione per settimana ISO (live inclusi)
+        from utils_contract_hours import get_iso_week_range
+        skipped_weeks = []
+        for week_start, (is_valid, error_msg, context) in writer.validate_weeks(desired).items():
+            if not is_valid:
+                import logging
+                logging.warning(f"Bulk fill: skipping week {week_start} for user {current_user.id}: {error_msg}")
+                skipped_weeks.append(week_start)
+                for day_date in [d for d in desired if get_iso_week_range(d)[0] == week_start]:
+                    del desired[day_date]
+        
+        days_filled = len(desired)
+        days_replaced = sum(1 for d in desired if writer.has_manual_events(d))
+        
+        # Un DELETE e un INSERT per tutto il mese (solo le differenze)
+        writer.replace_manual_events(desired)
+        writer.finalize(timesheet)
         
         db.session.commit()
         
         if days_filled == 0:
-            return jsonify({'success': True, 'message': 'Nessun giorno compilato (tutti i giorni lavorativi sono già coperti o nel futuro)'})
+            message = 'Nessun giorno compilato (tutti i giorni lavorativi sono già coperti o nel futuro)'
+            if skipped_weeks:
+                message = 'Nessun giorno compilato: limite ore settimanali contrattuale già raggiunto'
+            return jsonify({'success': True, 'message': message})
         
         # Messaggio con dettagli sostituzioni
         message = f'{days_filled} giorni compilati con orari standard'
         if days_replaced > 0:
             message += f' ({days_replaced} giorni sostituiti)'
+        if skipped_weeks:
+            weeks_str = ', '.join(w.strftime('%d/%m') for w in skipped_weeks)
+            message += f'. Settimane non compilate per limite ore contrattuale: {weeks_str}'
         
         return jsonify({'success': True, 'message': message})
         
@@ -2672,7 +2586,6 @@ def save_month_sessions():
             return redirect(url_for('attendance.my_attendance', year=year, month=month))
         
         # Parse dei dati del form: rows[KEY][field]
-        from models import AttendanceSession
         from datetime import time as time_obj
         
         import logging
@@ -2697,11 +2610,10 @@ def save_month_sessions():
         
         logging.info(f"Parsed rows_data: {rows_data}")
         
-        # Processa ogni riga
-        sessions_updated = 0
-        sessions_created = 0
-        
-        sessions_deleted = 0
+        # Processa ogni riga (in memoria): il diff con le sessioni esistenti è applicato alla fine
+        from services.timesheet_writer import MonthTimesheetWriter, SessionSpec
+        session_specs = []
+        delete_ids = []
         
         for row_key, row_data in rows_data.items():
             day = int(row_data.get('day'))
@@ -2710,14 +2622,7 @@ def save_month_sessions():
             
             # Gestisci cancellazione
             if row_data.get('delete') == 'true' and session_id and session_id.isdigit():
-                session = AttendanceSession.query.filter_by(
-                    id=int(session_id),
-                    user_id=current_user.id,
-                    company_id=company_id
-                ).first()
-                if session:
-                    db.session.delete(session)
-                    sessions_deleted += 1
+                delete_ids.append(int(session_id))
                 continue
             
             # Ignora righe vuote (senza orari)
@@ -2799,44 +2704,26 @@ def save_month_sessions():
             commessa_id = int(row_data.get('commessa_id')) if row_data.get('commessa_id') else None
             attendance_type_id = int(row_data.get('attendance_type_id')) if row_data.get('attendance_type_id') else None
             
-            # Update o Create
-            if session_id and session_id.isdigit():
-                # Update sessione esistente
-                session = AttendanceSession.query.filter_by(
-                    id=int(session_id),
-                    user_id=current_user.id,
-                    company_id=company_id
-                ).first()
-                
-                if session:
-                    session.date = day_date
-                    session.start_time = start_time
-                    session.end_time = end_time
-                    session.break_start_time = break_start
-                    session.break_end_time = break_end
-                    session.sede_id = sede_id
-                    session.commessa_id = commessa_id
-                    session.attendance_type_id = attendance_type_id
-                    session.duration_hours = duration_hours
-                    sessions_updated += 1
-            else:
-                # Crea nuova sessione
-                session = AttendanceSession(
-                    timesheet_id=timesheet.id,
-                    user_id=current_user.id,
-                    company_id=company_id,
-                    date=day_date,
-                    start_time=start_time,
-                    end_time=end_time,
-                    break_start_time=break_start,
-                    break_end_time=break_end,
-                    sede_id=sede_id,
-                    commessa_id=commessa_id,
-                    attendance_type_id=attendance_type_id,
-                    duration_hours=duration_hours
-                )
-                db.session.add(session)
-                sessions_created += 1
+            # Update (id esistente) o Create (id None)
+            session_specs.append(SessionSpec(
+                id=int(session_id) if session_id and session_id.isdigit() else None,
+                date=day_date,
+                start_time=start_time,
+                end_time=end_time,
+                break_start_time=break_start,
+                break_end_time=break_end,
+                sede_id=sede_id,
+                commessa_id=commessa_id,
+                attendance_type_id=attendance_type_id,
+                duration_hours=duration_hours
+            ))
+        
+        # Un DELETE, un UPDATE e un INSERT per tutto il mese (solo le righe cambiate)
+        writer = MonthTimesheetWriter(current_user, company_id, year, month)
+        sessions_created, sessions_updated, sessions_deleted = writer.apply_sessions(
+            timesheet.id, session_specs, delete_ids
+        )
+        writer.finalize(timesheet)
         
         db.session.commit()
         
@@ -2882,7 +2769,7 @@ def bulk_fill_sessions():
             return jsonify({'success': False, 'message': 'Timesheet consolidato, non modificabile'}), 400
         
         # Ottieni work_schedule dell'utente
-        from models import WorkSchedule, LeaveRequest, Holiday, User, AttendanceSession, AttendanceType
+        from models import WorkSchedule, User, AttendanceType
         import logging
         
         # Carica esplicitamente l'utente dal database per ottenere il work_schedule_id
@@ -2939,26 +2826,12 @@ def bulk_fill_sessions():
         
         # Ottieni range mese
         from calendar import monthrange
-        first_day = date(year, month, 1)
         last_day_num = monthrange(year, month)[1]
-        last_day = date(year, month, last_day_num)
-        
-        # Ottieni ferie/permessi approvati nel mese
-        leaves_query = filter_by_company(LeaveRequest.query).filter(
-            LeaveRequest.user_id == current_user.id,
-            LeaveRequest.status == 'Approved',
-            LeaveRequest.start_date <= last_day,
-            LeaveRequest.end_date >= first_day
-        ).all()
         
-        # Crea set di date con ferie/permessi
-        leave_dates = set()
-        for leave in leaves_query:
-            current_date = leave.start_date
-            while current_date <= leave.end_date:
-                if first_day <= current_date <= last_day:
-                    leave_dates.add(current_date)
-                current_date += tdelta(days=1)
+        # Ferie/permessi approvati nel mese (caricati una volta)
+        from services.timesheet_writer import MonthTimesheetWriter, SessionSpec
+        writer = MonthTimesheetWriter(current_user, company_id, year, month, leave_statuses=('Approved',))
+        leave_dates = writer.leave_dates
         
         # Ottieni festività
         user_sedi = []
@@ -2968,27 +2841,15 @@ def bulk_fill_sessions():
             user_sedi = [current_user.sede_obj]
         
         user_sede_ids = [s.id for s in user_sedi] if user_sedi else []
-        holidays_query = Holiday.query.filter_by(month=month, active=True)
-        if user_sede_ids:
-            from sqlalchemy import or_
-            holidays_query = holidays_query.filter(
-                or_(Holiday.sede_id.in_(user_sede_ids), Holiday.sede_id.is_(None))
-            )
-        else:
-            holidays_query = holidays_query.filter(Holiday.sede_id.is_(None))
-        
-        holidays = holidays_query.all()
-        holiday_days = {h.day for h in holidays}
+        holiday_days = holiday_calendar.holiday_days_in_month(company_id, year, month, user_sede_ids)
         
         # Ottieni sessioni già esistenti
-        existing_sessions = AttendanceSession.query.filter_by(
-            timesheet_id=timesheet.id
-        ).all()
+        existing_sessions = writer.load_sessions(timesheet.id).values()
         
         days_with_sessions = {s.date.day for s in existing_sessions}
         
-        # Compila automaticamente
-        filled_count = 0
+        # Compila automaticamente (in memoria)
+        new_sessions = []
         today = date.today()
         sede_id = current_user.sede_id or (user_sedi[0].id if user_sedi else None)
         
@@ -3017,10 +2878,7 @@ def bulk_fill_sessions():
                 continue
             
             # Crea nuova sessione
-            session = AttendanceSession(
-                timesheet_id=timesheet.id,
-                user_id=current_user.id,
-                company_id=company_id,
+            new_sessions.append(SessionSpec(
                 date=day_date,
                 start_time=standard_start,
                 end_time=standard_end,
@@ -3030,9 +2888,11 @@ def bulk_fill_sessions():
                 commessa_id=None,
                 attendance_type_id=attendance_type_ordinario.id,
                 duration_hours=standard_hours
-            )
-            db.session.add(session)
-            filled_count += 1
+            ))
+        
+        # Un solo INSERT multi-riga per tutto il mese
+        filled_count, _, _ = writer.apply_sessions(timesheet.id, new_sessions)
+        writer.finalize(timesheet)
         
         db.session.commit()
         
@@ -3416,6 +3276,7 @@ def save_my_attendance():
                 date=day_date,
                 is_manual=True
             ).delete()
+            refresh_attendance_day(current_user.id, day_date)
             db.session.commit()
             return jsonify({'success': True, 'message': 'Presenza eliminata'})
         
@@ -3439,6 +3300,7 @@ def save_my_attendance():
             date=day_date,
             is_manual=True
         ).delete()
+        refresh_attendance_day(current_user.id, day_date)
         
         # Crea nuovi eventi
         from zoneinfo import ZoneInfo
@@ -3545,6 +3407,7 @@ def delete_my_attendance_day():
             date=day_date,
             is_manual=True
         ).delete()
+        refresh_attendance_day(current_user.id, day_date)
         
         db.session.commit()
         
@@ -3601,48 +3464,27 @@ def bulk_fill_month():
         if sede_id not in user_sedi_ids:
             return jsonify({'success': False, 'message': 'Non hai accesso a questa sede'}), 403
         
-        # Helper per creare timestamp - deve creare datetime completo in orario italiano
-        def create_timestamp(day_date, time_str):
-            if not time_str:
-                return None
-            hour, minute = map(int, time_str.split(':'))
-            # Crea datetime in orario italiano (come gli altri inserimenti manuali)
-            from zoneinfo import ZoneInfo
-            italy_tz = ZoneInfo('Europe/Rome')
-            naive_dt = datetime.combine(day_date, time(hour, minute))
-            # Localizza in timezone italiano
-            italian_dt = naive_dt.replace(tzinfo=italy_tz)
-            # Converti in UTC per il salvataggio (come fa il resto del sistema)
-            utc_tz = ZoneInfo('UTC')
-            utc_dt = italian_dt.astimezone(utc_tz)
-            # Ritorna naive UTC (il database si aspetta naive UTC)
-            return utc_dt.replace(tzinfo=None)
+        # Orari inseriti in ora italiana: EventSpec.local li converte in UTC naive
+        from services.timesheet_writer import MonthTimesheetWriter, EventSpec
+        day_times = []
+        for event_type, time_str in (('clock_in', clock_in_str), ('break_start', break_start_str),
+                                     ('break_end', break_end_str), ('clock_out', clock_out_str)):
+            if time_str:
+                hour, minute = map(int, time_str.split(':'))
+                day_times.append((event_type, time(hour, minute)))
         
         # Determina quanti giorni ha il mese
         import calendar
         _, days_in_month = calendar.monthrange(year, month)
         
-        filled_count = 0
+        # Stato del mese caricato una volta: timbrature e ferie/permessi approvati
+        writer = MonthTimesheetWriter(current_user, company_id, year, month, leave_statuses=('Approved',))
+        desired = {}
         skipped_count = 0
         
-        # Carica festività per questo mese
-        from sqlalchemy import or_
-        holidays_query = filter_by_company(Holiday.query).filter_by(
-            month=month,
-            active=True
-        )
-        if sede_id:
-            holidays_query = holidays_query.filter(
-                or_(
-                    Holiday.sede_id == sede_id,
-                    Holiday.sede_id.is_(None)  # Festività nazionali
-                )
-            )
-        else:
-            holidays_query = holidays_query.filter(Holiday.sede_id.is_(None))
-        
-        holidays = holidays_query.all()
-        holiday_days = {h.day for h in holidays}
+        # Festività del mese (nazionali + sede selezionata) dal calendario compilato del tenant
+        holiday_days = holiday_calendar.holiday_days_in_month(company_id, year, month,
+                                                              [sede_id] if sede_id else [])
         
         # Itera su tutti i giorni del mese
         for day in range(1, days_in_month + 1):
@@ -3657,100 +3499,43 @@ def bulk_fill_month():
                 skipped_count += 1
                 continue
             
-            # Controlla se ci sono eventi live per quel giorno
-            live_events = filter_by_company(AttendanceEvent.query).filter_by(
-                user_id=current_user.id,
-                date=day_date,
-                is_manual=False
-            ).first()
-            
-            if live_events:
+            # Salta giorni con eventi live, eventi straordinari (ferie, permessi, malattie)
+            # o dati manuali già presenti
+            if (writer.has_live_events(day_date) or writer.is_leave_day(day_date) or
+                    writer.has_manual_events(day_date)):
                 skipped_count += 1
                 continue
             
-            # Controlla se ci sono eventi straordinari (ferie, permessi, malattie)
-            leave_request = filter_by_company(LeaveRequest.query).filter(
-                LeaveRequest.user_id == current_user.id,
-                LeaveRequest.start_date <= day_date,
-                LeaveRequest.end_date >= day_date,
-                LeaveRequest.status == 'Approved'
-            ).first()
-            
-            if leave_request:
-                skipped_count += 1
-                continue
-            
-            # Controlla se ci sono già dati manuali per quel giorno
-            existing_manual = filter_by_company(AttendanceEvent.query).filter_by(
-                user_id=current_user.id,
-                date=day_date,
-                is_manual=True
-            ).first()
-            
-            if existing_manual:
-                skipped_count += 1
-                continue
-            
-            # Inserisci i dati per questo giorno
-            if clock_in_str:
-                clock_in_event = AttendanceEvent(
-                    user_id=current_user.id,
-                    event_type='clock_in',
-                    timestamp=create_timestamp(day_date, clock_in_str),
-                    date=day_date,
-                    is_manual=True,
-                    sede_id=sede_id,
-                    commessa_id=commessa_id,
-                    company_id=company_id
-                )
-                db.session.add(clock_in_event)
-            
-            if break_start_str:
-                break_start_event = AttendanceEvent(
-                    user_id=current_user.id,
-                    event_type='break_start',
-                    timestamp=create_timestamp(day_date, break_start_str),
-                    date=day_date,
-                    is_manual=True,
-                    sede_id=sede_id,
-                    commessa_id=commessa_id,
-                    company_id=company_id
-                )
-                db.session.add(break_start_event)
-            
-            if break_end_str:
-                break_end_event = AttendanceEvent(
-                    user_id=current_user.id,
-                    event_type='break_end',
-                    timestamp=create_timestamp(day_date, break_end_str),
-                    date=day_date,
-                    is_manual=True,
-                    sede_id=sede_id,
-                    commessa_id=commessa_id,
-                    company_id=company_id
-                )
-                db.session.add(break_end_event)
-            
-            if clock_out_str:
-                clock_out_event = AttendanceEvent(
-                    user_id=current_user.id,
-                    event_type='clock_out',
-                    timestamp=create_timestamp(day_date, clock_out_str),
-                    date=day_date,
-                    is_manual=True,
-                    sede_id=sede_id,
-                    commessa_id=commessa_id,
-                    company_id=company_id
-                )
-                db.session.add(clock_out_event)
-            
-            filled_count += 1
+            # Inserisci i dati per questo giorno (in memoria)
+            desired[day_date] = [
+                EventSpec.local(day_date, event_type, datetime.combine(day_date, event_time),
+                                sede_id=sede_id, commessa_id=commessa_id)
+                for event_type, event_time in day_times
+            ]
+        
+        # Limite settimanale contrattuale: una validazione per settimana ISO
+        from utils_contract_hours import get_iso_week_range
+        skipped_weeks = []
+        for week_start, (is_valid, error_msg, context) in writer.validate_weeks(desired).items():
+            if not is_valid:
+                skipped_weeks.append(week_start)
+                for day_date in [d for d in desired if get_iso_week_range(d)[0] == week_start]:
+                    del desired[day_date]
+                    skipped_count += 1
+        
+        # Un solo INSERT multi-riga per tutto il mese
+        writer.replace_manual_events(desired)
+        writer.finalize(timesheet)
+        filled_count = len(desired)
         
         db.session.commit()
         
         message = f'Compilazione completata: {filled_count} giorni compilati'
         if skipped_count > 0:
             message += f', {skipped_count} giorni saltati (già compilati o con eventi straordinari)'
+        if skipped_weeks:
+            weeks_str = ', '.join(w.strftime('%d/%m') for w in skipped_weeks)
+            message += f'. Settimane non compilate per limite ore contrattuale: {weeks_str}'
         
         return jsonify({'success': True, 'message': message})
         
@@ -4035,9 +3820,9 @@ def export_timesheet(timesheet_id):
         from models import MonthlyTimesheet, AttendanceEvent
         from datetime import date
         from io import BytesIO
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
         from flask import send_file
+        from sqlalchemy.orm import joinedload
+        from services import export_renderer
         import calendar
         
         # Ottieni il timesheet
@@ -4049,54 +3834,27 @@ def export_timesheet(timesheet_id):
             flash('Timesheet non trovato', 'danger')
             return redirect(url_for('attendance.timesheets'))
         
-        # Crea workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Timesheet"
-        
-        # Stili
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        # Intestazione
-        ws['A1'] = f"Timesheet - {current_user.get_full_name()}"
-        ws['A1'].font = Font(bold=True, size=14)
-        ws['A2'] = f"Mese: {calendar.month_name[timesheet.month]} {timesheet.year}"
-        ws['A3'] = f"Stato: {timesheet.get_status()}"
-        
-        # Riga vuota
-        current_row = 5
-        
-        # Header tabella
-        headers = ['Giorno', 'Data', 'Entrata', 'Uscita', 'Inizio Pausa', 'Fine Pausa', 'Ore Lavorate', 'Sede', 'Commessa']
-        for col, header in enumerate(headers, start=1):
-            cell = ws.cell(row=current_row, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = Alignment(horizontal='center')
-            cell.border = border
-        
-        current_row += 1
-        
-        # Dati
         month_days = calendar.monthrange(timesheet.year, timesheet.month)[1]
         italian_weekdays = ['Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom']
         
+        # Eventi del mese in una sola query, con sede e commessa
+        month_events = filter_by_company(AttendanceEvent.query).options(
+            joinedload(AttendanceEvent.sede), joinedload(AttendanceEvent.commessa)
+        ).filter(
+            AttendanceEvent.user_id == current_user.id,
+            AttendanceEvent.date >= date(timesheet.year, timesheet.month, 1),
+            AttendanceEvent.date <= date(timesheet.year, timesheet.month, month_days)
+        ).order_by(AttendanceEvent.timestamp).all()
+        
+        events_by_day = {}
+        for event in month_events:
+            events_by_day.setdefault(event.date, []).append(event)
+        
+        rows = []
         for day in range(1, month_days + 1):
             day_date = date(timesheet.year, timesheet.month, day)
             weekday = italian_weekdays[day_date.weekday()]
-            
-            # Ottieni eventi del giorno
-            events = filter_by_company(AttendanceEvent.query).filter(
-                AttendanceEvent.user_id == current_user.id,
-                AttendanceEvent.date == day_date
-            ).order_by(AttendanceEvent.timestamp).all()
+            events = events_by_day.get(day_date)
             
             if events:
                 clock_in = None
@@ -4142,26 +3900,16 @@ def export_timesheet(timesheet_id):
                     except:
                         ore_lavorate = ""
                 
-                ws.cell(row=current_row, column=1, value=weekday).border = border
-                ws.cell(row=current_row, column=2, value=day_date.strftime('%d/%m/%Y')).border = border
-                ws.cell(row=current_row, column=3, value=clock_in).border = border
-                ws.cell(row=current_row, column=4, value=clock_out).border = border
-                ws.cell(row=current_row, column=5, value=break_start).border = border
-                ws.cell(row=current_row, column=6, value=break_end).border = border
-                ws.cell(row=current_row, column=7, value=ore_lavorate).border = border
-                ws.cell(row=current_row, column=8, value=sede_name).border = border
-                ws.cell(row=current_row, column=9, value=commessa_name).border = border
-                
-                current_row += 1
-        
-        # Adatta larghezza colonne
-        for col in range(1, 10):
-            ws.column_dimensions[chr(64 + col)].width = 15
-        
-        # Salva in BytesIO
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+                rows.append([weekday, day_date.strftime('%d/%m/%Y'), clock_in, clock_out,
+                             break_start, break_end, ore_lavorate, sede_name, commessa_name])
+        
+        # Excel dalla cache se timbrature e stato del timesheet non sono cambiati
+        output = BytesIO(export_renderer.get_timesheet_xlsx({
+            'title': f"Timesheet - {current_user.get_full_name()}",
+            'month_label': f"Mese: {calendar.month_name[timesheet.month]} {timesheet.year}",
+            'status': f"Stato: {timesheet.get_status()}",
+            'rows': rows,
+        }))
         
         filename = f"timesheet_{timesheet.year}_{timesheet.month:02d}_{current_user.username}.xlsx"
         
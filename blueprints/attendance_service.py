@@ -279,7 +279,8 @@ def build_timesheet_grid(
         Lista di DayRow ordinati per data (1-31)
     """
     from calendar import monthrange
-    from models import Holiday, WorkSchedule
+    from models import WorkSchedule
+    from services import holiday_calendar
     
     italian_weekdays = ['Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato', 'Domenica']
     
@@ -376,26 +377,9 @@ def build_timesheet_grid(
                 )
             current += timedelta(days=1)
     
-    # Carica festività (Holiday usa month/day non date e non ha company_id)
-    # Le festività sono filtrate tramite sede o sono nazionali (sede_id NULL)
+    # Festività del mese (nazionali + sedi dell'utente) dal calendario compilato del tenant
     user_sede_ids = [s.id for s in user_sedi] if user_sedi else []
-    holidays_query = Holiday.query.filter_by(
-        month=month,
-        active=True
-    )
-    if user_sede_ids:
-        from sqlalchemy import or_
-        holidays_query = holidays_query.filter(
-            or_(
-                Holiday.sede_id.in_(user_sede_ids),
-                Holiday.sede_id.is_(None)  # Festività nazionali
-            )
-        )
-    else:
-        holidays_query = holidays_query.filter(Holiday.sede_id.is_(None))
-    
-    holidays = holidays_query.all()
-    holiday_days = {h.day for h in holidays}
+    holiday_days = holiday_calendar.holiday_days_in_month(company_id, year, month, user_sede_ids)
     
     # Costruisci la griglia giorno per giorno
     grid = []
@@ -9,7 +9,6 @@ from werkzeug.security import check_password_hash, generate_password_hash
 from urllib.parse import urlparse, urljoin
 from io import BytesIO
 import secrets
-import qrcode
 import base64
 from datetime import timedelta, datetime
 
@@ -291,6 +290,8 @@ def qr_fresh(action):
 @auth_bp.route('/generate_qr_codes')
 def generate_qr_codes():
     """Genera i codici QR per entrata e uscita"""
+    import qrcode
+    
     try:
         base_url = request.url_root.rstrip('/')
         
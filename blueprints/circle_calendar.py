@@ -1,10 +1,11 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, jsonify, Response
 from flask_login import login_required, current_user
 from app import db
 from models import CircleCalendarEvent
 from utils_tenant import filter_by_company, get_user_company_id, set_company_on_create
 from datetime import datetime, timedelta
-from sqlalchemy import desc
+from sqlalchemy import desc, func, or_, and_
+import hashlib
 
 bp = Blueprint('circle_calendar', __name__, url_prefix='/circle/calendar')
 
@@ -17,45 +18,118 @@ def index():
     
     return render_template('circle/calendar/index.html')
 
+def _parse_window_bound(value):
+    """Converte il parametro ISO di FullCalendar in datetime naive (ora locale)"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed.replace(tzinfo=None)
+
+def _calendar_version(company_id):
+    """
+    Versione dei dati calendario del tenant: (conteggio, max id, ultima modifica).
+    Cambia a ogni create/edit/delete e costa una sola query aggregata sull'indice.
+    """
+    query = db.session.query(
+        func.count(CircleCalendarEvent.id),
+        func.max(CircleCalendarEvent.id),
+        func.max(func.coalesce(CircleCalendarEvent.updated_at, CircleCalendarEvent.created_at))
+    )
+    if company_id is not None:
+        query = query.filter(CircleCalendarEvent.company_id == company_id)
+    return query.one()
+
 @bp.route('/events')
 @login_required
 def get_events():
-    """API JSON per eventi calendario"""
+    """API JSON per eventi calendario (con espansione ricorrenze e cache HTTP)"""
     if not current_user.has_permission('can_view_calendar'):
         abort(403)
     
     start_date = request.args.get('start')
     end_date = request.args.get('end')
+    company_id = get_user_company_id()
+    
+    # ETag/Last-Modified: la navigazione ripetuta tra i mesi riceve 304 senza caricare eventi
+    count, max_id, last_modified = _calendar_version(company_id)
+    etag = hashlib.md5(
+        f"{company_id}|{start_date}|{end_date}|{count}|{max_id}|{last_modified}".encode('utf-8')
+    ).hexdigest()
+    
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
     
     query = filter_by_company(CircleCalendarEvent.query, current_user)
     
     if start_date and end_date:
-        start = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        end = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+        start = _parse_window_bound(start_date)
+        end = _parse_window_bound(end_date)
         # Usa overlap logic: eventi che si sovrappongono alla finestra
-        # (start < window_end AND end > window_start)
+        # (start < window_end AND end > window_start), servita da idx_circle_event_company_range.
+        # Gli eventi ricorrenti sono inclusi se la ricorrenza è ancora attiva nella finestra
+        # e vengono espansi lato server solo per la finestra richiesta.
+        duration = CircleCalendarEvent.end_datetime - CircleCalendarEvent.start_datetime
         query = query.filter(
             CircleCalendarEvent.start_datetime < end,
-            CircleCalendarEvent.end_datetime > start
+            or_(
+                and_(
+                    CircleCalendarEvent.recurrence_rule.is_(None),
+                    CircleCalendarEvent.end_datetime > start
+                ),
+                and_(
+                    CircleCalendarEvent.recurrence_rule.isnot(None),
+                    or_(
+                        CircleCalendarEvent.recurrence_until.is_(None),
+                        CircleCalendarEvent.recurrence_until + duration > start
+                    )
+                )
+            )
         )
-    
-    events = query.all()
+        events = query.all()
+        occurrences = [
+            (event, occ_start, occ_end)
+            for event in events
+            for occ_start, occ_end in event.occurrences_between(start, end)
+        ]
+    else:
+        events = query.all()
+        occurrences = [(event, event.start_datetime, event.end_datetime) for event in events]
     
     events_json = [{
         'id': event.id,
+        'groupId': event.id if event.is_recurring else None,
         'title': event.title,
-        'start': event.start_datetime.isoformat(),
-        'end': event.end_datetime.isoformat(),
+        'start': occ_start.isoformat(),
+        'end': occ_end.isoformat(),
         'color': event.color,
         'allDay': event.is_all_day,
         'extendedProps': {
             'description': event.description,
             'location': event.location,
-            'type': event.event_type
+            'type': event.event_type,
+            'recurrence': event.recurrence_rule
         }
-    } for event in events]
-    
-    return jsonify(events_json)
+    } for event, occ_start, occ_end in occurrences]
+    
+    response = jsonify(events_json)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Il browser conserva la risposta ma la rivalida a ogni cambio vista
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def _read_recurrence_fields(event):
+    """Applica all'evento i campi di ricorrenza inviati dal form"""
+    rule = request.form.get('recurrence_rule') or None
+    event.recurrence_rule = rule if rule in CircleCalendarEvent.RECURRENCE_RULES else None
+    try:
+        event.recurrence_interval = max(1, int(request.form.get('recurrence_interval') or 1))
+    except ValueError:
+        event.recurrence_interval = 1
+    until = request.form.get('recurrence_until')
+    event.recurrence_until = datetime.fromisoformat(until) if (until and event.recurrence_rule) else None
 
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -90,6 +164,7 @@ def create():
             is_all_day=is_all_day,
             color=color
         )
+        _read_recurrence_fields(new_event)
         set_company_on_create(new_event)
         
         db.session.add(new_event)
@@ -138,6 +213,7 @@ def edit(event_id):
         event.location = request.form.get('location')
         event.is_all_day = request.form.get('is_all_day') == 'on'
         event.color = request.form.get('color', '#0d6efd')
+        _read_recurrence_fields(event)
         
         db.session.commit()
         
@@ -8,7 +8,6 @@ from email_utils import send_announcement_notification
 from sqlalchemy import desc
 from datetime import datetime
 from werkzeug.utils import secure_filename
-from PIL import Image
 import os
 import uuid
 
@@ -74,6 +73,8 @@ def view_post(post_id):
 @login_required
 def create():
     """Crea nuova comunicazione associata a un canale"""
+    from PIL import Image
+    
     if not current_user.has_permission('can_create_channel_communications'):
         abort(403)
     
@@ -263,6 +264,8 @@ def toggle_like(post_id):
 @login_required
 def edit(post_id):
     """Modifica comunicazione esistente"""
+    from PIL import Image
+    
     if not current_user.has_permission('can_edit_posts'):
         abort(403)
     
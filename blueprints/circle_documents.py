@@ -1,13 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, send_file
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from app import db
 from models import CircleDocument
 from utils_tenant import filter_by_company, get_user_company_id, set_company_on_create
 from utils_security import sanitize_html, validate_document_upload
+from services import file_storage
 from sqlalchemy import desc
-import os
-from datetime import datetime
 
 bp = Blueprint('circle_documents', __name__, url_prefix='/circle/documents')
 
@@ -75,19 +74,8 @@ def upload():
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
             
-            # Usa percorso assoluto per compatibilità Apache
-            from flask import current_app
-            upload_path = os.path.join(current_app.root_path, UPLOAD_FOLDER)
-            
-            # Crea cartella se non esiste
-            os.makedirs(upload_path, exist_ok=True)
-            
-            # Nome file univoco
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            unique_filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(upload_path, unique_filename)
-            
-            file.save(filepath)
+            # Salvataggio content-addressed: hash calcolato in streaming, file identici deduplicati
+            storage_key = file_storage.store_upload(file)
             
             # Estrai estensione
             file_type = filename.rsplit('.', 1)[1].lower()
@@ -96,7 +84,7 @@ def upload():
                 title=title,
                 description=description,
                 category=category,
-                file_path=unique_filename,
+                file_path=storage_key,
                 file_type=file_type,
                 uploader_id=current_user.id,
                 version=version
@@ -123,15 +111,17 @@ def download(document_id):
     
     document = filter_by_company(CircleDocument.query, current_user).filter_by(id=document_id).first_or_404()
     
-    # Usa percorso assoluto per compatibilità Apache
-    from flask import current_app
-    filepath = os.path.join(current_app.root_path, UPLOAD_FOLDER, document.file_path)
-    
-    if os.path.exists(filepath):
-        return send_file(filepath, as_attachment=True, download_name=document.file_path)
+    if file_storage.is_cas_key(document.file_path):
+        download_name = f"{secure_filename(document.title) or 'documento'}.{document.file_type}"
     else:
+        download_name = document.file_path
+    
+    # ETag/Range oppure handoff al front server (X-Accel-Redirect / X-Sendfile)
+    response = file_storage.send_stored_file(document.file_path, UPLOAD_FOLDER, download_name=download_name)
+    if response is None:
         flash('File non trovato', 'danger')
         return redirect(url_for('circle_documents.index'))
+    return response
 
 @bp.route('/<int:document_id>/delete', methods=['POST'])
 @login_required
@@ -142,11 +132,8 @@ def delete(document_id):
     
     document = filter_by_company(CircleDocument.query, current_user).filter_by(id=document_id).first_or_404()
     
-    # Elimina file fisico
-    from flask import current_app
-    filepath = os.path.join(current_app.root_path, UPLOAD_FOLDER, document.file_path)
-    if os.path.exists(filepath):
-        os.remove(filepath)
+    # Rilascia il file fisico (il blob viene eliminato solo se non più referenziato)
+    file_storage.release(document.file_path, UPLOAD_FOLDER)
     
     db.session.delete(document)
     db.session.commit()
@@ -7,7 +7,6 @@ from utils_tenant import filter_by_company, get_user_company_id, set_company_on_
 from utils_security import sanitize_html, validate_image_upload
 from sqlalchemy import desc, or_, and_
 from werkzeug.utils import secure_filename
-from PIL import Image
 import os
 import uuid
 
@@ -326,6 +325,8 @@ def reject_request(group_id, request_id):
 @login_required
 def create_post(group_id):
     """Crea un post nella bacheca del gruppo"""
+    from PIL import Image
+    
     if not current_user.has_permission('can_access_hubly'):
         abort(403)
     
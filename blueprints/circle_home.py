@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, send_file
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, send_file, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 from app import db
 from models import (
@@ -9,19 +9,15 @@ from utils_tenant import filter_by_company, get_user_company_id, set_company_on_
 from datetime import datetime, timedelta
 from sqlalchemy import desc
 from werkzeug.utils import secure_filename
-from PIL import Image
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import cm
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_LEFT, TA_CENTER
 import os
 import uuid
 import io
 
 bp = Blueprint('circle', __name__, url_prefix='/circle')
 
+PERSONAS_PER_PAGE = 24
+CV_EXPORT_MAX_USERS = 1000
+
 @bp.route('/')
 @login_required
 def home():
@@ -121,17 +117,49 @@ def personas():
         abort(403)
     
     company_id = get_user_company_id()
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    
+    # Ricerca server-side paginata (escludi system admin, amministratori e l'utente corrente)
+    from services.persona_search import search_personas
+    pagination = search_personas(company_id, q, page=page, per_page=PERSONAS_PER_PAGE,
+                                 exclude_user_id=current_user.id)
+    
+    # Stato connessione per tutti i badge con una sola query sull'indice delle coppie
+    connection_statuses = current_user.get_connection_statuses(pagination.items)
+    
+    return render_template('circle/personas.html',
+                         users=pagination.items,
+                         pagination=pagination,
+                         q=q,
+                         connection_statuses=connection_statuses)
+
+@bp.route('/personas/search')
+@login_required
+def personas_search():
+    """API JSON per la ricerca Personas (risultati ordinati per rilevanza e paginati)"""
+    if not current_user.has_permission('can_access_hubly'):
+        abort(403)
     
-    # Filtra utenti della stessa azienda, escludi system admin, amministratori e l'utente corrente
-    users = User.query.filter(
-        User.company_id == company_id,
-        User.active == True,
-        User.is_system_admin == False,
-        User.role != 'Amministratore',
-        User.id != current_user.id
-    ).order_by(User.last_name, User.first_name).all()
-    
-    return render_template('circle/personas.html', users=users)
+    from services.persona_search import search_personas
+    per_page = min(request.args.get('per_page', PERSONAS_PER_PAGE, type=int), 100)
+    pagination = search_personas(get_user_company_id(), request.args.get('q', ''),
+                                 page=request.args.get('page', 1, type=int), per_page=per_page,
+                                 exclude_user_id=current_user.id)
+    
+    return jsonify({
+        'results': [{
+            'id': user.id,
+            'full_name': user.get_full_name(),
+            'job_title': user.job_title,
+            'department': user.department,
+            'avatar': user.get_profile_image_url(),
+            'url': url_for('circle.persona_detail', user_id=user.id)
+        } for user in pagination.items],
+        'page': pagination.page,
+        'pages': pagination.pages,
+        'total': pagination.total
+    })
 
 @bp.route('/personas/<int:user_id>')
 @login_required
@@ -187,204 +215,47 @@ def download_cv_pdf(user_id):
     if user.role == 'Amministratore' and user.id != current_user.id:
         abort(404)
     
-    # Crea PDF in memoria
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=2*cm, bottomMargin=2*cm)
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Stili personalizzati
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#007bff'),
-        spaceAfter=12,
-        alignment=TA_CENTER
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=colors.HexColor('#007bff'),
-        spaceAfter=8,
-        spaceBefore=12
-    )
-    
-    subheading_style = ParagraphStyle(
-        'CustomSubHeading',
-        parent=styles['Heading3'],
-        fontSize=12,
-        textColor=colors.HexColor('#333333'),
-        spaceAfter=6
-    )
-    
-    body_style = ParagraphStyle(
-        'CustomBody',
-        parent=styles['Normal'],
-        fontSize=10,
-        spaceAfter=6
-    )
-    
-    # Titolo - Nome completo
-    story.append(Paragraph(user.get_full_name(), title_style))
-    
-    # Job title e department
-    if user.job_title:
-        story.append(Paragraph(user.job_title, subheading_style))
-    if user.department:
-        story.append(Paragraph(user.department, body_style))
-    
-    story.append(Spacer(1, 0.5*cm))
-    
-    # Contatti
-    contact_data = []
-    if user.email:
-        contact_data.append(['Email:', user.email])
-    if user.phone_number:
-        contact_data.append(['Telefono:', user.phone_number])
-    
-    if contact_data:
-        contact_table = Table(contact_data, colWidths=[4*cm, 12*cm])
-        contact_table.setStyle(TableStyle([
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#666666')),
-            ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ]))
-        story.append(contact_table)
-        story.append(Spacer(1, 0.5*cm))
-    
-    # Bio
-    if user.bio:
-        story.append(Paragraph('Profilo Professionale', heading_style))
-        story.append(Paragraph(user.bio, body_style))
-        story.append(Spacer(1, 0.3*cm))
-    
-    # Formazione
-    if user.education:
-        story.append(Paragraph('Formazione', heading_style))
-        for edu in user.education:
-            degree = edu.get('degree', '')
-            institution = edu.get('institution', '')
-            location = edu.get('location', '')
-            start_date = edu.get('start_date', '')
-            end_date = edu.get('end_date', '')
-            description = edu.get('description', '')
-            
-            story.append(Paragraph(f"<b>{degree}</b>", subheading_style))
-            if institution:
-                inst_text = institution
-                if location:
-                    inst_text += f" - {location}"
-                story.append(Paragraph(inst_text, body_style))
-            if start_date or end_date:
-                period = f"{start_date} - {end_date}" if start_date and end_date else (start_date or end_date)
-                story.append(Paragraph(period, body_style))
-            if description:
-                story.append(Paragraph(description, body_style))
-            story.append(Spacer(1, 0.2*cm))
-    
-    # Esperienza Professionale
-    if user.experience:
-        story.append(Paragraph('Esperienza Professionale', heading_style))
-        for exp in user.experience:
-            position = exp.get('position', '')
-            company = exp.get('company', '')
-            location = exp.get('location', '')
-            start_date = exp.get('start_date', '')
-            end_date = exp.get('end_date', '')
-            current = exp.get('current', False)
-            description = exp.get('description', '')
-            
-            story.append(Paragraph(f"<b>{position}</b>", subheading_style))
-            if company:
-                comp_text = company
-                if location:
-                    comp_text += f" - {location}"
-                story.append(Paragraph(comp_text, body_style))
-            if start_date or end_date or current:
-                if current:
-                    period = f"{start_date} - Presente" if start_date else "Presente"
-                else:
-                    period = f"{start_date} - {end_date}" if start_date and end_date else (start_date or end_date)
-                story.append(Paragraph(period, body_style))
-            if description:
-                story.append(Paragraph(description, body_style))
-            story.append(Spacer(1, 0.2*cm))
-    
-    # Competenze
-    if user.skills:
-        story.append(Paragraph('Competenze', heading_style))
-        for skill_group in user.skills:
-            category = skill_group.get('category', 'Competenze')
-            items = skill_group.get('items', [])
-            story.append(Paragraph(f"<b>{category}:</b> {', '.join(items)}", body_style))
-        story.append(Spacer(1, 0.3*cm))
-    
-    # Lingue
-    if user.languages:
-        story.append(Paragraph('Lingue', heading_style))
-        for lang in user.languages:
-            language = lang.get('language', '')
-            level = lang.get('level', '')
-            proficiency = lang.get('proficiency', '')
-            certifications = lang.get('certifications', '')
-            
-            lang_text = f"<b>{language}</b>"
-            if level:
-                lang_text += f" - {level}"
-            if proficiency:
-                lang_text += f" ({proficiency})"
-            story.append(Paragraph(lang_text, body_style))
-            if certifications:
-                story.append(Paragraph(f"<i>{certifications}</i>", body_style))
-        story.append(Spacer(1, 0.3*cm))
-    
-    # Certificazioni
-    if user.certifications:
-        story.append(Paragraph('Certificazioni', heading_style))
-        for cert in user.certifications:
-            name = cert.get('name', '')
-            issuer = cert.get('issuer', '')
-            date = cert.get('date', '')
-            expiry = cert.get('expiry', '')
-            credential_id = cert.get('credential_id', '')
-            
-            story.append(Paragraph(f"<b>{name}</b>", subheading_style))
-            if issuer:
-                story.append(Paragraph(f"Ente certificatore: {issuer}", body_style))
-            if date or expiry:
-                cert_period = f"Rilasciata: {date}" if date else ""
-                if expiry:
-                    cert_period += f" | Scadenza: {expiry}"
-                story.append(Paragraph(cert_period, body_style))
-            if credential_id:
-                story.append(Paragraph(f"ID Credenziale: {credential_id}", body_style))
-            story.append(Spacer(1, 0.2*cm))
-    
-    # Referenze
-    if user.references:
-        story.append(Paragraph('Referenze', heading_style))
-        # Sostituisci newline con <br/> per il PDF
-        references_html = user.references.replace('\n', '<br/>')
-        story.append(Paragraph(references_html, body_style))
-    
-    # Build PDF
-    doc.build(story)
-    buffer.seek(0)
-    
-    # Prepara filename
-    filename = f"CV_{user.last_name}_{user.first_name}.pdf"
+    # PDF dalla cache (chiave = hash dei campi del profilo), rigenerato solo se il profilo è cambiato
+    from services.cv_renderer import get_cv_pdf, cv_payload, cv_filename
+    buffer = io.BytesIO(get_cv_pdf(user))
     
     return send_file(
         buffer,
         mimetype='application/pdf',
         as_attachment=True,
-        download_name=filename
+        download_name=cv_filename(cv_payload(user))
     )
 
+@bp.route('/personas/cv-export')
+@login_required
+def export_cvs_zip():
+    """Esporta in un archivio ZIP i CV delle Personas (risultato della ricerca corrente o ID selezionati)"""
+    if not current_user.has_permission('can_access_hubly') or not current_user.can_view_hr_data():
+        abort(403)
+    
+    from services.cv_renderer import iter_cv_zip
+    from services.persona_search import directory_query, search_personas
+    
+    company_id = get_user_company_id()
+    user_ids = request.args.getlist('user_ids', type=int)
+    
+    if user_ids:
+        users = directory_query(company_id).filter(User.id.in_(user_ids)).order_by(
+            User.last_name, User.first_name
+        ).all()
+    else:
+        q = request.args.get('q', '').strip()
+        users = search_personas(company_id, q, page=1, per_page=CV_EXPORT_MAX_USERS).items
+    
+    if not users:
+        flash('Nessun CV da esportare', 'warning')
+        return redirect(url_for('circle.personas'))
+    
+    filename = f"CV_export_{datetime.now().strftime('%Y%m%d_%H%M')}.zip"
+    response = Response(stream_with_context(iter_cv_zip(users)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 @bp.route('/tech-feed')
 @login_required
 def tech_feed():
@@ -403,6 +274,8 @@ def tech_feed():
 @login_required
 def create_delorean():
     """Crea nuovo post Delorean"""
+    from PIL import Image
+    
     if not current_user.has_permission('can_create_posts'):
         abort(403)
     
@@ -473,6 +346,8 @@ def create_delorean():
 @login_required
 def create_tech_feed():
     """Crea nuovo post Tech Feed"""
+    from PIL import Image
+    
     if not current_user.has_permission('can_create_posts'):
         abort(403)
     
@@ -563,18 +438,7 @@ def send_connection_request(user_id):
         return redirect(url_for('circle.personas'))
     
     # Verifica se esiste già una connessione o richiesta
-    existing = ConnectionRequest.query.filter(
-        db.or_(
-            db.and_(
-                ConnectionRequest.sender_id == current_user.id,
-                ConnectionRequest.recipient_id == target_user.id
-            ),
-            db.and_(
-                ConnectionRequest.sender_id == target_user.id,
-                ConnectionRequest.recipient_id == current_user.id
-            )
-        )
-    ).first()
+    existing = ConnectionRequest.pair_query(current_user.id, target_user.id).first()
     
     if existing:
         if existing.status == 'Accepted':
@@ -690,17 +554,7 @@ def remove_connection(user_id):
         abort(403)
     
     # Trova la connessione accettata
-    connection = filter_by_company(ConnectionRequest.query).filter(
-        db.or_(
-            db.and_(
-                ConnectionRequest.sender_id == current_user.id,
-                ConnectionRequest.recipient_id == user_id
-            ),
-            db.and_(
-                ConnectionRequest.sender_id == user_id,
-                ConnectionRequest.recipient_id == current_user.id
-            )
-        ),
+    connection = filter_by_company(ConnectionRequest.pair_query(current_user.id, user_id)).filter(
         ConnectionRequest.status == 'Accepted'
     ).first()
     
@@ -8,7 +8,6 @@ from email_utils import send_announcement_notification
 from sqlalchemy import desc
 from datetime import datetime
 from werkzeug.utils import secure_filename
-from PIL import Image
 import os
 import uuid
 
@@ -60,6 +59,8 @@ def view_post(post_id, slug=None):
 @login_required
 def create(slug=None):
     """Crea nuovo post/news"""
+    from PIL import Image
+    
     if not current_user.has_permission('can_create_posts'):
         abort(403)
     
@@ -226,6 +227,8 @@ def toggle_like(post_id, slug=None):
 @login_required
 def edit(post_id, slug=None):
     """Modifica post esistente"""
+    from PIL import Image
+    
     if not current_user.has_permission('can_edit_posts'):
         abort(403)
     
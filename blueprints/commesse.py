@@ -12,8 +12,9 @@
 # 7. unassign_user (POST) - Rimozione assegnazione risorsa
 # 8. commessa_users (GET) - Lista risorse assegnate a commessa
 # 9. user_commesse (GET) - Lista commesse assegnate a risorsa
+# 10. commesse_ore (GET) - Ore consumate/residue di più commesse (batch)
 #
-# Total routes: 9 commesse management routes
+# Total routes: 10 commesse management routes
 # =============================================================================
 
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash
@@ -69,6 +70,7 @@ def manage_commesse():
     
     # Ordina per data fine (scadenze più vicine prima)
     commesse = query.order_by(Commessa.data_fine.asc()).all()
+    Commessa.preload_ore_consumate(commesse)
     
     # Statistiche
     totale_commesse = filter_by_company(Commessa.query).count()
@@ -454,3 +456,27 @@ def user_commesse(user_id):
         'commesse': commesse_data,
         'total': len(commesse_data)
     })
+
+
+@commesse_bp.route('/api/ore')
+@login_required
+@require_commesse_permission
+def commesse_ore():
+    """API: ore consumate, residue e completamento per più commesse (?ids=1,2,3)"""
+    query = filter_by_company(Commessa.query)
+    
+    ids_param = request.args.get('ids', '')
+    if ids_param:
+        try:
+            ids = [int(x) for x in ids_param.split(',') if x.strip()]
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Parametro ids non valido'}), 400
+        query = query.filter(Commessa.id.in_(ids))
+    
+    commesse = Commessa.preload_ore_consumate(query.all())
+    
+    return jsonify({
+        'success': True,
+        'commesse': {str(c.id): c.get_ore_summary() for c in commesse},
+        'total': len(commesse)
+    })
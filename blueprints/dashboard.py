@@ -15,6 +15,7 @@ from models import (
 )
 from utils import get_user_statistics, get_team_statistics, format_hours
 from utils_tenant import filter_by_company
+from services import listing, overtime_detection
 
 # Create Blueprint
 dashboard_bp = Blueprint('dashboard', __name__)
@@ -298,6 +299,19 @@ def dashboard():
             OvertimeRequest.status == 'Pending'
         ).order_by(OvertimeRequest.created_at.desc()).limit(5).all()
     
+    # Widget gestione straordinari: richieste del mese e straordinario rilevato dalle timbrature
+    overtime_stats = None
+    if current_user.can_view_overtime_widget():
+        month_start, month_end = listing.month_range(date.today().year, date.today().month)
+        users_query = listing.scope_to_sede(filter_by_company(User.query), current_user)
+        requests_query = listing.filter_date_range(
+            filter_by_company(OvertimeRequest.query).filter(
+                OvertimeRequest.employee_id.in_(users_query.with_entities(User.id))
+            ),
+            OvertimeRequest.overtime_date, month_start, month_end
+        )
+        overtime_stats = overtime_detection.widget_stats(requests_query, users_query, month_start, month_end)
+    
     # Widget mileage requests
     recent_mileage_requests = []
     my_mileage_requests = []
@@ -403,6 +417,7 @@ def dashboard():
                          expense_reports_data=expense_reports_data,
                          recent_overtime_requests=recent_overtime_requests,
                          my_overtime_requests=my_overtime_requests,
+                         overtime_stats=overtime_stats,
                          recent_mileage_requests=recent_mileage_requests,
                          my_mileage_requests=my_mileage_requests,
                          banca_ore_wallet=banca_ore_wallet,
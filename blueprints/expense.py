@@ -5,7 +5,7 @@
 # and all related financial operations including categories and approvals
 # =============================================================================
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
 from io import BytesIO
@@ -17,10 +17,9 @@ from models import User, ExpenseReport, ExpenseCategory, OvertimeRequest, Overti
 from forms import ExpenseFilterForm, ExpenseReportForm, OvertimeRequestForm, MileageRequestForm, MileageFilterForm, ExpenseCategoryForm, OvertimeTypeForm, ExpenseApprovalForm
 from app import db, app
 from sqlalchemy.orm import joinedload
-from werkzeug.utils import secure_filename
 from utils_tenant import filter_by_company, set_company_on_create, get_user_company_id
 from services.distance_service import get_distance_service
-import uuid
+from services import file_storage, listing, mileage_summary, overtime_detection
 
 # =============================================================================
 # BLUEPRINT CONFIGURATION
@@ -34,6 +33,9 @@ expense_bp = Blueprint(
     static_folder='../static'
 )
 
+# Cartella dei file ricevuta salvati prima dello storage content-addressed
+RECEIPTS_FOLDER = os.path.join('static', 'uploads', 'expenses')
+
 # =============================================================================
 # PERMISSION DECORATORS
 # =============================================================================
@@ -153,20 +155,8 @@ def create_expense_report():
         # Gestione upload file
         receipt_filename = None
         if form.receipt_file.data:
-            file = form.receipt_file.data
-            filename = secure_filename(file.filename)
-            
-            # Crea nome file unico
-            file_extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-            unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
-            
-            # Crea directory uploads se non esiste
-            upload_dir = os.path.join(app.root_path, 'static', 'uploads', 'expenses')
-            os.makedirs(upload_dir, exist_ok=True)
-            
-            file_path = os.path.join(upload_dir, unique_filename)
-            file.save(file_path)
-            receipt_filename = unique_filename
+            # Salvataggio content-addressed (hash in streaming, deduplica)
+            receipt_filename = file_storage.store_upload(form.receipt_file.data)
         
         # Crea nota spese
         expense = ExpenseReport(
@@ -191,10 +181,6 @@ def create_expense_report():
 @login_required
 def edit_expense_report(expense_id):
     """Modifica nota spese esistente"""
-    import os
-    from werkzeug.utils import secure_filename
-    import uuid
-    
     expense = filter_by_company(ExpenseReport.query).filter_by(id=expense_id).first_or_404()
     
     # Verifica permessi
@@ -212,26 +198,9 @@ def edit_expense_report(expense_id):
     if form.validate_on_submit():
         # Gestione upload file
         if form.receipt_file.data:
-            # Elimina vecchio file se esiste
-            if expense.receipt_filename:
-                old_file_path = os.path.join(app.root_path, 'static', 'uploads', 'expenses', expense.receipt_filename)
-                if os.path.exists(old_file_path):
-                    os.remove(old_file_path)
-            
-            file = form.receipt_file.data
-            filename = secure_filename(file.filename)
-            
-            # Crea nome file unico
-            file_extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-            unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
-            
-            # Crea directory uploads se non esiste
-            upload_dir = os.path.join(app.root_path, 'static', 'uploads', 'expenses')
-            os.makedirs(upload_dir, exist_ok=True)
-            
-            file_path = os.path.join(upload_dir, unique_filename)
-            file.save(file_path)
-            expense.receipt_filename = unique_filename
+            # Rilascia il vecchio file (eliminato solo se non più referenziato)
+            file_storage.release(expense.receipt_filename, RECEIPTS_FOLDER)
+            expense.receipt_filename = file_storage.store_upload(form.receipt_file.data)
         
         # Aggiorna dati
         expense.expense_date = form.expense_date.data
@@ -290,8 +259,6 @@ def approve_expense_report(expense_id):
 @login_required
 def download_expense_receipt(expense_id):
     """Download ricevuta allegata"""
-    import os
-    
     expense = filter_by_company(ExpenseReport.query).filter_by(id=expense_id).first_or_404()
     
     # Verifica permessi
@@ -305,21 +272,20 @@ def download_expense_receipt(expense_id):
         flash('Nessun documento allegato a questa nota spese', 'warning')
         return redirect(url_for('expense.expense_reports'))
     
-    file_path = os.path.join(app.root_path, 'static', 'uploads', 'expenses', expense.receipt_filename)
-    
-    if not os.path.exists(file_path):
+    response = file_storage.send_stored_file(
+        expense.receipt_filename, RECEIPTS_FOLDER,
+        download_name=f"ricevuta_{expense.id}_{expense.expense_date.strftime('%Y%m%d')}.{expense.receipt_filename.split('.')[-1]}"
+    )
+    if response is None:
         flash('File non trovato', 'danger')
         return redirect(url_for('expense.expense_reports'))
     
-    return send_file(file_path, as_attachment=True, 
-                    download_name=f"ricevuta_{expense.id}_{expense.expense_date.strftime('%Y%m%d')}.{expense.receipt_filename.split('.')[-1]}")
+    return response
 
 @expense_bp.route('/reports/delete/<int:expense_id>', methods=['POST'])
 @login_required
 def delete_expense_report(expense_id):
     """Elimina nota spese"""
-    import os
-    
     expense = filter_by_company(ExpenseReport.query).filter_by(id=expense_id).first_or_404()
     
     # Verifica permessi
@@ -333,10 +299,7 @@ def delete_expense_report(expense_id):
         return redirect(url_for('expense.expense_reports'))
     
     # Elimina file allegato se esiste
-    if expense.receipt_filename:
-        file_path = os.path.join(app.root_path, 'static', 'uploads', 'expenses', expense.receipt_filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    file_storage.release(expense.receipt_filename, RECEIPTS_FOLDER)
     
     db.session.delete(expense)
     db.session.commit()
@@ -581,8 +544,15 @@ def overtime_requests_management():
     # Ordina per data più recente
     requests = query.order_by(OvertimeRequest.overtime_date.desc()).all()
     
+    # Straordinario rilevato dalle timbrature (ultimi 30 giorni per quello senza richiesta)
+    detected = overtime_detection.for_requests(requests)
+    users_query = listing.scope_to_sede(filter_by_company(User.query), current_user)
+    unrequested = overtime_detection.unrequested(users_query, date.today() - timedelta(days=30), date.today())
+    
     return render_template('overtime_requests.html', 
                          requests=requests, 
+                         detected=detected,
+                         unrequested=unrequested,
                          form=filter_form)
 
 @expense_bp.route('/overtime/requests/create', methods=['GET', 'POST'])
@@ -830,11 +800,7 @@ def mileage_requests():
         filter_form = MileageFilterForm(current_user=current_user)
         
         # Base query (with company filter)
-        query = filter_by_company(MileageRequest.query).options(
-            joinedload(MileageRequest.user),
-            joinedload(MileageRequest.approver),  
-            joinedload(MileageRequest.vehicle)
-        )
+        query = filter_by_company(MileageRequest.query)
         
         # Filtri per sede (se l'utente non ha accesso globale)
         if not current_user.all_sedi and current_user.sede_id:
@@ -852,9 +818,16 @@ def mileage_requests():
                 query = query.filter(MileageRequest.travel_date <= filter_form.date_to.data)
         
         # Ordina per data più recente
-        requests = query.order_by(MileageRequest.created_at.desc()).all()
+        requests = query.options(
+            joinedload(MileageRequest.user),
+            joinedload(MileageRequest.approver),
+            joinedload(MileageRequest.vehicle)
+        ).order_by(MileageRequest.created_at.desc()).all()
         
-        return render_template('mileage_requests.html', requests=requests, filter_form=filter_form)
+        # Totali per stato e per dipendente della stessa selezione, calcolati nel database
+        return render_template('mileage_requests.html', requests=requests, filter_form=filter_form,
+                               summary=mileage_summary.totals(query),
+                               user_summaries=mileage_summary.by_user(query))
     except Exception as e:
         import logging
         logging.exception(f"Errore nel caricamento delle richieste di rimborso: {str(e)}")
@@ -942,12 +915,13 @@ def my_mileage_requests():
             flash('Non hai i permessi per visualizzare le tue richieste di rimborso chilometrico.', 'warning')
             return redirect(url_for('dashboard.dashboard'))
         
-        requests = filter_by_company(MileageRequest.query).filter_by(user_id=current_user.id)\
-                                      .options(joinedload(MileageRequest.approver),
-                                              joinedload(MileageRequest.vehicle))\
-                                      .order_by(MileageRequest.created_at.desc()).all()
+        query = filter_by_company(MileageRequest.query).filter_by(user_id=current_user.id)
+        requests = query.options(joinedload(MileageRequest.approver),
+                                 joinedload(MileageRequest.vehicle))\
+                        .order_by(MileageRequest.created_at.desc()).all()
         
-        return render_template('my_mileage_requests.html', requests=requests)
+        return render_template('my_mileage_requests.html', requests=requests,
+                               summary=mileage_summary.totals(query))
     except Exception as e:
         import logging
         logging.exception(f"Errore nel caricamento delle mie richieste di rimborso: {str(e)}")
@@ -1270,6 +1244,130 @@ def mileage_requests_excel():
     return response
 
 
+def build_mileage_requests_export():
+    """
+    Excel delle richieste di rimborso chilometrico visibili all'utente corrente (azienda
+    e sede), con il foglio di riepilogo mensile. I permessi li verifica la route chiamante.
+    """
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment
+    
+    # Base query (with company filter)
+    query = filter_by_company(MileageRequest.query)
+    
+    # Filtri per sede
+    if not current_user.all_sedi and current_user.sede_id:
+        query = query.join(User, MileageRequest.user_id == User.id).filter(User.sede_id == current_user.sede_id)
+    
+    requests = query.options(
+        joinedload(MileageRequest.user),
+        joinedload(MileageRequest.approver),
+        joinedload(MileageRequest.vehicle)
+    ).order_by(MileageRequest.travel_date.desc()).all()
+    
+    # Crea workbook
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Rimborsi Chilometrici"
+    
+    # Header con stile
+    headers = [
+        'Data Viaggio', 'Utente', 'Percorso', 'KM Totali', 'Veicolo', 
+        'Importo (€)', 'Stato', 'Motivazione', 'Note', 'Data Richiesta', 
+        'Approvato/Rifiutato da', 'Data Approvazione', 'Commento Approvazione'
+    ]
+    
+    for col, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col, value=header)
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        cell.alignment = Alignment(horizontal="center")
+    
+    # Dati
+    for row, req in enumerate(requests, 2):
+        ws.cell(row=row, column=1, value=req.travel_date.strftime('%d/%m/%Y'))
+        ws.cell(row=row, column=2, value=req.user.get_full_name())
+        ws.cell(row=row, column=3, value=req.get_route_summary())
+        ws.cell(row=row, column=4, value=req.total_km)
+        
+        # Veicolo
+        if req.vehicle:
+            vehicle_info = f"{req.vehicle.marca} {req.vehicle.modello}"
+        else:
+            vehicle_info = req.vehicle_description or "Non specificato"
+        ws.cell(row=row, column=5, value=vehicle_info)
+        
+        ws.cell(row=row, column=6, value=req.total_amount or 0)
+        
+        # Stato con colore
+        status_cell = ws.cell(row=row, column=7, value=req.get_status_display())
+        if req.status == 'Approved':
+            status_cell.fill = PatternFill(start_color="D4F4DD", end_color="D4F4DD", fill_type="solid")
+        elif req.status == 'Rejected':
+            status_cell.fill = PatternFill(start_color="F8D7DA", end_color="F8D7DA", fill_type="solid")
+        
+        ws.cell(row=row, column=8, value=req.purpose)
+        ws.cell(row=row, column=9, value=req.notes or '')
+        ws.cell(row=row, column=10, value=req.created_at.strftime('%d/%m/%Y %H:%M'))
+        
+        if req.approver:
+            ws.cell(row=row, column=11, value=req.approver.get_full_name())
+        if req.approved_at:
+            ws.cell(row=row, column=12, value=req.approved_at.strftime('%d/%m/%Y %H:%M'))
+        ws.cell(row=row, column=13, value=req.approval_comment or '')
+    
+    # Auto-fit colonne
+    for column in ws.columns:
+        max_length = 0
+        column_letter = column[0].column_letter
+        for cell in column:
+            try:
+                if len(str(cell.value)) > max_length:
+                    max_length = len(str(cell.value))
+            except:
+                pass
+        adjusted_width = min(max_length + 2, 50)
+        ws.column_dimensions[column_letter].width = adjusted_width
+    
+    # Riepilogo per dipendente e mese (una query GROUP BY)
+    summary_ws = wb.create_sheet("Riepilogo Mensile")
+    summary_headers = [
+        'Mese', 'Utente', 'Richieste', 'KM Approvati', 'Importo Approvato (€)',
+        'KM In Attesa', 'Importo In Attesa (€)', 'Rifiutate', 'KM Totali', 'Importo Totale (€)'
+    ]
+    for col, header in enumerate(summary_headers, 1):
+        cell = summary_ws.cell(row=1, column=col, value=header)
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        cell.alignment = Alignment(horizontal="center")
+    
+    for row, summary in enumerate(mileage_summary.monthly_by_user(query), 2):
+        summary_ws.cell(row=row, column=1, value=summary['month'].strftime('%m/%Y'))
+        summary_ws.cell(row=row, column=2, value=summary['user'].get_full_name() if summary['user'] else '')
+        summary_ws.cell(row=row, column=3, value=summary['total_count'])
+        summary_ws.cell(row=row, column=4, value=summary['approved_km'])
+        summary_ws.cell(row=row, column=5, value=summary['approved_amount'])
+        summary_ws.cell(row=row, column=6, value=summary['pending_km'])
+        summary_ws.cell(row=row, column=7, value=summary['pending_amount'])
+        summary_ws.cell(row=row, column=8, value=summary['rejected_count'])
+        summary_ws.cell(row=row, column=9, value=summary['total_km'])
+        summary_ws.cell(row=row, column=10, value=summary['total_amount'])
+    
+    for col, header in enumerate(summary_headers, 1):
+        summary_ws.column_dimensions[summary_ws.cell(row=1, column=col).column_letter].width = max(len(header) + 2, 14)
+    
+    # Prepara response
+    output = BytesIO()
+    wb.save(output)
+    output.seek(0)
+    
+    response = make_response(output.read())
+    response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    response.headers['Content-Disposition'] = f'attachment; filename=rimborsi_chilometrici_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
+    
+    return response
+
+
 @expense_bp.route('/mileage/requests/export')
 @login_required
 @require_mileage_permission
@@ -1280,98 +1378,7 @@ def export_mileage_requests():
         return redirect(url_for('dashboard.dashboard'))
     
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment
-        from sqlalchemy.orm import joinedload
-        
-        # Base query (with company filter)
-        query = filter_by_company(MileageRequest.query).options(
-            joinedload(MileageRequest.user),
-            joinedload(MileageRequest.approver),
-            joinedload(MileageRequest.vehicle)
-        )
-        
-        # Filtri per sede
-        if not current_user.all_sedi and current_user.sede_id:
-            query = query.join(User).filter(User.sede_id == current_user.sede_id)
-        
-        requests = query.order_by(MileageRequest.travel_date.desc()).all()
-        
-        # Crea workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Rimborsi Chilometrici"
-        
-        # Header con stile
-        headers = [
-            'Data Viaggio', 'Utente', 'Percorso', 'KM Totali', 'Veicolo', 
-            'Importo (€)', 'Stato', 'Motivazione', 'Note', 'Data Richiesta', 
-            'Approvato/Rifiutato da', 'Data Approvazione', 'Commento Approvazione'
-        ]
-        
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            cell.alignment = Alignment(horizontal="center")
-        
-        # Dati
-        for row, req in enumerate(requests, 2):
-            ws.cell(row=row, column=1, value=req.travel_date.strftime('%d/%m/%Y'))
-            ws.cell(row=row, column=2, value=req.user.get_full_name())
-            ws.cell(row=row, column=3, value=req.get_route_summary())
-            ws.cell(row=row, column=4, value=req.total_km)
-            
-            # Veicolo
-            if req.vehicle:
-                vehicle_info = f"{req.vehicle.marca} {req.vehicle.modello}"
-            else:
-                vehicle_info = req.vehicle_description or "Non specificato"
-            ws.cell(row=row, column=5, value=vehicle_info)
-            
-            ws.cell(row=row, column=6, value=req.total_amount or 0)
-            
-            # Stato con colore
-            status_cell = ws.cell(row=row, column=7, value=req.get_status_display())
-            if req.status == 'Approved':
-                status_cell.fill = PatternFill(start_color="D4F4DD", end_color="D4F4DD", fill_type="solid")
-            elif req.status == 'Rejected':
-                status_cell.fill = PatternFill(start_color="F8D7DA", end_color="F8D7DA", fill_type="solid")
-            
-            ws.cell(row=row, column=8, value=req.purpose)
-            ws.cell(row=row, column=9, value=req.notes or '')
-            ws.cell(row=row, column=10, value=req.created_at.strftime('%d/%m/%Y %H:%M'))
-            
-            if req.approver:
-                ws.cell(row=row, column=11, value=req.approver.get_full_name())
-            if req.approved_at:
-                ws.cell(row=row, column=12, value=req.approved_at.strftime('%d/%m/%Y %H:%M'))
-            ws.cell(row=row, column=13, value=req.approval_comment or '')
-        
-        # Auto-fit colonne
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Prepara response
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        response = make_response(output.read())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename=rimborsi_chilometrici_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        return response
-        
+        return build_mileage_requests_export()
     except Exception as e:
         flash(f'Errore durante l\'esportazione: {str(e)}', 'danger')
         return redirect(url_for('expense.mileage_requests'))
@@ -160,11 +160,7 @@ def shifts_excel():
 @login_required  
 def shifts_pdf():
     """Export calendario turni in formato PDF"""
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib import colors
-    from reportlab.lib.units import inch
+    from services import export_renderer
     
     # Parametri dalla query string
     view_mode = request.args.get('view', 'month')
@@ -207,65 +203,12 @@ def shifts_pdf():
         shifts_query = shifts_query.filter(Shift.user_id == current_user.id)
         filename = f"miei_{filename}"
     
-    shifts = shifts_query.order_by(Shift.date, Shift.start_time).all()
-    
-    # Crea PDF
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    styles = getSampleStyleSheet()
-    story = []
-    
-    # Titolo
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        spaceAfter=30,
-        alignment=1
-    )
-    story.append(Paragraph(f"Calendario Turni - {title_period}", title_style))
+    subtitle = [f"Utente: {current_user.get_full_name()}"] if show_my_shifts else []
     
-    if show_my_shifts:
-        story.append(Paragraph(f"Utente: {current_user.get_full_name()}", styles['Normal']))
-        story.append(Spacer(1, 20))
-    
-    # Prepara dati per tabella
-    table_data = [['Data', 'Utente', 'Orario', 'Durata', 'Tipo']]
-    
-    for shift in shifts:
-        duration = (datetime.combine(date.today(), shift.end_time) - 
-                   datetime.combine(date.today(), shift.start_time)).total_seconds() / 3600
-        
-        table_data.append([
-            shift.date.strftime('%d/%m'),
-            shift.user.get_full_name()[:20],  # Limita lunghezza nome
-            f"{shift.start_time.strftime('%H:%M')}-{shift.end_time.strftime('%H:%M')}",
-            f"{duration:.1f}h",
-            shift.shift_type[:10]  # Limita lunghezza tipo
-        ])
-    
-    if len(table_data) > 1:
-        # Crea tabella
-        table = Table(table_data)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(table)
-    else:
-        story.append(Paragraph("Nessun turno trovato per il periodo selezionato.", styles['Normal']))
-    
-    # Genera PDF
-    doc.build(story)
-    buffer.seek(0)
-    pdf_data = buffer.getvalue()
-    buffer.close()
+    # Turni con utente e sede in una query; PDF dalla cache se i turni non sono cambiati
+    rows = export_renderer.shift_rows(shifts_query)
+    payload = export_renderer.calendar_payload(f"Calendario Turni - {title_period}", subtitle, rows)
+    pdf_data = export_renderer.get_shifts_pdf(payload)
     
     response = make_response(pdf_data)
     response.headers['Content-Type'] = 'application/pdf'
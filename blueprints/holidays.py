@@ -11,6 +11,7 @@ from app import db
 from models import Holiday, italian_now
 from forms import HolidayForm
 from utils_tenant import filter_by_company, set_company_on_create, get_user_company_id
+from services import holiday_calendar
 
 # Create blueprint
 holidays_bp = Blueprint('holidays', __name__, url_prefix='/holidays')
@@ -64,6 +65,7 @@ def add_holiday():
         
         db.session.add(holiday)
         db.session.commit()
+        holiday_calendar.invalidate(holiday.company_id)
         flash(f'Festività "{holiday.name}" aggiunta con successo.', 'success')
         return redirect(url_for('holidays.holidays'))
     
@@ -104,6 +106,7 @@ def edit_holiday(holiday_id):
         holiday.active = form.active.data
         
         db.session.commit()
+        holiday_calendar.invalidate(holiday.company_id)
         flash(f'Festività "{holiday.name}" aggiornata con successo.', 'success')
         return redirect(url_for('holidays.holidays'))
     
@@ -120,8 +123,10 @@ def delete_holiday(holiday_id):
     holiday = filter_by_company(Holiday.query).filter_by(id=holiday_id).first_or_404()
     
     try:
+        company_id = holiday.company_id
         db.session.delete(holiday)
         db.session.commit()
+        holiday_calendar.invalidate(company_id)
         flash(f'Festività "{holiday.name}" eliminata con successo.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -186,6 +191,7 @@ def api_generate_holidays():
             created_count += 1
         
         db.session.commit()
+        holiday_calendar.invalidate(get_user_company_id())
         
         return jsonify({
             'success': True, 
@@ -8,23 +8,24 @@
 # 3. contract_history (GET) - Visualizza storico contrattuale dipendente
 # 4. contract_history_export (GET) - Export Excel storico contrattuale
 # 5. hr_export (GET) - Export Excel dati HR
+# 6. hr_expiries (GET) - Scadenzario documenti, formazione e contratti
 #
-# Total routes: 5
+# Total routes: 6
 # =============================================================================
 
 from flask import Blueprint, request, render_template, redirect, url_for, flash, make_response, session, jsonify
 from flask_login import login_required, current_user
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from functools import wraps
 from app import db
-from models import User, UserHRData, ACITable, Sede, WorkSchedule, ContractHistory, SecondmentPeriod
-from utils_tenant import filter_by_company, set_company_on_create
+from models import User, UserHRData, ACITable, Sede, ContractHistory, SecondmentPeriod, HRExpiryEvent
+from utils_tenant import filter_by_company, set_company_on_create, get_user_company_id
 from utils_hr import assign_cod_si, sync_operational_fields
 from utils_codice_fiscale import calculate_codice_fiscale
 from utils_contract_history import get_current_snapshot, save_contract_history_if_changed
+from services.hr_roster import roster_query
+from services import hr_expiry
 from io import BytesIO
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 import os
 from werkzeug.utils import secure_filename
 
@@ -194,7 +195,8 @@ def hr_list():
             User.is_system_admin == False
         )
     
-    users = users_query.all()
+    # Filtri applicati in SQL, dati HR e sede caricati nella stessa query
+    users = roster_query(users_query, active_filters).all()
     
     # Crea dizionario con dati HR per ogni utente
     users_data = []
@@ -246,77 +248,6 @@ def hr_list():
             'has_expiring_certs': has_expiring_certs,
         })
     
-    # Applica filtri personalizzati PRIMA di calcolare le statistiche
-    if active_filters:
-        filtered_data = []
-        for data in users_data:
-            user = data['user']
-            hr_data = data['hr_data']
-            
-            matches = True
-            
-            # Filtro matricola
-            if 'matricola' in active_filters:
-                if not user.matricola or active_filters['matricola'].lower() not in user.matricola.lower():
-                    matches = False
-            
-            # Filtro data assunzione (filtra per anno)
-            if 'hire_date' in active_filters:
-                if not hr_data:
-                    matches = False
-                else:
-                    filter_date_str = active_filters['hire_date']
-                    try:
-                        from datetime import datetime
-                        filter_date = datetime.strptime(filter_date_str, '%Y-%m-%d').date()
-                        if not hr_data.hire_date or hr_data.hire_date.year != filter_date.year:
-                            matches = False
-                    except:
-                        pass  # Se parsing fallisce, ignora il filtro
-            
-            # Filtro tipo contratto - INCLUDE anche utenti senza dati HR (da configurare)
-            if 'contract_type' in active_filters:
-                if hr_data and hr_data.contract_type:
-                    # Ha dati HR e contract_type: verifica corrispondenza
-                    if hr_data.contract_type != active_filters['contract_type']:
-                        matches = False
-                # Se non ha hr_data o non ha contract_type, lo include sempre (da configurare)
-            
-            # Filtro CCNL
-            if 'ccnl' in active_filters:
-                if not hr_data or not hr_data.ccnl or active_filters['ccnl'].lower() not in hr_data.ccnl.lower():
-                    matches = False
-            
-            # Filtro mansione
-            if 'mansione' in active_filters:
-                if not hr_data or not hr_data.mansione or active_filters['mansione'].lower() not in hr_data.mansione.lower():
-                    matches = False
-            
-            # Filtro qualifica
-            if 'qualifica' in active_filters:
-                if not hr_data or not hr_data.qualifica or active_filters['qualifica'].lower() not in hr_data.qualifica.lower():
-                    matches = False
-            
-            # Filtro sede assunzione
-            if 'sede_assunzione' in active_filters:
-                if not hr_data or not hr_data.sede_id or str(hr_data.sede_id) != str(active_filters['sede_assunzione']):
-                    matches = False
-            
-            # Filtro genere
-            if 'gender' in active_filters:
-                if not hr_data or not hr_data.gender or hr_data.gender != active_filters['gender']:
-                    matches = False
-            
-            # Filtro città
-            if 'city' in active_filters:
-                if not hr_data or not hr_data.city or active_filters['city'].lower() not in hr_data.city.lower():
-                    matches = False
-            
-            if matches:
-                filtered_data.append(data)
-        
-        users_data = filtered_data
-    
     # Ricalcola statistiche sui dati filtrati - SOLO CONTRATTI ATTIVI
     # I dipendenti con contratti non attivi sono solo storico, non vanno conteggiati
     active_employees_data = [d for d in users_data if d['contract_status'] == 'Attivo']
@@ -375,6 +306,41 @@ def hr_reset_filters():
     return redirect(url_for('hr.hr_list'))
 
 
+@hr_bp.route('/expiries')
+@login_required
+@require_hr_permission
+def hr_expiries():
+    """Scadenzario: scadenze scadute e in arrivo lette dal calendario precalcolato"""
+    if not (current_user.can_view_hr_data() or current_user.can_manage_hr_data()):
+        flash('Non hai i permessi per visualizzare lo scadenzario', 'error')
+        return redirect(url_for('hr.hr_list'))
+    
+    days = min(max(request.args.get('days', 90, type=int), 1), 365)
+    category = request.args.get('category')
+    if category not in hr_expiry.NOTICE_DAYS:
+        category = None
+    
+    # Scadute da non più di un anno + in arrivo nei prossimi giorni richiesti
+    today = date.today()
+    expiries = hr_expiry.upcoming(get_user_company_id(), today - timedelta(days=365),
+                                  today + timedelta(days=days),
+                                  categories=[category] if category else None)
+    
+    rows = [{'expiry': expiry, 'status': get_expiry_status(expiry.expiry_date)} for expiry in expiries]
+    counts = {
+        'expired': sum(1 for row in rows if row['status']['status'] == 'expired'),
+        'urgent': sum(1 for row in rows if row['status']['status'] == 'urgent'),
+        'upcoming': sum(1 for row in rows if row['status']['status'] in ('warning', 'ok')),
+    }
+    
+    return render_template('hr_expiries.html',
+                         rows=rows,
+                         counts=counts,
+                         days=days,
+                         category=category,
+                         category_labels=HRExpiryEvent.CATEGORY_LABELS)
+
+
 @hr_bp.route('/detail/<int:user_id>', methods=['GET', 'POST'])
 @login_required
 @require_hr_permission
@@ -1191,6 +1157,8 @@ def contract_history(user_id):
 @require_hr_permission
 def contract_history_export(user_id):
     """Export Excel dello storico contrattuale"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
     
     # Verifica permessi
     if not (current_user.can_view_hr_data() or current_user.can_manage_hr_data()):
@@ -1358,11 +1326,94 @@ def contract_history_export(user_id):
     return response
 
 
+def _hr_export_row(user):
+    """Valori di una riga dell'export HR (stesso ordine delle intestazioni)"""
+    hr_data = user.hr_data
+    
+    return [
+        # DATI CONTRATTUALI
+        user.matricola if user.matricola else '',
+        user.last_name,
+        user.first_name,
+        hr_data.hire_date.strftime('%d/%m/%Y') if hr_data and hr_data.hire_date else '',
+        hr_data.contract_end_date.strftime('%d/%m/%Y') if hr_data and hr_data.contract_end_date else '',
+        hr_data.contract_type if hr_data else '',
+        hr_data.distacco_supplier if hr_data else '',
+        hr_data.consulente_vat if hr_data else '',
+        hr_data.nome_fornitore if hr_data else '',
+        hr_data.partita_iva_fornitore if hr_data else '',
+        hr_data.ccnl if hr_data else '',
+        hr_data.mansione if hr_data else '',
+        hr_data.qualifica if hr_data else '',
+        hr_data.ccnl_level if hr_data else '',
+        str(hr_data.work_hours_week).replace('.', ',') if hr_data and hr_data.work_hours_week else '',
+        hr_data.working_time_type if hr_data else '',
+        str(hr_data.part_time_percentage).replace('.', ',') if hr_data and hr_data.part_time_percentage else '',
+        hr_data.part_time_type if hr_data else '',
+        hr_data.sede.name if hr_data and hr_data.sede else '',
+        'Sì' if hr_data and hr_data.all_sedi else 'No' if hr_data else '',
+        hr_data.work_schedule.name if hr_data and hr_data.work_schedule else '',
+        str(hr_data.superminimo).replace('.', ',') if hr_data and hr_data.superminimo else '',
+        str(hr_data.rimborsi_diarie).replace('.', ',') if hr_data and hr_data.rimborsi_diarie else '',
+        'Sì' if hr_data and hr_data.ticket_restaurant else 'No' if hr_data else '',
+        hr_data.rischio_inail if hr_data else '',
+        hr_data.tipo_assunzione if hr_data else '',
+        hr_data.other_notes if hr_data else '',
+        # ANAGRAFICA RISORSA
+        hr_data.education_level if hr_data else '',
+        hr_data.birth_city if hr_data else '',
+        hr_data.birth_date.strftime('%d/%m/%Y') if hr_data and hr_data.birth_date else '',
+        hr_data.get_age() if hr_data else '',
+        hr_data.gender if hr_data else '',
+        hr_data.codice_fiscale if hr_data else '',
+        hr_data.city if hr_data else '',
+        hr_data.address if hr_data else '',
+        hr_data.alternative_domicile if hr_data else '',
+        hr_data.postal_code if hr_data else '',
+        hr_data.phone if hr_data else '',
+        'Sì' if hr_data and hr_data.law_104_benefits else 'No' if hr_data else '',
+        hr_data.personal_email if hr_data else '',
+        user.email,
+        hr_data.marital_status if hr_data else '',
+        hr_data.dependents_number if hr_data and hr_data.dependents_number else '',
+        hr_data.emergency_contact_name if hr_data else '',
+        hr_data.emergency_contact_phone if hr_data else '',
+        hr_data.driver_license_number if hr_data else '',
+        hr_data.driver_license_type if hr_data else '',
+        hr_data.driver_license_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.driver_license_expiry else '',
+        f"{hr_data.aci_vehicle.marca} {hr_data.aci_vehicle.modello} ({hr_data.aci_vehicle.tipologia})" if hr_data and hr_data.aci_vehicle else '',
+        'Sì' if hr_data and hr_data.overtime_enabled else 'No' if hr_data else '',
+        hr_data.overtime_type if hr_data and hr_data.overtime_type else '',
+        str(hr_data.banca_ore_limite_max).replace('.', ',') if hr_data and hr_data.banca_ore_limite_max else '',
+        str(hr_data.banca_ore_periodo_mesi) if hr_data and hr_data.banca_ore_periodo_mesi else '',
+        # VISITE E FORMAZIONE
+        hr_data.minimum_requirements if hr_data else '',
+        hr_data.medical_visit_date.strftime('%d/%m/%Y') if hr_data and hr_data.medical_visit_date else '',
+        hr_data.medical_visit_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.medical_visit_expiry else '',
+        hr_data.training_general_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_general_date else '',
+        hr_data.training_general_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_general_expiry else '',
+        hr_data.training_rspp_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_rspp_date else '',
+        hr_data.training_rspp_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_rspp_expiry else '',
+        hr_data.training_rls_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_rls_date else '',
+        hr_data.training_rls_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_rls_expiry else '',
+        hr_data.training_first_aid_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_first_aid_date else '',
+        hr_data.training_first_aid_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_first_aid_expiry else '',
+        hr_data.training_emergency_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_emergency_date else '',
+        hr_data.training_emergency_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_emergency_expiry else '',
+        hr_data.training_supervisor_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_supervisor_date else '',
+        hr_data.training_supervisor_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_supervisor_expiry else ''
+    ]
+
+
 @hr_bp.route('/export')
 @login_required
 @require_hr_permission
 def hr_export():
     """Export Excel con dati HR personalizzato (campi e filtri selezionabili)"""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
     
     if not (current_user.can_view_hr_data() or current_user.can_manage_hr_data()):
         flash('Non hai i permessi per esportare i dati HR', 'error')
@@ -1385,73 +1436,12 @@ def hr_export():
         User.is_system_admin == False
     ).order_by(User.last_name, User.first_name)
     
-    users = users_query.all()
-    
-    # Applica filtri personalizzati
-    if active_filters:
-        filtered_users = []
-        for user in users:
-            hr_data = user.hr_data
-            
-            # Se ci sono filtri attivi ma l'utente non ha dati HR, escludilo
-            if not hr_data:
-                continue
-            
-            matches = True
-            
-            # Applica gli stessi filtri usati nella lista
-            if 'matricola' in active_filters:
-                if not user.matricola or active_filters['matricola'].lower() not in user.matricola.lower():
-                    matches = False
-            
-            # Filtro data assunzione (filtra per anno)
-            if 'hire_date' in active_filters:
-                filter_date_str = active_filters['hire_date']
-                try:
-                    from datetime import datetime
-                    filter_date = datetime.strptime(filter_date_str, '%Y-%m-%d').date()
-                    if not hr_data.hire_date or hr_data.hire_date.year != filter_date.year:
-                        matches = False
-                except:
-                    pass  # Se parsing fallisce, ignora il filtro
-            
-            if 'contract_type' in active_filters:
-                if not hr_data.contract_type or hr_data.contract_type != active_filters['contract_type']:
-                    matches = False
-            
-            if 'ccnl' in active_filters:
-                if not hr_data.ccnl or active_filters['ccnl'].lower() not in hr_data.ccnl.lower():
-                    matches = False
-            
-            if 'mansione' in active_filters:
-                if not hr_data.mansione or active_filters['mansione'].lower() not in hr_data.mansione.lower():
-                    matches = False
-            
-            if 'qualifica' in active_filters:
-                if not hr_data.qualifica or active_filters['qualifica'].lower() not in hr_data.qualifica.lower():
-                    matches = False
-            
-            if 'sede_assunzione' in active_filters:
-                if not hr_data.sede_id or str(hr_data.sede_id) != str(active_filters['sede_assunzione']):
-                    matches = False
-            
-            if 'gender' in active_filters:
-                if not hr_data.gender or hr_data.gender != active_filters['gender']:
-                    matches = False
-            
-            if 'city' in active_filters:
-                if not hr_data.city or active_filters['city'].lower() not in hr_data.city.lower():
-                    matches = False
-            
-            if matches:
-                filtered_users.append(user)
-        
-        users = filtered_users
+    # Filtri applicati in SQL; le righe vengono lette a blocchi e scritte subito nel foglio
+    users = roster_query(users_query, active_filters, require_hr_data=True, for_export=True)
     
-    # Crea workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Dati HR"
+    # Workbook in modalità write-only: le righe non restano in memoria come celle
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Dati HR")
     
     # Styling
     header_font = Font(bold=True, color="FFFFFF")
@@ -1487,107 +1477,28 @@ def hr_export():
         'Formazione Preposto - Data', 'Formazione Preposto - Scadenza'
     ]
     
+    # In write-only le larghezze vanno fissate prima delle righe: stimate dall'intestazione
     for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
+        ws.column_dimensions[get_column_letter(col)].width = min(max(len(header), 14) + 2, 50)
+    
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
         cell.font = header_font
         cell.fill = header_fill
         cell.alignment = Alignment(horizontal='center')
         cell.border = thin_border
+        header_cells.append(cell)
+    ws.append(header_cells)
     
     # Dati
-    for row_idx, user in enumerate(users, 2):
-        hr_data = user.hr_data
-        
-        row_data = [
-            # DATI CONTRATTUALI
-            user.matricola if user.matricola else '',
-            user.last_name,
-            user.first_name,
-            hr_data.hire_date.strftime('%d/%m/%Y') if hr_data and hr_data.hire_date else '',
-            hr_data.contract_end_date.strftime('%d/%m/%Y') if hr_data and hr_data.contract_end_date else '',
-            hr_data.contract_type if hr_data else '',
-            hr_data.distacco_supplier if hr_data else '',
-            hr_data.consulente_vat if hr_data else '',
-            hr_data.nome_fornitore if hr_data else '',
-            hr_data.partita_iva_fornitore if hr_data else '',
-            hr_data.ccnl if hr_data else '',
-            hr_data.mansione if hr_data else '',
-            hr_data.qualifica if hr_data else '',
-            hr_data.ccnl_level if hr_data else '',
-            str(hr_data.work_hours_week).replace('.', ',') if hr_data and hr_data.work_hours_week else '',
-            hr_data.working_time_type if hr_data else '',
-            str(hr_data.part_time_percentage).replace('.', ',') if hr_data and hr_data.part_time_percentage else '',
-            hr_data.part_time_type if hr_data else '',
-            hr_data.sede.name if hr_data and hr_data.sede else '',
-            'Sì' if hr_data and hr_data.all_sedi else 'No' if hr_data else '',
-            hr_data.work_schedule.name if hr_data and hr_data.work_schedule else '',
-            str(hr_data.superminimo).replace('.', ',') if hr_data and hr_data.superminimo else '',
-            str(hr_data.rimborsi_diarie).replace('.', ',') if hr_data and hr_data.rimborsi_diarie else '',
-            'Sì' if hr_data and hr_data.ticket_restaurant else 'No' if hr_data else '',
-            hr_data.rischio_inail if hr_data else '',
-            hr_data.tipo_assunzione if hr_data else '',
-            hr_data.other_notes if hr_data else '',
-            # ANAGRAFICA RISORSA
-            hr_data.education_level if hr_data else '',
-            hr_data.birth_city if hr_data else '',
-            hr_data.birth_date.strftime('%d/%m/%Y') if hr_data and hr_data.birth_date else '',
-            hr_data.get_age() if hr_data else '',
-            hr_data.gender if hr_data else '',
-            hr_data.codice_fiscale if hr_data else '',
-            hr_data.city if hr_data else '',
-            hr_data.address if hr_data else '',
-            hr_data.alternative_domicile if hr_data else '',
-            hr_data.postal_code if hr_data else '',
-            hr_data.phone if hr_data else '',
-            'Sì' if hr_data and hr_data.law_104_benefits else 'No' if hr_data else '',
-            hr_data.personal_email if hr_data else '',
-            user.email,
-            hr_data.marital_status if hr_data else '',
-            hr_data.dependents_number if hr_data and hr_data.dependents_number else '',
-            hr_data.emergency_contact_name if hr_data else '',
-            hr_data.emergency_contact_phone if hr_data else '',
-            hr_data.driver_license_number if hr_data else '',
-            hr_data.driver_license_type if hr_data else '',
-            hr_data.driver_license_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.driver_license_expiry else '',
-            f"{hr_data.aci_vehicle.marca} {hr_data.aci_vehicle.modello} ({hr_data.aci_vehicle.tipologia})" if hr_data and hr_data.aci_vehicle else '',
-            'Sì' if hr_data and hr_data.overtime_enabled else 'No' if hr_data else '',
-            hr_data.overtime_type if hr_data and hr_data.overtime_type else '',
-            str(hr_data.banca_ore_limite_max).replace('.', ',') if hr_data and hr_data.banca_ore_limite_max else '',
-            str(hr_data.banca_ore_periodo_mesi) if hr_data and hr_data.banca_ore_periodo_mesi else '',
-            # VISITE E FORMAZIONE
-            hr_data.minimum_requirements if hr_data else '',
-            hr_data.medical_visit_date.strftime('%d/%m/%Y') if hr_data and hr_data.medical_visit_date else '',
-            hr_data.medical_visit_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.medical_visit_expiry else '',
-            hr_data.training_general_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_general_date else '',
-            hr_data.training_general_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_general_expiry else '',
-            hr_data.training_rspp_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_rspp_date else '',
-            hr_data.training_rspp_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_rspp_expiry else '',
-            hr_data.training_rls_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_rls_date else '',
-            hr_data.training_rls_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_rls_expiry else '',
-            hr_data.training_first_aid_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_first_aid_date else '',
-            hr_data.training_first_aid_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_first_aid_expiry else '',
-            hr_data.training_emergency_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_emergency_date else '',
-            hr_data.training_emergency_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_emergency_expiry else '',
-            hr_data.training_supervisor_date.strftime('%d/%m/%Y') if hr_data and hr_data.training_supervisor_date else '',
-            hr_data.training_supervisor_expiry.strftime('%d/%m/%Y') if hr_data and hr_data.training_supervisor_expiry else ''
-        ]
-        
-        for col, value in enumerate(row_data, 1):
-            cell = ws.cell(row=row_idx, column=col, value=value)
+    for user in users.yield_per(500):
+        row_cells = []
+        for value in _hr_export_row(user):
+            cell = WriteOnlyCell(ws, value=value)
             cell.border = thin_border
-    
-    # Auto-adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
+            row_cells.append(cell)
+        ws.append(row_cells)
     
     # Save to BytesIO
     excel_file = BytesIO()
@@ -22,6 +22,9 @@ from app import db
 from models import User, LeaveRequest, LeaveType, Sede, Holiday, italian_now
 from forms import LeaveRequestForm
 from utils_tenant import get_user_company_id, filter_by_company, set_company_on_create
+from sqlalchemy import func
+from sqlalchemy.orm import contains_eager
+from services import listing
 import io
 import csv
 
@@ -30,6 +33,9 @@ import csv
 # Create blueprint
 leave_bp = Blueprint('leave', __name__, url_prefix='/leave')
 
+# Richieste per pagina nella lista ferie/permessi
+LEAVE_REQUESTS_PAGE_SIZE = 50
+
 # Helper functions
 def require_login(f):
     """Decorator to require login for routes"""
@@ -61,28 +67,19 @@ def leave_requests():
         flash('Non hai i permessi per accedere alle richieste', 'danger')
         return redirect(url_for('dashboard.dashboard'))
     
-    # Base query con filtro company
-    query = filter_by_company(LeaveRequest.query)
+    # Base query con filtro company, unita all'utente per lo scoping per sede
+    query = listing.join_user(filter_by_company(LeaveRequest.query), LeaveRequest.user_id)
     
     # Filtri per vista
     if view == 'my':
         # Solo le proprie richieste
         query = query.filter(LeaveRequest.user_id == current_user.id)
     elif view == 'approve':
-        # Solo richieste in pending per approvazione
-        query = query.filter(LeaveRequest.status == 'Pending')
-        
-        # Se non è multi-sede, filtra per sede
-        if not current_user.all_sedi and current_user.sede_obj:
-            sede_users = User.query.filter_by(sede_id=current_user.sede_obj.id).all()
-            user_ids = [u.id for u in sede_users]
-            query = query.filter(LeaveRequest.user_id.in_(user_ids))
+        # Solo richieste in pending per approvazione, nella sede se non è multi-sede
+        query = listing.scope_to_sede(query.filter(LeaveRequest.status == 'Pending'), current_user)
     elif view == 'view':
         # Tutte le richieste con controllo sede
-        if not current_user.all_sedi and current_user.sede_obj:
-            sede_users = User.query.filter_by(sede_id=current_user.sede_obj.id).all()
-            user_ids = [u.id for u in sede_users]
-            query = query.filter(LeaveRequest.user_id.in_(user_ids))
+        query = listing.scope_to_sede(query, current_user)
     
     # Filtri aggiuntivi
     status_filter = request.args.get('status')
@@ -96,36 +93,36 @@ def leave_requests():
     year_filter = request.args.get('year')
     if year_filter:
         try:
-            year = int(year_filter)
-            query = query.filter(
-                db.extract('year', LeaveRequest.start_date) == year
-            )
+            query = listing.filter_date_range(query, LeaveRequest.start_date, *listing.year_range(int(year_filter)))
         except ValueError:
             pass
     
-    # Ordinamento
-    requests = query.join(User, LeaveRequest.user_id == User.id).order_by(
-        LeaveRequest.created_at.desc()
-    ).all()
-    
-    # Statistiche per dashboard (filtrate per company)
-    stats = {}
-    if view in ['approve', 'view']:
-        stats_query = filter_by_company(LeaveRequest.query)
-        stats = {
-            'pending_count': stats_query.filter_by(status='Pending').count(),
-            'approved_count': stats_query.filter_by(status='Approved').count(),
-            'rejected_count': stats_query.filter_by(status='Rejected').count(),
-        }
-    
-    # Lista anni disponibili per filtro
-    years = db.session.query(
-        db.extract('year', LeaveRequest.start_date).label('year')
-    ).distinct().order_by('year').all()
-    available_years = [y.year for y in years if y.year]
+    # Statistiche sulle richieste filtrate (una query raggruppata per stato)
+    status_counts = dict(
+        query.with_entities(LeaveRequest.status, func.count(LeaveRequest.id)).group_by(LeaveRequest.status).all()
+    )
+    stats = {
+        'total_count': sum(status_counts.values()),
+        'pending_count': status_counts.get('Pending', 0),
+        'approved_count': status_counts.get('Approved', 0),
+        'rejected_count': status_counts.get('Rejected', 0),
+    }
+    
+    # Ordinamento (paginato a chiave)
+    requests = listing.keyset_page(query.options(contains_eager(LeaveRequest.user)), [
+        (LeaveRequest.created_at, True),
+        (LeaveRequest.id, True),
+    ], cursor=request.args.get('cursor'), page_size=LEAVE_REQUESTS_PAGE_SIZE)
+    
+    # Lista anni disponibili per filtro (estremi delle date dell'azienda)
+    first_date, last_date = filter_by_company(LeaveRequest.query).with_entities(
+        func.min(LeaveRequest.start_date), func.max(LeaveRequest.start_date)
+    ).one()
+    available_years = list(range(first_date.year, last_date.year + 1)) if first_date else []
     
     return render_template('leave_requests.html',
                          requests=requests,
+                         page_links=listing.page_links(requests),
                          view=view,
                          stats=stats,
                          available_years=available_years,
@@ -468,11 +465,10 @@ def leave_balance_api(user_id, year):
                 return jsonify({'error': 'Non puoi visualizzare dati di altre sedi'}), 403
         
         # Calcola saldo ferie semplificato
-        approved_requests = filter_by_company(LeaveRequest.query).filter(
+        approved_requests = listing.filter_date_range(filter_by_company(LeaveRequest.query).filter(
             LeaveRequest.user_id == user_id,
-            LeaveRequest.status == 'Approved',
-            db.extract('year', LeaveRequest.start_date) == year
-        ).all()
+            LeaveRequest.status == 'Approved'
+        ), LeaveRequest.start_date, *listing.year_range(year)).all()
         
         used_days = sum(req.working_days or 0 for req in approved_requests)
         balance = {'used_days': used_days, 'remaining_days': max(0, 22 - used_days)}
@@ -20,6 +20,7 @@ from app import db
 from models import User, InternalMessage
 from forms import SendMessageForm
 from utils_tenant import filter_by_company, set_company_on_create
+from services import listing, message_inbox
 
 # Create blueprint
 messages_bp = Blueprint('messages', __name__)
@@ -46,53 +47,22 @@ def require_messages_permission(f):
 @require_messages_permission
 def internal_messages():
     """Visualizza i messaggi interni per l'utente corrente (ricevuti e inviati)"""
-    from datetime import timedelta
+    box = request.args.get('box', 'received')
+    if box not in ('received', 'sent'):
+        box = 'received'
+    cursor = request.args.get('cursor')
     
-    # Messaggi ricevuti dall'utente corrente (with company filter)
-    received_messages = filter_by_company(InternalMessage.query).filter(
-        InternalMessage.recipient_id == current_user.id
-    ).order_by(InternalMessage.created_at.desc()).all()
-    
-    # Messaggi inviati dall'utente corrente (with company filter)
-    # Raggruppa per message_group_id per evitare duplicati
-    sent_messages_raw = filter_by_company(InternalMessage.query).filter(
-        InternalMessage.sender_id == current_user.id
-    ).order_by(InternalMessage.created_at.desc()).all()
-    
-    # Filtra i messaggi inviati per mostrare solo uno per gruppo
-    sent_messages = []
-    seen_groups = set()
-    seen_legacy_groups = set()  # Per messaggi senza group_id
-    
-    for msg in sent_messages_raw:
-        if msg.message_group_id:
-            # Nuovi messaggi con group_id
-            if msg.message_group_id not in seen_groups:
-                sent_messages.append(msg)
-                seen_groups.add(msg.message_group_id)
-        else:
-            # Messaggi vecchi senza group_id: raggruppa per sender+title+timestamp
-            # Crea una chiave basata su sender, titolo e timestamp (arrotondato al secondo)
-            timestamp_key = msg.created_at.replace(microsecond=0)
-            legacy_key = (msg.sender_id, msg.title, timestamp_key)
-            
-            if legacy_key not in seen_legacy_groups:
-                sent_messages.append(msg)
-                seen_legacy_groups.add(legacy_key)
-    
-    # Unisci e ordina tutti i messaggi per data
-    messages = sorted(received_messages + sent_messages, 
-                     key=lambda x: x.created_at, reverse=True)
-    
-    # Conta messaggi non letti ricevuti (with company filter)
-    unread_count = filter_by_company(InternalMessage.query).filter_by(
-        recipient_id=current_user.id,
-        is_read=False
-    ).count()
+    # Una pagina alla volta, dal più recente (inviati: uno per gruppo di destinatari)
+    if box == 'sent':
+        page = message_inbox.sent_page(current_user, cursor)
+    else:
+        page = message_inbox.received_page(current_user, cursor)
     
     return render_template('internal_messages.html', 
-                         messages=messages, 
-                         unread_count=unread_count)
+                         messages=page,
+                         box=box,
+                         page_links=listing.page_links(page),
+                         unread_count=message_inbox.unread_count(current_user.id))
 
 @messages_bp.route('/message/<int:message_id>/mark_read')
 @login_required  
@@ -169,18 +139,8 @@ def delete_message(message_id):
 def mark_all_messages_read():
     """Segna tutti i messaggi dell'utente come letti"""
     try:
-        # Segna tutti i messaggi non letti dell'utente corrente come letti (with company filter)
-        unread_messages = filter_by_company(InternalMessage.query).filter_by(
-            recipient_id=current_user.id,
-            is_read=False
-        ).all()
-        
-        for message in unread_messages:
-            message.is_read = True
-        
-        db.session.commit()
-        
-        count = len(unread_messages)
+        # Un solo UPDATE per tutti i non letti, il contatore del badge torna a zero
+        count = message_inbox.mark_all_read(current_user)
         if count > 0:
             flash(f'Tutti i {count} messaggi non letti sono stati marcati come letti', 'success')
         else:
@@ -17,13 +17,14 @@ from flask_login import login_required, current_user, login_user, logout_user
 from datetime import datetime, date, timedelta, time
 from functools import wraps
 from app import db
-from models import User, AttendanceEvent, Sede, italian_now
+from models import User, Sede, italian_now
 from forms import LoginForm
-import qrcode
 import base64
+import uuid
 from io import BytesIO
 from werkzeug.security import check_password_hash
-from utils_tenant import filter_by_company, set_company_on_create
+from utils_tenant import filter_by_company
+from services import clock_status
 
 # Create blueprint
 qr_bp = Blueprint('qr', __name__, url_prefix='/qr')
@@ -93,13 +94,6 @@ def quick_attendance(action):
         flash('Azione non valida', 'error')
         return redirect(url_for('dashboard.dashboard'))
     
-    from zoneinfo import ZoneInfo
-    italy_tz = ZoneInfo('Europe/Rome')
-    now = datetime.now(italy_tz)
-    
-    # Verifica stato attuale dell'utente
-    user_status, last_event = AttendanceEvent.get_user_status(current_user.id)
-    
     if request.method == 'POST':
         # Determina sede_id
         sede_id = None
@@ -112,74 +106,41 @@ def quick_attendance(action):
             # Utente mono-sede: usa la sua sede
             sede_id = current_user.sede_id
         
-        # Processa l'azione
-        success = False
-        message = ""
+        # Stato verificato e aggiornato nella stessa transazione dell'inserimento
+        event_type = 'clock_in' if action == 'entrata' else 'clock_out'
+        result = clock_status.clock(current_user, event_type, sede_id=sede_id,
+                                    notes=request.form.get('notes', ''),
+                                    idempotency_key=clock_status.idempotency_key_from(request))
         
-        if action == 'entrata':
-            if user_status == 'out':
-                # Clock in
-                event = AttendanceEvent(
-                    user_id=current_user.id,
-                    date=now.date(),
-                    event_type='clock_in',
-                    timestamp=now,
-                    sede_id=sede_id,
-                    notes=request.form.get('notes', '')
-                )
-                set_company_on_create(event)
-                db.session.add(event)
-                db.session.commit()
-                
-                success = True
-                message = f"Entrata registrata alle {now.strftime('%H:%M')}"
-            else:
-                message = "Sei già dentro! Non puoi registrare un'altra entrata."
-                
-        elif action == 'uscita':
-            if user_status == 'in':
-                # Clock out
-                event = AttendanceEvent(
-                    user_id=current_user.id,
-                    date=now.date(),
-                    event_type='clock_out',
-                    timestamp=now,
-                    sede_id=sede_id,
-                    notes=request.form.get('notes', '')
-                )
-                set_company_on_create(event)
-                db.session.add(event)
-                db.session.commit()
-                
-                success = True
-                message = f"Uscita registrata alle {now.strftime('%H:%M')}"
-            else:
-                message = "Non sei dentro! Non puoi registrare un'uscita."
-        
-        if success:
+        if result.success:
+            label = 'Entrata' if action == 'entrata' else 'Uscita'
+            message = f"{label} registrata alle {result.timestamp.strftime('%H:%M')}"
             # Redirect a pagina di successo invece che tornare al form
             return redirect(url_for('qr.attendance_success', action=action, message=message))
+        
+        if action == 'entrata':
+            message = "Sei già dentro! Non puoi registrare un'altra entrata."
         else:
-            flash(message, 'warning')
-            # Torna al form solo in caso di errore
-            return redirect(url_for('qr.quick_attendance', action=action))
+            message = "Non sei dentro! Non puoi registrare un'uscita."
+        flash(message, 'warning')
+        # Torna al form solo in caso di errore
+        return redirect(url_for('qr.quick_attendance', action=action))
     
     # GET request: mostra il form
+    from zoneinfo import ZoneInfo
+    now = datetime.now(ZoneInfo('Europe/Rome'))
+    status = clock_status.get_status(current_user, now)
+    
     available_sedi = []
     if current_user.all_sedi:
         available_sedi = filter_by_company(Sede.query).filter_by(active=True).all()
     
-    # Ottieni eventi di oggi per le statistiche
-    today_events = AttendanceEvent.get_daily_events(current_user.id)
-    today_hours = AttendanceEvent.get_daily_work_hours(current_user.id)
-    
     return render_template('quick_attendance.html',
                          action=action,
-                         user_status=user_status,
-                         last_event=last_event,
-                         today_events=today_events,
-                         today_hours=today_hours,
+                         user_status=status['status'],
+                         today_hours=status['today_hours'],
                          available_sedi=available_sedi,
+                         idempotency_key=uuid.uuid4().hex,
                          current_time=now)
 
 @qr_bp.route('/success/<action>')
@@ -195,18 +156,14 @@ def attendance_success(action):
     italy_tz = ZoneInfo('Europe/Rome')
     now = datetime.now(italy_tz)
     
-    # Ottieni statistiche aggiornate
-    today_events = AttendanceEvent.get_daily_events(current_user.id)
-    today_hours = AttendanceEvent.get_daily_work_hours(current_user.id)
-    user_status, last_event = AttendanceEvent.get_user_status(current_user.id)
+    # Stato e ore di oggi dalla riga di stato dell'utente
+    status = clock_status.get_status(current_user, now)
     
     return render_template('qr_attendance_success.html',
                          action=action,
                          message=message,
-                         today_events=today_events,
-                         today_hours=today_hours,
-                         user_status=user_status,
-                         last_event=last_event,
+                         today_hours=status['today_hours'],
+                         user_status=status['status'],
                          current_time=now)
 
 # =============================================================================
@@ -216,6 +173,8 @@ def attendance_success(action):
 @qr_bp.route('/generate')
 def generate_codes():
     """Genera i codici QR per entrata e uscita"""
+    import qrcode
+    
     try:
         # Genera QR codes per entrata e uscita
         base_url = request.url_root.rstrip('/')
@@ -278,25 +237,24 @@ def page(action):
 def api_status():
     """API per ottenere lo stato attuale dell'utente"""
     try:
-        user_status, last_event = AttendanceEvent.get_user_status(current_user.id)
-        today_hours = AttendanceEvent.get_daily_work_hours(current_user.id)
-        
         from zoneinfo import ZoneInfo
         italy_tz = ZoneInfo('Europe/Rome')
         now = datetime.now(italy_tz)
         
+        status = clock_status.get_status(current_user, now)
+        
         return jsonify({
             'success': True,
             'user': {
                 'name': current_user.get_full_name(),
                 'role': current_user.role
             },
-            'status': user_status,
+            'status': status['status'],
             'current_time': now.strftime('%H:%M'),
-            'today_hours': f"{today_hours:.2f}",
+            'today_hours': f"{status['today_hours']:.2f}",
             'last_event': {
-                'type': last_event.event_type if last_event else None,
-                'time': last_event.timestamp_italian.strftime('%H:%M') if last_event else None
+                'type': status['last_event_type'],
+                'time': status['last_event_at'].strftime('%H:%M') if status['last_event_at'] else None
             }
         })
     except Exception as e:
@@ -320,63 +278,30 @@ def api_quick_action():
                 'error': 'Azione non valida'
             }), 400
         
-        from zoneinfo import ZoneInfo
-        italy_tz = ZoneInfo('Europe/Rome')
-        now = datetime.now(italy_tz)
-        
-        # Verifica stato attuale
-        user_status, _ = AttendanceEvent.get_user_status(current_user.id)
-        
         # Determina sede_id
         if not sede_id and current_user.sede_id:
             sede_id = current_user.sede_id
         elif sede_id:
             sede_id = int(sede_id)
         
-        # Processa l'azione
-        if action == 'entrata' and user_status == 'out':
-            event = AttendanceEvent(
-                user_id=current_user.id,
-                date=now.date(),
-                event_type='clock_in',
-                timestamp=now,
-                sede_id=sede_id,
-                notes=notes
-            )
-            set_company_on_create(event)
-            db.session.add(event)
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': f"Entrata registrata alle {now.strftime('%H:%M')}",
-                'new_status': 'in'
-            })
-            
-        elif action == 'uscita' and user_status == 'in':
-            event = AttendanceEvent(
-                user_id=current_user.id,
-                date=now.date(),
-                event_type='clock_out',
-                timestamp=now,
-                sede_id=sede_id,
-                notes=notes
-            )
-            set_company_on_create(event)
-            db.session.add(event)
-            db.session.commit()
-            
+        event_type = 'clock_in' if action == 'entrata' else 'clock_out'
+        result = clock_status.clock(current_user, event_type, sede_id=sede_id, notes=notes,
+                                    idempotency_key=clock_status.idempotency_key_from(request))
+        
+        if result.success:
+            label = 'Entrata' if action == 'entrata' else 'Uscita'
             return jsonify({
                 'success': True,
-                'message': f"Uscita registrata alle {now.strftime('%H:%M')}",
-                'new_status': 'out'
+                'message': f"{label} registrata alle {result.timestamp.strftime('%H:%M')}",
+                'new_status': result.status,
+                'today_hours': f"{result.today_hours:.2f}"
             })
-        else:
-            message = "Sei già dentro!" if user_status == 'in' and action == 'entrata' else "Non sei dentro!"
-            return jsonify({
-                'success': False,
-                'error': message
-            }), 400
+        
+        message = "Sei già dentro!" if result.status == 'in' and action == 'entrata' else "Non sei dentro!"
+        return jsonify({
+            'success': False,
+            'error': message
+        }), 400
             
     except Exception as e:
         db.session.rollback()
@@ -28,14 +28,17 @@ from forms import ReperibilitaCoverageForm, ReperibilitaReplicaForm
 from collections import defaultdict
 from utils import generate_reperibilita_shifts
 from utils_tenant import filter_by_company, set_company_on_create
+from sqlalchemy.orm import contains_eager
+from services import listing
 from io import BytesIO, StringIO
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment
 from defusedcsv import csv
 
 # Create blueprint
 reperibilita_bp = Blueprint('reperibilita', __name__, url_prefix='/reperibilita')
 
+# Turni per pagina nella gestione reperibilità
+REPERIBILITA_PAGE_SIZE = 100
+
 # Helper functions
 def require_reperibilita_permissions(f):
     """Decorator to require reperibilità permissions for routes"""
@@ -111,26 +114,15 @@ def reperibilita_shifts():
     month_filter = request.args.get('month')
     user_filter = request.args.get('user', 'all')
     
-    # Query base
-    query = filter_by_company(ReperibilitaShift.query)
+    # Query base, unita all'utente per lo scoping per sede
+    query = listing.join_user(filter_by_company(ReperibilitaShift.query), ReperibilitaShift.user_id)
     
-    # Filtro mese
-    if month_filter:
-        try:
-            year, month = month_filter.split('-')
-            query = query.filter(
-                db.extract('year', ReperibilitaShift.date) == int(year),
-                db.extract('month', ReperibilitaShift.date) == int(month)
-            )
-        except ValueError:
-            pass
-    else:
-        # Mese corrente di default
+    # Filtro mese (mese corrente di default) come intervallo di date
+    selected = listing.parse_month(month_filter)
+    if selected is None:
         now = italian_now()
-        query = query.filter(
-            db.extract('year', ReperibilitaShift.date) == now.year,
-            db.extract('month', ReperibilitaShift.date) == now.month
-        )
+        selected = (now.year, now.month)
+    query = listing.filter_date_range(query, ReperibilitaShift.date, *listing.month_range(*selected))
     
     # Filtro utente
     if user_filter != 'all':
@@ -141,21 +133,21 @@ def reperibilita_shifts():
             pass
     
     # Controllo sede
-    if not current_user.all_sedi and current_user.sede_obj:
-        sede_users = User.query.filter_by(sede_id=current_user.sede_obj.id).all()
-        user_ids = [u.id for u in sede_users]
-        query = query.filter(ReperibilitaShift.user_id.in_(user_ids))
-    
-    # Esecuzione query
-    shifts = query.join(User, ReperibilitaShift.user_id == User.id).order_by(
-        ReperibilitaShift.date.desc(),
-        ReperibilitaShift.start_time
-    ).all()
+    query = listing.scope_to_sede(query, current_user)
+    
+    # Esecuzione query (paginata a chiave)
+    shifts = listing.keyset_page(query.options(
+        contains_eager(ReperibilitaShift.user).joinedload(User.sede_obj)
+    ), [
+        (ReperibilitaShift.date, True),
+        (ReperibilitaShift.start_time, False),
+        (ReperibilitaShift.id, False),
+    ], cursor=request.args.get('cursor'), page_size=REPERIBILITA_PAGE_SIZE)
     
     # Lista utenti per filtro
-    available_users = User.query.filter_by(active=True).order_by(User.last_name, User.first_name).all()
-    if not current_user.all_sedi and current_user.sede_obj:
-        available_users = [u for u in available_users if u.sede_id == current_user.sede_obj.id]
+    available_users = listing.scope_to_sede(User.query.filter_by(active=True), current_user).order_by(
+        User.last_name, User.first_name
+    ).all()
     
     # Parametri per navigation 
     period_mode = request.args.get('period', 'month')
@@ -193,6 +185,7 @@ def reperibilita_shifts():
 
     return render_template('reperibilita_shifts.html',
                          shifts=shifts,
+                         page_links=listing.page_links(shifts),
                          available_users=available_users,
                          selected_month=month_filter,
                          selected_user=user_filter,
@@ -219,15 +212,9 @@ def my_reperibilita():
     query = filter_by_company(ReperibilitaShift.query).filter_by(user_id=current_user.id)
     
     # Filtro mese
-    if month_filter:
-        try:
-            year, month = month_filter.split('-')
-            query = query.filter(
-                db.extract('year', ReperibilitaShift.date) == int(year),
-                db.extract('month', ReperibilitaShift.date) == int(month)
-            )
-        except ValueError:
-            pass
+    selected = listing.parse_month(month_filter)
+    if selected:
+        query = listing.filter_date_range(query, ReperibilitaShift.date, *listing.month_range(*selected))
     
     # Ordinamento
     shifts = query.order_by(ReperibilitaShift.date.desc()).all()
@@ -1002,6 +989,9 @@ def my_interventions():
 @require_reperibilita_permissions
 def export_general_interventions_excel():
     """Export interventi generici in formato Excel"""
+    import openpyxl
+    from openpyxl.styles import Font, PatternFill, Alignment
+    
     if not current_user.can_view_my_interventions():
         return jsonify({'error': 'Non autorizzato'}), 403
     
@@ -1107,6 +1097,9 @@ def export_general_interventions_excel():
 @require_reperibilita_permissions
 def export_reperibilita_interventions_excel():
     """Export interventi di reperibilità in formato Excel"""
+    import openpyxl
+    from openpyxl.styles import Font, PatternFill, Alignment
+    
     if not current_user.can_view_my_interventions():
         return jsonify({'error': 'Non autorizzato'}), 403
     
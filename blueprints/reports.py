@@ -240,9 +240,13 @@ def overtime_requests_excel():
 @require_reports_permission
 def export_mileage_requests():
     """Export mileage reimbursement requests"""
-    # Placeholder for mileage export logic
-    # Will be migrated from routes.py
-    pass
+    # Stesso export (righe e riepilogo mensile) della gestione rimborsi, sotto il permesso report
+    from blueprints.expense import build_mileage_requests_export
+    try:
+        return build_mileage_requests_export()
+    except Exception as e:
+        flash(f'Errore durante l\'esportazione: {str(e)}', 'danger')
+        return redirect(url_for('reports.reports'))
 
 @reports_bp.route('/aci_export')
 @login_required
@@ -262,9 +266,8 @@ def aci_export():
 @require_reports_permission
 def export_shifts_pdf():
     """Export shifts data to PDF format"""
-    # Placeholder for shifts PDF export logic
-    # Will be migrated from routes.py
-    pass
+    # Stesso documento (e stessa cache) dell'export calendario turni
+    return redirect(url_for('export.shifts_pdf', **request.args))
 
 # =============================================================================
 # BLUEPRINT REGISTRATION READY
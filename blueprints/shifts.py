@@ -19,7 +19,7 @@
 # - team-shifts (GET) - Vista turni team settimanale
 # - team-shifts/change-user/<int:shift_id> (POST) - Cambio utente turno
 # - delete/<int:shift_id> (POST) - Eliminazione singolo turno
-# + calculate_shift_presence() helper function
+# - coverage-report (GET) - Report mensile copertura turni / presenze
 # =============================================================================
 
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, make_response
@@ -27,8 +27,9 @@ from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
 from functools import wraps
 from app import db, csrf
-from models import User, Shift, Sede, PresidioCoverageTemplate, PresidioCoverage, AttendanceEvent, ReperibilitaShift, LeaveRequest, italian_now, get_active_presidio_templates
+from models import User, Shift, Sede, PresidioCoverageTemplate, PresidioCoverage, ReperibilitaShift, LeaveRequest, italian_now, get_active_presidio_templates
 from utils_tenant import get_user_company_id, filter_by_company, set_company_on_create
+from services import export_renderer, shift_presence
 from forms import EditShiftForm, PresidioCoverageTemplateForm, PresidioCoverageForm, PresidioCoverageSearchForm
 from collections import defaultdict
 from io import BytesIO
@@ -616,21 +617,32 @@ def team_shifts():
             reperibilita_by_date[rep_shift.date] = []
         reperibilita_by_date[rep_shift.date].append(rep_shift)
     
+    # Stato di presenza di tutti i turni della settimana (una query sulle timbrature)
+    presence = shift_presence.reconcile(weekly_shifts)
+    
     # Raggruppa i turni per giorno e aggiungi informazioni di presenza
     shifts_by_day = {}
     for shift in weekly_shifts:
         if shift.date not in shifts_by_day:
             shifts_by_day[shift.date] = []
         
-        # Calcola lo stato di presenza per ogni turno
-        shift.presence_status = calculate_shift_presence(shift)
+        shift.presence_info = presence.get(shift.id)
         shifts_by_day[shift.date].append(shift)
     
+    today = date.today()
+    weekday_names = ['Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato', 'Domenica']
+    week_dates = []
+    for offset in range(7):
+        day = week_start + timedelta(days=offset)
+        week_dates.append({'date': day, 'weekday': weekday_names[offset], 'is_today': day == today})
+    
     return render_template('team_shifts.html', 
                          shifts_by_day=shifts_by_day,
                          reperibilita_by_date=reperibilita_by_date,
                          week_start=week_start,
                          week_end=week_end,
+                         week_dates=week_dates,
+                         today=today,
                          prev_week=prev_week,
                          next_week=next_week,
                          target_date=target_date)
@@ -732,37 +744,6 @@ def delete_shift(shift_id):
     
     return redirect(request.referrer or url_for('dashboard.dashboard'))
 
-# =============================================================================
-# HELPER FUNCTIONS
-# =============================================================================
-
-def calculate_shift_presence(shift):
-    """Calculate presence status for a specific shift"""
-    # Combina data e orari del turno per creare datetime completi
-    shift_start = datetime.combine(shift.date, shift.start_time)
-    shift_end = datetime.combine(shift.date, shift.end_time)
-    
-    # Prendi tutti gli eventi di presenza dell'utente per quella data
-    events = AttendanceEvent.query.filter(
-        AttendanceEvent.user_id == shift.user_id,
-        AttendanceEvent.date == shift.date
-    ).order_by(AttendanceEvent.timestamp).all()
-    
-    if not events:
-        return {'status': 'absent', 'description': 'Nessuna timbratura'}
-    
-    # Analizza gli eventi per determinare lo stato
-    # Implementazione semplificata - può essere estesa secondo necessità
-    clock_in_events = [e for e in events if e.action == 'clock_in']
-    clock_out_events = [e for e in events if e.action == 'clock_out']
-    
-    if clock_in_events and clock_out_events:
-        return {'status': 'present', 'description': 'Presente'}
-    elif clock_in_events:
-        return {'status': 'partial', 'description': 'Entrata registrata'}
-    else:
-        return {'status': 'absent', 'description': 'Assente'}
-
 # =============================================================================
 # EXPORT ROUTES
 # =============================================================================
@@ -812,6 +793,7 @@ def export_shifts_excel():
         filename = f"miei_{filename}"
     
     shifts = shifts_query.order_by(Shift.date, Shift.start_time).all()
+    presence = shift_presence.reconcile(shifts)
     
     # Crea Excel in memoria usando openpyxl
     from openpyxl import Workbook
@@ -830,7 +812,7 @@ def export_shifts_excel():
     )
     
     # Header
-    headers = ['Data', 'Utente', 'Ruolo', 'Orario Inizio', 'Orario Fine', 'Tipo Turno', 'Durata (ore)']
+    headers = ['Data', 'Utente', 'Ruolo', 'Orario Inizio', 'Orario Fine', 'Tipo Turno', 'Durata (ore)', 'Presenza']
     for col, header in enumerate(headers, 1):
         cell = ws.cell(row=1, column=col, value=header)
         cell.font = header_font
@@ -850,7 +832,8 @@ def export_shifts_excel():
             shift.start_time.strftime('%H:%M'),
             shift.end_time.strftime('%H:%M'),
             shift.shift_type,
-            f"{duration:.1f}"
+            f"{duration:.1f}",
+            presence[shift.id]['message'] if presence.get(shift.id) else '-'
         ]
         
         for col, value in enumerate(row_data, 1):
@@ -915,11 +898,11 @@ def export_shifts_pdf():
             end_date = date(current_date.year + 1, 1, 1) - timedelta(days=1)
         else:
             end_date = date(current_date.year, current_date.month + 1, 1) - timedelta(days=1)
-        title = f"Turni {current_date.strftime('%B %Y').title()}"
+        title = export_renderer.month_title(current_date)
         filename = f"turni_{current_date.strftime('%Y-%m')}.pdf"
     
     # Query dei turni
-    shifts_query = Shift.query.filter(
+    shifts_query = filter_by_company(Shift.query).filter(
         Shift.date >= start_date,
         Shift.date <= end_date
     )
@@ -929,93 +912,59 @@ def export_shifts_pdf():
         title = f"I Miei {title}"
         filename = f"miei_{filename}"
     
-    shifts = shifts_query.order_by(Shift.date, Shift.start_time).all()
-    
-    # Crea PDF in memoria
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib import colors
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import inch
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1*inch, bottomMargin=1*inch)
-    story = []
-    
-    # Stili
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        spaceAfter=30,
-        alignment=1  # Center
-    )
-    
-    # Titolo
-    story.append(Paragraph(title, title_style))
-    story.append(Paragraph(f"Generato il {datetime.now().strftime('%d/%m/%Y alle %H:%M')}", styles['Normal']))
-    story.append(Spacer(1, 20))
+    # Solo una sede (PDF per sede)
+    sede_id = request.args.get('sede', type=int)
+    if sede_id:
+        sede = filter_by_company(Sede.query).filter_by(id=sede_id).first_or_404()
+        shifts_query = shifts_query.filter(Shift.user.has(User.sede_id == sede_id))
+        title = f"{title} - {sede.name}"
     
-    if not shifts:
-        story.append(Paragraph("Nessun turno trovato per il periodo selezionato.", styles['Normal']))
-    else:
-        # Raggruppa turni per data
-        shifts_by_date = {}
-        for shift in shifts:
-            if shift.date not in shifts_by_date:
-                shifts_by_date[shift.date] = []
-            shifts_by_date[shift.date].append(shift)
-        
-        # Genera calendario giorno per giorno
-        for shift_date in sorted(shifts_by_date.keys()):
-            day_shifts = shifts_by_date[shift_date]
-            
-            # Header giorno
-            weekday_name = ['Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato', 'Domenica'][shift_date.weekday()]
-            day_header = f"{weekday_name} {shift_date.strftime('%d/%m/%Y')}"
-            
-            story.append(Paragraph(day_header, styles['Heading2']))
-            
-            # Tabella turni
-            data = [['Utente', 'Ruolo', 'Orario', 'Durata']]
-            
-            for shift in day_shifts:
-                duration = (datetime.combine(date.today(), shift.end_time) -
-                          datetime.combine(date.today(), shift.start_time)).total_seconds() / 3600
-                
-                data.append([
-                    shift.user.get_full_name(),
-                    shift.user.role,
-                    f"{shift.start_time.strftime('%H:%M')} - {shift.end_time.strftime('%H:%M')}",
-                    f"{duration:.1f}h"
-                ])
-            
-            table = Table(data, colWidths=[2.5*inch, 1.5*inch, 1.5*inch, 1*inch])
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            
-            story.append(table)
-            story.append(Spacer(1, 20))
+    # Turni con utente e sede in una query, presenze in una query
+    rows = export_renderer.shift_rows(shifts_query)
+    presence = shift_presence.reconcile(rows)
     
-    doc.build(story)
+    # PDF dalla cache se turni e presenze del periodo non sono cambiati
+    pdf_data = export_renderer.get_shifts_pdf(export_renderer.daily_payload(title, [], rows, presence))
     
-    # Crea response
-    buffer.seek(0)
-    response = make_response(buffer.getvalue())
+    response = make_response(pdf_data)
     response.headers['Content-Type'] = 'application/pdf'
     response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
     
     return response
 
+@shifts_bp.route('/coverage-report')
+@login_required
+def coverage_report():
+    """Report mensile copertura turni: presenze riconciliate con le timbrature"""
+    if not current_user.can_view_shifts():
+        flash('Non hai i permessi per accedere a questa funzionalità.', 'danger')
+        return redirect(url_for('dashboard.dashboard'))
+    
+    month_param = request.args.get('month', date.today().strftime('%Y-%m'))
+    try:
+        month_start = datetime.strptime(month_param, '%Y-%m').date()
+    except ValueError:
+        month_start = date.today().replace(day=1)
+    if month_start.month == 12:
+        month_end = date(month_start.year + 1, 1, 1) - timedelta(days=1)
+    else:
+        month_end = date(month_start.year, month_start.month + 1, 1) - timedelta(days=1)
+    
+    sede_id = request.args.get('sede', type=int)
+    if not current_user.all_sedi and current_user.sede_obj:
+        sede_id = current_user.sede_obj.id
+    
+    # Turni, utenti e timbrature del mese in una sola query
+    report = shift_presence.coverage_report(get_user_company_id(), month_start, month_end, sede_id=sede_id)
+    sedi = filter_by_company(Sede.query).filter_by(active=True).order_by(Sede.name).all() if current_user.all_sedi else []
+    
+    return render_template('shift_coverage_report.html',
+                         report=report,
+                         month_start=month_start,
+                         sede_id=sede_id,
+                         sedi=sedi,
+                         status_labels=shift_presence.STATUS_LABELS)
+
 # =============================================================================
 # ADMIN COVERAGE MANAGEMENT ROUTES
 # =============================================================================
@@ -5,7 +5,7 @@
 # API endpoints and administrative operations
 # =============================================================================
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response, abort
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
 from functools import wraps
@@ -17,6 +17,7 @@ from app import db
 from werkzeug.security import generate_password_hash
 from sqlalchemy.orm import joinedload
 from utils_tenant import filter_by_company, set_company_on_create
+from services import calendar_feed, message_inbox, shift_presence
 from utils_security import validate_image_upload
 
 # =============================================================================
@@ -31,6 +32,9 @@ user_management_bp = Blueprint(
     static_folder='../static'
 )
 
+# Cartella delle immagini profilo salvate prima dello storage content-addressed
+PROFILES_FOLDER = 'static/uploads/profiles'
+
 # =============================================================================
 # PERMISSION DECORATORS
 # =============================================================================
@@ -252,8 +256,9 @@ def user_profile():
     from forms import UserProfileForm
     from werkzeug.utils import secure_filename
     from PIL import Image
+    from io import BytesIO
     import os
-    import uuid
+    from services import file_storage
     
     form = UserProfileForm(obj=current_user, original_email=current_user.email)
     
@@ -284,21 +289,11 @@ def user_profile():
                 flash(error_msg, 'danger')
                 return render_template('user_profile.html', user=current_user, form=form)
             
-            # Generate unique filename
-            file_ext = os.path.splitext(secure_filename(file.filename))[1]
-            unique_filename = f"{uuid.uuid4().hex}{file_ext}"
-            
-            # Save path
-            upload_folder = os.path.join('static', 'uploads', 'profiles')
-            os.makedirs(upload_folder, exist_ok=True)
-            file_path = os.path.join(upload_folder, unique_filename)
-            
-            # Save and resize image
-            file.save(file_path)
+            file_ext = os.path.splitext(secure_filename(file.filename))[1].lower()
             
-            # Resize image to 200x200 using PIL
+            # Resize image to 200x200 using PIL (in memoria, poi salvataggio content-addressed)
             try:
-                with Image.open(file_path) as img:
+                with Image.open(file.stream) as img:
                     # Convert to RGB if necessary (for PNG with transparency)
                     if img.mode in ('RGBA', 'LA', 'P'):
                         background = Image.new('RGB', img.size, (255, 255, 255))
@@ -309,16 +304,18 @@ def user_profile():
                     
                     # Resize maintaining aspect ratio and crop to square
                     img.thumbnail((200, 200), Image.Resampling.LANCZOS)
-                    img.save(file_path, quality=85, optimize=True)
+                    buffer = BytesIO()
+                    img.save(buffer, format=Image.registered_extensions().get(file_ext, 'JPEG'), quality=85, optimize=True)
+                    buffer.seek(0)
                 
-                # Delete old profile image if exists
-                if current_user.profile_image:
-                    old_image_path = os.path.join(upload_folder, current_user.profile_image)
-                    if os.path.exists(old_image_path):
-                        os.remove(old_image_path)
+                # Immagini identiche (es. avatar aziendale) occupano un solo blob
+                new_image_key = file_storage.store_stream(buffer, filename=f"profile{file_ext}")
+                
+                # Release old profile image if exists
+                file_storage.release(current_user.profile_image, PROFILES_FOLDER)
                 
                 # Update user profile image
-                current_user.profile_image = unique_filename
+                current_user.profile_image = new_image_key
             except Exception as e:
                 flash(f'Errore nel caricamento dell\'immagine: {str(e)}', 'danger')
         
@@ -328,11 +325,31 @@ def user_profile():
             current_user.password_hash = generate_password_hash(form.password.data)
         
         db.session.commit()
+        
+        # Nome, ruolo, contatti e bio compaiono nel CV: prepara il PDF aggiornato
+        from services.cv_renderer import schedule_regeneration
+        schedule_regeneration(current_user)
+        
         flash('Profilo aggiornato con successo', 'success')
         return redirect(url_for('user_management.user_profile'))
     
     return render_template('user_profile.html', user=current_user, form=form)
 
+@user_management_bp.route('/profile/image/<int:user_id>')
+@login_required
+def profile_image(user_id):
+    """Immagine profilo di un utente della stessa azienda (i blob non stanno in static/)"""
+    from services import file_storage
+    
+    user = filter_by_company(User.query).filter_by(id=user_id).first_or_404()
+    if not user.profile_image:
+        abort(404)
+    
+    response = file_storage.send_stored_file(user.profile_image, PROFILES_FOLDER, as_attachment=False)
+    if response is None:
+        abort(404)
+    return response
+
 @user_management_bp.route('/profile/cv', methods=['GET', 'POST'])
 @login_required
 def cv_editor():
@@ -397,6 +414,10 @@ def cv_editor():
             
             db.session.commit()
             
+            # Prepara in background il PDF aggiornato del CV
+            from services.cv_renderer import schedule_regeneration
+            schedule_regeneration(current_user)
+            
             if request.is_json:
                 return jsonify({'success': True, 'message': 'CV aggiornato con successo'})
             else:
@@ -695,6 +716,7 @@ def _delete_user_cascade(user_id):
     
     # 1. Delete attendance events
     filter_by_company(AttendanceEvent.query).filter_by(user_id=user_id).delete()
+    shift_presence.mark_touched(user_id)
     
     # 2. Delete leave requests (both as requester and approver)
     filter_by_company(LeaveRequest.query).filter_by(user_id=user_id).delete()
@@ -703,6 +725,7 @@ def _delete_user_cascade(user_id):
     # 3. Delete shifts (both assigned and created)
     filter_by_company(Shift.query).filter_by(user_id=user_id).delete()
     filter_by_company(Shift.query).filter_by(created_by=user_id).delete()
+    calendar_feed.mark_touched(user.company_id)
     
     # 4. Delete shift templates created by user
     filter_by_company(ShiftTemplate.query).filter_by(created_by=user_id).delete()
@@ -721,7 +744,11 @@ def _delete_user_cascade(user_id):
     
     # 8. Delete internal messages (received and sent)
     filter_by_company(InternalMessage.query).filter_by(recipient_id=user_id).delete()
+    sent_to = [row.recipient_id for row in filter_by_company(InternalMessage.query).filter_by(
+        sender_id=user_id, is_read=False
+    ).with_entities(InternalMessage.recipient_id).distinct()]
     filter_by_company(InternalMessage.query).filter_by(sender_id=user_id).delete()
+    message_inbox.recount(db.session.connection(), sent_to)
     
     # 9. Delete password reset tokens
     filter_by_company(PasswordResetToken.query).filter_by(user_id=user_id).delete()
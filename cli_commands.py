@@ -6,6 +6,23 @@ from flask.cli import with_appcontext
 from app import app
 
 
+@app.cli.command('init-db')
+@with_appcontext
+def init_db_command():
+    """
+    Crea le tabelle mancanti e carica i dati di default (idempotente)
+    
+    Da eseguire una volta a ogni deploy quando i worker partono con
+    INIT_DB_ON_STARTUP=False:
+    INIT_DB_ON_STARTUP=False flask init-db && gunicorn main:app
+    """
+    from app import init_database
+    
+    click.echo("Creazione tabelle e seed dati di default...")
+    init_database()
+    click.echo("✅ Database inizializzato")
+
+
 @app.cli.command('send-timesheet-reminders')
 @with_appcontext
 def send_timesheet_reminders_command():
@@ -74,5 +91,253 @@ def test_reminder_preview_command():
         click.echo(f"\n⚠️  Sarebbero inviati {total} messaggi se eseguissi 'flask send-timesheet-reminders'")
 
 
+@app.cli.command('rebuild-persona-index')
+@click.option('--company-id', type=int, default=None, help='Ricostruisci solo per questa azienda')
+@with_appcontext
+def rebuild_persona_index_command(company_id):
+    """
+    Ricostruisce l'indice di ricerca della directory Personas (CIRCLE)
+    
+    L'indice è aggiornato automaticamente a ogni salvataggio del profilo;
+    questo comando serve per il backfill iniziale o per riallineare l'indice.
+    """
+    from services.persona_search import rebuild_index
+    
+    click.echo("Ricostruzione indice Personas in corso...")
+    indexed = rebuild_index(company_id=company_id)
+    click.echo(f"✅ Profili indicizzati: {indexed}")
+
+
+
+@app.cli.command('backfill-commessa-hours')
+@click.option('--company-id', type=int, default=None, help='Ricalcola solo le commesse di questa azienda')
+@with_appcontext
+def backfill_commessa_hours_command(company_id):
+    """
+    Ricalcola il ledger delle ore consumate per commessa
+    
+    Il ledger è aggiornato automaticamente a ogni salvataggio di sessioni e timbrature;
+    questo comando serve per il backfill iniziale dei dati storici o per riallinearlo.
+    """
+    from services.commessa_hours import rebuild_ledger
+    
+    click.echo("Ricalcolo ore commessa in corso...")
+    refreshed = rebuild_ledger(company_id=company_id)
+    click.echo(f"✅ Giorni-utente ricalcolati: {refreshed}")
+
+
+@app.cli.command('rebuild-weekly-hours')
+@click.option('--company-id', type=int, default=None, help='Ricalcola solo gli utenti di questa azienda')
+@with_appcontext
+def rebuild_weekly_hours_command(company_id):
+    """
+    Ricalcola il ledger delle ore lavorate per settimana ISO
+    
+    Il ledger è aggiornato automaticamente a ogni salvataggio di timbrature e assenze e
+    le settimane mancanti sono calcolate alla prima lettura; questo comando precalcola
+    lo storico o lo riallinea dopo correzioni fatte direttamente sul database.
+    """
+    from services.weekly_hours import rebuild_ledger
+    
+    click.echo("Ricalcolo ore settimanali in corso...")
+    refreshed = rebuild_ledger(company_id=company_id)
+    click.echo(f"✅ Settimane-utente ricalcolate: {refreshed}")
+
+
+@app.cli.command('rebuild-hr-expiry-calendar')
+@click.option('--company-id', type=int, default=None, help='Ricalcola solo le schede HR di questa azienda')
+@with_appcontext
+def rebuild_hr_expiry_calendar_command(company_id):
+    """
+    Ricalcola il calendario delle scadenze HR (documenti, formazione, contratti)
+    
+    Il calendario è aggiornato automaticamente a ogni salvataggio della scheda HR;
+    questo comando serve per il popolamento iniziale o per riallinearlo.
+    """
+    from services.hr_expiry import rebuild_calendar
+    
+    click.echo("Ricalcolo calendario scadenze HR in corso...")
+    synced = rebuild_calendar(company_id=company_id)
+    click.echo(f"✅ Schede HR riallineate: {synced}")
+
+
+@app.cli.command('send-hr-expiry-digest')
+@with_appcontext
+def send_hr_expiry_digest_command():
+    """
+    Invia ai gestori HR il riepilogo delle scadenze in arrivo (un messaggio per azienda)
+    
+    Esegui questo comando quotidianamente via cron:
+    0 7 * * * cd /path/to/app && flask send-hr-expiry-digest
+    
+    Ogni scadenza viene segnalata una sola volta, quando entra nella finestra di
+    preavviso (documenti 30 giorni, formazione e contratti 60 giorni).
+    """
+    from services.hr_expiry import send_expiry_digest
+    from datetime import date
+    
+    click.echo(f"=== Digest scadenze HR - {date.today().strftime('%Y-%m-%d')} ===\n")
+    stats = send_expiry_digest()
+    
+    if stats['expiries'] == 0:
+        click.echo("Nessuna nuova scadenza da segnalare oggi.")
+        return
+    
+    click.echo(f"✅ Scadenze segnalate: {stats['expiries']}")
+    click.echo(f"  - Aziende: {stats['companies']}")
+    click.echo(f"  - Messaggi inviati: {stats['messages']}")
+
+
+@app.cli.command('prerender-shift-pdfs')
+@click.option('--month', default=None, help='Mese da renderizzare (YYYY-MM, default: mese precedente)')
+@click.option('--company-id', type=int, default=None, help='Renderizza solo i PDF di questa azienda')
+@with_appcontext
+def prerender_shift_pdfs_command(month, company_id):
+    """
+    Genera in parallelo i PDF mensili dei turni (azienda e singole sedi) mancanti in cache
+    
+    Esegui questo comando a inizio mese via cron, così i download del mese chiuso
+    sono serviti dalla cache:
+    0 3 1 * * cd /path/to/app && flask prerender-shift-pdfs
+    """
+    from datetime import date, datetime, timedelta
+    from models import Company
+    from services.export_renderer import month_shifts_payloads, prerender_shifts_pdfs
+    
+    if month:
+        month_start = datetime.strptime(month, '%Y-%m').date()
+    else:
+        month_start = (date.today().replace(day=1) - timedelta(days=1)).replace(day=1)
+    
+    query = Company.query.filter_by(active=True)
+    if company_id is not None:
+        query = query.filter_by(id=company_id)
+    
+    payloads = []
+    for company in query.order_by(Company.id).all():
+        payloads.extend(month_shifts_payloads(company.id, month_start))
+    
+    click.echo(f"Rendering PDF turni {month_start.strftime('%Y-%m')}: {len(payloads)} documenti...")
+    rendered = prerender_shifts_pdfs(payloads)
+    click.echo(f"✅ PDF generati: {rendered} (già in cache: {len(payloads) - rendered})")
+
+
+@app.cli.command('prune-export-cache')
+@click.option('--days', type=int, default=30, help='Età massima in giorni dei documenti in cache')
+@with_appcontext
+def prune_export_cache_command(days):
+    """Elimina dalla cache degli export i documenti più vecchi di --days giorni"""
+    from services.export_renderer import prune_cache
+    
+    removed = prune_cache(max_age_days=days)
+    click.echo(f"✅ Documenti rimossi dalla cache: {removed}")
+
+
+@app.cli.command('prune-cv-cache')
+@click.option('--days', type=int, default=30, help='Giorni senza utilizzo dopo i quali un CV viene rimosso')
+@with_appcontext
+def prune_cv_cache_command(days):
+    """Elimina dalla cache i CV PDF non usati da più di --days giorni"""
+    from services.cv_renderer import prune_cache
+    
+    removed = prune_cache(max_age_days=days)
+    click.echo(f"✅ CV rimossi dalla cache: {removed}")
+
+
+
+@app.cli.command('banca-ore-nightly')
+@click.option('--company-id', type=int, default=None, help='Elabora solo gli utenti di questa azienda')
+@with_appcontext
+def banca_ore_nightly_command(company_id):
+    """
+    Chiude i giorni lavorativi nel ledger banca ore e registra le ore scadute
+    
+    Esegui questo comando ogni notte via cron:
+    30 1 * * * cd /path/to/app && flask banca-ore-nightly
+    
+    Gli ultimi BANCA_ORE_CLOSE_LOOKBACK_DAYS giorni vengono ricontrollati, così le
+    timbrature corrette dopo la chiusura diventano rettifiche.
+    """
+    from services.banca_ore_ledger import run_nightly
+    
+    stats = run_nightly(company_id=company_id)
+    click.echo(f"✅ Giorni ricontrollati: {stats['days']}")
+    click.echo(f"  - Movimenti da presenze: {stats['movements']}")
+    click.echo(f"  - Bucket scaduti: {stats['expired']}")
+
+
+@app.cli.command('rebuild-banca-ore')
+@click.option('--company-id', type=int, default=None, help='Ricostruisci solo gli utenti di questa azienda')
+@click.option('--months', type=int, default=12, help='Mesi di storico da registrare')
+@with_appcontext
+def rebuild_banca_ore_command(company_id, months):
+    """
+    Popola il ledger banca ore dallo storico (presenze, straordinari approvati, permessi)
+    
+    Idempotente: le giornate e le richieste già registrate non vengono duplicate.
+    """
+    from services.banca_ore_ledger import rebuild_ledger
+    
+    click.echo(f"Ricostruzione banca ore ({months} mesi) in corso...")
+    stats = rebuild_ledger(company_id=company_id, months=months)
+    click.echo(f"✅ Movimenti registrati: {stats['movements']}")
+    click.echo(f"  - Bucket scaduti: {stats['expired']}")
+
+
+@app.cli.command('detect-overtime')
+@click.option('--date', 'day', default=None, help='Giorno da elaborare (YYYY-MM-DD, default: ieri)')
+@click.option('--month', default=None, help='Mese da elaborare (YYYY-MM), in alternativa a --date')
+@click.option('--company-id', type=int, default=None, help='Elabora solo gli utenti di questa azienda')
+@with_appcontext
+def detect_overtime_command(day, month, company_id):
+    """
+    Rileva lo straordinario dalle timbrature per un giorno o un mese chiuso
+    
+    Esegui questo comando ogni notte via cron (flask banca-ore-nightly lo esegue
+    già per gli ultimi giorni):
+    15 1 * * * cd /path/to/app && flask detect-overtime
+    """
+    from datetime import date, datetime, timedelta
+    from services.listing import month_range
+    from services.overtime_detection import run_detection
+    
+    if month:
+        month_start = datetime.strptime(month, '%Y-%m').date()
+        start, end = month_range(month_start.year, month_start.month)
+    else:
+        start = end = datetime.strptime(day, '%Y-%m-%d').date() if day else date.today() - timedelta(days=1)
+    
+    click.echo(f"Rilevamento straordinari {start.strftime('%d/%m/%Y')} - {end.strftime('%d/%m/%Y')}...")
+    stats = run_detection(start, end, company_id=company_id)
+    click.echo(f"✅ Giornate con straordinario o richiesta: {stats['rows']} ({stats['users']} utenti)")
+    click.echo(f"  - Ore rilevate: {stats['overtime_hours']}")
+    click.echo(f"  - Tempo: {stats['seconds']}s")
+
+
+@app.cli.command('archive-messages')
+@click.option('--days', type=int, default=None, help='Archivia i messaggi letti più vecchi di questi giorni')
+@click.option('--recount', is_flag=True, help='Ricalcola anche i contatori dei non letti di tutti gli utenti')
+@with_appcontext
+def archive_messages_command(days, recount):
+    """
+    Sposta in archivio i messaggi interni letti più vecchi di MESSAGE_ARCHIVE_AFTER_DAYS
+    
+    Esegui questo comando ogni notte via cron:
+    0 3 * * * cd /path/to/app && flask archive-messages
+    
+    I messaggi non letti restano nella casella finché non vengono letti.
+    """
+    from app import db
+    from services import message_inbox
+    
+    stats = message_inbox.archive_messages(older_than_days=days)
+    click.echo(f"✅ Messaggi archiviati: {stats['archived']}")
+    click.echo(f"  - Eliminati dall'archivio: {stats['purged']}")
+    
+    if recount:
+        message_inbox.recount(db.session.connection())
+        db.session.commit()
+        click.echo("✅ Contatori dei non letti ricalcolati")
+
 if __name__ == '__main__':
     app.cli()
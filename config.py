@@ -21,6 +21,8 @@ class Config:
         raise ValueError("DATABASE_URL environment variable is required for PostgreSQL connection")
     DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', '300'))  # 5 minutes
     DATABASE_POOL_PRE_PING = os.environ.get('DATABASE_POOL_PRE_PING', 'True').lower() == 'true'
+    # create_all + seed a ogni avvio del processo; in produzione False ed esecuzione di 'flask init-db' al deploy
+    INIT_DB_ON_STARTUP = os.environ.get('INIT_DB_ON_STARTUP', 'True').lower() == 'true'
     
     # Server Configuration
     SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
@@ -35,6 +37,44 @@ class Config:
     STATIC_QR_DIR = os.path.join('static', 'qr')
     STATIC_UPLOADS_DIR = os.path.join('static', 'uploads')
     
+    # Content-Addressed File Storage (services/file_storage.py)
+    # I blob stanno fuori da static/: si scaricano solo dalle route con controllo di permessi.
+    # Con il backend nginx la location deve essere interna, ad esempio:
+    #   location /protected-files/ { internal; alias /path/to/app/instance/storage/; }
+    STORAGE_ROOT = os.environ.get('STORAGE_ROOT')  # Default: <instance_path>/storage
+    STORAGE_SENDFILE_BACKEND = os.environ.get('STORAGE_SENDFILE_BACKEND', '')  # '', 'nginx' (X-Accel-Redirect), 'sendfile' (X-Sendfile)
+    STORAGE_ACCEL_PREFIX = os.environ.get('STORAGE_ACCEL_PREFIX', '/protected-files/')  # nginx internal location -> STORAGE_ROOT
+    
+    # CV PDF Rendering (services/cv_renderer.py)
+    CV_CACHE_DIR = os.environ.get('CV_CACHE_DIR')  # Default: <instance_path>/cv_cache
+    CV_RENDER_WORKERS = int(os.environ.get('CV_RENDER_WORKERS', '0')) or None  # Default: min(4, CPU)
+    
+    # Shift PDF / Timesheet Export Rendering (services/export_renderer.py)
+    EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR')  # Default: <instance_path>/export_cache
+    EXPORT_RENDER_WORKERS = int(os.environ.get('EXPORT_RENDER_WORKERS', '0')) or None  # Default: min(4, CPU)
+    EXPORT_PARALLEL_MIN_ROWS = int(os.environ.get('EXPORT_PARALLEL_MIN_ROWS', '500'))  # Larger documents render in the process pool
+    
+    # ACI Lookup Index (services/aci_lookup.py)
+    ACI_LOOKUP_TTL = int(os.environ.get('ACI_LOOKUP_TTL', '300'))  # Max age in seconds of the per-worker index
+    
+    # Holiday Calendar (services/holiday_calendar.py)
+    HOLIDAY_CALENDAR_TTL = int(os.environ.get('HOLIDAY_CALENDAR_TTL', '3600'))  # Max age in seconds of the per-worker calendar
+    
+    # Calendar Feed (services/calendar_feed.py)
+    CALENDAR_FEED_TTL = int(os.environ.get('CALENDAR_FEED_TTL', '60'))  # Max age in seconds of a cached feed response
+    
+    # Shift Presence (services/shift_presence.py)
+    SHIFT_PRESENCE_TTL = int(os.environ.get('SHIFT_PRESENCE_TTL', '3600'))  # Max age in seconds of a cached closed-day result
+    
+    # Banca Ore Ledger (services/banca_ore_ledger.py)
+    BANCA_ORE_CLOSE_LOOKBACK_DAYS = int(os.environ.get('BANCA_ORE_CLOSE_LOOKBACK_DAYS', '7'))  # Closed days re-checked nightly for clock corrections
+    BANCA_ORE_EXPIRY_WARNING_DAYS = int(os.environ.get('BANCA_ORE_EXPIRY_WARNING_DAYS', '30'))  # Window for hours shown as expiring
+    
+    # Internal Message Inbox (services/message_inbox.py)
+    MESSAGE_ARCHIVE_AFTER_DAYS = int(os.environ.get('MESSAGE_ARCHIVE_AFTER_DAYS', '180'))  # Read messages older than this move to the archive
+    MESSAGE_ARCHIVE_PURGE_DAYS = int(os.environ.get('MESSAGE_ARCHIVE_PURGE_DAYS', '0'))  # Archived messages older than this are deleted (0 = keep)
+    MESSAGE_ARCHIVE_BATCH_SIZE = int(os.environ.get('MESSAGE_ARCHIVE_BATCH_SIZE', '5000'))  # Messages moved per transaction
+    
     # Notification and Alert Settings
     TOAST_DURATION_SUCCESS = int(os.environ.get('TOAST_DURATION_SUCCESS', '3000'))  # 3 seconds
     TOAST_DURATION_ERROR = int(os.environ.get('TOAST_DURATION_ERROR', '5000'))     # 5 seconds
@@ -0,0 +1,36 @@
+-- Migration: Set-based ACI Excel import with background jobs
+-- Date: 2026-10-19
+-- Description: Adds a unique key on aci_table (company_id, tipologia, marca, modello) used by the
+--              INSERT ... ON CONFLICT upsert in services/aci_import.py, after removing existing
+--              duplicates (the most recent row wins). Creates background_job to track progress
+--              of imports running outside the HTTP request. NULLS NOT DISTINCT requires PostgreSQL 15+.
+
+-- Rimozione duplicati esistenti (mantiene il record con id più alto)
+DELETE FROM aci_table a
+USING aci_table b
+WHERE a.id < b.id
+  AND a.company_id IS NOT DISTINCT FROM b.company_id
+  AND a.tipologia = b.tipologia
+  AND a.marca = b.marca
+  AND a.modello = b.modello;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_aci_company_tipologia_marca_modello
+    ON aci_table (company_id, tipologia, marca, modello) NULLS NOT DISTINCT;
+
+CREATE TABLE IF NOT EXISTS background_job (
+    id VARCHAR(32) PRIMARY KEY,
+    job_type VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    total INTEGER NOT NULL DEFAULT 0,
+    processed INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    result JSON,
+    created_by INTEGER REFERENCES "user"(id) ON DELETE SET NULL,
+    company_id INTEGER REFERENCES company(id) ON DELETE CASCADE,
+    created_at TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_background_job_company_type
+    ON background_job (company_id, job_type, created_at);
@@ -0,0 +1,11 @@
+-- Migration: Idempotent clock events
+-- Date: 2026-10-19
+-- Description: Adds attendance_event.idempotency_key (client request key sent by the clock
+--              buttons, QR forms and quick-action API) with a partial unique index per user,
+--              so a repeated request can never create a second event.
+
+ALTER TABLE attendance_event ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(64);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_event_idempotency
+    ON attendance_event (user_id, idempotency_key)
+    WHERE idempotency_key IS NOT NULL;
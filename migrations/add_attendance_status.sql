@@ -0,0 +1,21 @@
+-- Migration: Per-user attendance status
+-- Date: 2026-10-19
+-- Description: Creates attendance_status (one row per user) used by the QR/quick-action
+--              clock fast path. The row is locked with SELECT ... FOR UPDATE and updated in
+--              the same transaction as the clock event insert. No backfill needed: rows are
+--              rebuilt from the day's clock events on first access.
+
+CREATE TABLE IF NOT EXISTS attendance_status (
+    user_id INTEGER PRIMARY KEY REFERENCES "user"(id) ON DELETE CASCADE,
+    company_id INTEGER REFERENCES company(id),
+    status_date DATE NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'out',
+    last_event_id INTEGER,
+    last_event_type VARCHAR(20),
+    last_event_at TIMESTAMP,
+    session_started_at TIMESTAMP,
+    break_started_at TIMESTAMP,
+    break_minutes INTEGER NOT NULL DEFAULT 0,
+    worked_minutes INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP
+);
@@ -0,0 +1,42 @@
+-- Migration: Banca ore ledger
+-- Date: 2026-10-19
+-- Description: Creates banca_ore_movement (append-only hours-bank ledger, credits are FIFO
+--              expiry buckets) and banca_ore_balance (one balance row per user read by the
+--              wallet, the dashboard widget and the company report). Run
+--              `flask rebuild-banca-ore` once to load history, then `flask banca-ore-nightly`
+--              every night to close days and expire hours.
+
+CREATE TABLE IF NOT EXISTS banca_ore_movement (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES "user"(id) ON DELETE CASCADE,
+    kind VARCHAR(20) NOT NULL,
+    hours DOUBLE PRECISION NOT NULL,
+    remaining DOUBLE PRECISION,
+    work_date DATE NOT NULL,
+    expires_on DATE,
+    source_type VARCHAR(20),
+    source_id INTEGER,
+    created_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_banca_ore_movement_user_created
+    ON banca_ore_movement (user_id, created_at, id);
+
+CREATE INDEX IF NOT EXISTS idx_banca_ore_movement_source
+    ON banca_ore_movement (source_type, source_id, work_date);
+
+CREATE INDEX IF NOT EXISTS idx_banca_ore_movement_open
+    ON banca_ore_movement (expires_on, user_id) WHERE remaining > 0;
+
+CREATE TABLE IF NOT EXISTS banca_ore_balance (
+    user_id INTEGER PRIMARY KEY REFERENCES "user"(id) ON DELETE CASCADE,
+    accrued_attendance DOUBLE PRECISION NOT NULL DEFAULT 0,
+    accrued_overtime DOUBLE PRECISION NOT NULL DEFAULT 0,
+    used DOUBLE PRECISION NOT NULL DEFAULT 0,
+    expired DOUBLE PRECISION NOT NULL DEFAULT 0,
+    balance DOUBLE PRECISION NOT NULL DEFAULT 0,
+    expiring_soon DOUBLE PRECISION NOT NULL DEFAULT 0,
+    next_expiry DATE,
+    computed_on DATE,
+    updated_at TIMESTAMP
+);
@@ -0,0 +1,12 @@
+-- Migration: Calendar feed indexes
+-- Date: 2026-10-19
+-- Description: Indexes for the FullCalendar feed (services/calendar_feed.py). Leave requests are
+--              selected per tenant with the overlap predicate
+--              start_date <= window_end AND end_date >= window_start, served by a range scan on
+--              end_date with start_date checked from the index; shifts by tenant and date.
+
+CREATE INDEX IF NOT EXISTS idx_leave_request_company_dates
+    ON leave_request (company_id, end_date, start_date);
+
+CREATE INDEX IF NOT EXISTS idx_shift_company_date
+    ON shift (company_id, date);
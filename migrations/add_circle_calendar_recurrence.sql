@@ -0,0 +1,23 @@
+-- Migration: Range index, recurrence and modification tracking for CIRCLE calendar events
+-- Date: 2026-10-19
+-- Description: Adds recurrence fields (rule, interval, until) and updated_at to
+--              circle_calendar_event, plus composite indexes used by the FullCalendar
+--              feed (overlap query per tenant and window) and by the ETag/Last-Modified
+--              version query in blueprints/circle_calendar.py.
+
+ALTER TABLE circle_calendar_event
+ADD COLUMN IF NOT EXISTS recurrence_rule VARCHAR(20),
+ADD COLUMN IF NOT EXISTS recurrence_interval INTEGER NOT NULL DEFAULT 1,
+ADD COLUMN IF NOT EXISTS recurrence_until TIMESTAMP,
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+
+-- Inizializza updated_at per gli eventi esistenti
+UPDATE circle_calendar_event SET updated_at = created_at WHERE updated_at IS NULL;
+
+-- Overlap query: company_id = ? AND start_datetime < window_end AND end_datetime > window_start
+CREATE INDEX IF NOT EXISTS idx_circle_event_company_range
+ON circle_calendar_event(company_id, start_datetime, end_datetime);
+
+-- Eventi ricorrenti ancora attivi nella finestra
+CREATE INDEX IF NOT EXISTS idx_circle_event_company_recurrence
+ON circle_calendar_event(company_id, recurrence_rule, recurrence_until);
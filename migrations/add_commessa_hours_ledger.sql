@@ -0,0 +1,25 @@
+-- Migration: Hours ledger for commesse
+-- Date: 2026-10-19
+-- Description: Creates commessa_hours_ledger (one row per commessa/user/day) used by
+--              Commessa.get_ore_consumate. The ledger is refreshed on every flush that touches
+--              attendance sessions or clock events; run `flask backfill-commessa-hours` once
+--              after applying this migration to populate historical data.
+
+CREATE TABLE IF NOT EXISTS commessa_hours_ledger (
+    id SERIAL PRIMARY KEY,
+    commessa_id INTEGER NOT NULL REFERENCES commessa(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES "user"(id) ON DELETE CASCADE,
+    date DATE NOT NULL,
+    hours DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP,
+    CONSTRAINT uq_commessa_hours_day UNIQUE (commessa_id, user_id, date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_commessa_hours_user_date
+    ON commessa_hours_ledger (user_id, date);
+
+-- Lookup delle sessioni/timbrature di un utente in un giorno durante il ricalcolo
+CREATE INDEX IF NOT EXISTS idx_attendance_session_user_date
+    ON attendance_session (user_id, date);
+CREATE INDEX IF NOT EXISTS idx_attendance_event_user_date
+    ON attendance_event (user_id, date);
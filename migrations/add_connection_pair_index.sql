@@ -0,0 +1,24 @@
+-- Migration: Normalized undirected pair index for CIRCLE connections
+-- Date: 2026-10-19
+-- Description: Adds user_low_id/user_high_id (LEAST/GREATEST of sender and recipient) to
+--              connection_request so that a pair lookup is a single index seek instead
+--              of an OR over both directions, and the personas directory can resolve
+--              every connection badge with one adjacency query.
+
+ALTER TABLE connection_request
+ADD COLUMN IF NOT EXISTS user_low_id INTEGER,
+ADD COLUMN IF NOT EXISTS user_high_id INTEGER;
+
+-- Backfill delle righe esistenti
+UPDATE connection_request
+SET user_low_id = LEAST(sender_id, recipient_id),
+    user_high_id = GREATEST(sender_id, recipient_id)
+WHERE user_low_id IS NULL OR user_high_id IS NULL;
+
+-- Lookup della coppia e adiacenza lato "low"
+CREATE INDEX IF NOT EXISTS idx_connection_pair
+ON connection_request(user_low_id, user_high_id, status);
+
+-- Adiacenza lato "high"
+CREATE INDEX IF NOT EXISTS idx_connection_pair_high
+ON connection_request(user_high_id, user_low_id, status);
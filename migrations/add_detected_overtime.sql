@@ -0,0 +1,23 @@
+-- Migration: Detected overtime
+-- Date: 2026-10-19
+-- Description: Creates detected_overtime (one row per user and closed day with overtime or
+--              an overtime request), written by the batch detector in
+--              services/overtime_detection.py and read by the overtime widget, the approval
+--              screen and the banca ore ledger. Run `flask detect-overtime --month YYYY-MM`
+--              to backfill past months.
+
+CREATE TABLE IF NOT EXISTS detected_overtime (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES "user"(id) ON DELETE CASCADE,
+    company_id INTEGER REFERENCES company(id),
+    date DATE NOT NULL,
+    worked_hours DOUBLE PRECISION NOT NULL DEFAULT 0,
+    standard_hours DOUBLE PRECISION NOT NULL DEFAULT 0,
+    overtime_hours DOUBLE PRECISION NOT NULL DEFAULT 0,
+    overtime_request_id INTEGER REFERENCES overtime_request(id) ON DELETE SET NULL,
+    detected_at TIMESTAMP,
+    CONSTRAINT uq_detected_overtime_user_date UNIQUE (user_id, date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_detected_overtime_company_date
+    ON detected_overtime (company_id, date);
@@ -0,0 +1,24 @@
+-- Migration: HR expiry calendar
+-- Date: 2026-10-19
+-- Description: Creates hr_expiry_event, one row per expiry date of an HR record (documents,
+--              training/medical visits, contract and probation end). Rows are maintained by
+--              the UserHRData listeners; dashboards and the nightly digest read a date range on
+--              (company_id, expiry_date). Backfill existing records with:
+--              flask rebuild-hr-expiry-calendar
+
+CREATE TABLE IF NOT EXISTS hr_expiry_event (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES "user"(id) ON DELETE CASCADE,
+    company_id INTEGER NOT NULL REFERENCES company(id),
+    hr_data_id INTEGER NOT NULL REFERENCES user_hr_data(id) ON DELETE CASCADE,
+    kind VARCHAR(30) NOT NULL,
+    category VARCHAR(20) NOT NULL,
+    label VARCHAR(100) NOT NULL,
+    expiry_date DATE NOT NULL,
+    notified_on DATE,
+    updated_at TIMESTAMP,
+    CONSTRAINT uq_hr_expiry_event_kind UNIQUE (hr_data_id, kind)
+);
+
+CREATE INDEX IF NOT EXISTS idx_hr_expiry_event_company_date
+    ON hr_expiry_event (company_id, expiry_date);
@@ -0,0 +1,22 @@
+-- Migration: Listing indexes
+-- Date: 2026-10-19
+-- Description: Indexes for the reperibilità and leave request listings (services/listing.py).
+--              Month and year filters are date ranges and pages are fetched by keyset
+--              (date DESC, start_time, id for reperibilità; created_at DESC, id DESC for leave
+--              requests), so both are served by per-tenant composite indexes. Keyset columns
+--              must be NOT NULL: leave_request.created_at is backfilled and constrained.
+
+CREATE INDEX IF NOT EXISTS idx_reperibilita_shift_company_date
+    ON reperibilita_shift (company_id, date, start_time);
+
+UPDATE leave_request
+SET created_at = COALESCE(approved_at, start_date::timestamp)
+WHERE created_at IS NULL;
+
+ALTER TABLE leave_request ALTER COLUMN created_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_leave_request_company_created
+    ON leave_request (company_id, created_at, id);
+
+CREATE INDEX IF NOT EXISTS idx_leave_request_company_start
+    ON leave_request (company_id, start_date);
@@ -0,0 +1,55 @@
+-- Migration: Internal message inbox indexes, unread counters and archive
+-- Date: 2026-10-19
+-- Description: Indexes for the keyset-paginated inbox and the unread badge on
+--              internal_message, the per-user unread counter read by the navbar badge
+--              (kept up to date by services/message_inbox.py) and the archive table
+--              filled by `flask archive-messages`. Counters are backfilled from the
+--              current unread messages. created_at, the keyset column, is backfilled and
+--              made NOT NULL.
+
+UPDATE internal_message SET created_at = NOW() WHERE created_at IS NULL;
+
+ALTER TABLE internal_message ALTER COLUMN created_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_internal_message_recipient_read_created
+    ON internal_message (recipient_id, is_read, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_internal_message_recipient_created
+    ON internal_message (recipient_id, created_at, id);
+
+CREATE INDEX IF NOT EXISTS idx_internal_message_sender_created
+    ON internal_message (sender_id, created_at, id);
+
+CREATE TABLE IF NOT EXISTS message_unread_counter (
+    user_id INTEGER PRIMARY KEY REFERENCES "user"(id) ON DELETE CASCADE,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP
+);
+
+INSERT INTO message_unread_counter (user_id, unread_count, updated_at)
+SELECT recipient_id, COUNT(*), NOW()
+FROM internal_message
+WHERE is_read = FALSE
+GROUP BY recipient_id
+ON CONFLICT (user_id) DO UPDATE SET unread_count = EXCLUDED.unread_count, updated_at = EXCLUDED.updated_at;
+
+CREATE TABLE IF NOT EXISTS internal_message_archive (
+    id INTEGER PRIMARY KEY,
+    recipient_id INTEGER NOT NULL,
+    sender_id INTEGER,
+    title VARCHAR(200) NOT NULL,
+    message TEXT NOT NULL,
+    message_type VARCHAR(50),
+    is_read BOOLEAN DEFAULT TRUE,
+    related_leave_request_id INTEGER,
+    created_at TIMESTAMP,
+    company_id INTEGER,
+    message_group_id VARCHAR(36),
+    archived_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_internal_message_archive_recipient_created
+    ON internal_message_archive (recipient_id, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_internal_message_archive_archived
+    ON internal_message_archive (archived_at);
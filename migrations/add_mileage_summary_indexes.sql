@@ -0,0 +1,11 @@
+-- Migration: Mileage summary indexes
+-- Date: 2026-10-19
+-- Description: Indexes for the grouped mileage reimbursement summaries computed in
+--              services/mileage_summary.py (per-user totals and yearly fixed
+--              reimbursement balance, tenant-wide monthly summary of the export).
+
+CREATE INDEX IF NOT EXISTS idx_mileage_request_user_status_travel
+    ON mileage_request (user_id, status, travel_date);
+
+CREATE INDEX IF NOT EXISTS idx_mileage_request_company_travel
+    ON mileage_request (company_id, travel_date);
@@ -0,0 +1,28 @@
+-- Migration: Search index for CIRCLE Personas directory
+-- Date: 2026-10-19
+-- Description: Creates persona_search_index (one row per user) with a weighted tsvector
+--              (names > job title/department > skills/languages > certifications/experience)
+--              and a trigram index on the normalized text. The index is kept up to date by
+--              the after_insert/after_update listeners on User; run
+--              `flask rebuild-persona-index` once after applying this migration to backfill.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS persona_search_index (
+    user_id INTEGER PRIMARY KEY REFERENCES "user"(id) ON DELETE CASCADE,
+    company_id INTEGER REFERENCES company(id) ON DELETE CASCADE,
+    search_text TEXT NOT NULL DEFAULT '',
+    search_vector TSVECTOR,
+    updated_at TIMESTAMP
+);
+
+-- Full-text (to_tsquery 'simple' con prefissi)
+CREATE INDEX IF NOT EXISTS idx_persona_search_vector
+ON persona_search_index USING GIN (search_vector);
+
+-- Sottostringhe / ILIKE
+CREATE INDEX IF NOT EXISTS idx_persona_search_trgm
+ON persona_search_index USING GIN (search_text gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_persona_search_company
+ON persona_search_index(company_id);
@@ -0,0 +1,22 @@
+-- Migration: Add stored_file table for content-addressed upload storage
+-- Date: 2026-10-19
+-- Description: Creates stored_file table used by services/file_storage.py to deduplicate
+--              uploaded files (CIRCLE documents, expense receipts, profile images) by
+--              SHA-256 content hash, with a reference count shared across tenants.
+
+CREATE TABLE IF NOT EXISTS stored_file (
+    id SERIAL PRIMARY KEY,
+    sha256 VARCHAR(64) NOT NULL,
+    extension VARCHAR(10) NOT NULL DEFAULT '',
+    size_bytes BIGINT NOT NULL DEFAULT 0,
+    content_type VARCHAR(100),
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP,
+    CONSTRAINT _stored_file_sha256_ext_uc UNIQUE (sha256, extension)
+);
+
+-- Migration complete
+-- Summary:
+--   - Created stored_file table (unique on sha256 + extension, used by ON CONFLICT upsert)
+--   - Existing uploads keep their legacy filenames and are still resolved from
+--     their original folders; new uploads are stored as 'cas/<ab>/<cd>/<sha256>.<ext>'
@@ -0,0 +1,17 @@
+-- Migration: Weekly hours ledger
+-- Date: 2026-10-19
+-- Description: Creates weekly_hours_ledger (one row per user/ISO week) read by
+--              validate_weekly_limit and calculate_weekly_hours_total. Rows are refreshed on
+--              every flush that touches clock events or leave requests and built lazily on
+--              first read; run `flask rebuild-weekly-hours` to precompute historical weeks.
+
+CREATE TABLE IF NOT EXISTS weekly_hours_ledger (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES "user"(id) ON DELETE CASCADE,
+    week_start DATE NOT NULL,
+    daily_hours JSON NOT NULL DEFAULT '{}',
+    leave_days JSON NOT NULL DEFAULT '[]',
+    total_hours DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP,
+    CONSTRAINT uq_weekly_hours_user_week UNIQUE (user_id, week_start)
+);
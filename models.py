@@ -17,16 +17,23 @@
 # 11. Mileage Management Models (MileageRequest)
 # 12. System Configuration Models (Sede, WorkSchedule, ACITable)
 # 13. Session Management Models (UserSession)
+# 14. File Storage Models (StoredFile)
+# 15. CIRCLE Search Index Models (PersonaSearchIndex)
+# 16. Background Job Models (BackgroundJob)
+# 17. Commessa Hours Ledger Models (CommessaHoursLedger)
+# 18. Weekly Hours Ledger Models (WeeklyHoursLedger)
+# 19. Attendance Status Models (AttendanceStatus)
+# 20. HR Expiry Calendar Models (HRExpiryEvent)
 #
-# Total Models: 26
+# Total Models: 27
 # =============================================================================
 
 # Core imports
 from datetime import datetime, date, timedelta
 from zoneinfo import ZoneInfo
 from flask_login import UserMixin
-from sqlalchemy import event
 from sqlalchemy.orm import validates
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from app import db
 from constants import RoleNames, RequestStatus, TimesheetStatus, AttendanceEventType, OvertimeTypes
 
@@ -317,6 +324,10 @@ class User(UserMixin, db.Model):
     def get_profile_image_url(self):
         """Restituisce l'URL dell'immagine del profilo o quella di default"""
         if self.profile_image:
+            from services.file_storage import is_cas_key
+            if is_cas_key(self.profile_image):
+                from flask import url_for
+                return url_for('user_management.profile_image', user_id=self.id)
             return f"/static/uploads/profiles/{self.profile_image}"
         return "/static/images/defaults/default_profile.png"
     
@@ -954,6 +965,17 @@ class User(UserMixin, db.Model):
         return (self.has_permission('can_view_my_banca_ore_widget') and 
                 self.overtime_enabled and self.overtime_type == 'Banca Ore')
     
+    @property
+    def banca_ore_enabled(self):
+        """True se lo straordinario dell'utente confluisce nella banca ore"""
+        return bool(self.overtime_enabled and self.overtime_type == 'Banca Ore')
+    
+    @property
+    def banca_ore_saldo(self):
+        """Saldo banca ore corrente (dal ledger, una riga per utente)"""
+        row = db.session.get(BancaOreBalance, self.id)
+        return round(row.balance, 2) if row else 0.0
+    
     # === TABELLE ACI ===
     def can_manage_aci_tables(self):
         """Può gestire le tabelle ACI"""
@@ -1009,82 +1031,52 @@ class User(UserMixin, db.Model):
     # === CONNECTION MANAGEMENT (CIRCLE) ===
     def is_connected_with(self, other_user):
         """Verifica se due utenti sono connessi (richiesta accettata)"""
-        connection = ConnectionRequest.query.filter(
-            db.or_(
-                db.and_(
-                    ConnectionRequest.sender_id == self.id,
-                    ConnectionRequest.recipient_id == other_user.id
-                ),
-                db.and_(
-                    ConnectionRequest.sender_id == other_user.id,
-                    ConnectionRequest.recipient_id == self.id
-                )
-            ),
+        connection = ConnectionRequest.pair_query(self.id, other_user.id).filter(
             ConnectionRequest.status == 'Accepted'
         ).first()
         return connection is not None
     
     def has_pending_request_with(self, other_user):
         """Verifica se esiste una richiesta pendente con un altro utente"""
-        pending = ConnectionRequest.query.filter(
-            db.or_(
-                db.and_(
-                    ConnectionRequest.sender_id == self.id,
-                    ConnectionRequest.recipient_id == other_user.id
-                ),
-                db.and_(
-                    ConnectionRequest.sender_id == other_user.id,
-                    ConnectionRequest.recipient_id == self.id
-                )
-            ),
+        pending = ConnectionRequest.pair_query(self.id, other_user.id).filter(
             ConnectionRequest.status == 'Pending'
         ).first()
         return pending
     
-    def get_connection_status(self, other_user):
+    def get_connection_status(self, other_user, statuses=None):
         """Restituisce lo stato della connessione con un altro utente
         Returns: 'connected', 'pending_sent', 'pending_received', 'none'
+        
+        Se `statuses` (risultato di get_connection_statuses) è fornito non
+        viene eseguita alcuna query.
         """
         if self.id == other_user.id:
             return 'self'
         
-        # Check if connected
-        if self.is_connected_with(other_user):
-            return 'connected'
-        
-        # Check pending request
-        pending = self.has_pending_request_with(other_user)
-        if pending:
-            if pending.sender_id == self.id:
-                return 'pending_sent'
-            else:
-                return 'pending_received'
-        
-        return 'none'
+        if statuses is None:
+            statuses = ConnectionRequest.get_statuses_for(self, [other_user.id])
+        return statuses.get(other_user.id, 'none')
+    
+    def get_connection_statuses(self, other_users=None):
+        """Stato di connessione verso molti utenti in una sola query
+        Returns: dict {user_id: status}; gli utenti non presenti sono 'none'
+        """
+        other_ids = None if other_users is None else [u.id for u in other_users]
+        return ConnectionRequest.get_statuses_for(self, other_ids)
     
     def get_connections(self):
         """Restituisce tutti gli utenti connessi"""
-        # Richieste inviate e accettate
-        sent_accepted = db.session.query(User).join(
-            ConnectionRequest, 
-            ConnectionRequest.recipient_id == User.id
-        ).filter(
-            ConnectionRequest.sender_id == self.id,
-            ConnectionRequest.status == 'Accepted'
-        ).all()
-        
-        # Richieste ricevute e accettate
-        received_accepted = db.session.query(User).join(
-            ConnectionRequest,
-            ConnectionRequest.sender_id == User.id
-        ).filter(
-            ConnectionRequest.recipient_id == self.id,
+        # Il vicino è l'altro estremo della coppia normalizzata: una sola query,
+        # senza unire e de-duplicare due join in Python
+        other_id = db.case(
+            (ConnectionRequest.user_low_id == self.id, ConnectionRequest.user_high_id),
+            else_=ConnectionRequest.user_low_id
+        )
+        neighbor_ids = db.select(other_id).where(
+            db.or_(ConnectionRequest.user_low_id == self.id, ConnectionRequest.user_high_id == self.id),
             ConnectionRequest.status == 'Accepted'
-        ).all()
-        
-        # Unisci e rimuovi duplicati
-        connections = list(set(sent_accepted + received_accepted))
-        return connections
+        )
+        return User.query.filter(User.id.in_(neighbor_ids)).all()
     
     def get_pending_connection_requests(self):
         """Restituisce tutte le richieste di connessione pendenti ricevute"""
@@ -1415,37 +1407,9 @@ class UserHRData(db.Model):
         Returns:
             dict con chiavi 'max_annual', 'used', 'available'
         """
-        from datetime import date as dt_date
-        from sqlalchemy import extract, func
-        
-        if year is None:
-            year = dt_date.today().year
-        
-        # Se non ha configurato rimborso fisso, ritorna None
-        if not self.mileage_reimbursement_type or self.mileage_reimbursement_type not in ['fisso', 'entrambi']:
-            return None
-        
-        if not self.mileage_fixed_max_annual:
-            return None
+        from services.mileage_summary import fixed_balances
         
-        # Calcola totale rimborsi fissi approvati nell'anno
-        from models import MileageRequest
-        from constants import RequestStatus
-        total_used = db.session.query(func.sum(MileageRequest.total_amount)).filter(
-            MileageRequest.user_id == self.user_id,
-            MileageRequest.reimbursement_type == 'fisso',
-            MileageRequest.status == RequestStatus.APPROVED,
-            extract('year', MileageRequest.travel_date) == year
-        ).scalar() or 0.0
-        
-        available = self.mileage_fixed_max_annual - total_used
-        
-        return {
-            'max_annual': self.mileage_fixed_max_annual,
-            'used': round(total_used, 2),
-            'available': round(max(0, available), 2),
-            'year': year
-        }
+        return fixed_balances([self.user_id], year, hr_rows=[self]).get(self.user_id)
 
 
 class ContractHistory(db.Model):
@@ -1646,6 +1610,13 @@ class AttendanceType(db.Model):
 
 class AttendanceEvent(db.Model):
     """Modello per registrare eventi multipli di entrata/uscita nella stessa giornata"""
+    __table_args__ = (
+        db.Index('idx_attendance_event_user_date', 'user_id', 'date'),
+        # Una richiesta di timbratura ripetuta (doppio tap, retry di rete) non crea un secondo evento
+        db.Index('uq_attendance_event_idempotency', 'user_id', 'idempotency_key', unique=True,
+                 postgresql_where=db.text('idempotency_key IS NOT NULL')),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False, default=date.today)
@@ -1660,6 +1631,7 @@ class AttendanceEvent(db.Model):
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True)  # Multi-tenant
     is_manual = db.Column(db.Boolean, default=False, nullable=False)  # Indica se inserito manualmente a posteriori
     entry_type = db.Column(db.String(20), default='standard', nullable=False)  # DEPRECATED: usare attendance_type_id
+    idempotency_key = db.Column(db.String(64), nullable=True)  # Chiave della richiesta client (percorso rapido)
     
     # Social Safety Net (Ammortizzatori Sociali) - Cached fields for historical accuracy
     safety_net_assignment_id = db.Column(db.Integer, db.ForeignKey('social_safety_net_assignment.id'), nullable=True)  # Assegnazione ammortizzatore attiva
@@ -2650,6 +2622,10 @@ class AttendanceSession(db.Model):
     Permette di gestire più sessioni nella stessa giornata con diverse tipologie.
     Es: 4h presenza ORD (8:00-12:00) + 4h assenza ASS (12:00-16:00)
     """
+    __table_args__ = (
+        db.Index('idx_attendance_session_user_date', 'user_id', 'date'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     timesheet_id = db.Column(db.Integer, db.ForeignKey('monthly_timesheet.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -2782,6 +2758,14 @@ class LeaveType(db.Model):
         ]
 
 class LeaveRequest(db.Model):
+    __table_args__ = (
+        # Sovrapposizione con una finestra di date per tenant (feed calendario)
+        db.Index('idx_leave_request_company_dates', 'company_id', 'end_date', 'start_date'),
+        # Lista richieste: paginazione a chiave per tenant e filtro per anno (services/listing.py)
+        db.Index('idx_leave_request_company_created', 'company_id', 'created_at', 'id'),
+        db.Index('idx_leave_request_company_start', 'company_id', 'start_date'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     leave_type_id = db.Column(db.Integer, db.ForeignKey('leave_type.id'), nullable=True)  # Riferimento alla tipologia (nullable per migrazione)
@@ -2792,7 +2776,7 @@ class LeaveRequest(db.Model):
     status = db.Column(db.String(20), default='Pending')  # Pending, Approved, Rejected
     approved_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     approved_at = db.Column(db.DateTime, nullable=True)
-    created_at = db.Column(db.DateTime, default=italian_now)
+    created_at = db.Column(db.DateTime, default=italian_now, nullable=False)  # Chiave della paginazione a cursore
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True)  # Multi-tenant
     
     # Campi per permessi orari
@@ -2900,31 +2884,13 @@ class LeaveRequest(db.Model):
         if self.leave_type_obj and self.leave_type_obj.count_weekends_holidays:
             return (self.end_date - self.start_date).days + 1
         
-        # Altrimenti conta solo i giorni lavorativi
-        working_days = 0
-        current_date = self.start_date
-        
-        while current_date <= self.end_date:
-            # Controlla se è weekend (sabato=5, domenica=6)
-            is_weekend = current_date.weekday() in [5, 6]
-            
-            # Controlla se è festivo
-            is_holiday = False
-            if self.user and self.user.sede_id:
-                holidays = Holiday.get_holidays_for_date(current_date, self.user.sede_id)
-                is_holiday = len(holidays) > 0
-            else:
-                # Se non ha sede, controlla solo festività nazionali
-                holidays = Holiday.get_holidays_for_date(current_date, sede_id=None)
-                is_holiday = len(holidays) > 0
-            
-            # Conta solo se non è weekend e non è festivo
-            if not is_weekend and not is_holiday:
-                working_days += 1
-            
-            current_date += timedelta(days=1)
+        # Altrimenti conta solo i giorni lavorativi (esclusi weekend e festività
+        # nazionali o della sede dell'utente) dal calendario compilato del tenant
+        from services import holiday_calendar
         
-        return working_days
+        company_id = self.company_id if self.company_id is not None else (self.user.company_id if self.user else None)
+        sede_id = self.user.sede_id if self.user else None
+        return holiday_calendar.working_days_between(company_id, self.start_date, self.end_date, sede_id)
     
     def get_calendar_days_count(self):
         """Restituisce il numero totale di giorni calendario del periodo"""
@@ -2937,6 +2903,10 @@ class LeaveRequest(db.Model):
 # =============================================================================
 
 class Shift(db.Model):
+    __table_args__ = (
+        db.Index('idx_shift_company_date', 'company_id', 'date'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
@@ -3322,6 +3292,11 @@ class ReperibilitaCoverage(db.Model):
 
 class ReperibilitaShift(db.Model):
     """Turni di reperibilità separati dai turni normali"""
+    __table_args__ = (
+        # Lista turni: filtro per mese e paginazione a chiave per tenant (services/listing.py)
+        db.Index('idx_reperibilita_shift_company_date', 'company_id', 'date', 'start_time'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
@@ -3499,6 +3474,14 @@ class Holiday(db.Model):
 
 class InternalMessage(db.Model):
     """Modello per messaggi interni del sistema"""
+    __table_args__ = (
+        # Badge dei non letti, segna tutti come letti e archiviazione
+        db.Index('idx_internal_message_recipient_read_created', 'recipient_id', 'is_read', 'created_at'),
+        # Paginazione a chiave delle caselle ricevuti e inviati
+        db.Index('idx_internal_message_recipient_created', 'recipient_id', 'created_at', 'id'),
+        db.Index('idx_internal_message_sender_created', 'sender_id', 'created_at', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # None per messaggi di sistema
@@ -3507,7 +3490,7 @@ class InternalMessage(db.Model):
     message_type = db.Column(db.String(50), default='info')  # 'info', 'warning', 'success', 'danger'
     is_read = db.Column(db.Boolean, default=False)
     related_leave_request_id = db.Column(db.Integer, db.ForeignKey('leave_request.id'), nullable=True)
-    created_at = db.Column(db.DateTime, default=italian_now)
+    created_at = db.Column(db.DateTime, default=italian_now, nullable=False)  # Chiave della paginazione a cursore
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True)  # Multi-tenant
     message_group_id = db.Column(db.String(36), nullable=True)  # UUID per raggruppare messaggi multipli
     
@@ -3568,6 +3551,50 @@ class InternalMessage(db.Model):
             return 1
 
 
+class MessageUnreadCounter(db.Model):
+    """
+    Contatore dei messaggi non letti per destinatario, aggiornato nella stessa transazione
+    di invio, lettura ed eliminazione (services/message_inbox.py): il badge della navbar
+    legge questa riga invece di contare i messaggi a ogni pagina.
+    """
+    __tablename__ = 'message_unread_counter'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=italian_now, onupdate=italian_now)
+    
+    def __repr__(self):
+        return f'<MessageUnreadCounter user={self.user_id} {self.unread_count}>'
+
+
+class InternalMessageArchive(db.Model):
+    """
+    Messaggi interni letti e più vecchi del periodo di conservazione, spostati qui dal job
+    di archiviazione per tenere piccola la tabella delle caselle. Nessuna FK: l'archivio
+    sopravvive a utenti e richieste eliminati.
+    """
+    __tablename__ = 'internal_message_archive'
+    __table_args__ = (
+        db.Index('idx_internal_message_archive_recipient_created', 'recipient_id', 'created_at'),
+        db.Index('idx_internal_message_archive_archived', 'archived_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)  # Stesso id del messaggio originale
+    recipient_id = db.Column(db.Integer, nullable=False)
+    sender_id = db.Column(db.Integer, nullable=True)
+    title = db.Column(db.String(200), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    message_type = db.Column(db.String(50))
+    is_read = db.Column(db.Boolean, default=True)
+    related_leave_request_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime)
+    company_id = db.Column(db.Integer, nullable=True)
+    message_group_id = db.Column(db.String(36), nullable=True)
+    archived_at = db.Column(db.DateTime, default=italian_now)
+    
+    def __repr__(self):
+        return f'<InternalMessageArchive {self.id} {self.title}>'
+
 
 class PasswordResetToken(db.Model):
     """Token per reset password"""
@@ -3945,6 +3972,12 @@ class OvertimeRequest(db.Model):
 
 class MileageRequest(db.Model):
     """Richieste di rimborso chilometrico dei dipendenti"""
+    __table_args__ = (
+        # Riepiloghi per dipendente, saldo dei rimborsi fissi (services/mileage_summary.py)
+        db.Index('idx_mileage_request_user_status_travel', 'user_id', 'status', 'travel_date'),
+        db.Index('idx_mileage_request_company_travel', 'company_id', 'travel_date'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     travel_date = db.Column(db.Date, nullable=False)
@@ -4115,42 +4148,14 @@ class MileageRequest(db.Model):
     @classmethod
     def get_pending_count_for_user(cls, user):
         """Restituisce il numero di richieste in attesa per l'utente"""
-        query = cls.query.filter_by(status='Pending')
-        
-        if user.all_sedi:
-            return query.count()
-        else:
-            return query.join(User, cls.user_id == User.id).filter(
-                User.sede_id == user.sede_id
-            ).count()
+        from services.mileage_summary import pending_count
+        return pending_count(user)
     
     @classmethod
     def get_monthly_summary(cls, user_id, year, month):
         """Restituisce un riassunto mensile dei rimborsi per un dipendente"""
-        from sqlalchemy import extract
-        
-        query = cls.query.filter(
-            cls.user_id == user_id,
-            extract('year', cls.travel_date) == year,
-            extract('month', cls.travel_date) == month
-        )
-        
-        # Calcola totali per stato
-        pending = query.filter_by(status='Pending').all()
-        approved = query.filter_by(status='Approved').all()
-        rejected = query.filter_by(status='Rejected').all()
-        
-        return {
-            'pending_count': len(pending),
-            'approved_count': len(approved),
-            'rejected_count': len(rejected),
-            'pending_km': sum([req.total_km for req in pending]),
-            'approved_km': sum([req.total_km for req in approved]),
-            'pending_amount': sum([req.total_amount for req in pending]),
-            'approved_amount': sum([req.total_amount for req in approved]),
-            'total_km': sum([req.total_km for req in pending + approved + rejected]),
-            'total_amount': sum([req.total_amount for req in pending + approved + rejected])
-        }
+        from services.mileage_summary import monthly_summary
+        return monthly_summary(user_id, year, month)
 
 
 # =============================================================================
@@ -4403,6 +4408,11 @@ class WorkSchedule(db.Model):
 class ACITable(db.Model):
     """Modello per le tabelle ACI (Automobile Club d'Italia) - Back office amministratore"""
     __tablename__ = 'aci_table'
+    __table_args__ = (
+        # Chiave dell'upsert set-based dell'import Excel (services/aci_import.py)
+        db.Index('uq_aci_company_tipologia_marca_modello', 'company_id', 'tipologia', 'marca', 'modello',
+                 unique=True, postgresql_nulls_not_distinct=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     tipologia = db.Column(db.String(100), nullable=False)  # Nome file Excel caricato
@@ -4683,6 +4693,20 @@ class CircleDocument(db.Model):
 class CircleCalendarEvent(db.Model):
     """Modello per eventi calendario aziendale CIRCLE"""
     __tablename__ = 'circle_calendar_event'
+    __table_args__ = (
+        # Serve la query di overlap per finestra (mese/settimana/giorno) per tenant
+        db.Index('idx_circle_event_company_range', 'company_id', 'start_datetime', 'end_datetime'),
+        # Eventi ricorrenti: filtrati per tenant e fine ricorrenza
+        db.Index('idx_circle_event_company_recurrence', 'company_id', 'recurrence_rule', 'recurrence_until'),
+    )
+    
+    # Regole di ricorrenza supportate -> etichetta
+    RECURRENCE_RULES = {
+        'daily': 'Ogni giorno',
+        'weekly': 'Ogni settimana',
+        'monthly': 'Ogni mese',
+        'yearly': 'Ogni anno',
+    }
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -4694,7 +4718,14 @@ class CircleCalendarEvent(db.Model):
     creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     is_all_day = db.Column(db.Boolean, default=False)
     color = db.Column(db.String(20), default='#0d6efd')  # Colore evento
+    
+    # Ricorrenza (None = evento singolo)
+    recurrence_rule = db.Column(db.String(20), nullable=True)  # 'daily', 'weekly', 'monthly', 'yearly'
+    recurrence_interval = db.Column(db.Integer, nullable=False, default=1)  # Ogni N periodi
+    recurrence_until = db.Column(db.DateTime, nullable=True)  # Ultima occorrenza possibile (None = senza fine)
+    
     created_at = db.Column(db.DateTime, default=italian_now)
+    updated_at = db.Column(db.DateTime, default=italian_now, onupdate=italian_now)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)  # Multi-tenant
     
     # Relationships
@@ -4702,6 +4733,66 @@ class CircleCalendarEvent(db.Model):
     
     def __repr__(self):
         return f'<CircleCalendarEvent {self.title}>'
+    
+    @property
+    def is_recurring(self):
+        return self.recurrence_rule in self.RECURRENCE_RULES
+    
+    def _nth_occurrence_start(self, n):
+        """Data/ora di inizio della n-esima occorrenza (n=0 è l'evento originale)"""
+        step = n * (self.recurrence_interval or 1)
+        if self.recurrence_rule == 'daily':
+            return self.start_datetime + timedelta(days=step)
+        if self.recurrence_rule == 'weekly':
+            return self.start_datetime + timedelta(weeks=step)
+        
+        months = step if self.recurrence_rule == 'monthly' else step * 12
+        total = self.start_datetime.month - 1 + months
+        year = self.start_datetime.year + total // 12
+        month = total % 12 + 1
+        # Giorno limitato alla lunghezza del mese (es. 31 -> 30/28)
+        next_month = date(year + (month // 12), month % 12 + 1, 1)
+        last_day = (next_month - timedelta(days=1)).day
+        return self.start_datetime.replace(year=year, month=month, day=min(self.start_datetime.day, last_day))
+    
+    def occurrences_between(self, window_start, window_end):
+        """
+        Espande l'evento nelle occorrenze che si sovrappongono alla finestra
+        [window_start, window_end). Per gli eventi ricorrenti il calcolo salta
+        direttamente alla prima occorrenza utile invece di iterare dall'origine.
+        
+        Returns:
+            list di tuple (start, end)
+        """
+        duration = self.end_datetime - self.start_datetime
+        
+        if not self.is_recurring:
+            if self.start_datetime < window_end and self.end_datetime > window_start:
+                return [(self.start_datetime, self.end_datetime)]
+            return []
+        
+        interval = self.recurrence_interval or 1
+        earliest = window_start - duration
+        if self.recurrence_rule in ('daily', 'weekly'):
+            period = timedelta(days=interval if self.recurrence_rule == 'daily' else 7 * interval)
+            n = max(0, (earliest - self.start_datetime) // period)
+        else:
+            months_per_step = interval if self.recurrence_rule == 'monthly' else 12 * interval
+            months_elapsed = (earliest.year - self.start_datetime.year) * 12 + earliest.month - self.start_datetime.month
+            n = max(0, months_elapsed // months_per_step - 1)
+        
+        occurrences = []
+        while True:
+            occ_start = self._nth_occurrence_start(n)
+            if occ_start >= window_end:
+                break
+            if self.recurrence_until and occ_start > self.recurrence_until:
+                break
+            occ_end = occ_start + duration
+            if occ_end > window_start:
+                occurrences.append((occ_start, occ_end))
+            n += 1
+        return occurrences
 
 
 class CircleComment(db.Model):
@@ -4882,6 +4973,12 @@ class ConnectionRequest(db.Model):
     responded_at = db.Column(db.DateTime, nullable=True)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)  # Multi-tenant
     
+    # Coppia non orientata normalizzata (min, max): una connessione A-B ha la stessa
+    # chiave indipendentemente da chi ha inviato la richiesta. Valorizzata dal listener
+    # before_insert/before_update.
+    user_low_id = db.Column(db.Integer, nullable=True)
+    user_high_id = db.Column(db.Integer, nullable=True)
+    
     # Relationships
     sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_connection_requests')
     recipient = db.relationship('User', foreign_keys=[recipient_id], backref='received_connection_requests')
@@ -4889,10 +4986,69 @@ class ConnectionRequest(db.Model):
     # Constraint per evitare richieste duplicate
     __table_args__ = (
         db.UniqueConstraint('sender_id', 'recipient_id', name='unique_connection_request'),
+        # Lookup puntuale della coppia e adiacenza dal lato "low"
+        db.Index('idx_connection_pair', 'user_low_id', 'user_high_id', 'status'),
+        # Adiacenza dal lato "high"
+        db.Index('idx_connection_pair_high', 'user_high_id', 'user_low_id', 'status'),
     )
     
     def __repr__(self):
         return f'<ConnectionRequest From#{self.sender_id} To#{self.recipient_id} Status:{self.status}>'
+    
+    @staticmethod
+    def pair_key(user_a_id, user_b_id):
+        """Chiave normalizzata (min, max) della coppia di utenti"""
+        return (user_a_id, user_b_id) if user_a_id <= user_b_id else (user_b_id, user_a_id)
+    
+    @classmethod
+    def pair_query(cls, user_a_id, user_b_id):
+        """Query sulle richieste tra due utenti in qualsiasi direzione (una sola seek sull'indice)"""
+        low_id, high_id = cls.pair_key(user_a_id, user_b_id)
+        return cls.query.filter(cls.user_low_id == low_id, cls.user_high_id == high_id)
+    
+    @classmethod
+    def get_statuses_for(cls, user, other_user_ids=None):
+        """
+        Stato di connessione tra `user` e molti altri utenti in una sola query.
+        
+        Args:
+            user: utente di riferimento
+            other_user_ids: id da valutare (None = tutti i vicini nel grafo)
+        
+        Returns:
+            dict {other_user_id: 'connected' | 'pending_sent' | 'pending_received'}
+            (gli utenti assenti dal dict sono in stato 'none')
+        """
+        rows = db.session.query(
+            cls.sender_id, cls.recipient_id, cls.status
+        ).filter(
+            db.or_(cls.user_low_id == user.id, cls.user_high_id == user.id),
+            cls.status.in_(['Accepted', 'Pending'])
+        )
+        if other_user_ids is not None:
+            other_user_ids = list(other_user_ids)
+            if not other_user_ids:
+                return {}
+            rows = rows.filter(
+                db.or_(cls.sender_id.in_(other_user_ids), cls.recipient_id.in_(other_user_ids))
+            )
+        
+        statuses = {}
+        for sender_id, recipient_id, status in rows:
+            other_id = recipient_id if sender_id == user.id else sender_id
+            if status == 'Accepted':
+                statuses[other_id] = 'connected'
+            elif statuses.get(other_id) != 'connected':
+                statuses[other_id] = 'pending_sent' if sender_id == user.id else 'pending_received'
+        return statuses
+
+
+@event.listens_for(ConnectionRequest, 'before_insert')
+@event.listens_for(ConnectionRequest, 'before_update')
+def _set_connection_pair_key(mapper, connection, target):
+    """Mantiene allineata la coppia normalizzata con sender/recipient"""
+    if target.sender_id is not None and target.recipient_id is not None:
+        target.user_low_id, target.user_high_id = ConnectionRequest.pair_key(target.sender_id, target.recipient_id)
 
 
 # =============================================================================
@@ -5041,14 +5197,23 @@ class Commessa(db.Model):
         return f'<Commessa {self.titolo} - {self.cliente}>'
     
     def get_ore_consumate(self):
-        """Calcola le ore consumate sulla commessa (placeholder per futura integrazione con timesheet)"""
-        # TODO: implementare calcolo ore dalle presenze/timesheet
-        return 0
+        """Ore consumate sulla commessa, dal ledger alimentato da timesheet e timbrature"""
+        if getattr(self, '_ore_consumate', None) is None:
+            self._ore_consumate = CommessaHoursLedger.hours_by_commessa([self.id])[self.id]
+        return self._ore_consumate
+    
+    @staticmethod
+    def preload_ore_consumate(commesse):
+        """Carica le ore consumate di una lista di commesse con una sola query (elenchi)"""
+        hours = CommessaHoursLedger.hours_by_commessa(c.id for c in commesse)
+        for commessa in commesse:
+            commessa._ore_consumate = hours[commessa.id]
+        return commesse
     
     def get_ore_residue(self):
         """Calcola le ore residue della commessa"""
         if self.durata_prevista_ore:
-            return self.durata_prevista_ore - self.get_ore_consumate()
+            return round(self.durata_prevista_ore - self.get_ore_consumate(), 2)
         return None
     
     def get_percentuale_completamento(self):
@@ -5058,6 +5223,16 @@ class Commessa(db.Model):
             return min(100, int((ore_consumate / self.durata_prevista_ore) * 100))
         return 0
     
+    def get_ore_summary(self):
+        """Consumate, residue e completamento in formato JSON"""
+        return {
+            'id': self.id,
+            'durata_prevista_ore': self.durata_prevista_ore,
+            'ore_consumate': self.get_ore_consumate(),
+            'ore_residue': self.get_ore_residue(),
+            'percentuale_completamento': self.get_percentuale_completamento(),
+        }
+    
     def is_scaduta(self):
         """Verifica se la commessa è scaduta"""
         return date.today() > self.data_fine and self.stato != 'chiusa'
@@ -5374,4 +5549,793 @@ class CCNLLevel(db.Model):
     company = db.relationship('Company', backref='ccnl_levels')
     
     def __repr__(self):
-        return f'<CCNLLevel {self.codice} ({self.qualification.nome})>'
\ No newline at end of file
+        return f'<CCNLLevel {self.codice} ({self.qualification.nome})>'
+
+# =============================================================================
+# FILE STORAGE MODELS
+# =============================================================================
+
+class StoredFile(db.Model):
+    """
+    Blob content-addressed condiviso tra tenant (vedi services/file_storage.py).
+    Il controllo accessi resta sul record che referenzia la chiave (CircleDocument,
+    ExpenseReport, User.profile_image); qui si tiene solo il reference count.
+    """
+    __tablename__ = 'stored_file'
+    __table_args__ = (
+        db.UniqueConstraint('sha256', 'extension', name='_stored_file_sha256_ext_uc'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    extension = db.Column(db.String(10), nullable=False, default='')
+    size_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    content_type = db.Column(db.String(100), nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=italian_now)
+    
+    def __repr__(self):
+        return f'<StoredFile {self.sha256[:12]}{self.extension} refs={self.ref_count}>'
+
+
+# =============================================================================
+# CIRCLE SEARCH INDEX MODELS
+# =============================================================================
+
+def _flatten_cv_field(value):
+    """Estrae il testo da un campo CV JSON (lista di stringhe o di dict)"""
+    if not value:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return ' '.join(_flatten_cv_field(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return ' '.join(_flatten_cv_field(v) for v in value)
+    return str(value)
+
+
+class PersonaSearchIndex(db.Model):
+    """
+    Indice di ricerca della directory Personas (una riga per utente).
+    Mantenuto dal listener su User (after_insert/after_update) e interrogato da
+    services/persona_search.py con full-text PostgreSQL (tsvector pesato) e
+    ILIKE servito dall'indice trigram creato dalla migration.
+    """
+    __tablename__ = 'persona_search_index'
+    __table_args__ = (
+        db.Index('idx_persona_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('idx_persona_search_company', 'company_id'),
+    )
+    
+    # Campi del profilo che rendono necessario aggiornare l'indice
+    INDEXED_FIELDS = (
+        'first_name', 'last_name', 'department', 'job_title', 'skills', 'languages',
+        'certifications', 'experience', 'company_id', 'active',
+    )
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id', ondelete='CASCADE'), nullable=True)
+    search_text = db.Column(db.Text, nullable=False, default='')  # Testo normalizzato (minuscolo) per ILIKE/trigram
+    search_vector = db.Column(TSVECTOR, nullable=True)
+    updated_at = db.Column(db.DateTime, default=italian_now, onupdate=italian_now)
+    
+    def __repr__(self):
+        return f'<PersonaSearchIndex user={self.user_id}>'
+    
+    @staticmethod
+    def build_document(user):
+        """
+        Sezioni pesate del documento di ricerca:
+        A = nome e cognome, B = ruolo e reparto, C = competenze e lingue,
+        D = certificazioni ed esperienze
+        """
+        return {
+            'A': f"{user.first_name or ''} {user.last_name or ''}",
+            'B': f"{user.job_title or ''} {user.department or ''}",
+            'C': f"{_flatten_cv_field(user.skills)} {_flatten_cv_field(user.languages)}",
+            'D': f"{_flatten_cv_field(user.certifications)} {_flatten_cv_field(user.experience)}",
+        }
+    
+    @classmethod
+    def upsert_statement(cls, user):
+        """INSERT ... ON CONFLICT che ricalcola la riga di indice di un utente"""
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        
+        document = cls.build_document(user)
+        search_vector = None
+        for weight, text in document.items():
+            part = db.func.setweight(db.func.to_tsvector('simple', text), weight)
+            search_vector = part if search_vector is None else search_vector.op('||')(part)
+        
+        values = {
+            'user_id': user.id,
+            'company_id': user.company_id,
+            'search_text': ' '.join(' '.join(document.values()).split()).lower(),
+            'search_vector': search_vector,
+            'updated_at': italian_now(),
+        }
+        stmt = pg_insert(cls.__table__).values(**values)
+        return stmt.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_={key: stmt.excluded[key] for key in values if key != 'user_id'},
+        )
+
+
+@event.listens_for(User, 'after_insert')
+def _index_new_persona(mapper, connection, target):
+    """Indicizza il profilo appena creato"""
+    connection.execute(PersonaSearchIndex.upsert_statement(target))
+
+
+@event.listens_for(User, 'after_update')
+def _reindex_persona(mapper, connection, target):
+    """Aggiorna l'indice solo se è cambiato un campo ricercabile"""
+    state = db.inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in PersonaSearchIndex.INDEXED_FIELDS):
+        connection.execute(PersonaSearchIndex.upsert_statement(target))
+
+
+# =============================================================================
+# BACKGROUND JOB MODELS
+# =============================================================================
+
+class BackgroundJob(db.Model):
+    """
+    Job eseguiti fuori dalla richiesta HTTP (import massivi, elaborazioni batch).
+    Lo stato è salvato su database così che qualsiasi worker gunicorn possa
+    rispondere al polling dell'avanzamento.
+    """
+    __tablename__ = 'background_job'
+    __table_args__ = (
+        db.Index('idx_background_job_company_type', 'company_id', 'job_type', 'created_at'),
+    )
+    
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    job_type = db.Column(db.String(50), nullable=False)  # es. 'aci_import'
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, completed, failed
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id', ondelete='CASCADE'), nullable=True)
+    created_at = db.Column(db.DateTime, default=italian_now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<BackgroundJob {self.job_type} {self.id[:8]} {self.status}>'
+    
+    @property
+    def progress_percent(self):
+        if not self.total:
+            return 100 if self.status == 'completed' else 0
+        return min(100, int(self.processed * 100 / self.total))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'progress': self.progress_percent,
+            'message': self.message,
+            'result': self.result,
+        }
+
+
+# =============================================================================
+# COMMESSA HOURS LEDGER MODELS
+# =============================================================================
+
+class CommessaHoursLedger(db.Model):
+    """
+    Ore lavorate per commessa, una riga per (commessa, utente, giorno).
+
+    Mantenuto in modo incrementale dall'hook after_flush più sotto: ogni volta che
+    cambiano le sessioni di un utente in un giorno (sessione timesheet salvata o
+    eliminata, timbratura di uscita registrata, timbrature corrette) il giorno viene
+    ricalcolato. Le ore consumate di una commessa sono quindi una SUM su poche righe
+    indicizzate invece della rilettura di tutte le timbrature.
+    """
+    __tablename__ = 'commessa_hours_ledger'
+    __table_args__ = (
+        db.UniqueConstraint('commessa_id', 'user_id', 'date', name='uq_commessa_hours_day'),
+        db.Index('idx_commessa_hours_user_date', 'user_id', 'date'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    commessa_id = db.Column(db.Integer, db.ForeignKey('commessa.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    hours = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=italian_now, onupdate=italian_now)
+    
+    def __repr__(self):
+        return f'<CommessaHoursLedger commessa={self.commessa_id} user={self.user_id} {self.date} {self.hours}h>'
+    
+    @staticmethod
+    def compute_day(connection, user_id, day):
+        """
+        Ore per commessa di un utente in un giorno, con la stessa precedenza della vista
+        timesheet: se esistono sessioni (AttendanceSession) valgono quelle, altrimenti
+        si ricostruiscono le sessioni dalle timbrature (commessa della clock_in,
+        pause sottratte).
+
+        Returns:
+            dict {commessa_id: ore}
+        """
+        sessions = AttendanceSession.__table__
+        rows = connection.execute(
+            db.select(sessions.c.commessa_id, db.func.sum(sessions.c.duration_hours))
+            .where(sessions.c.user_id == user_id, sessions.c.date == day)
+            .group_by(sessions.c.commessa_id)
+        ).all()
+        if rows:
+            return {commessa_id: float(hours or 0) for commessa_id, hours in rows if commessa_id is not None}
+        
+        events = AttendanceEvent.__table__
+        rows = connection.execute(
+            db.select(events.c.event_type, events.c.timestamp, events.c.commessa_id)
+            .where(events.c.user_id == user_id, events.c.date == day)
+            .order_by(events.c.timestamp)
+        ).all()
+        
+        totals = {}
+        session_start = session_commessa = break_start = None
+        break_seconds = 0
+        for event_type, timestamp, commessa_id in rows:
+            if event_type == 'clock_in':
+                session_start, session_commessa, break_seconds, break_start = timestamp, commessa_id, 0, None
+            elif event_type == 'break_start' and session_start:
+                break_start = timestamp
+            elif event_type == 'break_end' and break_start:
+                break_seconds += (timestamp - break_start).total_seconds()
+                break_start = None
+            elif event_type == 'clock_out' and session_start:
+                commessa_id = session_commessa or commessa_id
+                if commessa_id:
+                    worked = (timestamp - session_start).total_seconds() - break_seconds
+                    totals[commessa_id] = totals.get(commessa_id, 0) + max(0, worked) / 3600
+                session_start = session_commessa = break_start = None
+                break_seconds = 0
+        return totals
+    
+    @classmethod
+    def refresh_day(cls, connection, user_id, day):
+        """Riscrive le righe del ledger per (utente, giorno)"""
+        table = cls.__table__
+        totals = cls.compute_day(connection, user_id, day)
+        connection.execute(table.delete().where(table.c.user_id == user_id, table.c.date == day))
+        rows = [
+            {'commessa_id': commessa_id, 'user_id': user_id, 'date': day,
+             'hours': round(hours, 2), 'updated_at': italian_now()}
+            for commessa_id, hours in totals.items() if hours > 0
+        ]
+        if rows:
+            connection.execute(table.insert(), rows)
+    
+    @classmethod
+    def hours_by_commessa(cls, commessa_ids):
+        """Ore consumate per un insieme di commesse con una sola query aggregata"""
+        commessa_ids = list(commessa_ids)
+        if not commessa_ids:
+            return {}
+        rows = db.session.query(cls.commessa_id, db.func.sum(cls.hours)).filter(
+            cls.commessa_id.in_(commessa_ids)
+        ).group_by(cls.commessa_id).all()
+        totals = {commessa_id: round(float(hours or 0), 2) for commessa_id, hours in rows}
+        return {commessa_id: totals.get(commessa_id, 0.0) for commessa_id in commessa_ids}
+
+
+# =============================================================================
+# WEEKLY HOURS LEDGER MODELS
+# =============================================================================
+
+class WeeklyHoursLedger(db.Model):
+    """
+    Ore lavorate per utente e settimana ISO (dalle timbrature, giorni di ferie/permesso esclusi).
+
+    daily_hours contiene le ore di ogni giorno della settimana, leave_days i giorni con
+    ferie/permessi approvati o in attesa; total_hours è la somma già al netto delle
+    assenze. Le timbrature aggiornano solo il proprio giorno, le richieste di assenza
+    ricalcolano le settimane coinvolte: la validazione del limite settimanale legge una
+    riga invece di riscandire la settimana.
+    """
+    __tablename__ = 'weekly_hours_ledger'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'week_start', name='uq_weekly_hours_user_week'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    week_start = db.Column(db.Date, nullable=False)  # Lunedì della settimana ISO
+    daily_hours = db.Column(db.JSON, nullable=False, default=dict)  # {'YYYY-MM-DD': ore}
+    leave_days = db.Column(db.JSON, nullable=False, default=list)  # ['YYYY-MM-DD', ...]
+    total_hours = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=italian_now, onupdate=italian_now)
+    
+    def __repr__(self):
+        return f'<WeeklyHoursLedger user={self.user_id} {self.week_start} {self.total_hours}h>'
+    
+    @staticmethod
+    def week_start_for(day):
+        return day - timedelta(days=day.weekday())
+    
+    @staticmethod
+    def _total(daily_hours, leave_days):
+        return round(sum(h for d, h in daily_hours.items() if d not in leave_days), 4)
+    
+    @staticmethod
+    def _events_hours(connection, user_id, start, end):
+        """Ore per giorno dalle timbrature nell'intervallo (stessa regola di validate_weekly_limit)"""
+        from utils_contract_hours import calculate_daily_work_hours
+        
+        events = AttendanceEvent.__table__
+        rows = connection.execute(
+            db.select(events.c.date, events.c.event_type, events.c.timestamp)
+            .where(events.c.user_id == user_id, events.c.date >= start, events.c.date <= end)
+        ).all()
+        return {d.isoformat(): round(h, 4) for d, h in calculate_daily_work_hours(rows).items()}
+    
+    @staticmethod
+    def _leave_days(connection, user_id, week_start):
+        week_end = week_start + timedelta(days=6)
+        leaves = LeaveRequest.__table__
+        rows = connection.execute(
+            db.select(leaves.c.start_date, leaves.c.end_date).where(
+                leaves.c.user_id == user_id,
+                leaves.c.status.in_(['Approved', 'Pending']),
+                leaves.c.start_date <= week_end,
+                leaves.c.end_date >= week_start,
+            )
+        ).all()
+        days = set()
+        for start_date, end_date in rows:
+            current = max(start_date, week_start)
+            while current <= min(end_date, week_end):
+                days.add(current.isoformat())
+                current += timedelta(days=1)
+        return sorted(days)
+    
+    @classmethod
+    def refresh_week(cls, connection, user_id, week_start):
+        """Ricalcolo completo della settimana (backfill, assenze modificate, riga mancante)"""
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        
+        daily_hours = cls._events_hours(connection, user_id, week_start, week_start + timedelta(days=6))
+        leave_days = cls._leave_days(connection, user_id, week_start)
+        values = {
+            'user_id': user_id,
+            'week_start': week_start,
+            'daily_hours': daily_hours,
+            'leave_days': leave_days,
+            'total_hours': cls._total(daily_hours, leave_days),
+            'updated_at': italian_now(),
+        }
+        stmt = pg_insert(cls.__table__).values(**values)
+        connection.execute(stmt.on_conflict_do_update(
+            constraint='uq_weekly_hours_user_week',
+            set_={key: stmt.excluded[key] for key in values if key not in ('user_id', 'week_start')},
+        ))
+        return values
+    
+    @classmethod
+    def refresh_day(cls, connection, user_id, day):
+        """Aggiornamento incrementale: ricalcola solo le ore del giorno toccato"""
+        table = cls.__table__
+        week_start = cls.week_start_for(day)
+        row = connection.execute(
+            db.select(table.c.id, table.c.daily_hours, table.c.leave_days)
+            .where(table.c.user_id == user_id, table.c.week_start == week_start)
+        ).first()
+        if row is None:
+            cls.refresh_week(connection, user_id, week_start)
+            return
+        
+        daily_hours = dict(row.daily_hours or {})
+        daily_hours.pop(day.isoformat(), None)
+        daily_hours.update(cls._events_hours(connection, user_id, day, day))
+        connection.execute(table.update().where(table.c.id == row.id).values(
+            daily_hours=daily_hours,
+            total_hours=cls._total(daily_hours, set(row.leave_days or [])),
+            updated_at=italian_now(),
+        ))
+    
+    @classmethod
+    def hours_for_week(cls, user_id, target_date, exclude_date=None):
+        """
+        Ore della settimana ISO di target_date al netto delle assenze, lette da una riga.
+        exclude_date: giorno da non conteggiare (tipicamente quello in modifica).
+        La riga mancante viene calcolata e salvata al primo accesso.
+        """
+        week_start = cls.week_start_for(target_date)
+        row = cls.query.filter_by(user_id=user_id, week_start=week_start).first()
+        if row is None:
+            values = cls.refresh_week(db.session.connection(), user_id, week_start)
+            daily_hours, leave_days, total = values['daily_hours'], values['leave_days'], values['total_hours']
+        else:
+            daily_hours, leave_days, total = row.daily_hours or {}, row.leave_days or [], row.total_hours
+        
+        if exclude_date is not None:
+            key = exclude_date.isoformat()
+            if key not in leave_days:
+                total -= daily_hours.get(key, 0)
+        return total
+
+
+# =============================================================================
+# BANCA ORE LEDGER MODELS
+# =============================================================================
+
+class BancaOreMovement(db.Model):
+    """
+    Movimento della banca ore (ledger append-only, ore con segno).
+
+    I crediti (straordinario da presenze, straordinari approvati, storni) sono anche
+    "bucket" con scadenza: remaining sono le ore del credito non ancora consumate o
+    scadute, e i debiti (permessi con banca ore, rettifiche negative) consumano i
+    bucket in ordine FIFO di scadenza. L'origine è (source_type, source_id) per le
+    richieste, (source_type, work_date) per i giorni di presenza: la somma delle ore
+    per origine è ciò che è già stato registrato e le correzioni aggiungono la
+    differenza. Gestito da services/banca_ore_ledger.py.
+    """
+    __tablename__ = 'banca_ore_movement'
+    __table_args__ = (
+        db.Index('idx_banca_ore_movement_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('idx_banca_ore_movement_source', 'source_type', 'source_id', 'work_date'),
+        # Bucket aperti: consumo FIFO per utente e sweep notturno delle scadenze
+        db.Index('idx_banca_ore_movement_open', 'expires_on', 'user_id',
+                 postgresql_where=db.text('remaining > 0')),
+    )
+    
+    # Tipo movimento -> etichetta
+    KIND_LABELS = {
+        'accrual': 'Accumulo da presenze',
+        'overtime': 'Straordinario approvato',
+        'usage': 'Utilizzo permesso',
+        'refund': 'Storno utilizzo',
+        'adjustment': 'Rettifica',
+        'expiry': 'Scadenza',
+    }
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # accrual, overtime, usage, refund, adjustment, expiry
+    hours = db.Column(db.Float, nullable=False)  # Positive = credito, negative = debito
+    remaining = db.Column(db.Float, nullable=True)  # Solo crediti: ore ancora disponibili nel bucket
+    work_date = db.Column(db.Date, nullable=False)  # Giorno di riferimento (presenza, straordinario, permesso)
+    expires_on = db.Column(db.Date, nullable=True)  # Crediti: primo giorno in cui le ore sono scadute
+    source_type = db.Column(db.String(20), nullable=True)  # attendance, overtime_request, leave_request
+    source_id = db.Column(db.Integer, nullable=True)  # Id della richiesta (nessuna FK: il ledger sopravvive alla richiesta)
+    created_at = db.Column(db.DateTime, default=italian_now)
+    
+    def __repr__(self):
+        return f'<BancaOreMovement user={self.user_id} {self.kind} {self.hours}h>'
+
+
+class BancaOreBalance(db.Model):
+    """
+    Saldo banca ore per utente (una riga), riscritto dal ledger a ogni movimento e dallo
+    sweep notturno: wallet, widget e report aziendale leggono questa riga invece di
+    ricalcolare lo storico.
+    """
+    __tablename__ = 'banca_ore_balance'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    accrued_attendance = db.Column(db.Float, nullable=False, default=0)  # Da presenze (rettifiche incluse)
+    accrued_overtime = db.Column(db.Float, nullable=False, default=0)  # Da straordinari approvati
+    used = db.Column(db.Float, nullable=False, default=0)  # Permessi al netto degli storni
+    expired = db.Column(db.Float, nullable=False, default=0)
+    balance = db.Column(db.Float, nullable=False, default=0)
+    expiring_soon = db.Column(db.Float, nullable=False, default=0)  # Ore in scadenza nella finestra di preavviso
+    next_expiry = db.Column(db.Date, nullable=True)
+    computed_on = db.Column(db.Date, nullable=True)  # Giorno a cui si riferisce expiring_soon
+    updated_at = db.Column(db.DateTime, default=italian_now, onupdate=italian_now)
+    
+    def __repr__(self):
+        return f'<BancaOreBalance user={self.user_id} {self.balance}h>'
+
+
+# =============================================================================
+# OVERTIME DETECTION MODELS
+# =============================================================================
+
+class DetectedOvertime(db.Model):
+    """
+    Straordinario rilevato dalle timbrature, una riga per (utente, giorno chiuso).
+
+    Scritto dal rilevamento a lotti (services/overtime_detection.py) per tutti gli utenti
+    abilitati allo straordinario; contiene solo i giorni con straordinario o con una
+    richiesta. Widget, schermata di approvazione e ledger banca ore leggono queste righe
+    invece di ricalcolare le ore lavorate richiesta per richiesta.
+    """
+    __tablename__ = 'detected_overtime'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'date', name='uq_detected_overtime_user_date'),
+        db.Index('idx_detected_overtime_company_date', 'company_id', 'date'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True)
+    date = db.Column(db.Date, nullable=False)
+    worked_hours = db.Column(db.Float, nullable=False, default=0)
+    standard_hours = db.Column(db.Float, nullable=False, default=0)
+    overtime_hours = db.Column(db.Float, nullable=False, default=0)
+    overtime_request_id = db.Column(db.Integer, db.ForeignKey('overtime_request.id', ondelete='SET NULL'), nullable=True)
+    detected_at = db.Column(db.DateTime, default=italian_now)
+    
+    user = db.relationship('User', foreign_keys=[user_id])
+    
+    def __repr__(self):
+        return f'<DetectedOvertime user={self.user_id} {self.date} {self.overtime_hours}h>'
+
+
+# =============================================================================
+# ATTENDANCE STATUS MODELS
+# =============================================================================
+
+class AttendanceStatus(db.Model):
+    """
+    Stato corrente di timbratura per utente (una riga per utente).
+
+    Mantenuto dal percorso rapido di timbratura (services/clock_status.py) nella stessa
+    transazione dell'inserimento della timbratura, con la riga bloccata in FOR UPDATE:
+    la macchina a stati e il totale ore del giorno si leggono da qui invece di
+    riscandire le timbrature. Le scritture da altri percorsi invalidano la riga, che
+    viene ricostruita dalle timbrature del giorno al primo accesso.
+    """
+    __tablename__ = 'attendance_status'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True)
+    status_date = db.Column(db.Date, nullable=False)  # Giorno (italiano) a cui si riferisce lo stato
+    status = db.Column(db.String(10), nullable=False, default='out')  # out, in, break
+    last_event_id = db.Column(db.Integer, nullable=True)
+    last_event_type = db.Column(db.String(20), nullable=True)
+    last_event_at = db.Column(db.DateTime, nullable=True)  # UTC naive, come AttendanceEvent.timestamp
+    session_started_at = db.Column(db.DateTime, nullable=True)  # Entrata della sessione in corso
+    break_started_at = db.Column(db.DateTime, nullable=True)  # Pausa in corso
+    break_minutes = db.Column(db.Integer, nullable=False, default=0)  # Pause chiuse della sessione in corso
+    worked_minutes = db.Column(db.Integer, nullable=False, default=0)  # Sessioni chiuse del giorno
+    updated_at = db.Column(db.DateTime, default=italian_now, onupdate=italian_now)
+    
+    def __repr__(self):
+        return f'<AttendanceStatus user={self.user_id} {self.status_date} {self.status}>'
+    
+    @classmethod
+    def invalidate(cls, connection, user_days):
+        """Scarta lo stato degli utenti con timbrature modificate nel giorno dello stato o dopo"""
+        table = cls.__table__
+        for user_id, day in user_days:
+            connection.execute(table.delete().where(table.c.user_id == user_id, table.c.status_date <= day))
+
+
+# =============================================================================
+# ATTENDANCE LEDGERS MAINTENANCE
+# =============================================================================
+
+# Chiave di session.info con gli utenti il cui AttendanceStatus è aggiornato dal chiamante
+ATTENDANCE_STATUS_OWNED_KEY = 'attendance_status_owned'
+
+
+def refresh_attendance_ledgers(connection, commessa_days=(), event_days=(), leave_weeks=(),
+                               status_days=None):
+    """
+    Aggiorna i ledger derivati dalle presenze.
+
+    Args:
+        commessa_days: (utente, giorno) con sessioni/timbrature su commessa modificate
+        event_days: (utente, giorno) con timbrature modificate
+        leave_weeks: (utente, lunedì) con richieste di assenza modificate
+        status_days: (utente, giorno) il cui stato di timbratura va invalidato
+            (default: event_days)
+    """
+    AttendanceStatus.invalidate(connection, event_days if status_days is None else status_days)
+    
+    for user_id, day in commessa_days:
+        CommessaHoursLedger.refresh_day(connection, user_id, day)
+    
+    leave_weeks = set(leave_weeks)
+    for user_id, week_start in leave_weeks:
+        WeeklyHoursLedger.refresh_week(connection, user_id, week_start)
+    for user_id, day in event_days:
+        if (user_id, WeeklyHoursLedger.week_start_for(day)) not in leave_weeks:
+            WeeklyHoursLedger.refresh_day(connection, user_id, day)
+
+
+def refresh_attendance_day(user_id, day):
+    """Da chiamare dopo DELETE/UPDATE massivi sulle timbrature, che non passano dal flush"""
+    refresh_attendance_ledgers(db.session.connection(),
+                               commessa_days=[(user_id, day)], event_days=[(user_id, day)])
+
+
+def _touched_attendance_data(session):
+    """Giorni e settimane da ricalcolare dopo il flush corrente"""
+    commessa_days = set()
+    event_days = set()
+    leave_weeks = set()
+    
+    def with_history(obj, *attrs):
+        # Valori correnti e, se modificati, quelli di partenza
+        state = db.inspect(obj)
+        current = tuple(getattr(obj, attr) for attr in attrs)
+        previous = tuple((state.attrs[attr].history.deleted or [getattr(obj, attr)])[0] for attr in attrs)
+        return {current, previous}
+    
+    def add_leave(obj):
+        for user_id, start_date, end_date in with_history(obj, 'user_id', 'start_date', 'end_date'):
+            if user_id is None or start_date is None or end_date is None:
+                continue
+            week_start = WeeklyHoursLedger.week_start_for(start_date)
+            while week_start <= end_date:
+                leave_weeks.add((user_id, week_start))
+                week_start += timedelta(days=7)
+    
+    for obj in session.new:
+        if isinstance(obj, AttendanceSession):
+            commessa_days.add((obj.user_id, obj.date))
+        elif isinstance(obj, AttendanceEvent):
+            event_days.add((obj.user_id, obj.date))
+            if obj.event_type == 'clock_out':
+                # Una sessione da timbratura si chiude con l'uscita
+                commessa_days.add((obj.user_id, obj.date))
+        elif isinstance(obj, LeaveRequest):
+            add_leave(obj)
+    for obj in list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, (AttendanceSession, AttendanceEvent)):
+            days = with_history(obj, 'user_id', 'date')
+            commessa_days.update(days)
+            if isinstance(obj, AttendanceEvent):
+                event_days.update(days)
+        elif isinstance(obj, LeaveRequest):
+            add_leave(obj)
+    
+    def valid(pairs):
+        return {(user_id, day) for user_id, day in pairs if user_id is not None and day is not None}
+    
+    return valid(commessa_days), valid(event_days), leave_weeks
+
+
+@event.listens_for(db.session, 'after_flush')
+def _refresh_attendance_ledgers(session, flush_context):
+    """Aggiorna ledger ore commessa e ore settimanali per i dati toccati dal flush"""
+    commessa_days, event_days, leave_weeks = _touched_attendance_data(session)
+    if commessa_days or event_days or leave_weeks:
+        # Il percorso rapido di timbratura aggiorna da sé lo stato degli utenti che gestisce
+        owned = session.info.get(ATTENDANCE_STATUS_OWNED_KEY, ())
+        status_days = {(user_id, day) for user_id, day in event_days if user_id not in owned}
+        refresh_attendance_ledgers(session.connection(), commessa_days, event_days, leave_weeks,
+                                   status_days=status_days)
+
+
+# =============================================================================
+# HR EXPIRY CALENDAR MODELS
+# =============================================================================
+
+class HRExpiryEvent(db.Model):
+    """
+    Calendario scadenze HR precalcolato (una riga per scadenza di una scheda HR).
+
+    Documenti, formazione/visita medica e fine contratto/prova sono colonne di
+    UserHRData: il listener su UserHRData (after_insert/after_update) mantiene qui una
+    riga per ogni data valorizzata, così dashboard e digest delle scadenze leggono un
+    intervallo sull'indice (company_id, expiry_date) invece di scandire tutte le schede.
+    notified_on registra il digest che ha già segnalato la scadenza e torna NULL quando
+    la data cambia.
+    """
+    __tablename__ = 'hr_expiry_event'
+    __table_args__ = (
+        db.UniqueConstraint('hr_data_id', 'kind', name='uq_hr_expiry_event_kind'),
+        db.Index('idx_hr_expiry_event_company_date', 'company_id', 'expiry_date'),
+    )
+    
+    # Tipo scadenza -> (colonna di UserHRData, categoria, etichetta)
+    EXPIRY_FIELDS = {
+        'id_card': ('id_card_expiry', 'document', "Carta d'identità"),
+        'passport': ('passport_expiry', 'document', 'Passaporto'),
+        'driver_license': ('driver_license_expiry', 'document', 'Patente'),
+        'medical_visit': ('medical_visit_expiry', 'training', 'Visita Medica'),
+        'training_general': ('training_general_expiry', 'training', 'Form. Generale'),
+        'training_rspp': ('training_rspp_expiry', 'training', 'RSPP'),
+        'training_rls': ('training_rls_expiry', 'training', 'RLS'),
+        'training_first_aid': ('training_first_aid_expiry', 'training', 'Primo Soccorso'),
+        'training_emergency': ('training_emergency_expiry', 'training', 'Emergenza'),
+        'training_supervisor': ('training_supervisor_expiry', 'training', 'Preposto'),
+        'contract_end': ('contract_end_date', 'contract', 'Fine contratto'),
+        'probation_end': ('probation_end_date', 'contract', 'Fine periodo di prova'),
+    }
+    
+    CATEGORY_LABELS = {
+        'document': 'Documenti',
+        'training': 'Formazione e visite mediche',
+        'contract': 'Contratti',
+    }
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    hr_data_id = db.Column(db.Integer, db.ForeignKey('user_hr_data.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(30), nullable=False)  # Chiave di EXPIRY_FIELDS
+    category = db.Column(db.String(20), nullable=False)  # document, training, contract
+    label = db.Column(db.String(100), nullable=False)
+    expiry_date = db.Column(db.Date, nullable=False)
+    notified_on = db.Column(db.Date, nullable=True)  # Giorno del digest che l'ha segnalata
+    updated_at = db.Column(db.DateTime, default=italian_now, onupdate=italian_now)
+    
+    user = db.relationship('User', foreign_keys=[user_id])
+    
+    def __repr__(self):
+        return f'<HRExpiryEvent user={self.user_id} {self.kind} {self.expiry_date}>'
+    
+    @property
+    def days_left(self):
+        return (self.expiry_date - date.today()).days
+    
+    @classmethod
+    def tracked_columns(cls):
+        return [column for column, _, _ in cls.EXPIRY_FIELDS.values()]
+    
+    @classmethod
+    def sync(cls, connection, hr_data):
+        """Riallinea le scadenze di una scheda HR (upsert delle date presenti, delete delle altre)"""
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        
+        table = cls.__table__
+        now = italian_now()
+        rows = []
+        for kind, (column, category, label) in cls.EXPIRY_FIELDS.items():
+            expiry_date = getattr(hr_data, column)
+            if expiry_date is not None:
+                rows.append({
+                    'user_id': hr_data.user_id,
+                    'company_id': hr_data.company_id,
+                    'hr_data_id': hr_data.id,
+                    'kind': kind,
+                    'category': category,
+                    'label': label,
+                    'expiry_date': expiry_date,
+                    'updated_at': now,
+                })
+        
+        stale = table.delete().where(table.c.hr_data_id == hr_data.id)
+        if rows:
+            stale = stale.where(table.c.kind.notin_([row['kind'] for row in rows]))
+        connection.execute(stale)
+        
+        if rows:
+            stmt = pg_insert(table).values(rows)
+            connection.execute(stmt.on_conflict_do_update(
+                index_elements=['hr_data_id', 'kind'],
+                set_={
+                    'user_id': stmt.excluded.user_id,
+                    'company_id': stmt.excluded.company_id,
+                    'expiry_date': stmt.excluded.expiry_date,
+                    'updated_at': stmt.excluded.updated_at,
+                    # Una nuova data va segnalata di nuovo dal digest
+                    'notified_on': db.case(
+                        (table.c.expiry_date == stmt.excluded.expiry_date, table.c.notified_on),
+                        else_=None,
+                    ),
+                },
+            ))
+
+
+@event.listens_for(UserHRData, 'after_insert')
+def _index_new_hr_expiries(mapper, connection, target):
+    """Registra le scadenze della scheda HR appena creata"""
+    HRExpiryEvent.sync(connection, target)
+
+
+@event.listens_for(UserHRData, 'after_update')
+def _reindex_hr_expiries(mapper, connection, target):
+    """Riallinea le scadenze solo se è cambiata una data o il proprietario della scheda"""
+    state = db.inspect(target)
+    fields = HRExpiryEvent.tracked_columns() + ['user_id', 'company_id']
+    if any(state.attrs[field].history.has_changes() for field in fields):
+        HRExpiryEvent.sync(connection, target)
@@ -42,29 +42,21 @@ def index():
     if current_user.is_authenticated:
         # SUPERADMIN sees company dashboard
         if current_user.is_system_admin:
-            from models import Company, User
-            companies = Company.query.order_by(Company.created_at.desc()).all()
+            from services import company_overview
+            sort = request.args.get('sort', company_overview.DEFAULT_SORT)
+            if sort not in company_overview.SORT_OPTIONS:
+                sort = company_overview.DEFAULT_SORT
+            page = request.args.get('page', 1, type=int)
             
-            # Calculate statistics for each company
-            company_stats = []
-            for company in companies:
-                # Get active users count
-                active_users = company.users.filter_by(active=True).count()
-                
-                # Get company admin
-                admin = company.users.filter_by(role='Amministratore').first()
-                
-                stats = {
-                    'company': company,
-                    'active_users': active_users,
-                    'total_users': company.users.count(),
-                    'admin': admin,
-                    'sedi_count': company.sedi.count(),
-                    'usage_percent': round((active_users / company.max_licenses * 100) if company.max_licenses > 0 else 0)
-                }
-                company_stats.append(stats)
+            # Statistiche per azienda con query aggregate (ordinate e paginate nel database)
+            pagination, company_stats = company_overview.company_stats_page(sort=sort, page=page)
             
-            return render_template('dashboard_superadmin.html', company_stats=company_stats)
+            return render_template('dashboard_superadmin.html',
+                                   company_stats=company_stats,
+                                   pagination=pagination,
+                                   totals=company_overview.overview_totals(),
+                                   sort=sort,
+                                   sort_options=company_overview.SORT_OPTIONS)
         
         # Regular users see home page with FLOW and CIRCLE buttons
         return redirect(url_for('home'))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark dell'importazione Excel ACI (services/aci_import.py).
+
+Genera un file Excel sintetico (default 50.000 righe, con intestazioni di categoria
+e duplicati come nei file ACI reali) e misura le fasi di lettura, validazione e,
+se indicato un tenant, l'upsert su database. Senza --keep i dati importati vengono
+rimossi al termine.
+
+Usage:
+    python scripts/benchmark_aci_import.py
+    python scripts/benchmark_aci_import.py --rows 100000
+    python scripts/benchmark_aci_import.py --company-id 1 [--keep]
+"""
+
+import sys
+import os
+import argparse
+import random
+import tempfile
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from app import app, db
+from models import ACITable
+from services.aci_import import read_aci_excel, prepare_frame, upsert_frame
+
+BRANDS = ['ALFA ROMEO', 'AUDI', 'BMW', 'CITROEN', 'DACIA', 'FIAT', 'FORD', 'JEEP',
+          'KIA', 'MERCEDES', 'OPEL', 'PEUGEOT', 'RENAULT', 'SKODA', 'TOYOTA', 'VOLKSWAGEN']
+
+
+def build_workbook(path, rows):
+    """Crea un Excel con colonne MARCA, MODELLO, COSTO KM e alcune colonne extra ignorate"""
+    data = []
+    for i in range(rows):
+        if i % 500 == 0:
+            # Riga categoria (modello vuoto) come nei file ACI
+            data.append(('BENZINA', None, None, None))
+            continue
+        brand = random.choice(BRANDS)
+        data.append((brand, f'Modello {i % (rows // 2 or 1)} {brand[:3]}',
+                     round(random.uniform(0.25, 1.2), 4), 'extra'))
+    pd.DataFrame(data, columns=['MARCA', 'MODELLO', 'COSTO KM', 'NOTE']).to_excel(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark importazione Excel ACI')
+    parser.add_argument('--rows', type=int, default=50000, help='Righe del file sintetico')
+    parser.add_argument('--company-id', type=int, help='Esegue anche l\'upsert per questo tenant')
+    parser.add_argument('--keep', action='store_true', help='Non rimuove i record importati')
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp:
+        path = tmp.name
+
+    try:
+        start = time.perf_counter()
+        build_workbook(path, args.rows)
+        print(f"Generazione file ({args.rows} righe): {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        df = read_aci_excel(path)
+        print(f"Lettura Excel: {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        frame, skipped = prepare_frame(df)
+        print(f"Validazione/de-duplica: {time.perf_counter() - start:.3f}s "
+              f"({len(frame)} righe valide, {skipped} scartate)")
+
+        if args.company_id:
+            tipologia = f'BENCHMARK {time.strftime("%Y%m%d%H%M%S")}'
+            with app.app_context():
+                start = time.perf_counter()
+                upserted = upsert_frame(frame, tipologia, args.company_id)
+                elapsed = time.perf_counter() - start
+                print(f"Upsert database: {elapsed:.2f}s ({upserted} record, {upserted / elapsed:.0f} righe/s)")
+
+                # Secondo passaggio: tutte le righe vanno in ON CONFLICT DO UPDATE
+                start = time.perf_counter()
+                upsert_frame(frame, tipologia, args.company_id)
+                print(f"Re-import (solo aggiornamenti): {time.perf_counter() - start:.2f}s")
+
+                if not args.keep:
+                    ACITable.query.filter_by(company_id=args.company_id, tipologia=tipologia).delete()
+                    db.session.commit()
+                    print(f"Record di benchmark rimossi (tipologia '{tipologia}')")
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark dell'avvio di un worker (equivalente a 'gunicorn main:app').
+
+Misura in un processo pulito il costo di import di app.py (con o senza create_all + seed),
+di routes.py, di ogni blueprint e di cli_commands, contando le query eseguite al database
+in ciascuna fase. Riporta quali librerie pesanti risultano caricate a fine avvio: con gli
+import lazy nelle route non dovrebbero comparire.
+
+Con --compare esegue due avvii in sottoprocessi separati (INIT_DB_ON_STARTUP True/False)
+e ne confronta i totali.
+
+Usage:
+    python scripts/benchmark_startup.py
+    python scripts/benchmark_startup.py --skip-init-db
+    python scripts/benchmark_startup.py --top 10
+    python scripts/benchmark_startup.py --compare
+"""
+
+import sys
+import os
+import argparse
+import json
+import subprocess
+import time
+from importlib import import_module
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HEAVY_MODULES = ('pandas', 'numpy', 'reportlab', 'openpyxl', 'PIL', 'qrcode', 'googlemaps')
+
+query_count = 0
+
+
+def _count_query(*args, **kwargs):
+    global query_count
+    query_count += 1
+
+
+def measure(label, func):
+    """Esegue func e ne misura durata, query al database e moduli importati"""
+    modules_before = len(sys.modules)
+    queries_before = query_count
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    return {
+        'label': label,
+        'seconds': elapsed,
+        'queries': query_count - queries_before,
+        'modules': len(sys.modules) - modules_before,
+    }
+
+
+def run_boot():
+    """Avvio completo nel processo corrente, fase per fase"""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    event.listen(Engine, 'before_cursor_execute', _count_query)
+
+    phases = [measure('app (config, estensioni, init db)', lambda: import_module('app'))]
+    phases.append(measure('routes', lambda: import_module('routes')))
+
+    from app import app
+    from blueprints import BLUEPRINTS
+    for module_name, attribute in BLUEPRINTS:
+        def load(module_name=module_name, attribute=attribute):
+            app.register_blueprint(getattr(import_module(module_name), attribute))
+        phases.append(measure(module_name, load))
+
+    phases.append(measure('cli_commands', lambda: import_module('cli_commands')))
+
+    return {
+        'init_db': app.config['INIT_DB_ON_STARTUP'],
+        'phases': phases,
+        'total_seconds': sum(p['seconds'] for p in phases),
+        'total_queries': sum(p['queries'] for p in phases),
+        'heavy_loaded': [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+
+def print_report(result, top=None):
+    mode = 'con' if result['init_db'] else 'senza'
+    print(f"\n=== Avvio worker ({mode} create_all + seed) ===\n")
+    print(f"{'Fase':<42} {'ms':>9} {'query':>6} {'moduli':>7}")
+    print('-' * 67)
+
+    phases = result['phases']
+    if top:
+        phases = sorted(phases, key=lambda p: p['seconds'], reverse=True)[:top]
+    for phase in phases:
+        print(f"{phase['label']:<42} {phase['seconds'] * 1000:>9.1f} {phase['queries']:>6} {phase['modules']:>7}")
+
+    print('-' * 67)
+    print(f"{'Totale':<42} {result['total_seconds'] * 1000:>9.1f} {result['total_queries']:>6}")
+    heavy = ', '.join(result['heavy_loaded']) or 'nessuna'
+    print(f"\nLibrerie pesanti caricate all'avvio: {heavy}")
+
+
+def run_subprocess(init_db):
+    """Avvio in un interprete pulito: nessun modulo già in cache"""
+    env = dict(os.environ, INIT_DB_ON_STARTUP='True' if init_db else 'False')
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--json'],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark avvio worker')
+    parser.add_argument('--skip-init-db', action='store_true',
+                        help='Avvio con INIT_DB_ON_STARTUP=False')
+    parser.add_argument('--top', type=int, default=None,
+                        help='Mostra solo le N fasi più lente')
+    parser.add_argument('--compare', action='store_true',
+                        help='Confronta avvio con e senza create_all + seed')
+    parser.add_argument('--json', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        with_init = run_subprocess(init_db=True)
+        without_init = run_subprocess(init_db=False)
+        print_report(with_init, args.top)
+        print_report(without_init, args.top)
+        saved = (with_init['total_seconds'] - without_init['total_seconds']) * 1000
+        print(f"\nRisparmio per worker: {saved:.1f} ms, "
+              f"{with_init['total_queries'] - without_init['total_queries']} query")
+        return
+
+    if args.skip_init_db:
+        os.environ['INIT_DB_ON_STARTUP'] = 'False'
+
+    result = run_boot()
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print_report(result, args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Load test del percorso rapido di timbratura (services/clock_status.py).
+
+Simula un cambio turno: gli utenti attivi di un'azienda timbrano tutti insieme da
+più thread concorrenti (come i worker gunicorn dietro al kiosk QR). Per ogni utente
+esegue ciò che fa una richiesta kiosk: timbratura + lettura di stato e ore per la
+pagina di conferma. Con --legacy misura anche il percorso precedente
+(get_user_status + insert + get_daily_events + get_daily_work_hours).
+
+Le timbrature create vengono rimosse al termine, salvo --keep.
+
+Usage:
+    python scripts/loadtest_qr_clock.py --company-id 1
+    python scripts/loadtest_qr_clock.py --company-id 1 --users 200 --workers 16 --double-tap
+    python scripts/loadtest_qr_clock.py --company-id 1 --legacy
+"""
+
+import sys
+import os
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db
+from models import AttendanceEvent, User, refresh_attendance_day
+from services import clock_status
+
+ITALY_TZ = ZoneInfo('Europe/Rome')
+
+created_ids = []
+created_lock = threading.Lock()
+
+
+def fast_path(user_id, event_type):
+    user = db.session.get(User, user_id)
+    result = clock_status.clock(user, event_type, notes='loadtest')
+    clock_status.get_status(user)
+    return result.success, result.event_id
+
+
+def legacy_path(user_id, event_type):
+    user = db.session.get(User, user_id)
+    status, _ = AttendanceEvent.get_user_status(user_id)
+    if status != ('out' if event_type == 'clock_in' else 'in'):
+        return False, None
+    now = datetime.now(ITALY_TZ)
+    event = AttendanceEvent(user_id=user_id, date=now.date(), event_type=event_type, timestamp=now,
+                            notes='loadtest', company_id=user.company_id)
+    db.session.add(event)
+    db.session.commit()
+    AttendanceEvent.get_daily_events(user_id)
+    AttendanceEvent.get_daily_work_hours(user_id)
+    return True, event.id
+
+
+def run(label, target, user_ids, event_type, workers, double_tap):
+    """Esegue target per ogni utente (due volte con --double-tap) e stampa le latenze"""
+    latencies = []
+    outcomes = []
+
+    def one(user_id):
+        with app.app_context():
+            start = time.perf_counter()
+            try:
+                success, event_id = target(user_id, event_type)
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                db.session.remove()
+            latencies.append(elapsed)
+            outcomes.append(success)
+            if event_id:
+                with created_lock:
+                    created_ids.append((user_id, event_id))
+
+    jobs = [uid for uid in user_ids for _ in range(2 if double_tap else 1)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(one, jobs))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+    print(f"{label} {event_type}: {len(jobs)} richieste in {wall:.2f}s "
+          f"({len(jobs) / wall:.0f} req/s) - p50 {statistics.median(latencies) * 1000:.1f}ms, "
+          f"p95 {p95 * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms - "
+          f"{sum(outcomes)} registrate, {len(outcomes) - sum(outcomes)} rifiutate")
+
+
+def cleanup():
+    """Rimuove le timbrature del test e riallinea ledger e stato degli utenti"""
+    with app.app_context():
+        ids = [event_id for _, event_id in created_ids]
+        if ids:
+            events = AttendanceEvent.__table__
+            days = db.session.execute(
+                db.select(events.c.user_id, events.c.date).where(events.c.id.in_(ids)).distinct()
+            ).all()
+            db.session.execute(events.delete().where(events.c.id.in_(ids)))
+            for user_id, day in days:
+                refresh_attendance_day(user_id, day)
+            db.session.commit()
+        print(f"Timbrature di test rimosse: {len(ids)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test timbrature QR (cambio turno)')
+    parser.add_argument('--company-id', type=int, required=True, help='Azienda degli utenti simulati')
+    parser.add_argument('--users', type=int, default=200, help='Numero massimo di utenti')
+    parser.add_argument('--workers', type=int, default=16, help='Richieste concorrenti')
+    parser.add_argument('--double-tap', action='store_true',
+                        help='Ogni utente timbra due volte: la seconda deve essere rifiutata')
+    parser.add_argument('--legacy', action='store_true', help='Misura anche il percorso precedente')
+    parser.add_argument('--keep', action='store_true', help='Non rimuove le timbrature create')
+    args = parser.parse_args()
+
+    with app.app_context():
+        user_ids = [row.id for row in db.session.execute(
+            db.select(User.id).where(User.company_id == args.company_id, User.active.is_(True))
+            .order_by(User.id).limit(args.users)
+        )]
+    if not user_ids:
+        print("Nessun utente attivo per l'azienda indicata")
+        return
+
+    print(f"Utenti simulati: {len(user_ids)}, concorrenza: {args.workers}")
+    try:
+        # Cambio turno: il turno uscente esce, quello entrante entra
+        run('Fast path', fast_path, user_ids, 'clock_in', args.workers, args.double_tap)
+        run('Fast path', fast_path, user_ids, 'clock_out', args.workers, args.double_tap)
+        if args.legacy:
+            run('Legacy   ', legacy_path, user_ids, 'clock_in', args.workers, args.double_tap)
+            run('Legacy   ', legacy_path, user_ids, 'clock_out', args.workers, args.double_tap)
+    finally:
+        if not args.keep:
+            cleanup()
+
+
+if __name__ == '__main__':
+    main()
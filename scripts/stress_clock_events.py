@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Stress test multi-processo delle timbrature (services/clock_status.py).
+
+Avvia più processi (come i worker gunicorn), ognuno con il proprio pool di connessioni,
+che inviano in parallelo timbrature per lo stesso gruppo di utenti: azioni casuali,
+doppi tap simultanei sulla stessa azione e ritrasmissioni con la stessa chiave di
+idempotenza. Al termine verifica sul database che:
+- nessuna chiave di idempotenza sia associata a più di una timbratura
+- la sequenza delle timbrature di ogni utente rispetti la macchina a stati
+  (niente doppie entrate, uscite senza entrata, pause fuori sessione)
+
+Le timbrature create vengono rimosse al termine, salvo --keep. Exit code 1 se la
+verifica fallisce.
+
+Usage:
+    python scripts/stress_clock_events.py --company-id 1
+    python scripts/stress_clock_events.py --company-id 1 --processes 8 --users 20 --requests 500
+"""
+
+import sys
+import os
+import argparse
+import multiprocessing
+import random
+import time
+import uuid
+from collections import Counter
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MARKER = 'stress-clock-events'
+ACTIONS = ['clock_in', 'break_start', 'break_end', 'clock_out']
+
+
+def worker(seed, user_ids, requests, shared_keys, results):
+    """Processo worker: invia `requests` timbrature casuali per gli utenti indicati"""
+    from app import app, db
+    from models import User
+    from services import clock_status
+
+    rng = random.Random(seed)
+    accepted = rejected = replayed = errors = 0
+    with app.app_context():
+        # Ogni processo deve aprire connessioni proprie
+        db.engine.dispose()
+        for _ in range(requests):
+            user_id = rng.choice(user_ids)
+            action = rng.choice(ACTIONS)
+            # Una parte delle richieste riusa una chiave condivisa tra i processi (retry/doppio tap)
+            if rng.random() < 0.3 and shared_keys:
+                key = rng.choice(shared_keys)
+                user_id, action = key[0], key[1]
+                idempotency_key = key[2]
+            else:
+                idempotency_key = uuid.uuid4().hex
+            try:
+                user = db.session.get(User, user_id)
+                result = clock_status.clock(user, action, notes=MARKER, idempotency_key=idempotency_key)
+                if result.replayed:
+                    replayed += 1
+                elif result.success:
+                    accepted += 1
+                else:
+                    rejected += 1
+            except Exception:
+                db.session.rollback()
+                errors += 1
+            finally:
+                db.session.remove()
+    results.put((accepted, rejected, replayed, errors))
+
+
+def verify(user_ids):
+    """Controlla chiavi duplicate e sequenze non valide; restituisce la lista dei problemi"""
+    from app import db
+    from models import AttendanceEvent
+    from services.clock_status import NEXT_STATUS, VALID_TRANSITIONS
+
+    # Tutte le timbrature dei giorni del test: lo stato parte anche da quelle preesistenti
+    test_days = db.select(AttendanceEvent.date).where(
+        AttendanceEvent.user_id.in_(user_ids), AttendanceEvent.notes == MARKER
+    )
+    events = db.session.execute(
+        db.select(AttendanceEvent.user_id, AttendanceEvent.date, AttendanceEvent.event_type,
+                  AttendanceEvent.timestamp, AttendanceEvent.idempotency_key)
+        .where(AttendanceEvent.user_id.in_(user_ids), AttendanceEvent.date.in_(test_days))
+        .order_by(AttendanceEvent.user_id, AttendanceEvent.date, AttendanceEvent.timestamp,
+                  AttendanceEvent.id)
+    ).all()
+
+    problems = []
+    key_counts = Counter((e.user_id, e.idempotency_key) for e in events if e.idempotency_key)
+    problems.extend(f"Chiave duplicata {key} per utente {user_id} ({count} timbrature)"
+                    for (user_id, key), count in key_counts.items() if count > 1)
+
+    status = {}
+    for e in events:
+        current = status.get((e.user_id, e.date), 'out')
+        if current not in VALID_TRANSITIONS[e.event_type]:
+            problems.append(f"Utente {e.user_id} {e.date}: {e.event_type} con stato '{current}' "
+                            f"alle {e.timestamp}")
+        status[(e.user_id, e.date)] = NEXT_STATUS[e.event_type]
+    return events, problems
+
+
+def cleanup(user_ids):
+    from app import db
+    from models import AttendanceEvent, refresh_attendance_day
+
+    events = AttendanceEvent.__table__
+    days = db.session.execute(
+        db.select(events.c.user_id, events.c.date)
+        .where(events.c.user_id.in_(user_ids), events.c.notes == MARKER).distinct()
+    ).all()
+    db.session.execute(events.delete().where(events.c.user_id.in_(user_ids), events.c.notes == MARKER))
+    for user_id, day in days:
+        refresh_attendance_day(user_id, day)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress test multi-processo delle timbrature')
+    parser.add_argument('--company-id', type=int, required=True, help='Azienda degli utenti simulati')
+    parser.add_argument('--users', type=int, default=10, help='Utenti (pochi = più contesa)')
+    parser.add_argument('--processes', type=int, default=8, help='Processi concorrenti')
+    parser.add_argument('--requests', type=int, default=300, help='Richieste per processo')
+    parser.add_argument('--keep', action='store_true', help='Non rimuove le timbrature create')
+    args = parser.parse_args()
+
+    from app import app, db
+    from models import User
+
+    with app.app_context():
+        user_ids = [row.id for row in db.session.execute(
+            db.select(User.id).where(User.company_id == args.company_id, User.active.is_(True))
+            .order_by(User.id).limit(args.users)
+        )]
+        db.engine.dispose()
+    if not user_ids:
+        print("Nessun utente attivo per l'azienda indicata")
+        return 0
+
+    # Chiavi condivise: le stesse richieste ritrasmesse da processi diversi
+    shared_keys = [(user_id, action, uuid.uuid4().hex)
+                   for user_id in user_ids for action in ACTIONS]
+
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(seed, user_ids, args.requests, shared_keys, results))
+                 for seed in range(args.processes)]
+
+    print(f"Processi: {args.processes}, utenti: {len(user_ids)}, richieste totali: "
+          f"{args.processes * args.requests}")
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    accepted, rejected, replayed, errors = (sum(column) for column in zip(*totals))
+    print(f"Completato in {elapsed:.2f}s ({args.processes * args.requests / elapsed:.0f} req/s): "
+          f"{accepted} registrate, {rejected} rifiutate, {replayed} ripetute, {errors} errori")
+
+    problems = []
+    with app.app_context():
+        try:
+            events, problems = verify(user_ids)
+            print(f"Timbrature verificate: {len(events)}")
+            for problem in problems[:20]:
+                print(f"  ❌ {problem}")
+            if problems:
+                print(f"❌ {len(problems)} anomalie trovate")
+            else:
+                print("✅ Nessun duplicato e nessuna sequenza non valida")
+        finally:
+            if not args.keep:
+                cleanup(user_ids)
+                print("Timbrature di test rimosse")
+
+    return 1 if problems or errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
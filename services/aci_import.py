@@ -0,0 +1,147 @@
+"""
+ACI Import Service - Importazione massiva delle tabelle ACI (rimborsi chilometrici)
+
+Pipeline:
+1. Lettura Excel (solo colonne A, B, C: MARCA, MODELLO, COSTO KM)
+2. Validazione e pulizia vettoriale sull'intero DataFrame (niente iterrows)
+3. De-duplica per (marca, modello) mantenendo l'ultima occorrenza del file
+4. Upsert set-based a blocchi: INSERT ... ON CONFLICT (company_id, tipologia, marca, modello)
+   DO UPDATE SET costo_km, una sola istruzione per blocco
+5. Avanzamento riportato su background_job per il polling dalla pagina di upload
+"""
+
+import logging
+import os
+from typing import Callable, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from models import ACITable, italian_now
+
+logger = logging.getLogger(__name__)
+
+# Righe per singola istruzione INSERT ... ON CONFLICT
+UPSERT_CHUNK_SIZE = 5000
+
+
+def read_aci_excel(path: str) -> pd.DataFrame:
+    """Legge solo le colonne A, B, C del file Excel"""
+    return pd.read_excel(path, engine='openpyxl',
+                         usecols=[0, 1, 2],  # Leggi solo colonne A, B, C
+                         dtype={0: 'str', 1: 'str'},
+                         na_filter=True)
+
+
+def prepare_frame(df: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+    """
+    Validazione e de-duplica vettoriali.
+
+    Returns:
+        (DataFrame con colonne marca/modello/costo_km, numero di righe scartate)
+    """
+    if len(df.columns) < 3:
+        raise ValueError(
+            f"Il file Excel deve avere almeno 3 colonne (MARCA, MODELLO, COSTO KM). Trovate {len(df.columns)} colonne."
+        )
+
+    frame = df.iloc[:, :3].copy()
+    frame.columns = ['marca', 'modello', 'costo_km']
+
+    frame['marca'] = frame['marca'].astype('string').str.strip()
+    frame['modello'] = frame['modello'].astype('string').str.strip()
+    # Valori non numerici (intestazioni, righe categoria) diventano NaN e vengono scartati
+    frame['costo_km'] = pd.to_numeric(frame['costo_km'], errors='coerce')
+
+    valid = (
+        frame['marca'].notna() & (frame['marca'] != '') &
+        frame['modello'].notna() & (frame['modello'] != '') & (frame['modello'].str.lower() != 'nan') &
+        frame['costo_km'].notna()
+    ).fillna(False).astype(bool)
+    total_rows = len(frame)
+    frame = frame[valid].copy()
+
+    # Limiti di lunghezza delle colonne del modello
+    frame['marca'] = frame['marca'].str.slice(0, 100)
+    frame['modello'] = frame['modello'].str.slice(0, 200)
+
+    # ON CONFLICT non può toccare due volte la stessa riga nella stessa istruzione
+    frame = frame.drop_duplicates(subset=['marca', 'modello'], keep='last')
+
+    skipped = total_rows - len(frame)
+    return frame.reset_index(drop=True), skipped
+
+
+def upsert_frame(frame: pd.DataFrame, tipologia: str, company_id: Optional[int],
+                 chunk_size: int = UPSERT_CHUNK_SIZE,
+                 progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    Applica il DataFrame con INSERT ... ON CONFLICT DO UPDATE a blocchi.
+
+    Args:
+        frame: output di prepare_frame
+        tipologia: nome tipologia (tabella ACI)
+        company_id: tenant
+        progress: callback(processati, totale) chiamata dopo ogni blocco
+
+    Returns:
+        int: righe inserite o aggiornate
+    """
+    table = ACITable.__table__
+    now = italian_now()
+    total = len(frame)
+    processed = 0
+
+    records = frame.assign(
+        tipologia=tipologia,
+        company_id=company_id,
+        created_at=now,
+        updated_at=now,
+    ).to_dict('records')
+
+    for start in range(0, total, chunk_size):
+        chunk = records[start:start + chunk_size]
+        stmt = pg_insert(table).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['company_id', 'tipologia', 'marca', 'modello'],
+            set_={
+                'costo_km': stmt.excluded.costo_km,
+                'updated_at': stmt.excluded.updated_at,
+            },
+        )
+        db.session.execute(stmt)
+        db.session.commit()
+
+        processed += len(chunk)
+        if progress:
+            progress(processed, total)
+
+    return processed
+
+
+def run_import_job(job_id: str, path: str, tipologia: str, company_id: Optional[int]) -> dict:
+    """Target del background job: legge, valida e importa il file, poi lo elimina"""
+    from services.background_jobs import update_progress
+
+    try:
+        update_progress(job_id, 0, message='Lettura file Excel...')
+        df = read_aci_excel(path)
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+    frame, skipped = prepare_frame(df)
+    update_progress(job_id, 0, total=len(frame), message='Importazione record...')
+
+    imported = upsert_frame(
+        frame, tipologia, company_id,
+        progress=lambda done, total: update_progress(job_id, done, total=total)
+    )
+
+    # Le select marca/modello del form rimborsi devono vedere i nuovi dati
+    from services.aci_lookup import invalidate
+    invalidate(company_id)
+
+    logger.info(f"Import ACI '{tipologia}' (company {company_id}): {imported} record, {skipped} righe scartate")
+    return {'imported': imported, 'skipped': skipped, 'tipologia': tipologia}
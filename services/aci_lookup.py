@@ -0,0 +1,127 @@
+"""
+ACI Lookup Service - Indice in memoria per le select marca/modello delle tabelle ACI
+
+Le API /aci/api/marcas e /aci/api/modelos vengono chiamate a ogni cambio di select
+nel form rimborsi: invece di interrogare l'intera tabella del tenant a ogni richiesta,
+ogni worker costruisce alla prima richiesta un indice per tenant
+
+    tipologia -> marca -> [(id, modello, costo_km), ...]
+
+con una sola query, e lo serve da memoria finché non viene invalidato.
+
+Invalidazione:
+- esplicita da create/edit/delete/bulk_delete/upload (nel worker che ha fatto la modifica)
+- per età (ACI_LOOKUP_TTL secondi), che limita la staleness negli altri worker gunicorn
+
+L'ETag è calcolato sul contenuto dell'indice, quindi è identico tra worker diversi e
+le richieste ripetute del browser ricevono 304.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from flask import current_app
+
+from app import db
+from models import ACITable
+
+logger = logging.getLogger(__name__)
+
+# Età massima di un indice in secondi (default se non configurato)
+DEFAULT_TTL = 300
+
+
+class _TenantIndex:
+    """Indice immutabile di un tenant (company_id None = tutti i tenant, per i system admin)"""
+
+    __slots__ = ('tree', 'all_marcas', 'etag', 'built_at')
+
+    def __init__(self, tree: Dict[str, Dict[str, List[dict]]]):
+        self.tree = tree
+        self.all_marcas = sorted({marca for marcas in tree.values() for marca in marcas})
+        self.etag = hashlib.md5(
+            json.dumps(tree, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        ).hexdigest()
+        self.built_at = time.monotonic()
+
+    def marcas(self, tipologia: Optional[str] = None) -> List[str]:
+        if not tipologia:
+            return self.all_marcas
+        return sorted(self.tree.get(tipologia, {}))
+
+    def modelos(self, tipologia: Optional[str] = None, marca: Optional[str] = None) -> List[dict]:
+        if tipologia:
+            by_marca = [self.tree.get(tipologia, {})]
+        else:
+            by_marca = list(self.tree.values())
+
+        result = []
+        for marcas in by_marca:
+            if marca:
+                result.extend(marcas.get(marca, []))
+            else:
+                for items in marcas.values():
+                    result.extend(items)
+
+        # Le singole liste sono già ordinate per modello: riordina solo se ne ha unite più d'una
+        if not (tipologia and marca):
+            result.sort(key=lambda item: item['modello'])
+        return result
+
+
+_indexes: Dict[Optional[int], _TenantIndex] = {}
+_lock = threading.Lock()
+
+
+def _build(company_id: Optional[int]) -> _TenantIndex:
+    """Una sola query sulle colonne necessarie, ordinata per modello"""
+    query = db.session.query(
+        ACITable.id, ACITable.tipologia, ACITable.marca, ACITable.modello, ACITable.costo_km
+    )
+    if company_id is not None:
+        query = query.filter(ACITable.company_id == company_id)
+
+    tree: Dict[str, Dict[str, List[dict]]] = {}
+    rows = query.order_by(ACITable.modello, ACITable.id).all()
+    for row in rows:
+        tree.setdefault(row.tipologia, {}).setdefault(row.marca, []).append({
+            'id': row.id,
+            'modello': row.modello,
+            'costo_km': float(row.costo_km) if row.costo_km else 0.0,
+        })
+
+    logger.debug(f"Indice ACI costruito per company {company_id}: {len(rows)} record")
+    return _TenantIndex(tree)
+
+
+def get_index(company_id: Optional[int]) -> _TenantIndex:
+    """Restituisce l'indice del tenant, costruendolo se assente o scaduto"""
+    ttl = current_app.config.get('ACI_LOOKUP_TTL', DEFAULT_TTL)
+    index = _indexes.get(company_id)
+    if index is not None and time.monotonic() - index.built_at < ttl:
+        return index
+
+    with _lock:
+        # Un'altra richiesta potrebbe averlo costruito nel frattempo
+        index = _indexes.get(company_id)
+        if index is None or time.monotonic() - index.built_at >= ttl:
+            index = _build(company_id)
+            _indexes[company_id] = index
+    return index
+
+
+def invalidate(company_id: Optional[int] = None) -> None:
+    """
+    Scarta l'indice del tenant modificato e quello globale dei system admin.
+    company_id None (modifica fatta da system admin) scarta tutti gli indici.
+    """
+    with _lock:
+        if company_id is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(company_id, None)
+            _indexes.pop(None, None)
@@ -0,0 +1,100 @@
+"""
+Background Jobs Service - Esecuzione di elaborazioni lunghe fuori dalla richiesta HTTP
+
+Il job gira in un thread del worker con un proprio app context; stato e avanzamento
+sono salvati sulla tabella background_job, quindi il polling può essere servito da
+qualsiasi worker gunicorn.
+"""
+
+import logging
+import threading
+import uuid
+from typing import Callable, Optional
+
+from flask import current_app
+
+from app import db
+from models import BackgroundJob, italian_now
+
+logger = logging.getLogger(__name__)
+
+
+def create_job(job_type: str, company_id: Optional[int] = None, created_by: Optional[int] = None,
+               total: int = 0, message: Optional[str] = None) -> BackgroundJob:
+    """Registra un nuovo job in stato 'pending'"""
+    job = BackgroundJob(
+        id=uuid.uuid4().hex,
+        job_type=job_type,
+        company_id=company_id,
+        created_by=created_by,
+        total=total,
+        message=message,
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def update_progress(job_id: str, processed: int, total: Optional[int] = None,
+                    message: Optional[str] = None) -> None:
+    """Aggiorna l'avanzamento con un UPDATE diretto (non tocca gli oggetti in sessione)"""
+    values = {'processed': processed}
+    if total is not None:
+        values['total'] = total
+    if message is not None:
+        values['message'] = message
+    db.session.execute(
+        BackgroundJob.__table__.update().where(BackgroundJob.__table__.c.id == job_id).values(**values)
+    )
+    db.session.commit()
+
+
+def _finish(job_id: str, status: str, message: Optional[str] = None, result=None) -> None:
+    values = {'status': status, 'finished_at': italian_now()}
+    if message is not None:
+        values['message'] = message
+    if result is not None:
+        values['result'] = result
+    db.session.execute(
+        BackgroundJob.__table__.update().where(BackgroundJob.__table__.c.id == job_id).values(**values)
+    )
+    db.session.commit()
+
+
+def run_in_background(job: BackgroundJob, target: Callable, *args, **kwargs) -> None:
+    """
+    Avvia `target(job_id, *args, **kwargs)` in un thread daemon.
+    Il valore restituito da target (dict serializzabile) diventa job.result.
+    """
+    app = current_app._get_current_object()
+    job_id = job.id
+
+    def _runner():
+        with app.app_context():
+            try:
+                db.session.execute(
+                    BackgroundJob.__table__.update()
+                    .where(BackgroundJob.__table__.c.id == job_id)
+                    .values(status='running', started_at=italian_now())
+                )
+                db.session.commit()
+
+                result = target(job_id, *args, **kwargs)
+                _finish(job_id, 'completed', result=result)
+            except Exception as e:
+                db.session.rollback()
+                logger.exception(f"Job {job_id} fallito")
+                _finish(job_id, 'failed', message=str(e))
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=_runner, name=f"job-{job.job_type}-{job_id[:8]}", daemon=True)
+    thread.start()
+
+
+def get_job(job_id: str, company_id: Optional[int] = None) -> Optional[BackgroundJob]:
+    """Recupera un job verificando l'appartenenza al tenant"""
+    query = BackgroundJob.query.filter_by(id=job_id)
+    if company_id is not None:
+        query = query.filter_by(company_id=company_id)
+    return query.first()
@@ -0,0 +1,514 @@
+"""
+Banca Ore Ledger Service - Movimenti, scadenze FIFO e saldi della banca ore
+
+Ogni variazione della banca ore è un movimento append-only (banca_ore_movement):
+- accrual: straordinario rilevato dalle presenze (services/overtime_detection.py),
+  accreditato quando il giorno si chiude (close_day, un passaggio per tutti gli utenti)
+- overtime: richiesta di straordinario approvata
+- usage / refund: permesso approvato con use_banca_ore e suo storno
+- adjustment: differenza registrata quando una giornata o una richiesta cambiano
+- expiry: ore scadute, registrate dallo sweep notturno
+
+I crediti sono bucket con scadenza (giorno + banca_ore_periodo_mesi) consumati dai
+debiti in ordine FIFO di scadenza. Ogni scrittura riscrive con un solo INSERT ... SELECT
+la riga di banca_ore_balance degli utenti toccati: wallet, widget e report aziendale
+leggono quella riga invece di ricalcolare dodici mesi di timbrature.
+
+Richieste di straordinario e di permesso sono registrate dall'hook after_flush in fondo
+al modulo, qualunque sia il percorso che le approva o le elimina.
+"""
+
+import logging
+from calendar import monthrange
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from flask import current_app
+from sqlalchemy import and_, event, func, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import joinedload
+
+from app import db
+from models import (BancaOreBalance, BancaOreMovement, DetectedOvertime, LeaveRequest,
+                    OvertimeRequest, User, italian_now)
+from services import overtime_detection
+
+logger = logging.getLogger(__name__)
+
+BANCA_ORE_TYPE = 'Banca Ore'
+DEFAULT_PERIOD_MONTHS = 12
+DEFAULT_LIMIT_HOURS = 40.0
+
+SOURCE_ATTENDANCE = 'attendance'
+SOURCE_OVERTIME = 'overtime_request'
+SOURCE_LEAVE = 'leave_request'
+
+_movements = BancaOreMovement.__table__
+_balances = BancaOreBalance.__table__
+
+
+def _warning_days() -> int:
+    return current_app.config.get('BANCA_ORE_EXPIRY_WARNING_DAYS', 30)
+
+
+def _add_months(day: date, months: int) -> date:
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(day.day, monthrange(year, month)[1]))
+
+
+def _banca_ore_users(company_id: Optional[int] = None):
+    """Select degli utenti attivi con straordinario in banca ore"""
+    users = User.__table__
+    query = select(users.c.id).where(
+        users.c.active.is_(True),
+        users.c.overtime_enabled.is_(True),
+        users.c.overtime_type == BANCA_ORE_TYPE,
+    )
+    if company_id is not None:
+        query = query.where(users.c.company_id == company_id)
+    return query
+
+
+def _user_rows(connection, user_ids) -> Dict[int, object]:
+    users = User.__table__
+    rows = connection.execute(
+        select(users.c.id, users.c.overtime_enabled, users.c.overtime_type,
+               users.c.part_time_percentage, users.c.banca_ore_periodo_mesi)
+        .where(users.c.id.in_(user_ids))
+    ).all()
+    return {row.id: row for row in rows}
+
+
+# =============================================================================
+# SCRITTURA MOVIMENTI
+# =============================================================================
+
+def _credit(connection, user, kind, hours, work_date, expires_on, source_type=None, source_id=None):
+    connection.execute(_movements.insert().values(
+        user_id=user.id, kind=kind, hours=hours, remaining=hours, work_date=work_date,
+        expires_on=expires_on, source_type=source_type, source_id=source_id, created_at=italian_now(),
+    ))
+
+
+def _debit(connection, user, kind, hours, work_date, today, source_type=None, source_id=None):
+    """Consuma i bucket aperti in ordine di scadenza e registra il debito"""
+    buckets = connection.execute(
+        select(_movements.c.id, _movements.c.remaining, _movements.c.expires_on)
+        .where(_movements.c.user_id == user.id, _movements.c.remaining > 0, _movements.c.expires_on > today)
+        .order_by(_movements.c.expires_on, _movements.c.id)
+        .with_for_update()
+    ).all()
+
+    left = hours
+    last_expiry = None
+    for bucket in buckets:
+        if left <= 0:
+            break
+        taken = min(left, bucket.remaining)
+        connection.execute(_movements.update().where(_movements.c.id == bucket.id).values(
+            remaining=round(bucket.remaining - taken, 4)
+        ))
+        left = round(left - taken, 4)
+        last_expiry = bucket.expires_on
+    if left > 0:
+        logger.warning(f"Banca ore utente {user.id}: debito di {hours}h scoperto per {left}h")
+
+    # expires_on del debito = scadenza dell'ultimo bucket consumato (usata dagli storni)
+    connection.execute(_movements.insert().values(
+        user_id=user.id, kind=kind, hours=-hours, remaining=None, work_date=work_date,
+        expires_on=last_expiry, source_type=source_type, source_id=source_id, created_at=italian_now(),
+    ))
+
+
+def _apply(connection, user, source_type, delta, work_date, first, today, source_id=None):
+    """Registra la differenza `delta` (ore con segno) per un'origine"""
+    period = int(user.banca_ore_periodo_mesi or DEFAULT_PERIOD_MONTHS)
+
+    if source_type == SOURCE_LEAVE:
+        if delta < 0:
+            _debit(connection, user, 'usage', -delta, work_date, today, source_type, source_id)
+            return
+        # Lo storno riapre le ore con la scadenza dei bucket consumati dal permesso
+        expires_on = connection.execute(
+            select(func.max(_movements.c.expires_on)).where(
+                _movements.c.source_type == SOURCE_LEAVE, _movements.c.source_id == source_id,
+                _movements.c.kind == 'usage',
+            )
+        ).scalar() or _add_months(today, period)
+        _credit(connection, user, 'refund', delta, work_date, expires_on, source_type, source_id)
+        return
+
+    if delta > 0:
+        if first:
+            kind = 'accrual' if source_type == SOURCE_ATTENDANCE else 'overtime'
+        else:
+            kind = 'adjustment'
+        _credit(connection, user, kind, delta, work_date, _add_months(work_date, period), source_type, source_id)
+    else:
+        _debit(connection, user, 'adjustment', -delta, work_date, today, source_type, source_id)
+
+
+def _settle(connection, user, source_type, target, work_date, today, source_id=None) -> bool:
+    """Porta a `target` le ore registrate per un'origine; True se è stato scritto un movimento"""
+    where = [_movements.c.user_id == user.id, _movements.c.source_type == source_type]
+    if source_id is not None:
+        where.append(_movements.c.source_id == source_id)
+    else:
+        where.append(_movements.c.work_date == work_date)
+    count, recorded = connection.execute(
+        select(func.count(), func.coalesce(func.sum(_movements.c.hours), 0)).where(*where)
+    ).one()
+
+    delta = round(target - float(recorded), 2)
+    if abs(delta) < 0.01:
+        return False
+    _apply(connection, user, source_type, delta, work_date, count == 0, today, source_id)
+    return True
+
+
+def refresh_balances(connection, user_ids=None, today: Optional[date] = None):
+    """
+    Riscrive banca_ore_balance per gli utenti indicati (lista o select di id; None = tutti)
+    con un solo INSERT ... SELECT raggruppato sul ledger.
+    """
+    today = today or italian_now().date()
+    horizon = today + timedelta(days=_warning_days())
+    hours = _movements.c.hours
+    open_bucket = and_(_movements.c.remaining > 0, _movements.c.expires_on > today)
+
+    query = select(
+        _movements.c.user_id,
+        func.coalesce(func.sum(hours).filter(_movements.c.source_type == SOURCE_ATTENDANCE), 0),
+        func.coalesce(func.sum(hours).filter(_movements.c.source_type == SOURCE_OVERTIME), 0),
+        func.coalesce(-func.sum(hours).filter(_movements.c.source_type == SOURCE_LEAVE), 0),
+        func.coalesce(-func.sum(hours).filter(_movements.c.kind == 'expiry'), 0),
+        func.coalesce(func.sum(hours), 0),
+        func.coalesce(func.sum(_movements.c.remaining).filter(open_bucket, _movements.c.expires_on <= horizon), 0),
+        func.min(_movements.c.expires_on).filter(open_bucket),
+        literal(today, db.Date),
+        literal(italian_now(), db.DateTime),
+    ).group_by(_movements.c.user_id)
+    if user_ids is not None:
+        query = query.where(_movements.c.user_id.in_(user_ids))
+
+    columns = ['user_id', 'accrued_attendance', 'accrued_overtime', 'used', 'expired', 'balance',
+               'expiring_soon', 'next_expiry', 'computed_on', 'updated_at']
+    stmt = pg_insert(_balances).from_select(columns, query)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={column: stmt.excluded[column] for column in columns if column != 'user_id'},
+    ))
+
+
+# =============================================================================
+# CHIUSURA GIORNI, SCADENZE, BACKFILL
+# =============================================================================
+
+def close_day(day: date, company_id: Optional[int] = None, today: Optional[date] = None) -> int:
+    """
+    Accredita (o rettifica) lo straordinario da presenze di un giorno chiuso per tutti gli
+    utenti banca ore: utenti, straordinario rilevato (detected_overtime) e ore già
+    registrate sono letti con una query ciascuno. Il rilevamento del giorno deve essere
+    già stato eseguito (close_days lo esegue).
+
+    Returns:
+        int: utenti con un movimento registrato
+    """
+    today = today or italian_now().date()
+    connection = db.session.connection()
+    user_ids = _banca_ore_users(company_id)
+
+    users = _user_rows(connection, user_ids)
+    if not users:
+        return 0
+
+    # Con una richiesta di straordinario per il giorno vale solo quella (registrata all'approvazione)
+    detected = DetectedOvertime.__table__
+    overtime = {
+        row.user_id: 0.0 if row.overtime_request_id else row.overtime_hours
+        for row in connection.execute(
+            select(detected.c.user_id, detected.c.overtime_hours, detected.c.overtime_request_id)
+            .where(detected.c.date == day, detected.c.user_id.in_(user_ids))
+        )
+    }
+
+    recorded = dict(connection.execute(
+        select(_movements.c.user_id, func.sum(_movements.c.hours))
+        .where(_movements.c.source_type == SOURCE_ATTENDANCE, _movements.c.work_date == day,
+               _movements.c.user_id.in_(user_ids))
+        .group_by(_movements.c.user_id)
+    ).all())
+
+    changed = []
+    for user_id, user in users.items():
+        delta = round(overtime.get(user_id, 0.0) - float(recorded.get(user_id) or 0), 2)
+        if abs(delta) >= 0.01:
+            _apply(connection, user, SOURCE_ATTENDANCE, delta, day, user_id not in recorded, today)
+            changed.append(user_id)
+
+    if changed:
+        refresh_balances(connection, list(changed), today)
+    return len(changed)
+
+
+def sweep_expired(today: Optional[date] = None, company_id: Optional[int] = None) -> int:
+    """
+    Registra come scadute le ore residue dei bucket con scadenza raggiunta e ricalcola i
+    saldi (anche la finestra delle ore in scadenza si sposta ogni giorno).
+
+    Returns:
+        int: bucket scaduti
+    """
+    today = today or italian_now().date()
+    connection = db.session.connection()
+    tenant_users = None
+    if company_id is not None:
+        tenant_users = select(User.__table__.c.id).where(User.__table__.c.company_id == company_id)
+
+    query = select(_movements.c.id, _movements.c.user_id, _movements.c.remaining, _movements.c.expires_on).where(
+        _movements.c.remaining > 0, _movements.c.expires_on <= today
+    )
+    if tenant_users is not None:
+        query = query.where(_movements.c.user_id.in_(tenant_users))
+    buckets = connection.execute(query.with_for_update()).all()
+
+    if buckets:
+        now = italian_now()
+        connection.execute(_movements.insert(), [
+            {'user_id': bucket.user_id, 'kind': 'expiry', 'hours': -bucket.remaining, 'remaining': None,
+             'work_date': bucket.expires_on, 'expires_on': None, 'source_type': None, 'source_id': None,
+             'created_at': now}
+            for bucket in buckets
+        ])
+        connection.execute(_movements.update().where(
+            _movements.c.id.in_([bucket.id for bucket in buckets])
+        ).values(remaining=0))
+
+    refresh_balances(connection, tenant_users, today)
+    db.session.commit()
+    return len(buckets)
+
+
+def close_days(start: date, end: date, company_id: Optional[int] = None) -> int:
+    """Rileva lo straordinario e chiude i giorni da start a end inclusi, un commit per giorno"""
+    today = italian_now().date()
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(end, _add_months(chunk_start, 1) - timedelta(days=1))
+        overtime_detection.run_detection(chunk_start, chunk_end, company_id)
+        chunk_start = chunk_end + timedelta(days=1)
+
+    changed = 0
+    day = start
+    while day <= end:
+        changed += close_day(day, company_id, today)
+        db.session.commit()
+        day += timedelta(days=1)
+    return changed
+
+
+def run_nightly(company_id: Optional[int] = None) -> dict:
+    """
+    Job notturno: chiude gli ultimi BANCA_ORE_CLOSE_LOOKBACK_DAYS giorni (le correzioni
+    alle timbrature diventano rettifiche) e registra le scadenze.
+    """
+    today = italian_now().date()
+    lookback = current_app.config.get('BANCA_ORE_CLOSE_LOOKBACK_DAYS', 7)
+    changed = close_days(today - timedelta(days=lookback), today - timedelta(days=1), company_id)
+    expired = sweep_expired(today, company_id)
+    return {'days': lookback, 'movements': changed, 'expired': expired}
+
+
+def rebuild_ledger(company_id: Optional[int] = None, months: int = DEFAULT_PERIOD_MONTHS) -> dict:
+    """
+    Popolamento iniziale: chiude gli ultimi `months` mesi, registra straordinari approvati e
+    permessi con banca ore del periodo e applica le scadenze. Idempotente: le origini già
+    registrate non cambiano.
+    """
+    today = italian_now().date()
+    start = _add_months(today, -months)
+    accrued = close_days(start, today - timedelta(days=1), company_id)
+
+    connection = db.session.connection()
+    user_ids = _banca_ore_users(company_id)
+    users = _user_rows(connection, user_ids)
+
+    requests = OvertimeRequest.query.filter(
+        OvertimeRequest.status == 'Approved',
+        OvertimeRequest.overtime_date >= start,
+        OvertimeRequest.employee_id.in_(user_ids),
+    ).order_by(OvertimeRequest.overtime_date).all()
+    for overtime in requests:
+        _settle(connection, users[overtime.employee_id], SOURCE_OVERTIME, overtime.duration_hours,
+                overtime.overtime_date, today, overtime.id)
+
+    leaves = LeaveRequest.query.filter(
+        LeaveRequest.status == 'Approved',
+        LeaveRequest.use_banca_ore.is_(True),
+        LeaveRequest.banca_ore_hours_used.isnot(None),
+        LeaveRequest.start_date >= start,
+        LeaveRequest.user_id.in_(user_ids),
+    ).order_by(LeaveRequest.start_date).all()
+    for leave in leaves:
+        _settle(connection, users[leave.user_id], SOURCE_LEAVE, -leave.banca_ore_hours_used,
+                leave.start_date, today, leave.id)
+
+    refresh_balances(connection, user_ids, today)
+    db.session.commit()
+    expired = sweep_expired(today, company_id)
+    return {'movements': accrued + len(requests) + len(leaves), 'expired': expired}
+
+
+# =============================================================================
+# LETTURA
+# =============================================================================
+
+def _wallet(user, row) -> dict:
+    limite_max = float(user.banca_ore_limite_max or DEFAULT_LIMIT_HOURS)
+    periodo_mesi = int(user.banca_ore_periodo_mesi or DEFAULT_PERIOD_MONTHS)
+    ore_presenze = row.accrued_attendance if row else 0.0
+    ore_straordinari = row.accrued_overtime if row else 0.0
+    ore_saldo = max(0.0, row.balance) if row else 0.0
+
+    percentuale_utilizzo = (ore_saldo / limite_max * 100) if limite_max > 0 else 0
+    percentuale_utilizzo = min(100, max(0, percentuale_utilizzo))
+    if percentuale_utilizzo < 50:
+        color_class = 'bg-success'
+    elif percentuale_utilizzo < 80:
+        color_class = 'bg-warning'
+    else:
+        color_class = 'bg-danger'
+
+    return {
+        'ore_accumulate': round(ore_presenze + ore_straordinari, 2),
+        'ore_utilizzate': round(row.used, 2) if row else 0.0,
+        'ore_scadute': round(row.expired, 2) if row else 0.0,
+        'ore_saldo': round(ore_saldo, 2),
+        'ore_in_scadenza_30gg': round(row.expiring_soon, 2) if row else 0.0,
+        'prossima_scadenza': row.next_expiry if row and row.expiring_soon > 0 else None,
+        'limite_max': limite_max,
+        'periodo_mesi': periodo_mesi,
+        'percentuale_utilizzo': round(percentuale_utilizzo, 1),
+        'color_class': color_class,
+        'dettaglio': {
+            'ore_da_presenze': round(ore_presenze, 2),
+            'ore_da_straordinari': round(ore_straordinari, 2),
+        },
+    }
+
+
+def wallet(user) -> dict:
+    """Wallet banca ore dell'utente, letto dalla riga di saldo (una lettura per chiave primaria)"""
+    return _wallet(user, db.session.get(BancaOreBalance, user.id))
+
+
+def history(user_id: int, limit: int = 50) -> List[dict]:
+    """Ultimi movimenti con il saldo progressivo dopo ciascuno (finestra calcolata nel database)"""
+    running = func.sum(BancaOreMovement.hours).over(
+        partition_by=BancaOreMovement.user_id,
+        order_by=(BancaOreMovement.created_at, BancaOreMovement.id),
+    )
+    rows = db.session.query(BancaOreMovement, running.label('saldo_dopo')).filter(
+        BancaOreMovement.user_id == user_id
+    ).order_by(BancaOreMovement.created_at.desc(), BancaOreMovement.id.desc()).limit(limit).all()
+
+    movimenti = []
+    for movement, saldo_dopo in rows:
+        if movement.kind == 'expiry':
+            tipo = 'scadenza'
+        else:
+            tipo = 'accumulo' if movement.hours > 0 else 'utilizzo'
+        movimenti.append({
+            'data': movement.work_date,
+            'tipo': tipo,
+            'descrizione': BancaOreMovement.KIND_LABELS.get(movement.kind, movement.kind),
+            'ore': movement.hours,
+            'saldo_dopo': float(saldo_dopo or 0),
+        })
+    return movimenti
+
+
+def company_report(users_query) -> dict:
+    """
+    Wallet di tutti i dipendenti banca ore di una query utenti (già filtrata per azienda e
+    sede) con una sola query in join con i saldi.
+
+    Returns:
+        dict: rows (lista di (utente, wallet)) e totals
+    """
+    rows = users_query.filter(
+        User.active.is_(True),
+        User.overtime_enabled.is_(True),
+        User.overtime_type == BANCA_ORE_TYPE,
+    ).outerjoin(BancaOreBalance, BancaOreBalance.user_id == User.id).add_entity(BancaOreBalance).options(
+        joinedload(User.sede_obj)
+    ).order_by(User.last_name, User.first_name).all()
+
+    report = [(user, _wallet(user, balance)) for user, balance in rows]
+    totals = {key: round(sum(w[key] for _, w in report), 2)
+              for key in ('ore_accumulate', 'ore_utilizzate', 'ore_scadute', 'ore_saldo', 'ore_in_scadenza_30gg')}
+    return {'rows': report, 'totals': totals}
+
+
+# =============================================================================
+# HOOK DI SESSIONE
+# =============================================================================
+
+def _leave_target(leave) -> float:
+    if leave.status == 'Approved' and leave.use_banca_ore and leave.banca_ore_hours_used:
+        return -float(leave.banca_ore_hours_used)
+    return 0.0
+
+
+def _changed(obj, attrs: Iterable[str]) -> bool:
+    state = db.inspect(obj)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _record_requests(session, flush_context):
+    """Registra nel ledger approvazioni, modifiche ed eliminazioni di straordinari e permessi"""
+    pending = []  # (user_id, source_type, target, work_date, source_id)
+
+    for obj in session.new:
+        if isinstance(obj, LeaveRequest) and _leave_target(obj):
+            pending.append((obj.user_id, SOURCE_LEAVE, _leave_target(obj), obj.start_date, obj.id))
+        elif isinstance(obj, OvertimeRequest) and obj.status == 'Approved':
+            pending.append((obj.employee_id, SOURCE_OVERTIME, None, obj.overtime_date, obj))
+    for obj in session.dirty:
+        if isinstance(obj, LeaveRequest) and _changed(
+            obj, ('status', 'use_banca_ore', 'banca_ore_hours_used', 'start_date')
+        ):
+            pending.append((obj.user_id, SOURCE_LEAVE, _leave_target(obj), obj.start_date, obj.id))
+        elif isinstance(obj, OvertimeRequest) and _changed(
+            obj, ('status', 'overtime_date', 'start_time', 'end_time')
+        ):
+            pending.append((obj.employee_id, SOURCE_OVERTIME, None, obj.overtime_date, obj))
+    for obj in session.deleted:
+        if isinstance(obj, LeaveRequest):
+            pending.append((obj.user_id, SOURCE_LEAVE, 0.0, obj.start_date, obj.id))
+        elif isinstance(obj, OvertimeRequest):
+            pending.append((obj.employee_id, SOURCE_OVERTIME, 0.0, obj.overtime_date, obj.id))
+
+    if not pending:
+        return
+
+    connection = session.connection()
+    users = _user_rows(connection, list({user_id for user_id, *_ in pending}))
+    today = italian_now().date()
+    changed = set()
+    for user_id, source_type, target, work_date, source in pending:
+        user = users.get(user_id)
+        if user is None:
+            continue
+        if isinstance(source, OvertimeRequest):
+            # Solo gli straordinari approvati di utenti in banca ore entrano nel ledger
+            enabled = user.overtime_enabled and user.overtime_type == BANCA_ORE_TYPE
+            target = source.duration_hours if enabled and source.status == 'Approved' else 0.0
+            source = source.id
+        if _settle(connection, user, source_type, target, work_date, today, source):
+            changed.add(user_id)
+
+    if changed:
+        refresh_balances(connection, list(changed), today)
@@ -0,0 +1,244 @@
+"""
+Calendar Feed Service - Feed FullCalendar di ferie/permessi e turni
+
+Ogni tipo di evento è letto con una sola query che unisce l'utente (e la tipologia di
+assenza) e seleziona solo le colonne serializzate: nessun caricamento per riga. La
+finestra usa il predicato di sovrapposizione
+
+    start_date <= fine finestra AND end_date >= inizio finestra
+
+servito dall'indice (company_id, end_date, start_date) creato dalla migration; i turni
+usano (company_id, date). Il filtro per sede è una condizione sulla join con User.
+
+La risposta JSON serializzata viene tenuta in memoria per (tenant, vista, sede o utente,
+finestra, tipi di evento):
+- invalidazione guidata dalle scritture: ogni commit che aggiunge, modifica o elimina
+  ferie/permessi o turni via ORM scarta le risposte del tenant (hook di sessione sotto);
+  le delete/update massive lo segnalano con mark_touched
+- per età (CALENDAR_FEED_TTL secondi), che limita la staleness negli altri worker
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import event
+
+try:
+    import orjson
+except ImportError:  # Serializzazione con json della standard library
+    orjson = None
+
+from app import db
+from models import LeaveRequest, LeaveType, Shift, User
+
+logger = logging.getLogger(__name__)
+
+# Età massima di una risposta in secondi e numero massimo di risposte per worker (default)
+DEFAULT_TTL = 60
+MAX_ENTRIES = 512
+
+EVENT_TYPES = ('leaves', 'shifts')
+
+LEAVE_COLORS = {
+    'pending': '#ffc107',
+    'rejected': '#dc3545',
+    'cancelled': '#6c757d',
+}
+LEAVE_DEFAULT_COLOR = '#28a745'
+SHIFT_COLOR = '#007bff'
+
+
+def _dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+# =============================================================================
+# QUERY E SERIALIZZAZIONE
+# =============================================================================
+
+def _leave_events(company_id: int, start: Optional[date], end: Optional[date],
+                  user_id: Optional[int], sede_id: Optional[int]) -> List[dict]:
+    query = db.session.query(
+        LeaveRequest.id, LeaveRequest.start_date, LeaveRequest.end_date, LeaveRequest.status,
+        LeaveRequest.reason, LeaveRequest.start_time, LeaveRequest.end_time,
+        LeaveRequest.leave_type, LeaveType.name.label('leave_type_name'),
+        User.first_name, User.last_name,
+    ).join(User, User.id == LeaveRequest.user_id).outerjoin(
+        LeaveType, LeaveType.id == LeaveRequest.leave_type_id
+    ).filter(LeaveRequest.company_id == company_id)
+
+    if user_id is not None:
+        query = query.filter(LeaveRequest.user_id == user_id)
+    if sede_id is not None:
+        query = query.filter(User.sede_id == sede_id)
+    if start and end:
+        query = query.filter(LeaveRequest.start_date <= end, LeaveRequest.end_date >= start)
+
+    events = []
+    for row in query.all():
+        status = (row.status or '').lower()
+        color = LEAVE_COLORS.get(status, LEAVE_DEFAULT_COLOR)
+        user_name = f"{row.first_name} {row.last_name}"
+        leave_type = row.leave_type_name or row.leave_type or ''
+
+        title = user_name
+        if leave_type:
+            title += f" - {leave_type}"
+        if status == 'pending':
+            title = f"⏳ {title}"
+        elif status == 'approved':
+            title = f"✓ {title}"
+
+        events.append({
+            'id': f"leave-{row.id}",
+            'title': title,
+            'start': row.start_date.isoformat(),
+            'end': (row.end_date + timedelta(days=1)).isoformat(),
+            'backgroundColor': color,
+            'borderColor': color,
+            'extendedProps': {
+                'type': 'leave',
+                'status': status,
+                'user': user_name,
+                'leave_type': leave_type,
+                'reason': row.reason or '',
+                'duration_type': 'partial' if row.start_time is not None and row.end_time is not None else 'full_day',
+                'leave_id': row.id,
+            },
+        })
+    return events
+
+
+def _shift_events(company_id: int, start: Optional[date], end: Optional[date],
+                  user_id: Optional[int], sede_id: Optional[int]) -> List[dict]:
+    query = db.session.query(
+        Shift.id, Shift.date, Shift.start_time, Shift.end_time, Shift.shift_type,
+        User.first_name, User.last_name,
+    ).join(User, User.id == Shift.user_id).filter(Shift.company_id == company_id)
+
+    if user_id is not None:
+        query = query.filter(Shift.user_id == user_id)
+    if sede_id is not None:
+        query = query.filter(User.sede_id == sede_id)
+    if start and end:
+        query = query.filter(Shift.date >= start, Shift.date <= end)
+
+    events = []
+    for row in query.all():
+        start_datetime = datetime.combine(row.date, row.start_time or datetime.min.time())
+        end_datetime = datetime.combine(row.date, row.end_time or datetime.max.time())
+        user_name = f"{row.first_name} {row.last_name}"
+
+        title = f"🔵 {user_name}"
+        if row.shift_type:
+            title += f" - {row.shift_type}"
+
+        events.append({
+            'id': f"shift-{row.id}",
+            'title': title,
+            'start': start_datetime.isoformat(),
+            'end': end_datetime.isoformat(),
+            'backgroundColor': SHIFT_COLOR,
+            'borderColor': SHIFT_COLOR,
+            'extendedProps': {
+                'type': 'shift',
+                'user': user_name,
+                'shift_type': row.shift_type or '',
+                'shift_id': row.id,
+            },
+        })
+    return events
+
+
+# =============================================================================
+# CACHE
+# =============================================================================
+
+_responses: 'OrderedDict[tuple, Tuple[float, bytes]]' = OrderedDict()
+_lock = threading.Lock()
+
+
+def build_feed(company_id: int, start: Optional[date], end: Optional[date],
+               event_types: Iterable[str] = EVENT_TYPES, user_id: Optional[int] = None,
+               sede_id: Optional[int] = None) -> bytes:
+    """
+    JSON FullCalendar della finestra, dalla cache se presente.
+
+    Args:
+        user_id: solo gli eventi di questo utente (vista "my")
+        sede_id: solo gli utenti di questa sede (vista "all")
+    """
+    types = tuple(sorted(set(event_types) & set(EVENT_TYPES)))
+    key = (company_id, user_id, sede_id, start, end, types)
+    ttl = current_app.config.get('CALENDAR_FEED_TTL', DEFAULT_TTL)
+
+    cached = _responses.get(key)
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+
+    events = []
+    if 'leaves' in types:
+        events.extend(_leave_events(company_id, start, end, user_id, sede_id))
+    if 'shifts' in types:
+        events.extend(_shift_events(company_id, start, end, user_id, sede_id))
+    body = _dumps(events)
+
+    with _lock:
+        _responses[key] = (time.monotonic(), body)
+        _responses.move_to_end(key)
+        while len(_responses) > MAX_ENTRIES:
+            _responses.popitem(last=False)
+    return body
+
+
+def invalidate(company_id: Optional[int] = None) -> None:
+    """Scarta le risposte del tenant (None = tutte)"""
+    with _lock:
+        if company_id is None:
+            _responses.clear()
+        else:
+            for key in [key for key in _responses if key[0] == company_id]:
+                del _responses[key]
+
+
+# =============================================================================
+# INVALIDAZIONE GUIDATA DALLE SCRITTURE
+# =============================================================================
+
+# Chiave di session.info con i tenant da invalidare al commit
+_TOUCHED_KEY = 'calendar_feed_touched'
+
+
+def mark_touched(company_id: Optional[int], session=None) -> None:
+    """Invalida il tenant al prossimo commit (per le scritture massive che non passano dal flush)"""
+    session = session or db.session
+    session.info.setdefault(_TOUCHED_KEY, set()).add(company_id)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_touched_tenants(session, flush_context):
+    touched = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (LeaveRequest, Shift)):
+            if touched is None:
+                touched = session.info.setdefault(_TOUCHED_KEY, set())
+            touched.add(obj.company_id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_touched_tenants(session):
+    for company_id in session.info.pop(_TOUCHED_KEY, ()):
+        invalidate(company_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_touched_tenants(session):
+    session.info.pop(_TOUCHED_KEY, None)
@@ -0,0 +1,280 @@
+"""
+Clock Status Service - Percorso rapido per le timbrature (QR kiosk, API quick action)
+
+Una timbratura dal percorso rapido costa una transazione breve:
+1. SELECT ... FOR UPDATE della riga attendance_status dell'utente (serializza i doppi tap)
+2. verifica della transizione sulla macchina a stati della riga
+3. INSERT della timbratura e UPDATE della riga con il nuovo stato e le ore del giorno
+4. COMMIT
+
+Stato e ore lavorate oggi vengono poi letti dalla stessa riga, senza riscandire le
+timbrature. La riga viene ricostruita dalle timbrature del giorno quando manca, quando
+si riferisce a un giorno precedente o dopo essere stata invalidata da scritture fatte
+da altri percorsi (timesheet manuale, correzioni admin).
+
+Idempotenza: il client può inviare una chiave per richiesta (header Idempotency-Key o
+campo idempotency_key). Con la riga di stato bloccata, una chiave già usata restituisce
+la timbratura registrata la prima volta invece di crearne un'altra; l'indice unico
+(user_id, idempotency_key) su attendance_event fa da ultima difesa.
+
+Le ore seguono la regola di AttendanceEvent.get_daily_work_hours: per ogni sessione
+minuti arrotondati di (uscita - entrata) meno i minuti arrotondati di ogni pausa.
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from models import ATTENDANCE_STATUS_OWNED_KEY, AttendanceEvent, AttendanceStatus, italian_now
+
+ITALY_TZ = ZoneInfo('Europe/Rome')
+
+# Stati da cui è ammessa ciascuna timbratura (come AttendanceEvent.can_perform_action)
+VALID_TRANSITIONS = {
+    'clock_in': ('out',),
+    'clock_out': ('in', 'break'),
+    'break_start': ('in',),
+    'break_end': ('break',),
+}
+
+NEXT_STATUS = {
+    'clock_in': 'in',
+    'clock_out': 'out',
+    'break_start': 'break',
+    'break_end': 'in',
+}
+
+# Lunghezza massima della colonna AttendanceEvent.idempotency_key
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+STATE_FIELDS = ('status_date', 'status', 'last_event_id', 'last_event_type', 'last_event_at',
+                'session_started_at', 'break_started_at', 'break_minutes', 'worked_minutes')
+
+
+@dataclass
+class ClockResult:
+    """Esito di una timbratura dal percorso rapido"""
+    success: bool
+    status: str
+    today_hours: float
+    event_id: Optional[int] = None
+    timestamp: Optional[datetime] = None  # Orario italiano della timbratura
+    replayed: bool = False  # Richiesta ripetuta: timbratura già registrata con la stessa chiave
+
+
+def idempotency_key_from(request) -> Optional[str]:
+    """Chiave di idempotenza della richiesta (header, JSON o form), None se assente o non valida"""
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        payload = request.get_json(silent=True) if request.is_json else request.form
+        key = (payload or {}).get('idempotency_key')
+    if not isinstance(key, str):
+        return None
+    key = key.strip()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return None
+    return key
+
+
+def _utc_naive(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _to_italian(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc).astimezone(ITALY_TZ)
+
+
+def _minutes(start: datetime, end: datetime) -> int:
+    return round((end - start).total_seconds() / 60)
+
+
+def empty_state(day: date) -> dict:
+    return {
+        'status_date': day,
+        'status': 'out',
+        'last_event_id': None,
+        'last_event_type': None,
+        'last_event_at': None,
+        'session_started_at': None,
+        'break_started_at': None,
+        'break_minutes': 0,
+        'worked_minutes': 0,
+    }
+
+
+def apply_event(state: dict, event_type: str, timestamp: datetime, event_id: Optional[int] = None) -> None:
+    """Applica una timbratura allo stato (in place)"""
+    if event_type == 'clock_in':
+        if state['session_started_at'] is None:
+            state.update(session_started_at=timestamp, break_started_at=None, break_minutes=0)
+    elif event_type == 'clock_out':
+        if state['session_started_at'] is not None:
+            # Una pausa non chiusa non viene scalata, come in get_daily_work_hours
+            worked = _minutes(state['session_started_at'], timestamp) - state['break_minutes']
+            state['worked_minutes'] += max(0, worked)
+            state.update(session_started_at=None, break_started_at=None, break_minutes=0)
+    elif event_type == 'break_start':
+        if state['session_started_at'] is not None:
+            state['break_started_at'] = timestamp
+    elif event_type == 'break_end':
+        if state['session_started_at'] is not None and state['break_started_at'] is not None:
+            state['break_minutes'] += _minutes(state['break_started_at'], timestamp)
+            state['break_started_at'] = None
+
+    state.update(status=NEXT_STATUS.get(event_type, state['status']), last_event_id=event_id,
+                 last_event_type=event_type, last_event_at=timestamp)
+
+
+def worked_hours(state: dict, now_utc: datetime) -> float:
+    """Ore lavorate nel giorno dello stato, inclusa la sessione in corso"""
+    minutes = state['worked_minutes']
+    if state['session_started_at'] is not None:
+        running = _minutes(state['session_started_at'], now_utc) - state['break_minutes']
+        if state['break_started_at'] is not None:
+            running -= _minutes(state['break_started_at'], now_utc)
+        minutes += max(0, running)
+    return minutes / 60
+
+
+def _seed_state(connection, user_id: int, day: date) -> dict:
+    """Ricostruisce lo stato dalle timbrature del giorno"""
+    events = AttendanceEvent.__table__
+    rows = connection.execute(
+        select(events.c.id, events.c.event_type, events.c.timestamp)
+        .where(events.c.user_id == user_id, events.c.date == day)
+        .order_by(events.c.timestamp)
+    ).all()
+    state = empty_state(day)
+    for row in rows:
+        apply_event(state, row.event_type, row.timestamp, row.id)
+    return state
+
+
+def _read_state(connection, user, for_update: bool = False) -> Optional[dict]:
+    table = AttendanceStatus.__table__
+    query = select(*[table.c[field] for field in STATE_FIELDS]).where(table.c.user_id == user.id)
+    if for_update:
+        query = query.with_for_update()
+    row = connection.execute(query).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def _lock_state(connection, user, day: date) -> dict:
+    """Blocca la riga di stato dell'utente, creandola o riallineandola al giorno se serve"""
+    state = _read_state(connection, user, for_update=True)
+    if state is None:
+        connection.execute(
+            pg_insert(AttendanceStatus.__table__)
+            .values(user_id=user.id, company_id=user.company_id, updated_at=italian_now(),
+                    **_seed_state(connection, user.id, day))
+            .on_conflict_do_nothing(index_elements=['user_id'])
+        )
+        # In caso di creazione concorrente attende il lock dell'altra transazione
+        state = _read_state(connection, user, for_update=True)
+    elif state['status_date'] != day:
+        state = _seed_state(connection, user.id, day)
+    return state
+
+
+def get_status(user, now: Optional[datetime] = None) -> dict:
+    """
+    Stato corrente e ore di oggi con una lettura per chiave primaria.
+
+    Returns:
+        dict con status, today_hours, last_event_type, last_event_at (orario italiano)
+    """
+    now = now or datetime.now(ITALY_TZ)
+    day = now.date()
+    connection = db.session.connection()
+
+    state = _read_state(connection, user)
+    if state is None or state['status_date'] != day:
+        state = _seed_state(connection, user.id, day)
+
+    last_event_at = state['last_event_at']
+    return {
+        'status': state['status'],
+        'today_hours': worked_hours(state, _utc_naive(now)),
+        'last_event_type': state['last_event_type'],
+        'last_event_at': _to_italian(last_event_at) if last_event_at is not None else None,
+    }
+
+
+def _find_by_key(connection, user_id: int, idempotency_key: str):
+    events = AttendanceEvent.__table__
+    return connection.execute(
+        select(events.c.id, events.c.timestamp)
+        .where(events.c.user_id == user_id, events.c.idempotency_key == idempotency_key)
+    ).first()
+
+
+def clock(user, event_type: str, sede_id: Optional[int] = None, notes: str = '',
+          now: Optional[datetime] = None, idempotency_key: Optional[str] = None,
+          **fields) -> ClockResult:
+    """
+    Registra una timbratura verificando la transizione sullo stato bloccato dell'utente.
+    Esegue il commit (o rilascia il lock se la transizione non è ammessa).
+
+    Args:
+        idempotency_key: chiave della richiesta client; se già usata dall'utente la
+            timbratura originale viene restituita con replayed=True
+        fields: altre colonne di AttendanceEvent (es. attendance_type_id)
+    """
+    now = now or datetime.now(ITALY_TZ)
+    day = now.date()
+    timestamp = _utc_naive(now)
+    connection = db.session.connection()
+
+    # Il lock sulla riga di stato serializza le richieste concorrenti dello stesso utente
+    state = _lock_state(connection, user, day)
+
+    if idempotency_key:
+        previous = _find_by_key(connection, user.id, idempotency_key)
+        if previous is not None:
+            hours = worked_hours(state, timestamp)
+            db.session.commit()
+            return ClockResult(True, state['status'], hours, previous.id,
+                               _to_italian(previous.timestamp), replayed=True)
+
+    if state['status'] not in VALID_TRANSITIONS[event_type]:
+        hours = worked_hours(state, timestamp)
+        db.session.commit()
+        return ClockResult(False, state['status'], hours)
+
+    event = AttendanceEvent(
+        user_id=user.id,
+        date=day,
+        event_type=event_type,
+        timestamp=now,
+        sede_id=sede_id,
+        notes=notes,
+        company_id=user.company_id,
+        idempotency_key=idempotency_key,
+        **fields
+    )
+    db.session.add(event)
+
+    # Lo stato di questo utente lo aggiorniamo noi: l'hook di flush non deve invalidarlo
+    owned = db.session.info.setdefault(ATTENDANCE_STATUS_OWNED_KEY, set())
+    owned.add(user.id)
+    try:
+        db.session.flush()
+    finally:
+        owned.discard(user.id)
+
+    event_id = event.id
+    apply_event(state, event_type, timestamp, event_id)
+    table = AttendanceStatus.__table__
+    connection.execute(
+        table.update().where(table.c.user_id == user.id).values(updated_at=italian_now(), **state)
+    )
+    db.session.commit()
+
+    return ClockResult(True, state['status'], worked_hours(state, timestamp), event_id, now)
@@ -0,0 +1,64 @@
+"""
+Commessa Hours Service - Backfill e riallineamento del ledger ore commessa
+
+Il ledger (commessa_hours_ledger) è aggiornato automaticamente a ogni flush che tocca
+sessioni timesheet o timbrature; questo modulo serve per il popolamento iniziale dei
+dati storici e per riallineare un tenant dopo correzioni massive.
+"""
+
+import logging
+from typing import Optional
+
+from sqlalchemy import select, union
+
+from app import db
+from models import AttendanceEvent, AttendanceSession, CommessaHoursLedger, Commessa
+
+logger = logging.getLogger(__name__)
+
+
+def _days_to_rebuild(company_id: Optional[int] = None):
+    """
+    Coppie (utente, giorno) con almeno una sessione o timbratura su commessa,
+    più quelle già presenti nel ledger (per ripulire righe non più valide).
+    """
+    sessions = select(AttendanceSession.user_id, AttendanceSession.date).where(
+        AttendanceSession.commessa_id.isnot(None)
+    )
+    events = select(AttendanceEvent.user_id, AttendanceEvent.date).where(
+        AttendanceEvent.commessa_id.isnot(None)
+    )
+    ledger = select(CommessaHoursLedger.user_id, CommessaHoursLedger.date)
+
+    if company_id is not None:
+        tenant_commesse = select(Commessa.id).where(Commessa.company_id == company_id)
+        sessions = sessions.where(AttendanceSession.commessa_id.in_(tenant_commesse))
+        events = events.where(AttendanceEvent.commessa_id.in_(tenant_commesse))
+        ledger = ledger.where(CommessaHoursLedger.commessa_id.in_(tenant_commesse))
+
+    days = union(sessions, events, ledger).subquery()
+    return select(days.c.user_id, days.c.date).order_by(days.c.user_id, days.c.date)
+
+
+def rebuild_ledger(company_id: Optional[int] = None, batch_size: int = 500) -> int:
+    """
+    Ricalcola il ledger per tutti i giorni con ore su commessa, a lotti.
+
+    Args:
+        company_id: limita il ricalcolo alle commesse di un tenant (None = tutti)
+
+    Returns:
+        int: numero di giorni-utente ricalcolati
+    """
+    days = db.session.execute(_days_to_rebuild(company_id)).all()
+
+    refreshed = 0
+    for start in range(0, len(days), batch_size):
+        connection = db.session.connection()
+        for user_id, day in days[start:start + batch_size]:
+            CommessaHoursLedger.refresh_day(connection, user_id, day)
+        db.session.commit()
+        refreshed += len(days[start:start + batch_size])
+        logger.info(f"Ledger ore commessa: {refreshed}/{len(days)} giorni ricalcolati")
+
+    return refreshed
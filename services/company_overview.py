@@ -0,0 +1,119 @@
+"""
+Company Overview Service - Panoramica aziende della dashboard SUPERADMIN
+
+Le statistiche di tutti i tenant sono calcolate con aggregati raggruppati invece che con
+quattro query per azienda:
+- utenti: COUNT totale, COUNT FILTER (active) e MIN(id) degli Amministratori per company_id
+- sedi: COUNT per company_id
+
+Le due subquery sono unite a Company in un'unica query che calcola anche la percentuale
+di licenze usate, così che ordinamento e paginazione avvengano nel database. I totali
+delle card di riepilogo vengono da una seconda query di soli aggregati.
+"""
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import aliased
+
+from app import db
+from models import Company, Sede, User
+
+ADMIN_ROLE = 'Amministratore'
+
+# Ordinamenti ammessi nella dashboard (chiave -> etichetta)
+SORT_OPTIONS = {
+    'created': 'Più recenti',
+    'usage': 'Utilizzo licenze',
+    'users': 'Utenti attivi',
+    'name': 'Nome',
+}
+DEFAULT_SORT = 'created'
+
+
+def _user_stats():
+    return db.session.query(
+        User.company_id.label('company_id'),
+        func.count(User.id).label('total_users'),
+        func.count(User.id).filter(User.active.is_(True)).label('active_users'),
+        func.min(case((User.role == ADMIN_ROLE, User.id))).label('admin_id'),
+    ).filter(User.company_id.isnot(None)).group_by(User.company_id).subquery()
+
+
+def _sede_stats():
+    return db.session.query(
+        Sede.company_id.label('company_id'),
+        func.count(Sede.id).label('sedi_count'),
+    ).filter(Sede.company_id.isnot(None)).group_by(Sede.company_id).subquery()
+
+
+def company_stats_page(sort: str = DEFAULT_SORT, page: int = 1, per_page: int = 25):
+    """
+    Pagina di statistiche per azienda, ordinata nel database.
+
+    Returns:
+        tuple: (Pagination della query, lista di dict con le chiavi company, active_users,
+               total_users, admin, sedi_count, usage_percent)
+    """
+    users = _user_stats()
+    sedi = _sede_stats()
+    admin = aliased(User)
+
+    active_users = func.coalesce(users.c.active_users, 0)
+    usage = case(
+        (Company.max_licenses > 0, active_users * 100.0 / Company.max_licenses),
+        else_=0,
+    )
+
+    query = db.session.query(
+        Company,
+        active_users.label('active_users'),
+        func.coalesce(users.c.total_users, 0).label('total_users'),
+        func.coalesce(sedi.c.sedi_count, 0).label('sedi_count'),
+        usage.label('usage'),
+        admin.username.label('admin_username'),
+        admin.email.label('admin_email'),
+    ).outerjoin(users, users.c.company_id == Company.id).outerjoin(
+        sedi, sedi.c.company_id == Company.id
+    ).outerjoin(admin, admin.id == users.c.admin_id)
+
+    if sort == 'usage':
+        query = query.order_by(usage.desc(), Company.name)
+    elif sort == 'users':
+        query = query.order_by(active_users.desc(), Company.name)
+    elif sort == 'name':
+        query = query.order_by(Company.name)
+    else:
+        query = query.order_by(Company.created_at.desc(), Company.id.desc())
+
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+
+    company_stats = []
+    for row in pagination.items:
+        company_stats.append({
+            'company': row.Company,
+            'active_users': row.active_users,
+            'total_users': row.total_users,
+            'admin': {'username': row.admin_username, 'email': row.admin_email} if row.admin_username else None,
+            'sedi_count': row.sedi_count,
+            'usage_percent': round(row.usage),
+        })
+    return pagination, company_stats
+
+
+def overview_totals() -> dict:
+    """Totali delle card di riepilogo su tutte le aziende (una query)"""
+    company_totals = db.session.query(
+        func.count(Company.id).label('companies'),
+        func.count(Company.id).filter(Company.active.is_(True)).label('active_companies'),
+    ).subquery()
+    user_totals = db.session.query(
+        func.count(User.id).label('users'),
+        func.count(User.id).filter(User.active.is_(True)).label('active_users'),
+    ).filter(User.company_id.isnot(None)).subquery()
+
+    row = db.session.query(company_totals, user_totals).one()
+    return {
+        'companies': row.companies,
+        'active_companies': row.active_companies,
+        'users': row.users,
+        'active_users': row.active_users,
+    }
@@ -0,0 +1,428 @@
+"""
+CV Renderer Service - Generazione e cache dei CV PDF delle Personas (CIRCLE)
+
+Features:
+- Rendering ReportLab isolato in una funzione pura (payload dict -> bytes PDF),
+  eseguibile anche in processi worker
+- Stili ReportLab costruiti una sola volta per processo
+- Cache su disco indicizzata per hash dei campi del profilo: se il profilo non
+  cambia il PDF viene servito senza ricalcolo; ogni modifica produce un nuovo hash
+  (i file non usati da tempo si eliminano con flask prune-cv-cache)
+- Rigenerazione in background su ProcessPoolExecutor al salvataggio del profilo
+- Export massivo: rendering parallelo dei CV mancanti e archivio ZIP in streaming
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Campi del profilo che finiscono nel PDF: determinano l'hash di cache
+CV_FIELDS = (
+    'first_name', 'last_name', 'job_title', 'department', 'email', 'phone_number',
+    'bio', 'education', 'experience', 'skills', 'languages', 'certifications', 'references',
+)
+
+# Versione del layout: incrementare quando cambia il rendering per invalidare la cache
+CV_LAYOUT_VERSION = 1
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Pool di processi condiviso, creato alla prima richiesta"""
+    global _executor
+    if _executor is None:
+        max_workers = current_app.config.get('CV_RENDER_WORKERS') or min(4, os.cpu_count() or 1)
+        _executor = ProcessPoolExecutor(max_workers=max_workers)
+    return _executor
+
+
+def cv_payload(user) -> Dict:
+    """Estrae dal modello User i soli dati necessari al rendering (serializzabili)"""
+    return {field: getattr(user, field, None) for field in CV_FIELDS}
+
+
+def cv_fingerprint(payload: Dict) -> str:
+    """Hash SHA-256 stabile dei campi del profilo + versione del layout"""
+    raw = json.dumps({'v': CV_LAYOUT_VERSION, 'data': payload}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def cv_filename(payload: Dict) -> str:
+    return f"CV_{payload.get('last_name')}_{payload.get('first_name')}.pdf"
+
+
+def _cache_dir() -> str:
+    cache_dir = current_app.config.get('CV_CACHE_DIR') or os.path.join(current_app.instance_path, 'cv_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def _cache_path(fingerprint: str) -> str:
+    return os.path.join(_cache_dir(), f"{fingerprint}.pdf")
+
+
+def _write_cache(path: str, pdf_bytes: bytes) -> None:
+    """Scrittura atomica (file temporaneo + rename) per non servire PDF parziali"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(pdf_bytes)
+    os.replace(tmp_path, path)
+
+
+@lru_cache(maxsize=1)
+def _cv_styles():
+    """Stili personalizzati del CV, costruiti una volta per processo"""
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    styles = getSampleStyleSheet()
+    return {
+        'title': ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=24,
+            textColor=colors.HexColor('#007bff'),
+            spaceAfter=12,
+            alignment=TA_CENTER
+        ),
+        'heading': ParagraphStyle(
+            'CustomHeading',
+            parent=styles['Heading2'],
+            fontSize=14,
+            textColor=colors.HexColor('#007bff'),
+            spaceAfter=8,
+            spaceBefore=12
+        ),
+        'subheading': ParagraphStyle(
+            'CustomSubHeading',
+            parent=styles['Heading3'],
+            fontSize=12,
+            textColor=colors.HexColor('#333333'),
+            spaceAfter=6
+        ),
+        'body': ParagraphStyle(
+            'CustomBody',
+            parent=styles['Normal'],
+            fontSize=10,
+            spaceAfter=6
+        ),
+    }
+
+
+def render_cv_pdf(payload: Dict) -> bytes:
+    """
+    Costruisce il PDF del CV a partire dal payload di cv_payload().
+    Funzione pura (niente Flask/DB): può girare in un processo worker.
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+    styles = _cv_styles()
+    title_style = styles['title']
+    heading_style = styles['heading']
+    subheading_style = styles['subheading']
+    body_style = styles['body']
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=2*cm, bottomMargin=2*cm)
+    story = []
+
+    # Titolo - Nome completo
+    story.append(Paragraph(f"{payload.get('first_name')} {payload.get('last_name')}", title_style))
+
+    # Job title e department
+    if payload.get('job_title'):
+        story.append(Paragraph(payload['job_title'], subheading_style))
+    if payload.get('department'):
+        story.append(Paragraph(payload['department'], body_style))
+
+    story.append(Spacer(1, 0.5*cm))
+
+    # Contatti
+    contact_data = []
+    if payload.get('email'):
+        contact_data.append(['Email:', payload['email']])
+    if payload.get('phone_number'):
+        contact_data.append(['Telefono:', payload['phone_number']])
+
+    if contact_data:
+        contact_table = Table(contact_data, colWidths=[4*cm, 12*cm])
+        contact_table.setStyle(TableStyle([
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#666666')),
+            ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ]))
+        story.append(contact_table)
+        story.append(Spacer(1, 0.5*cm))
+
+    # Bio
+    if payload.get('bio'):
+        story.append(Paragraph('Profilo Professionale', heading_style))
+        story.append(Paragraph(payload['bio'], body_style))
+        story.append(Spacer(1, 0.3*cm))
+
+    # Formazione
+    if payload.get('education'):
+        story.append(Paragraph('Formazione', heading_style))
+        for edu in payload['education']:
+            degree = edu.get('degree', '')
+            institution = edu.get('institution', '')
+            location = edu.get('location', '')
+            start_date = edu.get('start_date', '')
+            end_date = edu.get('end_date', '')
+            description = edu.get('description', '')
+
+            story.append(Paragraph(f"<b>{degree}</b>", subheading_style))
+            if institution:
+                inst_text = institution
+                if location:
+                    inst_text += f" - {location}"
+                story.append(Paragraph(inst_text, body_style))
+            if start_date or end_date:
+                period = f"{start_date} - {end_date}" if start_date and end_date else (start_date or end_date)
+                story.append(Paragraph(period, body_style))
+            if description:
+                story.append(Paragraph(description, body_style))
+            story.append(Spacer(1, 0.2*cm))
+
+    # Esperienza Professionale
+    if payload.get('experience'):
+        story.append(Paragraph('Esperienza Professionale', heading_style))
+        for exp in payload['experience']:
+            position = exp.get('position', '')
+            company = exp.get('company', '')
+            location = exp.get('location', '')
+            start_date = exp.get('start_date', '')
+            end_date = exp.get('end_date', '')
+            current = exp.get('current', False)
+            description = exp.get('description', '')
+
+            story.append(Paragraph(f"<b>{position}</b>", subheading_style))
+            if company:
+                comp_text = company
+                if location:
+                    comp_text += f" - {location}"
+                story.append(Paragraph(comp_text, body_style))
+            if start_date or end_date or current:
+                if current:
+                    period = f"{start_date} - Presente" if start_date else "Presente"
+                else:
+                    period = f"{start_date} - {end_date}" if start_date and end_date else (start_date or end_date)
+                story.append(Paragraph(period, body_style))
+            if description:
+                story.append(Paragraph(description, body_style))
+            story.append(Spacer(1, 0.2*cm))
+
+    # Competenze
+    if payload.get('skills'):
+        story.append(Paragraph('Competenze', heading_style))
+        for skill_group in payload['skills']:
+            category = skill_group.get('category', 'Competenze')
+            items = skill_group.get('items', [])
+            story.append(Paragraph(f"<b>{category}:</b> {', '.join(items)}", body_style))
+        story.append(Spacer(1, 0.3*cm))
+
+    # Lingue
+    if payload.get('languages'):
+        story.append(Paragraph('Lingue', heading_style))
+        for lang in payload['languages']:
+            language = lang.get('language', '')
+            level = lang.get('level', '')
+            proficiency = lang.get('proficiency', '')
+            certifications = lang.get('certifications', '')
+
+            lang_text = f"<b>{language}</b>"
+            if level:
+                lang_text += f" - {level}"
+            if proficiency:
+                lang_text += f" ({proficiency})"
+            story.append(Paragraph(lang_text, body_style))
+            if certifications:
+                story.append(Paragraph(f"<i>{certifications}</i>", body_style))
+        story.append(Spacer(1, 0.3*cm))
+
+    # Certificazioni
+    if payload.get('certifications'):
+        story.append(Paragraph('Certificazioni', heading_style))
+        for cert in payload['certifications']:
+            name = cert.get('name', '')
+            issuer = cert.get('issuer', '')
+            date = cert.get('date', '')
+            expiry = cert.get('expiry', '')
+            credential_id = cert.get('credential_id', '')
+
+            story.append(Paragraph(f"<b>{name}</b>", subheading_style))
+            if issuer:
+                story.append(Paragraph(f"Ente certificatore: {issuer}", body_style))
+            if date or expiry:
+                cert_period = f"Rilasciata: {date}" if date else ""
+                if expiry:
+                    cert_period += f" | Scadenza: {expiry}"
+                story.append(Paragraph(cert_period, body_style))
+            if credential_id:
+                story.append(Paragraph(f"ID Credenziale: {credential_id}", body_style))
+            story.append(Spacer(1, 0.2*cm))
+
+    # Referenze
+    if payload.get('references'):
+        story.append(Paragraph('Referenze', heading_style))
+        # Sostituisci newline con <br/> per il PDF
+        references_html = payload['references'].replace('\n', '<br/>')
+        story.append(Paragraph(references_html, body_style))
+
+    # Build PDF
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def get_cv_pdf(user) -> bytes:
+    """PDF del CV dalla cache; se il profilo è cambiato lo rigenera e lo salva"""
+    payload = cv_payload(user)
+    path = _cache_path(cv_fingerprint(payload))
+
+    if os.path.exists(path):
+        os.utime(path)  # Ultimo uso, per prune_cache
+        with open(path, 'rb') as cached:
+            return cached.read()
+
+    pdf_bytes = render_cv_pdf(payload)
+    _write_cache(path, pdf_bytes)
+    return pdf_bytes
+
+
+def schedule_regeneration(user) -> None:
+    """
+    Rigenera in background il PDF dopo una modifica del profilo, così il primo
+    download successivo trova già la cache calda.
+    """
+    payload = cv_payload(user)
+    path = _cache_path(cv_fingerprint(payload))
+    if os.path.exists(path):
+        return
+
+    def _store(future):
+        try:
+            _write_cache(path, future.result())
+        except Exception as e:
+            logger.error(f"Rigenerazione CV fallita per utente {user.id}: {e}")
+
+    try:
+        _get_executor().submit(render_cv_pdf, payload).add_done_callback(_store)
+    except Exception as e:
+        # Il download resta comunque disponibile con rendering sincrono
+        logger.warning(f"Impossibile pianificare la rigenerazione del CV: {e}")
+
+
+def _render_to_cache(payload: Dict, path: str) -> str:
+    """Renderizza e salva in cache nel processo worker: al chiamante torna solo il percorso"""
+    _write_cache(path, render_cv_pdf(payload))
+    return path
+
+
+def _render_missing(payloads: List[Dict]) -> Iterator[str]:
+    """
+    Avvia in parallelo (processi) il rendering dei CV non presenti in cache, nell'ordine
+    di prima comparsa. L'iteratore restituito produce i fingerprint man mano che i PDF
+    sono su disco: i byte non passano mai dal processo principale.
+    """
+    missing = {}
+    for payload in payloads:
+        fingerprint = cv_fingerprint(payload)
+        if fingerprint not in missing and not os.path.exists(_cache_path(fingerprint)):
+            missing[fingerprint] = payload
+
+    if not missing:
+        return iter(())
+
+    fingerprints = list(missing)
+    done = _get_executor().map(
+        _render_to_cache, [missing[f] for f in fingerprints], [_cache_path(f) for f in fingerprints]
+    )
+    return (fingerprint for fingerprint, _ in zip(fingerprints, done))
+
+
+def prune_cache(max_age_days: int = 30) -> int:
+    """Elimina i CV in cache non usati da più di max_age_days giorni"""
+    cache_dir = _cache_dir()
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+class _ZipStream(io.RawIOBase):
+    """Buffer write-only: zipfile scrive qui, il generatore svuota i chunk prodotti"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _unique_name(name: str, used_names: set) -> str:
+    """Nome univoco nell'archivio per dipendenti omonimi"""
+    base, counter = name[:-4], 1
+    while name in used_names:
+        name = f"{base}_{counter}.pdf"
+        counter += 1
+    used_names.add(name)
+    return name
+
+
+def iter_cv_zip(users: Iterable) -> Iterator[bytes]:
+    """
+    Genera un archivio ZIP dei CV in streaming: i PDF mancanti vengono renderizzati
+    in parallelo e salvati in cache, e ogni file viene letto dal disco, scritto e
+    inviato al client appena pronto, senza costruire l'intero archivio in memoria.
+    """
+    payloads = [cv_payload(user) for user in users]
+    rendering = _render_missing(payloads)
+    ready = set()
+
+    stream = _ZipStream()
+    used_names = set()
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for payload in payloads:
+            fingerprint = cv_fingerprint(payload)
+            path = _cache_path(fingerprint)
+            # I rendering terminano nell'ordine di prima comparsa: si attende solo il prossimo
+            while fingerprint not in ready and not os.path.exists(path):
+                ready.add(next(rendering))
+            os.utime(path)
+            with open(path, 'rb') as cached:
+                archive.writestr(_unique_name(cv_filename(payload), used_names), cached.read())
+            yield stream.drain()
+    yield stream.drain()
@@ -3,7 +3,6 @@ import logging
 import time
 import copy
 from typing import Dict, List, Optional, Tuple, Any, Callable
-import googlemaps
 import hashlib
 
 logger = logging.getLogger(__name__)
@@ -16,13 +15,14 @@ class DistanceService:
     
     def __init__(self):
         self.api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
-        self.client: Optional[googlemaps.Client] = None
+        self.client: Optional['googlemaps.Client'] = None
         self._cache: Dict[str, Tuple[float, float, List[Dict]]] = {}  # key -> (timestamp, total_km, segments)
         self._cache_ttl = 86400  # 24 hours in seconds
         self._cache_max_size = 1000  # Maximum number of cache entries
         
         if self.api_key:
             try:
+                import googlemaps  # Imported on first use to keep worker startup light
                 self.client = googlemaps.Client(key=self.api_key)
                 logger.info("Google Maps Distance Matrix client initialized successfully")
             except Exception as e:
@@ -118,6 +118,8 @@ class DistanceService:
         Raises:
             Last exception if all retries fail
         """
+        import googlemaps
+        
         last_exception = None
         
         for attempt in range(max_retries):
@@ -182,6 +184,8 @@ class DistanceService:
                 'error': 'Numero massimo di indirizzi superato (massimo 25)'
             }
         
+        import googlemaps
+        
         # Check cache first
         cache_key = self._normalize_route_signature(addresses)
         cached_result = self._get_from_cache(cache_key)
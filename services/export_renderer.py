@@ -0,0 +1,411 @@
+"""
+Export Renderer Service - PDF dei turni e Excel dei timesheet con cache e rendering parallelo
+
+Come per i CV (services/cv_renderer.py):
+- le route estraggono dal database un payload di soli dati serializzabili (righe già
+  formattate, raggruppate per sede) e il rendering è una funzione pura payload -> bytes,
+  eseguibile anche in processi worker
+- stili di paragrafo e tabella costruiti una sola volta per processo
+- cache su disco indicizzata per hash del payload: finché turni e timbrature del periodo
+  non cambiano, i download successivi non rigenerano il documento; ogni modifica dei
+  dati produce un nuovo hash
+
+I documenti grandi (oltre EXPORT_PARALLEL_MIN_ROWS righe) vengono renderizzati nel pool
+di processi invece che nel thread della richiesta; prerender_shifts_pdfs() genera in parallelo più
+documenti (ad esempio i PDF delle singole sedi di un mese) per scaldare la cache.
+ReportLab non può unire PDF renderizzati separatamente, quindi le sezioni per sede di
+un singolo documento sono costruite nello stesso processo.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Versione dei layout: incrementare quando cambia il rendering per invalidare la cache
+EXPORT_LAYOUT_VERSION = 1
+
+WEEKDAY_NAMES = ['Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato', 'Domenica']
+NO_SEDE_LABEL = 'Senza sede'
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Pool di processi condiviso, creato alla prima richiesta"""
+    global _executor
+    if _executor is None:
+        max_workers = current_app.config.get('EXPORT_RENDER_WORKERS') or min(4, os.cpu_count() or 1)
+        _executor = ProcessPoolExecutor(max_workers=max_workers)
+    return _executor
+
+
+def fingerprint(payload: Dict) -> str:
+    """Hash SHA-256 stabile del payload (esclusa l'ora di generazione) + versione dei layout"""
+    data = {key: value for key, value in payload.items() if key != 'generated_at'}
+    raw = json.dumps({'v': EXPORT_LAYOUT_VERSION, 'data': data}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _cache_dir() -> str:
+    cache_dir = current_app.config.get('EXPORT_CACHE_DIR') or os.path.join(current_app.instance_path, 'export_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def _cache_path(digest: str, extension: str) -> str:
+    return os.path.join(_cache_dir(), f"{digest}.{extension}")
+
+
+def _write_cache(path: str, data: bytes) -> None:
+    """Scrittura atomica (file temporaneo + rename) per non servire file parziali"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_path, path)
+
+
+def _row_count(payload: Dict) -> int:
+    total = 0
+    for section in payload.get('sections', []):
+        total += len(section.get('rows', []))
+        total += sum(len(day['rows']) for day in section.get('days', []))
+    return total
+
+
+def duration_hours(start_time, end_time) -> float:
+    """Durata in ore di una fascia oraria (turni a cavallo della mezzanotte inclusi)"""
+    start = datetime.combine(date.today(), start_time)
+    end = datetime.combine(date.today(), end_time)
+    if end < start:
+        end += timedelta(days=1)
+    return (end - start).total_seconds() / 3600
+
+
+def day_label(day: date) -> str:
+    return f"{WEEKDAY_NAMES[day.weekday()]} {day.strftime('%d/%m/%Y')}"
+
+
+# =============================================================================
+# RENDERING (funzioni pure, senza Flask/DB)
+# =============================================================================
+
+@lru_cache(maxsize=1)
+def _pdf_styles():
+    """Stili di paragrafo e tabella dei PDF turni, costruiti una volta per processo"""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import TableStyle
+
+    styles = getSampleStyleSheet()
+    table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+    return {
+        'title': ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=18,
+            spaceAfter=30,
+            alignment=1  # Center
+        ),
+        'section': styles['Heading1'],
+        'day': styles['Heading2'],
+        'normal': styles['Normal'],
+        'table': table_style,
+        'daily_widths': [1.8*inch, 1.1*inch, 1.2*inch, 0.6*inch, 1.5*inch],
+        'inch': inch,
+    }
+
+
+DAILY_HEADER = ['Utente', 'Ruolo', 'Orario', 'Durata', 'Presenza']
+CALENDAR_HEADER = ['Data', 'Utente', 'Orario', 'Durata', 'Tipo']
+
+
+def render_shifts_pdf(payload: Dict) -> bytes:
+    """
+    PDF dei turni dal payload costruito dalle route.
+
+    payload: {'layout': 'daily' | 'calendar', 'title', 'subtitle': [righe], 'generated_at',
+              'sections': [{'title': sede, 'days': [{'label', 'rows'}]} (daily)
+                           | {'title': sede, 'rows': [...]} (calendar)]}
+
+    generated_at non entra nell'hash: un documento servito dalla cache riporta l'ora
+    in cui è stato generato da quegli stessi dati.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, PageBreak
+
+    styles = _pdf_styles()
+    inch = styles['inch']
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1*inch, bottomMargin=1*inch)
+    story = [Paragraph(payload['title'], styles['title'])]
+    for line in payload.get('subtitle', []):
+        story.append(Paragraph(line, styles['normal']))
+    if payload.get('generated_at'):
+        story.append(Paragraph(f"Generato il {payload['generated_at']}", styles['normal']))
+    story.append(Spacer(1, 20))
+
+    sections = payload.get('sections', [])
+    if not sections:
+        story.append(Paragraph("Nessun turno trovato per il periodo selezionato.", styles['normal']))
+
+    for index, section in enumerate(sections):
+        # Con più sedi ogni sede inizia in una nuova pagina
+        if len(sections) > 1:
+            if index:
+                story.append(PageBreak())
+            story.append(Paragraph(section['title'], styles['section']))
+
+        if payload['layout'] == 'daily':
+            for day in section['days']:
+                story.append(Paragraph(day['label'], styles['day']))
+                table = Table([DAILY_HEADER] + day['rows'], colWidths=styles['daily_widths'], repeatRows=1)
+                table.setStyle(styles['table'])
+                story.append(table)
+                story.append(Spacer(1, 20))
+        else:
+            table = Table([CALENDAR_HEADER] + section['rows'], repeatRows=1)
+            table.setStyle(styles['table'])
+            story.append(table)
+            story.append(Spacer(1, 20))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+TIMESHEET_HEADER = ['Giorno', 'Data', 'Entrata', 'Uscita', 'Inizio Pausa', 'Fine Pausa', 'Ore Lavorate', 'Sede', 'Commessa']
+
+
+def render_timesheet_xlsx(payload: Dict) -> bytes:
+    """
+    Excel del timesheet mensile dal payload costruito dalla route.
+
+    payload: {'title', 'month_label', 'status', 'rows': [[9 valori per giorno con timbrature]]}
+    """
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Timesheet"
+
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    border = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+
+    # Intestazione
+    ws['A1'] = payload['title']
+    ws['A1'].font = Font(bold=True, size=14)
+    ws['A2'] = payload['month_label']
+    ws['A3'] = payload['status']
+
+    current_row = 5
+    for col, header in enumerate(TIMESHEET_HEADER, start=1):
+        cell = ws.cell(row=current_row, column=col, value=header)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = Alignment(horizontal='center')
+        cell.border = border
+
+    for values in payload['rows']:
+        current_row += 1
+        for col, value in enumerate(values, start=1):
+            ws.cell(row=current_row, column=col, value=value).border = border
+
+    for col in range(1, len(TIMESHEET_HEADER) + 1):
+        ws.column_dimensions[chr(64 + col)].width = 15
+
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+# =============================================================================
+# CACHE E PARALLELISMO
+# =============================================================================
+
+def _get_cached(payload: Dict, renderer: Callable[[Dict], bytes], extension: str) -> bytes:
+    path = _cache_path(fingerprint(payload), extension)
+    if os.path.exists(path):
+        with open(path, 'rb') as cached:
+            return cached.read()
+
+    if _row_count(payload) >= current_app.config.get('EXPORT_PARALLEL_MIN_ROWS', 500):
+        # Documento grande: il rendering gira in un processo del pool, non nel worker web
+        data = _get_executor().submit(renderer, payload).result()
+    else:
+        data = renderer(payload)
+    _write_cache(path, data)
+    return data
+
+
+def get_shifts_pdf(payload: Dict) -> bytes:
+    """PDF dei turni dalla cache; se i dati sono cambiati lo rigenera e lo salva"""
+    return _get_cached(payload, render_shifts_pdf, 'pdf')
+
+
+def get_timesheet_xlsx(payload: Dict) -> bytes:
+    """Excel del timesheet dalla cache; se le timbrature sono cambiate lo rigenera e lo salva"""
+    return _get_cached(payload, render_timesheet_xlsx, 'xlsx')
+
+
+def prerender_shifts_pdfs(payloads: Iterable[Dict]) -> int:
+    """
+    Renderizza in parallelo (processi) i PDF non presenti in cache.
+
+    Returns:
+        int: documenti generati
+    """
+    missing = {}
+    for payload in payloads:
+        digest = fingerprint(payload)
+        if digest not in missing and not os.path.exists(_cache_path(digest, 'pdf')):
+            missing[digest] = payload
+
+    if not missing:
+        return 0
+
+    digests = list(missing)
+    for digest, pdf_bytes in zip(digests, _get_executor().map(render_shifts_pdf, [missing[d] for d in digests])):
+        _write_cache(_cache_path(digest, 'pdf'), pdf_bytes)
+    return len(digests)
+
+
+def prune_cache(max_age_days: int = 30) -> int:
+    """Elimina i documenti in cache generati da più di max_age_days giorni"""
+    cache_dir = _cache_dir()
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+# =============================================================================
+# PAYLOAD TURNI (query sul database)
+# =============================================================================
+
+def shift_rows(shifts_query) -> List:
+    """
+    Turni del periodo con utente e sede in una sola query di sole colonne.
+    shifts_query: Shift.query già filtrata (tenant, periodo, utente).
+    """
+    from models import Sede, Shift, User
+
+    return shifts_query.join(User, User.id == Shift.user_id).outerjoin(
+        Sede, Sede.id == User.sede_id
+    ).with_entities(
+        Shift.id, Shift.user_id, Shift.date, Shift.start_time, Shift.end_time, Shift.shift_type,
+        User.first_name, User.last_name, User.role, Sede.name.label('sede_name'),
+    ).order_by(Sede.name, Shift.date, Shift.start_time).all()
+
+
+def _by_sede(rows) -> Dict[str, list]:
+    sections: Dict[str, list] = {}
+    for row in rows:
+        sections.setdefault(row.sede_name or NO_SEDE_LABEL, []).append(row)
+    return sections
+
+
+def daily_payload(title: str, subtitle: List[str], rows, presence: Dict[int, Optional[dict]]) -> Dict:
+    """Payload del layout per giorno (Utente, Ruolo, Orario, Durata, Presenza), sezioni per sede"""
+    sections = []
+    for sede_name, sede_rows in _by_sede(rows).items():
+        days: Dict[date, list] = {}
+        for row in sede_rows:
+            info = presence.get(row.id)
+            days.setdefault(row.date, []).append([
+                f"{row.first_name} {row.last_name}",
+                row.role,
+                f"{row.start_time.strftime('%H:%M')} - {row.end_time.strftime('%H:%M')}",
+                f"{duration_hours(row.start_time, row.end_time):.1f}h",
+                info['message'] if info else '-',
+            ])
+        sections.append({
+            'title': sede_name,
+            'days': [{'label': day_label(day), 'rows': day_rows} for day, day_rows in sorted(days.items())],
+        })
+    return {'layout': 'daily', 'title': title, 'subtitle': subtitle, 'sections': sections,
+            'generated_at': datetime.now().strftime('%d/%m/%Y alle %H:%M')}
+
+
+def calendar_payload(title: str, subtitle: List[str], rows) -> Dict:
+    """Payload del layout a tabella unica (Data, Utente, Orario, Durata, Tipo), sezioni per sede"""
+    sections = []
+    for sede_name, sede_rows in _by_sede(rows).items():
+        sections.append({
+            'title': sede_name,
+            'rows': [[
+                row.date.strftime('%d/%m'),
+                f"{row.first_name} {row.last_name}"[:20],  # Limita lunghezza nome
+                f"{row.start_time.strftime('%H:%M')}-{row.end_time.strftime('%H:%M')}",
+                f"{duration_hours(row.start_time, row.end_time):.1f}h",
+                (row.shift_type or '')[:10],  # Limita lunghezza tipo
+            ] for row in sede_rows],
+        })
+    return {'layout': 'calendar', 'title': title, 'subtitle': subtitle, 'sections': sections}
+
+
+def month_title(day: date) -> str:
+    """Titolo del PDF mensile dei turni (condiviso da route e prerender)"""
+    return f"Turni {day.strftime('%B %Y').title()}"
+
+
+def month_shifts_payloads(company_id: int, month_start: date) -> List[Dict]:
+    """
+    Payload del PDF mensile di un'azienda e di ciascuna sede (stessi titoli della route
+    shifts.export_shifts_pdf), da passare a prerender_shifts_pdfs.
+    """
+    from calendar import monthrange
+    from models import Shift
+    from services import shift_presence
+
+    month_end = month_start.replace(day=monthrange(month_start.year, month_start.month)[1])
+    rows = shift_rows(Shift.query.filter(
+        Shift.company_id == company_id,
+        Shift.date >= month_start,
+        Shift.date <= month_end,
+    ))
+    if not rows:
+        return []
+
+    presence = shift_presence.reconcile(rows)
+    title = month_title(month_start)
+    payloads = [daily_payload(title, [], rows, presence)]
+    sedi = _by_sede(rows)
+    if len(sedi) > 1:
+        for sede_name, sede_rows in sedi.items():
+            payloads.append(daily_payload(f"{title} - {sede_name}", [], sede_rows, presence))
+    return payloads
@@ -0,0 +1,296 @@
+"""
+File Storage Service - Content-Addressed Upload Storage
+Archivia i file caricati (documenti CIRCLE, ricevute note spese, immagini profilo)
+indicizzandoli per hash SHA-256 del contenuto.
+
+Features:
+- Deduplica: file identici (anche di tenant diversi) occupano un solo blob su disco
+- Hash calcolato in streaming durante l'upload (nessuna rilettura del file)
+- Reference counting su tabella stored_file: il blob viene rimosso dopo il commit,
+  solo quando nessun record lo referenzia più
+- Blob fuori da static/ (default <instance_path>/storage): nessun file è raggiungibile
+  senza passare da una route con login e controllo del tenant
+- Download con ETag/Range (send_file conditional) oppure delegati al front server
+  tramite X-Accel-Redirect (nginx, location con direttiva internal) o X-Sendfile
+- Retrocompatibilità: i valori legacy (semplici nomi file) continuano a essere
+  risolti nella cartella di upload originale
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+from typing import BinaryIO, Optional, Tuple
+from urllib.parse import quote
+
+from flask import current_app, send_file, make_response
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from models import StoredFile, italian_now
+
+logger = logging.getLogger(__name__)
+
+# Prefisso delle chiavi content-addressed salvate nelle colonne *_filename/*_path
+CAS_PREFIX = 'cas/'
+
+# Dimensione dei chunk letti dallo stream di upload
+CHUNK_SIZE = 64 * 1024
+
+
+def _storage_root() -> str:
+    """Percorso assoluto della radice dei blob (configurabile con STORAGE_ROOT)"""
+    root = current_app.config.get('STORAGE_ROOT') or os.path.join(current_app.instance_path, 'storage')
+    if not os.path.isabs(root):
+        root = os.path.join(current_app.root_path, root)
+    return root
+
+
+def is_cas_key(key: Optional[str]) -> bool:
+    """True se la chiave punta a un blob content-addressed"""
+    return bool(key) and key.startswith(CAS_PREFIX)
+
+
+def _relative_blob_path(digest: str, extension: str) -> str:
+    """Percorso relativo del blob: ab/cd/abcd....ext (fan-out a due livelli)"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def _normalize_extension(filename: Optional[str]) -> str:
+    """Estensione in minuscolo con il punto iniziale (stringa vuota se assente o non valida)"""
+    if not filename:
+        return ''
+    ext = os.path.splitext(filename)[1].lower()
+    if len(ext) < 2 or len(ext) > 10 or not ext[1:].isalnum():
+        return ''
+    return ext
+
+
+def store_stream(stream: BinaryIO, filename: Optional[str] = None, content_type: Optional[str] = None) -> str:
+    """
+    Salva uno stream nel contenuto indirizzato per hash, calcolando lo SHA-256
+    mentre i chunk vengono scritti su un file temporaneo nella stessa directory
+    dei blob (così il rename finale è atomico).
+
+    Args:
+        stream: file-like aperto in lettura binaria (FileStorage.stream, BytesIO, ...)
+        filename: nome file originale, usato solo per l'estensione
+        content_type: MIME type dichiarato dal client
+
+    Returns:
+        str: chiave di storage da salvare sul record (es. 'cas/ab/cd/<sha256>.pdf')
+    """
+    root = _storage_root()
+    tmp_dir = os.path.join(root, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    extension = _normalize_extension(filename)
+    hasher = hashlib.sha256()
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                tmp_file.write(chunk)
+                size += len(chunk)
+
+        digest = hasher.hexdigest()
+        relative_path = _relative_blob_path(digest, extension)
+        final_path = os.path.join(root, relative_path)
+
+        # Upsert atomico del contatore di riferimenti prima di toccare il blob: il lock
+        # sulla riga (fino al commit) impedisce alla pulizia di un release concorrente
+        # di cancellare il blob che questo riferimento sta per usare
+        stmt = pg_insert(StoredFile.__table__).values(
+            sha256=digest,
+            extension=extension,
+            size_bytes=size,
+            content_type=content_type,
+            ref_count=1,
+            created_at=italian_now(),
+        ).on_conflict_do_update(
+            index_elements=['sha256', 'extension'],
+            set_={'ref_count': StoredFile.__table__.c.ref_count + 1},
+        )
+        db.session.execute(stmt)
+
+        if os.path.exists(final_path):
+            # Blob già presente: deduplica, scarta la copia temporanea
+            os.remove(tmp_path)
+            logger.debug(f"Blob {digest[:12]} già presente, upload deduplicato")
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return CAS_PREFIX + relative_path
+
+
+def store_upload(file_storage, content_type: Optional[str] = None) -> str:
+    """Salva un werkzeug FileStorage senza passare da file.save()"""
+    file_storage.stream.seek(0)
+    return store_stream(
+        file_storage.stream,
+        filename=file_storage.filename,
+        content_type=content_type or file_storage.mimetype,
+    )
+
+
+def _parse_key(key: str) -> Tuple[str, str]:
+    """Estrae (sha256, estensione) da una chiave CAS"""
+    basename = os.path.basename(key[len(CAS_PREFIX):])
+    digest, extension = os.path.splitext(basename)
+    return digest, extension
+
+
+def resolve_path(key: str, legacy_folder: str) -> str:
+    """
+    Percorso assoluto su disco per una chiave di storage.
+
+    Args:
+        key: valore salvato sul record (chiave CAS o nome file legacy)
+        legacy_folder: cartella relativa a root_path usata prima del CAS
+    """
+    if is_cas_key(key):
+        return os.path.join(_storage_root(), key[len(CAS_PREFIX):])
+    return os.path.join(current_app.root_path, legacy_folder, key)
+
+
+def release(key: Optional[str], legacy_folder: str, session=None) -> None:
+    """
+    Rilascia un riferimento al file. La rimozione dal disco avviene solo dopo il commit
+    della transazione (un rollback ripristina riferimenti e file): i blob CAS vengono
+    cancellati solo se il contatore è ancora a zero, i file legacy direttamente.
+    """
+    if not key:
+        return
+    session = session or db.session
+
+    if not is_cas_key(key):
+        session.info.setdefault(_RELEASED_KEY, set()).add((None, None, resolve_path(key, legacy_folder)))
+        return
+
+    digest, extension = _parse_key(key)
+    table = StoredFile.__table__
+    result = session.execute(
+        table.update()
+        .where(table.c.sha256 == digest, table.c.extension == extension)
+        .values(ref_count=table.c.ref_count - 1)
+        .returning(table.c.ref_count)
+    ).first()
+
+    if result is not None and result.ref_count <= 0:
+        session.info.setdefault(_RELEASED_KEY, set()).add((digest, extension, resolve_path(key, legacy_folder)))
+
+
+# =============================================================================
+# PULIZIA DEI BLOB DOPO IL COMMIT
+# =============================================================================
+
+# Chiave di session.info con i file da rimuovere al commit: (sha256, estensione, percorso),
+# sha256 None per i file legacy
+_RELEASED_KEY = 'file_storage_released'
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _purge_blob(digest: str, extension: str, path: str) -> None:
+    """
+    Elimina riga e blob se nessuno lo referenzia più. Il DELETE ... WHERE ref_count <= 0
+    attende gli upload concorrenti che hanno già incrementato il contatore (lock di riga)
+    e non elimina nulla se il blob è tornato in uso; il file viene rimosso prima del
+    commit, mentre il lock blocca ancora nuovi riferimenti.
+    """
+    table = StoredFile.__table__
+    with db.engine.begin() as connection:
+        deleted = connection.execute(
+            table.delete()
+            .where(table.c.sha256 == digest, table.c.extension == extension, table.c.ref_count <= 0)
+            .returning(table.c.sha256)
+        ).first()
+        if deleted is not None:
+            _remove(path)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _purge_released(session):
+    for digest, extension, path in session.info.pop(_RELEASED_KEY, ()):
+        try:
+            if digest is None:
+                _remove(path)
+            else:
+                _purge_blob(digest, extension, path)
+        except Exception:
+            logger.exception(f"Pulizia del file {path} non riuscita")
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_released(session):
+    session.info.pop(_RELEASED_KEY, None)
+
+
+def send_stored_file(key: str, legacy_folder: str, download_name: Optional[str] = None,
+                     as_attachment: bool = True, mimetype: Optional[str] = None):
+    """
+    Risposta HTTP per il download di un file archiviato.
+
+    Con STORAGE_SENDFILE_BACKEND='nginx' il trasferimento dei blob CAS è delegato a
+    nginx via X-Accel-Redirect (location interna STORAGE_ACCEL_PREFIX), con 'sendfile'
+    via X-Sendfile; altrimenti (e per i file legacy) il worker serve il file con
+    supporto ETag/Range.
+
+    Returns:
+        Response oppure None se il file non esiste su disco
+    """
+    path = resolve_path(key, legacy_folder)
+    if not os.path.exists(path):
+        return None
+
+    backend = current_app.config.get('STORAGE_SENDFILE_BACKEND', '')
+    etag = _parse_key(key)[0] if is_cas_key(key) else None
+
+    if backend in ('nginx', 'sendfile') and etag:
+        response = make_response('')
+        if backend == 'nginx':
+            prefix = current_app.config.get('STORAGE_ACCEL_PREFIX', '/protected-files/')
+            response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + key[len(CAS_PREFIX):]
+        else:
+            response.headers['X-Sendfile'] = path
+
+        if mimetype:
+            response.headers['Content-Type'] = mimetype
+        else:
+            response.headers.pop('Content-Type', None)
+        if download_name:
+            disposition = 'attachment' if as_attachment else 'inline'
+            response.headers['Content-Disposition'] = f"{disposition}; filename*=UTF-8''{quote(download_name)}"
+        response.set_etag(etag)
+        return response
+
+    response = send_file(
+        path,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        mimetype=mimetype,
+        conditional=True,
+        etag=etag if etag else True,
+    )
+    if etag:
+        # Il contenuto di un blob CAS non cambia mai: il browser può riusarlo
+        response.cache_control.private = True
+        response.cache_control.max_age = 86400
+    return response
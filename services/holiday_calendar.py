@@ -0,0 +1,205 @@
+"""
+Holiday Calendar Service - Calendario festività compilato per tenant
+
+Le festività (Holiday) sono ricorrenze giorno/mese, nazionali (sede_id NULL) o per sede.
+Invece di interrogare Holiday per ogni giorno controllato, ogni worker compila alla
+prima richiesta il calendario del tenant con una sola query e lo serve da memoria:
+
+    nazionali: {(mese, giorno)}     per sede: {sede_id: {(mese, giorno)}}
+
+Per ogni (anno, sede) viene poi costruita una bitmap dei giorni dell'anno (bit n = giorno
+n+1 dell'anno) con festivi e una con festivi + weekend: "è festivo" è un test di bit e
+"giorni lavorativi tra A e B" è un popcount sull'intervallo, senza iterare sui giorni.
+
+Le festività senza company_id (dati precedenti al multi-tenant) valgono per tutti i
+tenant; company_id None (system admin) compila le festività di tutti i tenant.
+
+Invalidazione:
+- esplicita da blueprints/holidays.py (nel worker che ha fatto la modifica)
+- per età (HOLIDAY_CALENDAR_TTL secondi), che limita la staleness negli altri worker
+"""
+
+import logging
+import threading
+import time
+from calendar import isleap, monthrange
+from datetime import date, timedelta
+from typing import Dict, FrozenSet, Iterable, Optional, Set, Tuple
+
+from flask import current_app
+
+from app import db
+from models import Holiday
+
+logger = logging.getLogger(__name__)
+
+# Età massima di un calendario in secondi (default se non configurato)
+DEFAULT_TTL = 3600
+
+
+def _year_length(year: int) -> int:
+    return 366 if isleap(year) else 365
+
+
+def _range_mask(first_bit: int, last_bit: int) -> int:
+    """Maschera con i bit da first_bit a last_bit inclusi"""
+    return ((1 << (last_bit + 1)) - 1) ^ ((1 << first_bit) - 1)
+
+
+def _year_chunks(start: date, end: date):
+    """Spezza [start, end] per anno: (anno, primo bit, ultimo bit)"""
+    for year in range(start.year, end.year + 1):
+        first = start if year == start.year else date(year, 1, 1)
+        last = end if year == end.year else date(year, 12, 31)
+        yield year, first.timetuple().tm_yday - 1, last.timetuple().tm_yday - 1
+
+
+class _TenantCalendar:
+    """Festività compilate di un tenant; le bitmap annuali sono calcolate una volta e riusate"""
+
+    __slots__ = ('national', 'by_sede', 'built_at', '_holiday_masks', '_weekend_masks')
+
+    def __init__(self, national: FrozenSet[Tuple[int, int]],
+                 by_sede: Dict[int, FrozenSet[Tuple[int, int]]]):
+        self.national = national
+        self.by_sede = by_sede
+        self.built_at = time.monotonic()
+        self._holiday_masks: Dict[Tuple[int, Optional[int]], int] = {}
+        self._weekend_masks: Dict[int, int] = {}
+
+    def _days(self, sede_id: Optional[int]) -> FrozenSet[Tuple[int, int]]:
+        if sede_id is None or sede_id not in self.by_sede:
+            return self.national
+        return self.national | self.by_sede[sede_id]
+
+    def holiday_mask(self, year: int, sede_id: Optional[int] = None) -> int:
+        key = (year, sede_id)
+        mask = self._holiday_masks.get(key)
+        if mask is None:
+            mask = 0
+            for month, day in self._days(sede_id):
+                # 29/02 negli anni non bisestili (e date non valide) non cade
+                if day <= monthrange(year, month)[1]:
+                    mask |= 1 << (date(year, month, day).timetuple().tm_yday - 1)
+            self._holiday_masks[key] = mask
+        return mask
+
+    def weekend_mask(self, year: int) -> int:
+        mask = self._weekend_masks.get(year)
+        if mask is None:
+            mask = 0
+            first_weekday = date(year, 1, 1).weekday()
+            for offset in range(_year_length(year)):
+                if (first_weekday + offset) % 7 >= 5:
+                    mask |= 1 << offset
+            self._weekend_masks[year] = mask
+        return mask
+
+    def is_holiday(self, day: date, sede_id: Optional[int] = None) -> bool:
+        return bool(self.holiday_mask(day.year, sede_id) >> (day.timetuple().tm_yday - 1) & 1)
+
+    def holidays_between(self, start: date, end: date, sede_id: Optional[int] = None) -> Set[date]:
+        result = set()
+        for year, first_bit, last_bit in _year_chunks(start, end):
+            bits = self.holiday_mask(year, sede_id) & _range_mask(first_bit, last_bit)
+            year_start = date(year, 1, 1)
+            while bits:
+                low = bits & -bits
+                result.add(year_start + timedelta(days=low.bit_length() - 1))
+                bits ^= low
+        return result
+
+    def working_days_between(self, start: date, end: date, sede_id: Optional[int] = None) -> int:
+        total = 0
+        for year, first_bit, last_bit in _year_chunks(start, end):
+            non_working = self.holiday_mask(year, sede_id) | self.weekend_mask(year)
+            total += (last_bit - first_bit + 1) - bin(non_working & _range_mask(first_bit, last_bit)).count('1')
+        return total
+
+
+_calendars: Dict[Optional[int], _TenantCalendar] = {}
+_lock = threading.Lock()
+
+
+def _build(company_id: Optional[int]) -> _TenantCalendar:
+    """Una sola query sulle festività attive del tenant"""
+    query = db.session.query(Holiday.month, Holiday.day, Holiday.sede_id).filter(Holiday.active == True)
+    if company_id is not None:
+        query = query.filter(db.or_(Holiday.company_id == company_id, Holiday.company_id.is_(None)))
+
+    national = set()
+    by_sede: Dict[int, Set[Tuple[int, int]]] = {}
+    rows = query.all()
+    for row in rows:
+        if row.sede_id is None:
+            national.add((row.month, row.day))
+        else:
+            by_sede.setdefault(row.sede_id, set()).add((row.month, row.day))
+
+    logger.debug(f"Calendario festività compilato per company {company_id}: {len(rows)} festività")
+    return _TenantCalendar(frozenset(national), {sede: frozenset(days) for sede, days in by_sede.items()})
+
+
+def get_calendar(company_id: Optional[int]) -> _TenantCalendar:
+    """Restituisce il calendario del tenant, compilandolo se assente o scaduto"""
+    ttl = current_app.config.get('HOLIDAY_CALENDAR_TTL', DEFAULT_TTL)
+    calendar = _calendars.get(company_id)
+    if calendar is not None and time.monotonic() - calendar.built_at < ttl:
+        return calendar
+
+    with _lock:
+        # Un'altra richiesta potrebbe averlo compilato nel frattempo
+        calendar = _calendars.get(company_id)
+        if calendar is None or time.monotonic() - calendar.built_at >= ttl:
+            calendar = _build(company_id)
+            _calendars[company_id] = calendar
+    return calendar
+
+
+def invalidate(company_id: Optional[int] = None) -> None:
+    """
+    Scarta il calendario del tenant modificato e quello globale dei system admin.
+    company_id None (modifica fatta da system admin) scarta tutti i calendari.
+    """
+    with _lock:
+        if company_id is None:
+            _calendars.clear()
+        else:
+            _calendars.pop(company_id, None)
+            _calendars.pop(None, None)
+
+
+# =============================================================================
+# API
+# =============================================================================
+
+def is_holiday(company_id: Optional[int], day: date, sede_id: Optional[int] = None) -> bool:
+    """Festività nazionale o della sede indicata"""
+    return get_calendar(company_id).is_holiday(day, sede_id)
+
+
+def holidays_between(company_id: Optional[int], start: date, end: date,
+                     sede_id: Optional[int] = None) -> Set[date]:
+    """Date festive tra start e end inclusi"""
+    if end < start:
+        return set()
+    return get_calendar(company_id).holidays_between(start, end, sede_id)
+
+
+def holiday_days_in_month(company_id: Optional[int], year: int, month: int,
+                          sede_ids: Iterable[int] = ()) -> Set[int]:
+    """Giorni del mese festivi a livello nazionale o in almeno una delle sedi indicate"""
+    calendar = get_calendar(company_id)
+    start, end = date(year, month, 1), date(year, month, monthrange(year, month)[1])
+    days = calendar.holidays_between(start, end)
+    for sede_id in set(sede_ids):
+        days |= calendar.holidays_between(start, end, sede_id)
+    return {day.day for day in days}
+
+
+def working_days_between(company_id: Optional[int], start: date, end: date,
+                         sede_id: Optional[int] = None) -> int:
+    """Giorni tra start e end inclusi che non sono né weekend né festivi"""
+    if end < start:
+        return 0
+    return get_calendar(company_id).working_days_between(start, end, sede_id)
@@ -0,0 +1,190 @@
+"""
+HR Expiry Service - Calendario scadenze HR e digest notturno
+
+Le scadenze di documenti, formazione/visite mediche e contratti sono precalcolate in
+hr_expiry_event (mantenuta dal listener su UserHRData): dashboard e digest leggono un
+intervallo di date sull'indice (company_id, expiry_date).
+
+Il digest notturno lavora per azienda: raccoglie con una query le scadenze non ancora
+segnalate che entrano nella finestra di preavviso della loro categoria, invia un solo
+messaggio raggruppato ai gestori HR dell'azienda e le marca come notificate con un
+solo UPDATE.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from flask import current_app, has_request_context, url_for
+from markupsafe import escape
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import contains_eager
+
+from app import db
+from models import HRExpiryEvent, User, UserHRData, UserRole
+from message_utils import send_internal_message_bulk
+
+logger = logging.getLogger(__name__)
+
+# Giorni di preavviso per categoria (come is_document_expiring_soon e get_training_expiring_soon)
+NOTICE_DAYS = {
+    'document': 30,
+    'training': 60,
+    'contract': 60,
+}
+
+
+def upcoming(company_id: Optional[int], start: date, end: date,
+             categories: Optional[Iterable[str]] = None) -> List[HRExpiryEvent]:
+    """
+    Scadenze tra start e end (inclusi) dei dipendenti attivi, ordinate per data.
+
+    Args:
+        company_id: tenant (None = tutte le aziende)
+        categories: limita a document/training/contract
+    """
+    query = HRExpiryEvent.query.join(User, User.id == HRExpiryEvent.user_id).filter(
+        User.active.is_(True),
+        HRExpiryEvent.expiry_date >= start,
+        HRExpiryEvent.expiry_date <= end,
+    )
+    if company_id is not None:
+        query = query.filter(HRExpiryEvent.company_id == company_id)
+    if categories:
+        query = query.filter(HRExpiryEvent.category.in_(list(categories)))
+    return query.options(contains_eager(HRExpiryEvent.user)).order_by(
+        HRExpiryEvent.expiry_date, User.last_name, User.first_name
+    ).all()
+
+
+def rebuild_calendar(company_id: Optional[int] = None, batch_size: int = 500) -> int:
+    """
+    Ricalcola il calendario da tutte le schede HR, a lotti.
+
+    Returns:
+        int: numero di schede HR riallineate
+    """
+    query = UserHRData.query.order_by(UserHRData.id)
+    if company_id is not None:
+        query = query.filter(UserHRData.company_id == company_id)
+
+    synced = 0
+    last_id = 0
+    while True:
+        batch = query.filter(UserHRData.id > last_id).limit(batch_size).all()
+        if not batch:
+            break
+        connection = db.session.connection()
+        for hr_data in batch:
+            HRExpiryEvent.sync(connection, hr_data)
+        db.session.commit()
+        last_id = batch[-1].id
+        synced += len(batch)
+        logger.info(f"Calendario scadenze HR: {synced} schede riallineate")
+
+    return synced
+
+
+def _due_filter(today: date):
+    """
+    Scadenze entrate nella finestra di preavviso della loro categoria. Documenti e
+    formazione già scaduti restano da segnalare; un contratto già terminato no.
+    """
+    conditions = []
+    for category, days in NOTICE_DAYS.items():
+        condition = and_(HRExpiryEvent.category == category,
+                         HRExpiryEvent.expiry_date <= today + timedelta(days=days))
+        if category == 'contract':
+            condition = and_(condition, HRExpiryEvent.expiry_date >= today)
+        conditions.append(condition)
+    return or_(*conditions)
+
+
+def _hr_managers(company_id: int) -> List[int]:
+    """Utenti attivi dell'azienda con permesso can_manage_hr_data (ruoli letti una volta)"""
+    roles = {role.name: role for role in UserRole.query.filter_by(company_id=company_id).all()}
+    recipients = []
+    for user in User.query.filter_by(company_id=company_id, active=True).all():
+        role = roles.get(user.role)
+        allowed = role.has_permission('can_manage_hr_data') if role else user.can_manage_hr_data()
+        if allowed:
+            recipients.append(user.id)
+    return recipients
+
+
+def _expiries_url() -> str:
+    """Link allo scadenzario, anche fuori da una richiesta (comando CLI notturno)"""
+    if has_request_context():
+        return url_for('hr.hr_expiries')
+    with current_app.test_request_context():
+        return url_for('hr.hr_expiries')
+
+
+def _format_digest(events: List[HRExpiryEvent], today: date) -> str:
+    by_category: Dict[str, List[HRExpiryEvent]] = defaultdict(list)
+    for expiry in events:
+        by_category[expiry.category].append(expiry)
+
+    parts = []
+    for category, label in HRExpiryEvent.CATEGORY_LABELS.items():
+        if category not in by_category:
+            continue
+        lines = []
+        for expiry in by_category[category]:
+            days_left = (expiry.expiry_date - today).days
+            when = f"scaduta da {abs(days_left)} giorni" if days_left < 0 else f"tra {days_left} giorni"
+            lines.append(f"<li>{escape(expiry.user.get_full_name())} - {escape(expiry.label)}: "
+                         f"{expiry.expiry_date.strftime('%d/%m/%Y')} ({escape(when)})</li>")
+        parts.append(f"<strong>{escape(label)}</strong><ul>{''.join(lines)}</ul>")
+
+    # I messaggi sono mostrati con |safe: nomi ed etichette vanno sempre escapati
+    return ("Le seguenti scadenze richiedono attenzione:<br><br>" + ''.join(parts) +
+            f"<a href='{escape(_expiries_url())}' class='btn btn-primary btn-sm'>Vai allo scadenzario</a>")
+
+
+def send_expiry_digest(today: Optional[date] = None) -> dict:
+    """
+    Invia un messaggio raggruppato per azienda con le scadenze non ancora segnalate.
+
+    Returns:
+        dict: {'companies': aziende notificate, 'expiries': scadenze segnalate, 'messages': messaggi}
+    """
+    today = today or date.today()
+    stats = {'companies': 0, 'expiries': 0, 'messages': 0}
+
+    pending = HRExpiryEvent.query.join(User, User.id == HRExpiryEvent.user_id).filter(
+        User.active.is_(True),
+        HRExpiryEvent.notified_on.is_(None),
+        _due_filter(today),
+    )
+    company_ids = [row[0] for row in pending.with_entities(HRExpiryEvent.company_id).distinct().all()]
+
+    for company_id in company_ids:
+        events = pending.filter(HRExpiryEvent.company_id == company_id).options(
+            contains_eager(HRExpiryEvent.user)
+        ).order_by(HRExpiryEvent.expiry_date).all()
+
+        recipients = _hr_managers(company_id)
+        if not recipients:
+            # Nessun destinatario: restano da segnalare al primo gestore HR configurato
+            logger.warning(f"Digest scadenze HR: nessun gestore HR per l'azienda {company_id}")
+            continue
+
+        messages = send_internal_message_bulk(
+            recipient_ids=recipients,
+            title=f"📅 Scadenze HR: {len(events)} da gestire",
+            message=_format_digest(events, today),
+            message_type='warning',
+            company_id=company_id,
+        )
+        HRExpiryEvent.query.filter(HRExpiryEvent.id.in_([e.id for e in events])).update(
+            {HRExpiryEvent.notified_on: today}, synchronize_session=False
+        )
+        db.session.commit()
+
+        stats['companies'] += 1
+        stats['expiries'] += len(events)
+        stats['messages'] += len(messages)
+
+    return stats
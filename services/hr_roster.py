@@ -0,0 +1,101 @@
+"""
+HR Roster Service - Query unica per lista ed export dei dati HR
+
+I filtri della lista HR (salvati in session come {nome: valore}) vengono tradotti in
+condizioni SQL sulla join User ⟕ UserHRData, con i dati HR e le relazioni usate da
+template ed export caricati nella stessa query: il numero di query non dipende più dal
+numero di dipendenti.
+
+La lista e l'export hanno semantiche diverse sui dipendenti senza dati HR, mantenute da
+require_hr_data:
+- lista: il filtro tipologia contratto include anche i dipendenti da configurare
+- export: con almeno un filtro attivo i dipendenti senza dati HR sono esclusi
+"""
+
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import false, or_
+from sqlalchemy.orm import contains_eager
+
+from models import User, UserHRData
+
+# Filtri testuali "contiene" (case-insensitive)
+CONTAINS_FILTERS = {
+    'matricola': User.matricola,
+    'ccnl': UserHRData.ccnl,
+    'mansione': UserHRData.mansione,
+    'qualifica': UserHRData.qualifica,
+    'city': UserHRData.city,
+}
+
+
+def _contains(column, value: str):
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return column.ilike(f'%{escaped}%', escape='\\')
+
+
+def apply_filters(query, filters: Optional[dict], require_hr_data: bool = False):
+    """Aggiunge alla query le condizioni corrispondenti ai filtri attivi"""
+    if not filters:
+        return query
+
+    if require_hr_data:
+        query = query.filter(UserHRData.id.isnot(None))
+
+    for name, column in CONTAINS_FILTERS.items():
+        if name in filters:
+            query = query.filter(_contains(column, filters[name]))
+
+    # Data assunzione: filtra per anno (data non valida = filtro ignorato)
+    if 'hire_date' in filters:
+        try:
+            year = datetime.strptime(filters['hire_date'], '%Y-%m-%d').year
+        except (TypeError, ValueError):
+            year = None
+        if year:
+            query = query.filter(UserHRData.hire_date >= date(year, 1, 1),
+                                 UserHRData.hire_date < date(year + 1, 1, 1))
+
+    if 'contract_type' in filters:
+        if require_hr_data:
+            query = query.filter(UserHRData.contract_type == filters['contract_type'])
+        else:
+            # Lista: inclusi anche i dipendenti senza dati HR o senza tipologia (da configurare)
+            query = query.filter(or_(
+                UserHRData.contract_type.is_(None),
+                UserHRData.contract_type == '',
+                UserHRData.contract_type == filters['contract_type'],
+            ))
+
+    if 'sede_assunzione' in filters:
+        try:
+            query = query.filter(UserHRData.sede_id == int(filters['sede_assunzione']))
+        except (TypeError, ValueError):
+            query = query.filter(false())
+
+    if 'gender' in filters:
+        query = query.filter(UserHRData.gender == filters['gender'])
+
+    return query
+
+
+def roster_query(users_query, filters: Optional[dict] = None, require_hr_data: bool = False,
+                 for_export: bool = False):
+    """
+    Utenti con dati HR già caricati (user.hr_data non esegue altre query).
+
+    Args:
+        users_query: query su User già filtrata per tenant/ruolo e ordinata
+        filters: filtri della lista HR
+        require_hr_data: semantica export (vedi docstring del modulo)
+        for_export: carica anche orario di lavoro e veicolo ACI
+    """
+    hr_loader = contains_eager(User.hr_data)
+    options = [hr_loader.joinedload(UserHRData.sede)]
+    if for_export:
+        options += [hr_loader.joinedload(UserHRData.work_schedule),
+                    hr_loader.joinedload(UserHRData.aci_vehicle)]
+
+    query = users_query.outerjoin(UserHRData, UserHRData.user_id == User.id).options(*options)
+    return apply_filters(query, filters, require_hr_data)
@@ -0,0 +1,187 @@
+"""
+Listing Service - Filtri e paginazione condivisi delle pagine di gestione
+
+- month_range / year_range: i filtri per mese e anno diventano intervalli di date
+  (date >= inizio AND date <= fine), che usano gli indici sulle colonne data invece
+  di EXTRACT(year/month ...) su ogni riga
+- scope_to_sede: lo scoping per sede è una condizione sulla join con User, non una
+  lista di id caricata in Python
+- keyset_page: paginazione a chiave (WHERE (chiavi) dopo il cursore ORDER BY chiavi
+  LIMIT n+1), costante al crescere dello storico, con cursore opaco nella query string
+"""
+
+import base64
+import json
+from calendar import monthrange
+from datetime import date, datetime, time
+from typing import List, Optional, Sequence, Tuple
+
+from flask import request, url_for
+from sqlalchemy import and_, or_
+
+from models import User
+
+DEFAULT_PAGE_SIZE = 50
+
+
+# =============================================================================
+# INTERVALLI DI DATE
+# =============================================================================
+
+def parse_month(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """'YYYY-MM' -> (anno, mese), None se assente o non valido"""
+    if not value:
+        return None
+    try:
+        year, month = (int(part) for part in value.split('-')[:2])
+        date(year, month, 1)
+    except ValueError:
+        return None
+    return year, month
+
+
+def month_range(year: int, month: int) -> Tuple[date, date]:
+    """Primo e ultimo giorno del mese"""
+    return date(year, month, 1), date(year, month, monthrange(year, month)[1])
+
+
+def year_range(year: int) -> Tuple[date, date]:
+    """Primo e ultimo giorno dell'anno"""
+    return date(year, 1, 1), date(year, 12, 31)
+
+
+def filter_date_range(query, column, start: date, end: date):
+    """Filtro sargable su una colonna Date (estremi inclusi)"""
+    return query.filter(column >= start, column <= end)
+
+
+# =============================================================================
+# SCOPING PER SEDE
+# =============================================================================
+
+def join_user(query, user_column):
+    """Join con l'utente della riga (per ordinamento, filtri e scoping per sede)"""
+    return query.join(User, User.id == user_column)
+
+
+def scope_to_sede(query, user):
+    """
+    Limita una query già unita a User alla sede dell'utente corrente, se non è multi-sede.
+    """
+    if not user.all_sedi and user.sede_obj:
+        query = query.filter(User.sede_id == user.sede_obj.id)
+    return query
+
+
+# =============================================================================
+# PAGINAZIONE A CHIAVE
+# =============================================================================
+
+class KeysetPage:
+    """Una pagina di risultati con il cursore della pagina successiva"""
+
+    def __init__(self, items: list, next_cursor: Optional[str], cursor: Optional[str]):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def is_first(self) -> bool:
+        return not self.cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def _encode(values: Sequence) -> str:
+    raw = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode(cursor: str, columns) -> Optional[List]:
+    """Cursore -> valori tipizzati come le colonne (None se il cursore non è valido)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if len(raw) != len(columns):
+            return None
+        values = []
+        for column, value in zip(columns, raw):
+            python_type = column.type.python_type
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif python_type is date:
+                value = date.fromisoformat(value)
+            elif python_type is time:
+                value = time.fromisoformat(value)
+            else:
+                value = python_type(value)
+            values.append(value)
+        return values
+    except (ValueError, TypeError, NotImplementedError):
+        return None
+
+
+def _after(order: Sequence[Tuple[object, bool]], values: List):
+    """
+    Righe successive al cursore nell'ordinamento dato, con direzioni miste:
+    k1 > v1 OR (k1 = v1 AND (k2 > v2 OR (k2 = v2 AND ...))) (con < per le chiavi discendenti)
+    """
+    condition = None
+    for (column, descending), value in reversed(list(zip(order, values))):
+        beyond = column < value if descending else column > value
+        condition = beyond if condition is None else or_(beyond, and_(column == value, condition))
+    return condition
+
+
+def keyset_page(query, order: Sequence[Tuple[object, bool]], cursor: Optional[str] = None,
+                page_size: int = DEFAULT_PAGE_SIZE) -> KeysetPage:
+    """
+    Pagina della query ordinata per `order` a partire dal cursore.
+
+    Args:
+        order: [(colonna, discendente)], colonne NOT NULL (un NULL non ha posto nel
+            confronto col cursore); l'ultima chiave deve essere univoca (es. id)
+        cursor: valore di next_cursor della pagina precedente (None = prima pagina)
+    """
+    columns = [column for column, _ in order]
+    if cursor:
+        values = _decode(cursor, columns)
+        if values is not None:
+            query = query.filter(_after(order, values))
+        else:
+            cursor = None
+
+    query = query.order_by(*[column.desc() if descending else column.asc() for column, descending in order])
+    items = query.limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = _encode([getattr(last, column.key) for column in columns])
+    return KeysetPage(items, next_cursor, cursor)
+
+
+def page_links(page: KeysetPage, **values) -> dict:
+    """
+    URL della prima pagina e della successiva per la richiesta corrente, conservando
+    i filtri della query string (per partials/keyset_pagination.html)
+    """
+    args = request.args.to_dict()
+    args.pop('cursor', None)
+    args.update(values)
+    return {
+        'first_url': url_for(request.endpoint, **args) if page.cursor else None,
+        'next_url': url_for(request.endpoint, cursor=page.next_cursor, **args) if page.has_next else None,
+    }
@@ -0,0 +1,221 @@
+"""
+Message Inbox Service - Caselle dei messaggi interni, badge dei non letti e archiviazione
+
+- received_page / sent_page: caselle paginate a chiave (created_at, id) sugli indici
+  (recipient_id, created_at, id) e (sender_id, created_at, id); gli inviati mostrano
+  un messaggio per gruppo (message_group_id, o mittente+titolo+secondo per i vecchi)
+- unread_count: il badge legge la riga di message_unread_counter, aggiornata con un
+  incremento atomico nella stessa transazione di invio, lettura ed eliminazione
+  (hook after_flush) e ricalcolata dopo le modifiche in blocco
+- mark_all_read: un solo UPDATE ... WHERE recipient_id = ? AND is_read = false
+- archive_messages: sposta in internal_message_archive i messaggi letti più vecchi di
+  MESSAGE_ARCHIVE_AFTER_DAYS, a lotti, ed elimina dall'archivio quelli più vecchi di
+  MESSAGE_ARCHIVE_PURGE_DAYS (se impostato)
+"""
+
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from typing import Iterable, Optional
+
+from flask import current_app
+from sqlalchemy import event, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import joinedload
+
+from app import db
+from models import InternalMessage, InternalMessageArchive, MessageUnreadCounter, italian_now
+from services.listing import keyset_page
+from utils_tenant import filter_by_company
+
+logger = logging.getLogger(__name__)
+
+INBOX_PAGE_SIZE = 30
+
+_ORDER = [(InternalMessage.created_at, True), (InternalMessage.id, True)]
+
+
+# =============================================================================
+# CASELLE
+# =============================================================================
+
+def received_page(user, cursor: Optional[str] = None, page_size: int = INBOX_PAGE_SIZE):
+    """Pagina dei messaggi ricevuti dall'utente, dal più recente"""
+    query = filter_by_company(InternalMessage.query).options(
+        joinedload(InternalMessage.sender)
+    ).filter(InternalMessage.recipient_id == user.id)
+    return keyset_page(query, _ORDER, cursor, page_size)
+
+
+def _group_key():
+    """Gruppo di invio: message_group_id, o mittente+titolo+secondo per i messaggi vecchi"""
+    return func.coalesce(
+        InternalMessage.message_group_id,
+        func.concat(InternalMessage.title, '|', func.date_trunc('second', InternalMessage.created_at)),
+    )
+
+
+def sent_page(user, cursor: Optional[str] = None, page_size: int = INBOX_PAGE_SIZE):
+    """Pagina dei messaggi inviati dall'utente, uno per gruppo di destinatari"""
+    first_of_group = select(func.min(InternalMessage.id)).where(
+        InternalMessage.sender_id == user.id
+    ).group_by(_group_key())
+    query = filter_by_company(InternalMessage.query).options(
+        joinedload(InternalMessage.recipient)
+    ).filter(InternalMessage.sender_id == user.id, InternalMessage.id.in_(first_of_group))
+    return keyset_page(query, _ORDER, cursor, page_size)
+
+
+# =============================================================================
+# NON LETTI
+# =============================================================================
+
+def unread_count(user_id: int) -> int:
+    """Messaggi non letti dell'utente (badge della navbar), dal contatore"""
+    count = db.session.execute(
+        select(MessageUnreadCounter.unread_count).where(MessageUnreadCounter.user_id == user_id)
+    ).scalar()
+    return max(count or 0, 0)
+
+
+def recount(connection, user_ids: Optional[Iterable[int]] = None) -> None:
+    """Ricalcola dai messaggi i contatori degli utenti indicati (tutti se None)"""
+    table = MessageUnreadCounter.__table__
+    messages = InternalMessage.__table__
+    counts = select(
+        messages.c.recipient_id, func.count(), literal(italian_now(), table.c.updated_at.type)
+    ).where(messages.c.is_read.is_(False)).group_by(messages.c.recipient_id)
+    reset = update(table).values(unread_count=0, updated_at=italian_now())
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        counts = counts.where(messages.c.recipient_id.in_(user_ids))
+        reset = reset.where(table.c.user_id.in_(user_ids))
+
+    connection.execute(reset)
+    statement = pg_insert(table).from_select(['user_id', 'unread_count', 'updated_at'], counts)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={'unread_count': statement.excluded.unread_count, 'updated_at': statement.excluded.updated_at},
+    ))
+
+
+def mark_all_read(user) -> int:
+    """Segna come letti tutti i messaggi ricevuti dall'utente (un solo UPDATE)"""
+    result = db.session.execute(
+        update(InternalMessage)
+        .where(InternalMessage.recipient_id == user.id, InternalMessage.is_read.is_(False))
+        .values(is_read=True)
+        .execution_options(synchronize_session=False)
+    )
+    recount(db.session.connection(), [user.id])
+    db.session.commit()
+    return result.rowcount
+
+
+def _apply_deltas(connection, deltas: dict) -> None:
+    table = MessageUnreadCounter.__table__
+    now = italian_now()
+    statement = pg_insert(table).values([
+        {'user_id': user_id, 'unread_count': delta, 'updated_at': now}
+        for user_id, delta in deltas.items()
+    ])
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={
+            'unread_count': func.greatest(table.c.unread_count + statement.excluded.unread_count, 0),
+            'updated_at': statement.excluded.updated_at,
+        },
+    ))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_unread(session, flush_context):
+    """Aggiorna i contatori dei non letti per messaggi inviati, letti ed eliminati"""
+    deltas = defaultdict(int)
+    stale = set()
+
+    for obj in session.new:
+        if isinstance(obj, InternalMessage) and not obj.is_read:
+            deltas[obj.recipient_id] += 1
+    for obj in session.dirty:
+        if not isinstance(obj, InternalMessage):
+            continue
+        state = db.inspect(obj)
+        recipient = state.attrs.recipient_id.history
+        read = state.attrs.is_read.history
+        if recipient.has_changes():
+            stale.update(user_id for user_id in list(recipient.deleted) + list(recipient.added) if user_id)
+        elif read.has_changes():
+            if read.deleted:
+                deltas[obj.recipient_id] += int(not obj.is_read) - int(not read.deleted[0])
+            else:
+                stale.add(obj.recipient_id)
+    for obj in session.deleted:
+        if isinstance(obj, InternalMessage) and not obj.is_read:
+            deltas[obj.recipient_id] -= 1
+
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta and user_id not in stale}
+    if deltas:
+        _apply_deltas(session.connection(), deltas)
+    if stale:
+        recount(session.connection(), stale)
+
+
+# =============================================================================
+# ARCHIVIAZIONE
+# =============================================================================
+
+_ARCHIVE_COLUMNS = ['id', 'recipient_id', 'sender_id', 'title', 'message', 'message_type', 'is_read',
+                    'related_leave_request_id', 'created_at', 'company_id', 'message_group_id']
+
+
+def archive_messages(older_than_days: Optional[int] = None, batch_size: Optional[int] = None) -> dict:
+    """
+    Sposta in archivio i messaggi letti più vecchi del periodo di conservazione, un lotto
+    per transazione (DELETE ... RETURNING dentro INSERT ... SELECT), e applica la
+    conservazione dell'archivio.
+
+    Returns:
+        dict: archived, purged
+    """
+    config = current_app.config
+    if older_than_days is None:
+        older_than_days = config.get('MESSAGE_ARCHIVE_AFTER_DAYS', 180)
+    if batch_size is None:
+        batch_size = config.get('MESSAGE_ARCHIVE_BATCH_SIZE', 5000)
+    now = italian_now()
+    cutoff = now - timedelta(days=older_than_days)
+
+    messages = InternalMessage.__table__
+    archive = InternalMessageArchive.__table__
+    archived = 0
+    while True:
+        batch = select(messages.c.id).where(
+            messages.c.is_read.is_(True), messages.c.created_at < cutoff
+        ).order_by(messages.c.id).limit(batch_size)
+        moved = messages.delete().where(messages.c.id.in_(batch)).returning(
+            *[messages.c[name] for name in _ARCHIVE_COLUMNS]
+        ).cte('moved')
+        result = db.session.execute(archive.insert().from_select(
+            _ARCHIVE_COLUMNS + ['archived_at'],
+            select(*[moved.c[name] for name in _ARCHIVE_COLUMNS], literal(now, archive.c.archived_at.type)),
+        ))
+        db.session.commit()
+        archived += result.rowcount
+        if result.rowcount < batch_size:
+            break
+
+    purged = 0
+    purge_days = config.get('MESSAGE_ARCHIVE_PURGE_DAYS', 0)
+    if purge_days:
+        result = db.session.execute(
+            archive.delete().where(archive.c.created_at < now - timedelta(days=purge_days))
+        )
+        db.session.commit()
+        purged = result.rowcount
+
+    stats = {'archived': archived, 'purged': purged}
+    logger.info(f"Archiviazione messaggi prima del {cutoff:%d/%m/%Y}: {stats}")
+    return stats
@@ -0,0 +1,209 @@
+"""
+Mileage Summary Service - Aggregati dei rimborsi chilometrici calcolati nel database
+
+Ogni riepilogo è una sola query GROUP BY sulla query delle richieste già filtrata
+(azienda, sede, filtri del form), invece di una query per utente o di somme in Python
+sulle richieste caricate:
+
+    totals            conteggi, km e importi per stato della selezione
+    by_user           totali per dipendente, con il saldo dei rimborsi fissi dell'anno
+    monthly_by_user   totali per dipendente e mese (foglio di riepilogo dell'export)
+    fixed_balances    saldo annuo dei rimborsi fissi per più utenti in una query
+
+I filtri per anno e mese sono intervalli su travel_date (services/listing.py), che usano
+l'indice (user_id, status, travel_date).
+"""
+
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+
+from app import db
+from constants import RequestStatus
+from models import MileageRequest, User, UserHRData
+from services.listing import month_range, year_range
+from utils_tenant import filter_by_company
+
+FIXED_TYPE = 'fisso'
+FIXED_PROFILE_TYPES = ('fisso', 'entrambi')
+
+_STATUSES = (RequestStatus.PENDING, RequestStatus.APPROVED, RequestStatus.REJECTED)
+
+
+def _aggregates():
+    return (
+        func.count(MileageRequest.id),
+        func.coalesce(func.sum(MileageRequest.total_km), 0),
+        func.coalesce(func.sum(MileageRequest.total_amount), 0),
+    )
+
+
+def _empty_totals() -> dict:
+    totals = {'total_count': 0, 'total_km': 0.0, 'total_amount': 0.0}
+    for status in _STATUSES:
+        prefix = status.lower()
+        totals.update({f'{prefix}_count': 0, f'{prefix}_km': 0.0, f'{prefix}_amount': 0.0})
+    return totals
+
+
+def _add(totals: dict, status: str, count: int, km, amount) -> None:
+    km, amount = float(km), float(amount)
+    totals['total_count'] += count
+    totals['total_km'] += km
+    totals['total_amount'] += amount
+    if status in _STATUSES:
+        prefix = status.lower()
+        totals[f'{prefix}_count'] += count
+        totals[f'{prefix}_km'] += km
+        totals[f'{prefix}_amount'] += amount
+
+
+def _rounded(totals: dict) -> dict:
+    return {key: round(value, 2) if isinstance(value, float) else value for key, value in totals.items()}
+
+
+# =============================================================================
+# RIEPILOGHI
+# =============================================================================
+
+def totals(query) -> dict:
+    """
+    Conteggi, km e importi per stato delle richieste della query (una query).
+
+    Args:
+        query: query di MileageRequest già filtrata, senza opzioni di caricamento
+
+    Returns:
+        dict: {pending,approved,rejected,total}_{count,km,amount}
+    """
+    result = _empty_totals()
+    for status, count, km, amount in query.with_entities(
+        MileageRequest.status, *_aggregates()
+    ).group_by(MileageRequest.status):
+        _add(result, status, count, km, amount)
+    return _rounded(result)
+
+
+def by_user(query, year: Optional[int] = None) -> List[dict]:
+    """
+    Totali per dipendente delle richieste della query, con il saldo dei rimborsi fissi
+    dell'anno: tre query in tutto, qualunque sia il numero di dipendenti.
+
+    Returns:
+        list: dict con user, totals, fixed_balance, ordinati per cognome e nome
+    """
+    per_user = defaultdict(_empty_totals)
+    for user_id, status, count, km, amount in query.with_entities(
+        MileageRequest.user_id, MileageRequest.status, *_aggregates()
+    ).group_by(MileageRequest.user_id, MileageRequest.status):
+        _add(per_user[user_id], status, count, km, amount)
+    if not per_user:
+        return []
+
+    users = User.query.filter(User.id.in_(list(per_user))).order_by(User.last_name, User.first_name).all()
+    balances = fixed_balances(list(per_user), year)
+    return [{
+        'user': user,
+        'totals': _rounded(per_user[user.id]),
+        'fixed_balance': balances.get(user.id),
+    } for user in users]
+
+
+def monthly_by_user(query) -> List[dict]:
+    """
+    Totali per dipendente e mese delle richieste della query (una query).
+
+    Returns:
+        list: dict con user, month (primo giorno del mese) e i totali per stato,
+        ordinati per mese e dipendente
+    """
+    month = func.date_trunc('month', MileageRequest.travel_date)
+    rows = defaultdict(_empty_totals)
+    for user_id, month_start, status, count, km, amount in query.with_entities(
+        MileageRequest.user_id, month, MileageRequest.status, *_aggregates()
+    ).group_by(MileageRequest.user_id, month, MileageRequest.status):
+        _add(rows[(user_id, month_start.date())], status, count, km, amount)
+    if not rows:
+        return []
+
+    users = {user.id: user for user in User.query.filter(User.id.in_(list({key[0] for key in rows})))}
+    result = [
+        dict(_rounded(values), user=users.get(user_id), month=month_start)
+        for (user_id, month_start), values in rows.items()
+    ]
+    result.sort(key=lambda row: (row['month'], row['user'].get_full_name() if row['user'] else ''))
+    return result
+
+
+def monthly_summary(user_id: int, year: int, month: int) -> dict:
+    """Riepilogo di un mese per un dipendente (MileageRequest.get_monthly_summary)"""
+    start, end = month_range(year, month)
+    return totals(MileageRequest.query.filter(
+        MileageRequest.user_id == user_id,
+        MileageRequest.travel_date >= start,
+        MileageRequest.travel_date <= end,
+    ))
+
+
+def pending_count(user) -> int:
+    """Richieste in attesa visibili all'utente (azienda e, se non multi-sede, sede)"""
+    query = filter_by_company(MileageRequest.query).filter(MileageRequest.status == RequestStatus.PENDING)
+    if not user.all_sedi:
+        query = query.join(User, MileageRequest.user_id == User.id).filter(User.sede_id == user.sede_id)
+    return query.count()
+
+
+# =============================================================================
+# SALDO RIMBORSI FISSI
+# =============================================================================
+
+def fixed_balances(user_ids: Iterable[int], year: Optional[int] = None,
+                   hr_rows: Optional[Iterable[UserHRData]] = None) -> Dict[int, dict]:
+    """
+    Saldo annuo dei rimborsi fissi per gli utenti con rimborso fisso configurato.
+
+    Args:
+        user_ids: utenti da considerare
+        year: anno di riferimento (default: anno corrente)
+        hr_rows: dati HR già caricati (evita la query sui profili)
+
+    Returns:
+        dict: user_id -> {'max_annual', 'used', 'available', 'year'} (solo utenti con
+        rimborso fisso e massimale annuo)
+    """
+    if year is None:
+        year = date.today().year
+    user_ids = list(user_ids)
+    if hr_rows is None:
+        hr_rows = UserHRData.query.filter(UserHRData.user_id.in_(user_ids)).all() if user_ids else []
+
+    limits = {
+        hr.user_id: hr.mileage_fixed_max_annual for hr in hr_rows
+        if hr.mileage_reimbursement_type in FIXED_PROFILE_TYPES and hr.mileage_fixed_max_annual
+    }
+    if not limits:
+        return {}
+
+    start, end = year_range(year)
+    used = dict(db.session.query(
+        MileageRequest.user_id, func.coalesce(func.sum(MileageRequest.total_amount), 0)
+    ).filter(
+        MileageRequest.user_id.in_(list(limits)),
+        MileageRequest.status == RequestStatus.APPROVED,
+        MileageRequest.reimbursement_type == FIXED_TYPE,
+        MileageRequest.travel_date >= start,
+        MileageRequest.travel_date <= end,
+    ).group_by(MileageRequest.user_id).all())
+
+    balances = {}
+    for user_id, max_annual in limits.items():
+        total_used = float(used.get(user_id, 0.0))
+        balances[user_id] = {
+            'max_annual': max_annual,
+            'used': round(total_used, 2),
+            'available': round(max(0, max_annual - total_used), 2),
+            'year': year,
+        }
+    return balances
@@ -0,0 +1,210 @@
+"""
+Overtime Detection Service - Rilevamento a lotti dello straordinario dalle timbrature
+
+Per un giorno o un mese chiuso il rilevamento legge con una query ciascuno gli utenti
+abilitati allo straordinario (con il proprio orario di lavoro), le loro timbrature e le
+richieste di straordinario del periodo, e calcola per ogni giorno:
+
+    ore lavorate      ultima entrata -> ultima uscita, pause chiuse escluse
+                      (stessa regola del limite settimanale)
+    ore standard      durata dell'orario assegnato nei suoi giorni (0 negli altri);
+                      senza orario 8h riproporzionate al part-time
+    straordinario     eccedenza dalla mezz'ora in su, arrotondata al quarto d'ora
+
+I risultati sostituiscono le righe del periodo in detected_overtime, letta da widget,
+schermata di approvazione e ledger banca ore.
+"""
+
+import logging
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Dict, List, Optional
+
+from sqlalchemy import exists, func, select, tuple_
+from sqlalchemy.orm import joinedload
+
+from app import db
+from models import AttendanceEvent, DetectedOvertime, OvertimeRequest, User, italian_now
+from utils_contract_hours import calculate_daily_work_hours
+
+logger = logging.getLogger(__name__)
+
+STANDARD_DAILY_HOURS = 8.0
+MIN_OVERTIME_HOURS = 0.5  # Regola dei 30 minuti
+
+
+def overtime_from_hours(daily_hours: float, standard_hours: float) -> float:
+    """Eccedenza sulle ore standard, solo dalla mezz'ora in su, arrotondata al quarto d'ora"""
+    overtime_hours = daily_hours - standard_hours
+    if overtime_hours < MIN_OVERTIME_HOURS:
+        return 0.0
+    return max(0.0, round(overtime_hours * 4) / 4)
+
+
+def standard_hours_for(user, day: date) -> float:
+    """Ore standard del giorno: orario di lavoro assegnato, altrimenti 8h al netto del part-time"""
+    schedule = user.work_schedule
+    if schedule:
+        return schedule.get_duration_hours() if day.weekday() in schedule.get_days_of_week_list() else 0.0
+
+    standard_hours = STANDARD_DAILY_HOURS
+    if user.part_time_percentage and user.part_time_percentage < 100:
+        standard_hours = standard_hours * (user.part_time_percentage / 100.0)
+    return standard_hours
+
+
+def _overtime_users(company_id: Optional[int] = None, user_ids: Optional[List[int]] = None):
+    query = User.query.filter(User.active.is_(True), User.overtime_enabled.is_(True))
+    if company_id is not None:
+        query = query.filter(User.company_id == company_id)
+    if user_ids is not None:
+        query = query.filter(User.id.in_(user_ids))
+    return query
+
+
+def detect(start: date, end: date, company_id: Optional[int] = None,
+           user_ids: Optional[List[int]] = None) -> List[dict]:
+    """
+    Straordinario rilevato da start a end inclusi, in un solo passaggio su timbrature e
+    richieste precaricate.
+
+    Returns:
+        list: un dict per (utente, giorno) con straordinario o con una richiesta
+    """
+    users = _overtime_users(company_id, user_ids).options(joinedload(User.work_schedule)).all()
+    if not users:
+        return []
+    ids = [user.id for user in users]
+
+    events_by_user = defaultdict(list)
+    for row in db.session.execute(
+        select(AttendanceEvent.user_id, AttendanceEvent.date, AttendanceEvent.event_type, AttendanceEvent.timestamp)
+        .where(AttendanceEvent.user_id.in_(ids), AttendanceEvent.date >= start, AttendanceEvent.date <= end)
+    ):
+        events_by_user[row.user_id].append(row)
+
+    requests = {}
+    request_days = defaultdict(set)
+    for request_id, employee_id, overtime_date in db.session.execute(
+        select(OvertimeRequest.id, OvertimeRequest.employee_id, OvertimeRequest.overtime_date)
+        .where(OvertimeRequest.employee_id.in_(ids), OvertimeRequest.overtime_date >= start,
+               OvertimeRequest.overtime_date <= end)
+        .order_by(OvertimeRequest.id)
+    ):
+        requests.setdefault((employee_id, overtime_date), request_id)
+        request_days[employee_id].add(overtime_date)
+
+    results = []
+    for user in users:
+        daily_hours = calculate_daily_work_hours(events_by_user.get(user.id, []))
+        days = set(daily_hours) | request_days[user.id]
+        for day in sorted(days):
+            worked_hours = daily_hours.get(day, 0.0)
+            standard_hours = standard_hours_for(user, day)
+            overtime_hours = overtime_from_hours(worked_hours, standard_hours)
+            request_id = requests.get((user.id, day))
+            if overtime_hours <= 0 and request_id is None:
+                continue
+            results.append({
+                'user_id': user.id,
+                'company_id': user.company_id,
+                'date': day,
+                'worked_hours': round(worked_hours, 2),
+                'standard_hours': round(standard_hours, 2),
+                'overtime_hours': overtime_hours,
+                'overtime_request_id': request_id,
+            })
+    return results
+
+
+def run_detection(start: date, end: date, company_id: Optional[int] = None) -> dict:
+    """
+    Rileva lo straordinario del periodo e sostituisce le righe di detected_overtime.
+
+    Returns:
+        dict: users, days, rows, overtime_hours, seconds
+    """
+    started = time.perf_counter()
+    results = detect(start, end, company_id)
+
+    table = DetectedOvertime.__table__
+    users = select(User.id).where(User.active.is_(True), User.overtime_enabled.is_(True))
+    if company_id is not None:
+        users = users.where(User.company_id == company_id)
+    db.session.execute(table.delete().where(table.c.date >= start, table.c.date <= end, table.c.user_id.in_(users)))
+    if results:
+        detected_at = italian_now()
+        db.session.execute(table.insert(), [dict(row, detected_at=detected_at) for row in results])
+    db.session.commit()
+
+    stats = {
+        'users': len({row['user_id'] for row in results}),
+        'days': (end - start).days + 1,
+        'rows': len(results),
+        'overtime_hours': round(sum(row['overtime_hours'] for row in results), 2),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+    logger.info(f"Rilevamento straordinari {start} - {end}: {stats}")
+    return stats
+
+
+# =============================================================================
+# LETTURA
+# =============================================================================
+
+def for_requests(requests) -> Dict[int, DetectedOvertime]:
+    """Rilevamento del giorno di ogni richiesta di straordinario (una query)"""
+    requests = list(requests)
+    keys = {(request.employee_id, request.overtime_date) for request in requests}
+    if not keys:
+        return {}
+    rows = {(row.user_id, row.date): row for row in DetectedOvertime.query.filter(
+        tuple_(DetectedOvertime.user_id, DetectedOvertime.date).in_(list(keys))
+    )}
+    return {request.id: rows[(request.employee_id, request.overtime_date)]
+            for request in requests if (request.employee_id, request.overtime_date) in rows}
+
+
+def _without_request():
+    """Nessuna richiesta per il giorno, anche se creata dopo il rilevamento"""
+    return ~exists().where(
+        OvertimeRequest.employee_id == DetectedOvertime.user_id,
+        OvertimeRequest.overtime_date == DetectedOvertime.date,
+    )
+
+
+def unrequested(users_query, start: date, end: date, limit: int = 50) -> List[DetectedOvertime]:
+    """Giorni con straordinario rilevato ma senza richiesta, per gli utenti della query"""
+    user_ids = users_query.with_entities(User.id)
+    return DetectedOvertime.query.options(joinedload(DetectedOvertime.user)).filter(
+        DetectedOvertime.user_id.in_(user_ids),
+        DetectedOvertime.overtime_hours > 0,
+        _without_request(),
+        DetectedOvertime.date >= start,
+        DetectedOvertime.date <= end,
+    ).order_by(DetectedOvertime.date.desc(), DetectedOvertime.overtime_hours.desc()).limit(limit).all()
+
+
+def widget_stats(requests_query, users_query, start: date, end: date) -> dict:
+    """Contatori del widget straordinari: richieste per stato e ore rilevate nel periodo"""
+    counts = dict(requests_query.with_entities(
+        OvertimeRequest.status, func.count(OvertimeRequest.id)
+    ).group_by(OvertimeRequest.status).all())
+
+    detected_hours, unrequested_days = db.session.query(
+        func.coalesce(func.sum(DetectedOvertime.overtime_hours), 0),
+        func.count(DetectedOvertime.id).filter(DetectedOvertime.overtime_hours > 0, _without_request()),
+    ).filter(
+        DetectedOvertime.user_id.in_(users_query.with_entities(User.id)),
+        DetectedOvertime.date >= start,
+        DetectedOvertime.date <= end,
+    ).one()
+
+    return {
+        'total_requests': sum(counts.values()),
+        'pending_requests': counts.get('Pending', 0),
+        'approved_requests': counts.get('Approved', 0),
+        'total_hours': round(float(detected_hours), 1),
+        'unrequested_days': unrequested_days,
+    }
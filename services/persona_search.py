@@ -0,0 +1,122 @@
+"""
+Persona Search Service - Ricerca server-side della directory Personas (CIRCLE)
+
+Interroga persona_search_index (mantenuto in modo incrementale dal listener su User)
+combinando:
+- full-text PostgreSQL con prefissi ('mar' trova 'Mario') su tsvector pesato
+  (nome > ruolo/reparto > competenze/lingue > certificazioni/esperienze)
+- ILIKE sul testo normalizzato, servito dall'indice trigram (typo parziali, sottostringhe)
+
+I risultati sono ordinati per rilevanza (ts_rank) e paginati: al browser arriva solo
+la pagina richiesta, non l'intero organico.
+"""
+
+import re
+from typing import Optional
+
+from sqlalchemy import func, literal, or_
+
+from app import db
+from models import User, PersonaSearchIndex
+
+# Token ammessi nella tsquery (lettere, cifre, caratteri accentati, + # . per skill tipo C++/C#)
+_TOKEN_RE = re.compile(r"[\w+#.]+", re.UNICODE)
+
+
+def _prefix_tsquery(query_text: str) -> Optional[str]:
+    """Converte 'mario pyth' in 'mario:* & pyth:*' (None se non ci sono token validi)"""
+    tokens = []
+    for token in _TOKEN_RE.findall(query_text.lower()):
+        # Rimuove i caratteri che hanno significato nella sintassi tsquery
+        token = token.strip('.')
+        token = re.sub(r"[&|!():*<>']", '', token)
+        if token:
+            tokens.append(f"{token}:*")
+    return ' & '.join(tokens) if tokens else None
+
+
+def directory_query(company_id, exclude_user_id=None):
+    """Query base della directory: colleghi attivi, esclusi admin di sistema e amministratori"""
+    query = User.query.filter(
+        User.company_id == company_id,
+        User.active == True,
+        User.is_system_admin == False,
+        User.role != 'Amministratore',
+    )
+    if exclude_user_id is not None:
+        query = query.filter(User.id != exclude_user_id)
+    return query
+
+
+def search_personas(company_id, query_text: str = '', page: int = 1, per_page: int = 24,
+                    exclude_user_id=None):
+    """
+    Ricerca paginata e ordinata per rilevanza.
+
+    Args:
+        company_id: tenant
+        query_text: testo libero (nome, reparto, ruolo, competenze, lingue)
+        page, per_page: paginazione
+        exclude_user_id: utente da escludere (tipicamente l'utente corrente)
+
+    Returns:
+        flask_sqlalchemy Pagination con items = lista di User
+    """
+    query = directory_query(company_id, exclude_user_id)
+    query_text = (query_text or '').strip()
+
+    if not query_text:
+        return query.order_by(User.last_name, User.first_name).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+
+    ts_query_text = _prefix_tsquery(query_text)
+    # % e _ digitati dall'utente sono caratteri letterali, non jolly
+    escaped = query_text.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    like_pattern = f"%{escaped}%"
+
+    query = query.join(PersonaSearchIndex, PersonaSearchIndex.user_id == User.id)
+
+    if ts_query_text:
+        ts_query = func.to_tsquery('simple', ts_query_text)
+        match = or_(
+            PersonaSearchIndex.search_vector.op('@@')(ts_query),
+            PersonaSearchIndex.search_text.ilike(like_pattern, escape='\\'),
+        )
+        rank = func.ts_rank(PersonaSearchIndex.search_vector, ts_query)
+    else:
+        match = PersonaSearchIndex.search_text.ilike(like_pattern, escape='\\')
+        rank = literal(0)
+
+    return query.filter(match).order_by(
+        rank.desc(), User.last_name, User.first_name
+    ).paginate(page=page, per_page=per_page, error_out=False)
+
+
+def rebuild_index(company_id=None, batch_size: int = 500) -> int:
+    """
+    Ricostruisce l'indice (backfill o riallineamento), a lotti.
+
+    Args:
+        company_id: limita la ricostruzione a un tenant (None = tutti)
+
+    Returns:
+        int: numero di profili indicizzati
+    """
+    query = User.query.order_by(User.id)
+    if company_id is not None:
+        query = query.filter(User.company_id == company_id)
+
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = query.filter(User.id > last_id).limit(batch_size).all()
+        if not batch:
+            break
+        for user in batch:
+            db.session.execute(PersonaSearchIndex.upsert_statement(user))
+        db.session.commit()
+        indexed += len(batch)
+        last_id = batch[-1].id
+
+    return indexed
@@ -0,0 +1,355 @@
+"""
+Shift Presence Service - Riconciliazione turni / timbrature
+
+Per un insieme di turni (vista settimanale, export, report di copertura) le timbrature
+di tutti gli utenti coinvolti sono lette con una sola query di intervallo sull'indice
+(user_id, date), includendo il giorno successivo per i turni a cavallo della mezzanotte.
+Gli eventi di ogni utente diventano intervalli di presenza (entrata -> uscita; le pause
+restano dentro l'intervallo) confrontati con la finestra del turno:
+
+    present  copertura completa, entrata entro la tolleranza
+    late     entrata oltre la tolleranza, poi copertura completa fino a fine turno
+    partial  copertura incompleta o uscita non registrata
+    absent   nessuna timbratura nella finestra del turno
+
+I turni non ancora iniziati non hanno stato. I timestamp delle timbrature sono UTC naive
+e vengono convertiti in ora italiana, come gli orari dei turni.
+
+Il risultato dei turni di giorni già chiusi è tenuto in memoria per (utente, giorno):
+ogni commit che tocca le timbrature di quell'utente e giorno lo scarta (hook di sessione
+sotto); SHIFT_PRESENCE_TTL limita la staleness negli altri worker.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from flask import current_app
+from sqlalchemy import and_, event
+
+from app import db
+from models import AttendanceEvent, Shift, User
+
+logger = logging.getLogger(__name__)
+
+ITALY_TZ = ZoneInfo('Europe/Rome')
+
+# Tolleranza su entrata e copertura (come il calcolo del ritardo in presenze)
+TOLERANCE = timedelta(minutes=15)
+# Margine attorno al turno entro cui una timbratura è attribuita al turno
+MATCH_MARGIN = timedelta(hours=2)
+
+# Età massima di un risultato in secondi e numero massimo di (utente, giorno) per worker (default)
+DEFAULT_TTL = 3600
+MAX_ENTRIES = 20000
+
+STATUS_LABELS = {
+    'present': ('success', 'Presente'),
+    'late': ('warning', 'In ritardo'),
+    'partial': ('info', 'Presenza parziale'),
+    'absent': ('danger', 'Assente'),
+}
+
+
+def _to_local(timestamp: datetime) -> datetime:
+    """Timestamp UTC naive -> ora italiana naive (confrontabile con gli orari dei turni)"""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(ITALY_TZ).replace(tzinfo=None)
+
+
+def _shift_window(shift_date: date, start_time, end_time) -> Tuple[datetime, datetime]:
+    start = datetime.combine(shift_date, start_time)
+    end = datetime.combine(shift_date, end_time)
+    if end <= start:  # Turno a cavallo della mezzanotte
+        end += timedelta(days=1)
+    return start, end
+
+
+def _work_intervals(events: Iterable[Tuple[str, datetime]]) -> List[Tuple[datetime, Optional[datetime]]]:
+    """
+    Eventi (tipo, ora locale) ordinati -> intervalli di presenza. Un intervallo senza
+    chiusura ha fine None (uscita non registrata o ancora in servizio).
+    """
+    intervals = []
+    opened = None
+    for event_type, moment in events:
+        if event_type == 'clock_in':
+            if opened is None:
+                opened = moment
+        elif event_type == 'clock_out':
+            if opened is not None:
+                intervals.append((opened, moment))
+                opened = None
+    if opened is not None:
+        intervals.append((opened, None))
+    return intervals
+
+
+def _label(shift_date: date, start_time, end_time, intervals, now: datetime) -> Optional[dict]:
+    """Stato di presenza di un turno dati gli intervalli di presenza dell'utente"""
+    start, end = _shift_window(shift_date, start_time, end_time)
+    if now < start:
+        return None
+
+    relevant = [
+        (opened, closed) for opened, closed in intervals
+        if opened < end + MATCH_MARGIN and (closed is None or closed > start - MATCH_MARGIN)
+    ]
+    if not relevant:
+        if now < start + TOLERANCE:
+            return None
+        return _result('absent')
+
+    actual_start = relevant[0][0]
+    actual_end = relevant[-1][1]
+    missing_exit = actual_end is None and now >= end
+
+    # Minuti coperti nella finestra del turno (un intervallo aperto copre fino ad ora)
+    horizon = min(now, end)
+    covered = timedelta()
+    for opened, closed in relevant:
+        closed = closed if closed is not None else (opened if missing_exit else horizon)
+        overlap = min(closed, horizon) - max(opened, start)
+        if overlap > timedelta():
+            covered += overlap
+
+    late = actual_start > start + TOLERANCE
+    expected = horizon - max(actual_start, start) if late else horizon - start
+
+    if missing_exit or covered < expected - TOLERANCE or (late and actual_start >= end):
+        status = 'partial'
+    elif late:
+        status = 'late'
+    else:
+        status = 'present'
+
+    result = _result(status, actual_start, actual_end)
+    if status == 'late':
+        result['message'] += f" (+{int((actual_start - start).total_seconds() // 60)} min)"
+    elif missing_exit:
+        result['message'] = 'Uscita non registrata'
+    elif now < end and status == 'present':
+        result['message'] = 'In servizio'
+    result['worked_minutes'] = int(covered.total_seconds() // 60)
+    return result
+
+
+def _result(status: str, actual_start: Optional[datetime] = None,
+            actual_end: Optional[datetime] = None) -> dict:
+    color, message = STATUS_LABELS[status]
+    return {
+        'status': status,
+        'color': color,
+        'message': message,
+        'actual_start': actual_start,
+        'actual_end': actual_end,
+        'worked_minutes': 0,
+    }
+
+
+def _events_by_user(user_ids, start: date, end: date) -> Dict[int, List[Tuple[str, datetime]]]:
+    """Una query di intervallo per tutti gli utenti (giorno successivo incluso per i turni notturni)"""
+    rows = db.session.query(
+        AttendanceEvent.user_id, AttendanceEvent.event_type, AttendanceEvent.timestamp
+    ).filter(
+        AttendanceEvent.user_id.in_(list(user_ids)),
+        AttendanceEvent.date >= start,
+        AttendanceEvent.date <= end + timedelta(days=1),
+    ).order_by(AttendanceEvent.user_id, AttendanceEvent.timestamp).all()
+
+    events = defaultdict(list)
+    for row in rows:
+        events[row.user_id].append((row.event_type, _to_local(row.timestamp)))
+    return events
+
+
+def _now() -> datetime:
+    return datetime.now(ITALY_TZ).replace(tzinfo=None)
+
+
+# =============================================================================
+# CACHE DEI GIORNI CHIUSI
+# =============================================================================
+
+# (user_id, giorno) -> (istante di calcolo, {(inizio, fine): risultato})
+_closed_days: 'OrderedDict[Tuple[int, date], Tuple[float, Dict[tuple, Optional[dict]]]]' = OrderedDict()
+_lock = threading.Lock()
+
+
+def _cached(user_id: int, shift_date: date, times: tuple, ttl: float):
+    entry = _closed_days.get((user_id, shift_date))
+    if entry is None or time.monotonic() - entry[0] >= ttl:
+        return False, None
+    if times not in entry[1]:
+        return False, None
+    return True, entry[1][times]
+
+
+def _store(user_id: int, shift_date: date, times: tuple, result: Optional[dict]) -> None:
+    key = (user_id, shift_date)
+    with _lock:
+        entry = _closed_days.get(key)
+        if entry is None or time.monotonic() - entry[0] >= current_app.config.get('SHIFT_PRESENCE_TTL', DEFAULT_TTL):
+            entry = (time.monotonic(), {})
+            _closed_days[key] = entry
+        entry[1][times] = result
+        _closed_days.move_to_end(key)
+        while len(_closed_days) > MAX_ENTRIES:
+            _closed_days.popitem(last=False)
+
+
+def invalidate(user_id: Optional[int] = None, day: Optional[date] = None) -> None:
+    """
+    Scarta i risultati del giorno dell'utente e del turno notturno del giorno prima
+    (day None = tutti i giorni dell'utente, user_id None = tutti)
+    """
+    with _lock:
+        if user_id is None:
+            _closed_days.clear()
+        elif day is None:
+            for key in [key for key in _closed_days if key[0] == user_id]:
+                del _closed_days[key]
+        else:
+            _closed_days.pop((user_id, day), None)
+            _closed_days.pop((user_id, day - timedelta(days=1)), None)
+
+
+# =============================================================================
+# API
+# =============================================================================
+
+def reconcile(shifts: Iterable[Shift], now: Optional[datetime] = None) -> Dict[int, Optional[dict]]:
+    """
+    Stato di presenza di ogni turno: {shift.id: dict con status, color, message,
+    actual_start, actual_end, worked_minutes} o None se il turno non è ancora iniziato.
+
+    Esegue al più una query, solo per i turni non presenti in cache.
+    """
+    shifts = list(shifts)
+    now = now or _now()
+    today = now.date()
+    ttl = current_app.config.get('SHIFT_PRESENCE_TTL', DEFAULT_TTL)
+
+    results = {}
+    pending = []
+    for shift in shifts:
+        times = (shift.start_time, shift.end_time)
+        # Un giorno è chiuso quando anche un eventuale turno notturno è terminato
+        if shift.date < today - timedelta(days=1):
+            hit, result = _cached(shift.user_id, shift.date, times, ttl)
+            if hit:
+                results[shift.id] = result
+                continue
+        pending.append(shift)
+
+    if pending:
+        events = _events_by_user({s.user_id for s in pending},
+                                 min(s.date for s in pending), max(s.date for s in pending))
+        intervals = {user_id: _work_intervals(user_events) for user_id, user_events in events.items()}
+        for shift in pending:
+            result = _label(shift.date, shift.start_time, shift.end_time,
+                            intervals.get(shift.user_id, []), now)
+            results[shift.id] = result
+            if shift.date < today - timedelta(days=1):
+                _store(shift.user_id, shift.date, (shift.start_time, shift.end_time), result)
+
+    return results
+
+
+def coverage_report(company_id: Optional[int], start: date, end: date,
+                    sede_id: Optional[int] = None, now: Optional[datetime] = None) -> dict:
+    """
+    Report di copertura dei turni tra start e end in una sola query: turni, utenti e
+    timbrature (stesso giorno e successivo) uniti con una outer join.
+
+    Returns:
+        dict: {'shifts': [righe per turno], 'days': {giorno: conteggi per stato}, 'totals': conteggi}
+    """
+    now = now or _now()
+    query = db.session.query(
+        Shift.id, Shift.user_id, Shift.date, Shift.start_time, Shift.end_time, Shift.shift_type,
+        User.first_name, User.last_name,
+        AttendanceEvent.event_type, AttendanceEvent.timestamp,
+    ).join(User, User.id == Shift.user_id).outerjoin(
+        AttendanceEvent, and_(
+            AttendanceEvent.user_id == Shift.user_id,
+            AttendanceEvent.date >= Shift.date,
+            AttendanceEvent.date <= Shift.date + 1,
+        )
+    ).filter(Shift.date >= start, Shift.date <= end)
+
+    if company_id is not None:
+        query = query.filter(Shift.company_id == company_id)
+    if sede_id is not None:
+        query = query.filter(User.sede_id == sede_id)
+
+    shifts = OrderedDict()
+    for row in query.order_by(Shift.date, Shift.start_time, Shift.id, AttendanceEvent.timestamp):
+        shift = shifts.get(row.id)
+        if shift is None:
+            shift = shifts[row.id] = {
+                'id': row.id,
+                'date': row.date,
+                'start_time': row.start_time,
+                'end_time': row.end_time,
+                'shift_type': row.shift_type,
+                'user': f"{row.first_name} {row.last_name}",
+                'events': [],
+            }
+        if row.timestamp is not None:
+            shift['events'].append((row.event_type, _to_local(row.timestamp)))
+
+    statuses = tuple(STATUS_LABELS) + ('pending',)
+    days = OrderedDict()
+    totals = dict.fromkeys(statuses, 0)
+    for shift in shifts.values():
+        shift['presence'] = _label(shift['date'], shift['start_time'], shift['end_time'],
+                                   _work_intervals(shift.pop('events')), now)
+        status = shift['presence']['status'] if shift['presence'] else 'pending'
+        days.setdefault(shift['date'], dict.fromkeys(statuses, 0))[status] += 1
+        totals[status] += 1
+
+    return {'shifts': list(shifts.values()), 'days': days, 'totals': totals}
+
+
+# =============================================================================
+# INVALIDAZIONE GUIDATA DALLE SCRITTURE
+# =============================================================================
+
+# Chiave di session.info con le coppie (utente, giorno) da invalidare al commit
+_TOUCHED_KEY = 'shift_presence_touched'
+
+
+def mark_touched(user_id: int, day: Optional[date] = None, session=None) -> None:
+    """
+    Invalida il giorno dell'utente (None = tutti i suoi giorni) al prossimo commit, per le
+    scritture Core e massive sulle timbrature che non passano dal flush
+    """
+    session = session or db.session
+    session.info.setdefault(_TOUCHED_KEY, set()).add((user_id, day))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_touched_days(session, flush_context):
+    touched = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, AttendanceEvent) and obj.date is not None:
+            if touched is None:
+                touched = session.info.setdefault(_TOUCHED_KEY, set())
+            touched.add((obj.user_id, obj.date))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_touched_days(session):
+    for user_id, day in session.info.pop(_TOUCHED_KEY, ()):
+        invalidate(user_id, day)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_touched_days(session):
+    session.info.pop(_TOUCHED_KEY, None)
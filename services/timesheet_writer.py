@@ -0,0 +1,303 @@
+"""
+Timesheet Writer Service - Scrittura a livello di mese del timesheet manuale
+
+Le compilazioni massive (bulk fill) e il salvataggio del mese lavorano su tutto il
+mese in una volta sola:
+1. caricamento unico di timbrature, sessioni, ferie/permessi e festività del mese
+   (per le timbrature l'intervallo è esteso alle settimane ISO di confine, per la
+   validazione del limite settimanale)
+2. costruzione in memoria dello stato desiderato giorno per giorno
+3. diff con lo stato esistente: le righe identiche restano, le altre vengono
+   eliminate con un solo DELETE e inserite con un solo INSERT multi-riga
+4. validazione del limite contrattuale una volta per settimana ISO
+
+Le scritture passano da Core (non dall'ORM): i timestamp sono normalizzati in UTC
+naive qui, una volta, invece che dal listener 'set' per ogni riga, e i ledger ore
+commessa e ore settimanali vengono aggiornati esplicitamente per i giorni toccati.
+"""
+
+from collections import Counter, defaultdict
+from dataclasses import dataclass, asdict
+from datetime import date, datetime, timedelta, timezone
+from calendar import monthrange
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import bindparam
+
+from app import db
+from models import (AttendanceEvent, AttendanceSession, LeaveRequest, italian_now,
+                    refresh_attendance_ledgers)
+from services import shift_presence
+from utils_contract_hours import (calculate_daily_work_hours, get_iso_week_range,
+                                  validate_weekly_limit_for_days)
+
+ITALY_TZ = ZoneInfo('Europe/Rome')
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    """Stessa normalizzazione del listener su AttendanceEvent.timestamp"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+@dataclass(frozen=True)
+class EventSpec:
+    """Timbratura desiderata (timestamp già in UTC naive)"""
+    date: date
+    event_type: str
+    timestamp: datetime
+    sede_id: Optional[int] = None
+    commessa_id: Optional[int] = None
+    entry_type: str = 'standard'
+    safety_net_assignment_id: Optional[int] = None
+    payroll_code: Optional[str] = None
+
+    @classmethod
+    def local(cls, day: date, event_type: str, local_dt: datetime, **fields) -> 'EventSpec':
+        """Crea la timbratura da un orario italiano (naive o aware)"""
+        if local_dt.tzinfo is None:
+            local_dt = local_dt.replace(tzinfo=ITALY_TZ)
+        return cls(date=day, event_type=event_type, timestamp=to_utc_naive(local_dt), **fields)
+
+    @classmethod
+    def from_row(cls, event) -> 'EventSpec':
+        return cls(
+            date=event.date,
+            event_type=event.event_type,
+            timestamp=event.timestamp,
+            sede_id=event.sede_id,
+            commessa_id=event.commessa_id,
+            entry_type=event.entry_type or 'standard',
+            safety_net_assignment_id=event.safety_net_assignment_id,
+            payroll_code=event.payroll_code,
+        )
+
+
+@dataclass
+class SessionSpec:
+    """Sessione timesheet desiderata (id None = nuova)"""
+    date: date
+    duration_hours: float
+    attendance_type_id: Optional[int]
+    start_time: Optional[object] = None
+    end_time: Optional[object] = None
+    break_start_time: Optional[object] = None
+    break_end_time: Optional[object] = None
+    sede_id: Optional[int] = None
+    commessa_id: Optional[int] = None
+    id: Optional[int] = None
+
+    FIELDS = ('date', 'duration_hours', 'attendance_type_id', 'start_time', 'end_time',
+              'break_start_time', 'break_end_time', 'sede_id', 'commessa_id')
+
+    def values(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class MonthTimesheetWriter:
+    """Stato del timesheet di un utente per un mese, caricato una volta sola"""
+
+    def __init__(self, user, company_id: Optional[int], year: int, month: int,
+                 leave_statuses: Iterable[str] = ('Approved', 'Pending')):
+        self.user = user
+        self.user_id = user.id
+        self.company_id = company_id
+        self.first_day = date(year, month, 1)
+        self.last_day = date(year, month, monthrange(year, month)[1])
+
+        # Intervallo esteso alle settimane ISO che toccano il mese
+        self.range_start = get_iso_week_range(self.first_day)[0]
+        self.range_end = get_iso_week_range(self.last_day)[1]
+
+        events_query = AttendanceEvent.query.filter(
+            AttendanceEvent.user_id == self.user_id,
+            AttendanceEvent.date >= self.range_start,
+            AttendanceEvent.date <= self.range_end,
+        )
+        leaves_query = LeaveRequest.query.filter(
+            LeaveRequest.user_id == self.user_id,
+            LeaveRequest.status.in_(list(leave_statuses)),
+            LeaveRequest.start_date <= self.range_end,
+            LeaveRequest.end_date >= self.range_start,
+        )
+        if company_id is not None:
+            events_query = events_query.filter(AttendanceEvent.company_id == company_id)
+            leaves_query = leaves_query.filter(LeaveRequest.company_id == company_id)
+
+        self.events = events_query.order_by(AttendanceEvent.timestamp).all()
+        self.events_by_day: Dict[date, List[AttendanceEvent]] = defaultdict(list)
+        for event in self.events:
+            self.events_by_day[event.date].append(event)
+
+        self.leave_dates = set()
+        for leave in leaves_query.all():
+            current = max(leave.start_date, self.range_start)
+            end = min(leave.end_date, self.range_end)
+            while current <= end:
+                self.leave_dates.add(current)
+                current += timedelta(days=1)
+
+        self._touched_days = set()
+
+    # -------------------------------------------------------------------------
+    # Stato esistente
+    # -------------------------------------------------------------------------
+
+    def month_days(self):
+        current = self.first_day
+        while current <= self.last_day:
+            yield current
+            current += timedelta(days=1)
+
+    def has_live_events(self, day: date) -> bool:
+        return any(not e.is_manual for e in self.events_by_day.get(day, []))
+
+    def has_manual_events(self, day: date) -> bool:
+        return any(e.is_manual for e in self.events_by_day.get(day, []))
+
+    def is_leave_day(self, day: date) -> bool:
+        return day in self.leave_dates
+
+    # -------------------------------------------------------------------------
+    # Validazione settimanale
+    # -------------------------------------------------------------------------
+
+    def resulting_daily_hours(self, desired: Dict[date, List[EventSpec]]) -> Dict[date, float]:
+        """Ore giornaliere dopo la scrittura: giorni sostituiti = live + desiderate"""
+        resulting = []
+        for day, events in self.events_by_day.items():
+            if day in desired:
+                resulting.extend(e for e in events if not e.is_manual)
+            else:
+                resulting.extend(events)
+        for specs in desired.values():
+            resulting.extend(specs)
+        return calculate_daily_work_hours(resulting)
+
+    def validate_weeks(self, desired: Dict[date, List[EventSpec]]) -> Dict[date, Tuple[bool, str, dict]]:
+        """
+        Una validazione per ogni settimana ISO toccata dalla scrittura.
+
+        Returns:
+            dict {lunedì della settimana: (is_valid, error_message, context)}
+        """
+        daily_hours = self.resulting_daily_hours(desired)
+        weeks = sorted({get_iso_week_range(day)[0] for day in desired})
+        return {
+            week_start: validate_weekly_limit_for_days(self.user, week_start, daily_hours, self.leave_dates)
+            for week_start in weeks
+        }
+
+    # -------------------------------------------------------------------------
+    # Scrittura timbrature
+    # -------------------------------------------------------------------------
+
+    def replace_manual_events(self, desired: Dict[date, List[EventSpec]]) -> Tuple[int, int]:
+        """
+        Sostituisce le timbrature manuali dei giorni indicati (lista vuota = svuota il giorno).
+        Le timbrature live non vengono mai toccate.
+
+        Returns:
+            (inserite, eliminate)
+        """
+        to_delete = []
+        to_insert = []
+
+        for day, specs in desired.items():
+            existing = [e for e in self.events_by_day.get(day, []) if e.is_manual]
+            wanted = Counter(specs)
+            for event in existing:
+                spec = EventSpec.from_row(event)
+                if wanted[spec] > 0:
+                    wanted[spec] -= 1  # Già presente identica: nessuna scrittura
+                else:
+                    to_delete.append(event.id)
+            to_insert.extend(wanted.elements())
+
+        events = AttendanceEvent.__table__
+        if to_delete:
+            db.session.execute(events.delete().where(events.c.id.in_(to_delete)))
+        if to_insert:
+            db.session.execute(events.insert(), [
+                dict(asdict(spec), user_id=self.user_id, company_id=self.company_id, is_manual=True)
+                for spec in to_insert
+            ])
+
+        deleted_ids = set(to_delete)
+        self._touched_days.update(spec.date for spec in to_insert)
+        self._touched_days.update(e.date for e in self.events if e.id in deleted_ids)
+        return len(to_insert), len(to_delete)
+
+    # -------------------------------------------------------------------------
+    # Scrittura sessioni
+    # -------------------------------------------------------------------------
+
+    def load_sessions(self, timesheet_id: int) -> Dict[int, AttendanceSession]:
+        sessions = AttendanceSession.query.filter_by(
+            timesheet_id=timesheet_id, user_id=self.user_id
+        ).all()
+        return {s.id: s for s in sessions}
+
+    def apply_sessions(self, timesheet_id: int, upserts: List[SessionSpec],
+                       delete_ids: Iterable[int] = ()) -> Tuple[int, int, int]:
+        """
+        Applica le sessioni del mese con un DELETE, un UPDATE executemany e un INSERT.
+        Gli id non appartenenti al timesheet dell'utente vengono ignorati.
+
+        Returns:
+            (create, aggiornate, eliminate)
+        """
+        existing = self.load_sessions(timesheet_id)
+        now = italian_now()
+
+        deletes = [sid for sid in set(delete_ids) if sid in existing]
+        inserts = []
+        updates = []
+        for spec in upserts:
+            if spec.id is None:
+                inserts.append(spec)
+            elif spec.id in existing and spec.id not in deletes:
+                current = existing[spec.id]
+                if any(getattr(current, f) != v for f, v in spec.values().items()):
+                    updates.append(spec)
+                    self._touched_days.add(current.date)
+
+        sessions = AttendanceSession.__table__
+        if deletes:
+            db.session.execute(sessions.delete().where(sessions.c.id.in_(deletes)))
+        if updates:
+            params = [dict(spec.values(), b_id=spec.id, updated_at=now) for spec in updates]
+            db.session.execute(
+                sessions.update().where(sessions.c.id == bindparam('b_id')).values(
+                    {field: bindparam(field) for field in SessionSpec.FIELDS + ('updated_at',)}
+                ),
+                params
+            )
+        if inserts:
+            db.session.execute(sessions.insert(), [
+                dict(spec.values(), timesheet_id=timesheet_id, user_id=self.user_id,
+                     company_id=self.company_id, created_at=now, updated_at=now)
+                for spec in inserts
+            ])
+
+        self._touched_days.update(existing[sid].date for sid in deletes)
+        self._touched_days.update(spec.date for spec in inserts + updates)
+        return len(inserts), len(updates), len(deletes)
+
+    # -------------------------------------------------------------------------
+    # Chiusura
+    # -------------------------------------------------------------------------
+
+    def finalize(self, timesheet=None) -> None:
+        """
+        Aggiorna i ledger dei giorni toccati e invalida al commit la presenza dei turni in
+        cache (le scritture Core non passano dall'hook ORM)
+        """
+        days = [(self.user_id, day) for day in sorted(self._touched_days)]
+        refresh_attendance_ledgers(db.session.connection(), commessa_days=days, event_days=days)
+        for user_id, day in days:
+            shift_presence.mark_touched(user_id, day)
+        if timesheet is not None:
+            timesheet.updated_at = italian_now()
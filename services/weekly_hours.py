@@ -0,0 +1,57 @@
+"""
+Weekly Hours Service - Backfill e riallineamento del ledger ore settimanali
+
+Il ledger (weekly_hours_ledger) è aggiornato a ogni flush che tocca timbrature o
+richieste di assenza, e le settimane mancanti vengono calcolate alla prima lettura;
+questo modulo serve per precalcolare lo storico e per riallineare un tenant dopo
+correzioni massive.
+"""
+
+import logging
+from typing import Optional
+
+from sqlalchemy import func, select, union
+
+from app import db
+from models import AttendanceEvent, User, WeeklyHoursLedger
+
+logger = logging.getLogger(__name__)
+
+
+def _weeks_to_rebuild(company_id: Optional[int] = None):
+    """Coppie (utente, lunedì) con timbrature, più quelle già presenti nel ledger"""
+    week_start = func.date_trunc('week', AttendanceEvent.date).cast(db.Date)
+    events = select(AttendanceEvent.user_id, week_start.label('week_start'))
+    ledger = select(WeeklyHoursLedger.user_id, WeeklyHoursLedger.week_start)
+
+    if company_id is not None:
+        tenant_users = select(User.id).where(User.company_id == company_id)
+        events = events.where(AttendanceEvent.user_id.in_(tenant_users))
+        ledger = ledger.where(WeeklyHoursLedger.user_id.in_(tenant_users))
+
+    weeks = union(events, ledger).subquery()
+    return select(weeks.c.user_id, weeks.c.week_start).order_by(weeks.c.user_id, weeks.c.week_start)
+
+
+def rebuild_ledger(company_id: Optional[int] = None, batch_size: int = 500) -> int:
+    """
+    Ricalcola il ledger per tutte le settimane con timbrature, a lotti.
+
+    Args:
+        company_id: limita il ricalcolo agli utenti di un tenant (None = tutti)
+
+    Returns:
+        int: numero di settimane-utente ricalcolate
+    """
+    weeks = db.session.execute(_weeks_to_rebuild(company_id)).all()
+
+    refreshed = 0
+    for start in range(0, len(weeks), batch_size):
+        connection = db.session.connection()
+        for user_id, week_start in weeks[start:start + batch_size]:
+            WeeklyHoursLedger.refresh_week(connection, user_id, week_start)
+        db.session.commit()
+        refreshed += len(weeks[start:start + batch_size])
+        logger.info(f"Ledger ore settimanali: {refreshed}/{len(weeks)} settimane ricalcolate")
+
+    return refreshed
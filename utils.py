@@ -21,7 +21,6 @@ from app import db
 from utils_tenant import filter_by_company
 import random
 import json
-import qrcode
 from io import BytesIO
 import base64
 import os
@@ -31,20 +30,13 @@ from flask import url_for, request
 # HOLIDAY & DATE MANAGEMENT
 # =============================================================================
 
-def is_italian_holiday(check_date):
+def is_italian_holiday(check_date, company_id=None, sede_id=None):
     """
-    Verifica se una data è un giorno festivo in Italia utilizzando il database
+    Verifica se una data è un giorno festivo (nazionale o della sede indicata)
+    utilizzando il calendario festività compilato del tenant
     """
-    from models import Holiday
-    
-    # Controlla festività dal database
-    holidays = Holiday.query.filter_by(
-        month=check_date.month,
-        day=check_date.day,
-        active=True
-    ).all()
-    
-    return len(holidays) > 0
+    from services import holiday_calendar
+    return holiday_calendar.is_holiday(company_id, check_date, sede_id)
 
 def get_italian_holidays():
     """
@@ -81,6 +73,8 @@ def generate_static_qr_codes():
     avviene tramite il login utente
     Restituisce True se la generazione è riuscita, False altrimenti
     """
+    import qrcode
+    
     try:
         # Ottieni configurazione per paths
         from config import get_config
@@ -1108,7 +1102,7 @@ def generate_reperibilita_shifts(start_date, end_date, created_by_id):
         day_coverages = [c for c in coverage_configs if c.day_of_week == day_of_week]
         
         # Add holiday coverages if this date is a holiday
-        if is_italian_holiday(current_date):
+        if is_italian_holiday(current_date, company_id):
             holiday_coverages = [c for c in coverage_configs if c.day_of_week == 7]  # 7 = Festivi
             day_coverages.extend(holiday_coverages)
         
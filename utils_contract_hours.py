@@ -9,8 +9,7 @@ This module provides helpers to:
 
 from datetime import date, datetime, timedelta
 from typing import Tuple, Optional, Dict, List
-from models import User, UserHRData, ContractHistory, AttendanceEvent, LeaveRequest
-from utils_tenant import filter_by_company
+from models import User, UserHRData, ContractHistory, WeeklyHoursLedger
 from utils_contract_history import get_current_snapshot
 
 
@@ -141,7 +140,8 @@ def calculate_weekly_hours_total(user_id: int, target_date: date, company_id: in
     Calculate total work hours for the ISO week containing target_date.
     
     Sums hours from all AttendanceEvents (manual + live) in the week,
-    excluding days with approved/pending leave requests.
+    excluding days with approved/pending leave requests. The total is read
+    from WeeklyHoursLedger, kept up to date on every attendance/leave write.
     
     Args:
         user_id: User ID
@@ -151,71 +151,7 @@ def calculate_weekly_hours_total(user_id: int, target_date: date, company_id: in
     Returns:
         Total hours worked in the week
     """
-    week_start, week_end = get_iso_week_range(target_date)
-    
-    # Get all attendance events in the week
-    events = filter_by_company(AttendanceEvent.query).filter(
-        AttendanceEvent.user_id == user_id,
-        AttendanceEvent.date >= week_start,
-        AttendanceEvent.date <= week_end
-    ).order_by(AttendanceEvent.date, AttendanceEvent.timestamp).all()
-    
-    # Get leave requests in the week (to exclude those days)
-    leaves = filter_by_company(LeaveRequest.query).filter(
-        LeaveRequest.user_id == user_id,
-        LeaveRequest.status.in_(['Approved', 'Pending']),
-        LeaveRequest.start_date <= week_end,
-        LeaveRequest.end_date >= week_start
-    ).all()
-    
-    # Build set of dates with leave
-    leave_dates = set()
-    for leave in leaves:
-        current_date = max(leave.start_date, week_start)
-        end_date = min(leave.end_date, week_end)
-        while current_date <= end_date:
-            leave_dates.add(current_date)
-            current_date += timedelta(days=1)
-    
-    # Calculate daily hours
-    from collections import defaultdict
-    daily_hours = defaultdict(float)
-    
-    for day_date in [week_start + timedelta(days=i) for i in range(7)]:
-        if day_date in leave_dates:
-            continue
-        
-        day_events = [e for e in events if e.date == day_date]
-        if not day_events:
-            continue
-        
-        # Calculate work hours for this day (simple clock_in/out calculation)
-        clock_in = None
-        clock_out = None
-        break_minutes = 0
-        break_start = None
-        
-        for event in day_events:
-            if event.event_type == 'clock_in':
-                clock_in = event.timestamp
-            elif event.event_type == 'clock_out':
-                clock_out = event.timestamp
-            elif event.event_type == 'break_start' and clock_in:
-                # Track break start
-                break_start = event.timestamp
-            elif event.event_type == 'break_end' and clock_in:
-                # Calculate break duration
-                if break_start:
-                    break_duration = (event.timestamp - break_start).total_seconds() / 60
-                    break_minutes += break_duration
-                    break_start = None
-        
-        if clock_in and clock_out:
-            total_minutes = (clock_out - clock_in).total_seconds() / 60
-            work_minutes = total_minutes - break_minutes
-            daily_hours[day_date] = work_minutes / 60
-    
-    return sum(daily_hours.values())
+    return WeeklyHoursLedger.hours_for_week(user_id, target_date)
 
 
 def validate_weekly_limit(
@@ -260,42 +196,61 @@ def validate_weekly_limit(
     # Calculate current weekly total (excluding the day being edited)
     week_start, week_end = get_iso_week_range(day_date)
     
-    # Get all events in the week EXCEPT the day being edited
-    events = filter_by_company(AttendanceEvent.query).filter(
-        AttendanceEvent.user_id == user_id,
-        AttendanceEvent.date >= week_start,
-        AttendanceEvent.date <= week_end,
-        AttendanceEvent.date != day_date  # Exclude day being edited
-    ).all()
-    
-    # Get leave dates
-    leaves = filter_by_company(LeaveRequest.query).filter(
-        LeaveRequest.user_id == user_id,
-        LeaveRequest.status.in_(['Approved', 'Pending']),
-        LeaveRequest.start_date <= week_end,
-        LeaveRequest.end_date >= week_start
-    ).all()
-    
-    leave_dates = set()
-    for leave in leaves:
-        current_date = max(leave.start_date, week_start)
-        end_date = min(leave.end_date, week_end)
-        while current_date <= end_date:
-            leave_dates.add(current_date)
-            current_date += timedelta(days=1)
-    
-    # Calculate hours for other days
+    # Ledger row of the week: hours of the other days, leave days already excluded
+    current_weekly_total = WeeklyHoursLedger.hours_for_week(user_id, day_date, exclude_date=day_date)
+    
+    # Calculate proposed day hours
+    if new_clock_in and new_clock_out:
+        total_minutes = (new_clock_out - new_clock_in).total_seconds() / 60
+        work_minutes = total_minutes - proposed_break_minutes
+        proposed_day_hours = work_minutes / 60
+    else:
+        proposed_day_hours = 0.0
+    
+    new_weekly_total = current_weekly_total + proposed_day_hours
+    
+    context = {
+        'work_hours_week': work_hours_week,
+        'current_weekly_total': round(current_weekly_total, 2),
+        'proposed_day_hours': round(proposed_day_hours, 2),
+        'new_weekly_total': round(new_weekly_total, 2),
+        'week_start': week_start,
+        'week_end': week_end
+    }
+    
+    # Validate against limit (allow small tolerance for rounding)
+    if new_weekly_total > work_hours_week + 0.1:  # 0.1h = 6min tolerance
+        error_msg = (
+            f"Superato limite ore settimanali contrattuale. "
+            f"Limite: {work_hours_week}h/settimana. "
+            f"Totale settimana ({week_start.strftime('%d/%m')} - {week_end.strftime('%d/%m')}): "
+            f"{round(current_weekly_total, 2)}h già registrate + {round(proposed_day_hours, 2)}h proposte = "
+            f"{round(new_weekly_total, 2)}h (eccesso: {round(new_weekly_total - work_hours_week, 2)}h)"
+        )
+        return False, error_msg, context
+    
+    return True, "", context
+
+
+def calculate_daily_work_hours(events) -> Dict[date, float]:
+    """
+    Work hours per day from a list of attendance events (ORM rows or any object
+    with date, event_type and timestamp), using the same rule as validate_weekly_limit:
+    last clock_in to last clock_out, minus completed breaks.
+    
+    Args:
+        events: Iterable of events, possibly spanning several days
+    
+    Returns:
+        Dict {date: hours} for days with both clock_in and clock_out
+    """
     from collections import defaultdict
-    daily_hours = defaultdict(float)
+    events_by_day = defaultdict(list)
+    for event in events:
+        events_by_day[event.date].append(event)
     
-    for day in [week_start + timedelta(days=i) for i in range(7)]:
-        if day == day_date or day in leave_dates:
-            continue
-        
-        day_events = [e for e in events if e.date == day]
-        if not day_events:
-            continue
-        
+    daily_hours = {}
+    for day, day_events in events_by_day.items():
         clock_in = None
         clock_out = None
         break_minutes = 0
@@ -315,38 +270,60 @@ def validate_weekly_limit(
         
         if clock_in and clock_out:
             total_minutes = (clock_out - clock_in).total_seconds() / 60
-            work_minutes = total_minutes - break_minutes
-            daily_hours[day] = work_minutes / 60
+            daily_hours[day] = (total_minutes - break_minutes) / 60
     
-    current_weekly_total = sum(daily_hours.values())
+    return daily_hours
+
+
+def validate_weekly_limit_for_days(
+    user: User,
+    week_start: date,
+    daily_hours: Dict[date, float],
+    leave_dates: set,
+    work_hours_week: Optional[float] = None
+) -> Tuple[bool, str, Dict]:
+    """
+    Validate a whole ISO week in one pass, for month-level writes.
     
-    # Calculate proposed day hours
-    if new_clock_in and new_clock_out:
-        total_minutes = (new_clock_out - new_clock_in).total_seconds() / 60
-        work_minutes = total_minutes - proposed_break_minutes
-        proposed_day_hours = work_minutes / 60
-    else:
-        proposed_day_hours = 0.0
+    Unlike validate_weekly_limit (one proposed day, events queried from the database),
+    the caller passes the final hours of every day of the week: existing days plus the
+    days being replaced. No queries are run except the contract lookup.
     
-    new_weekly_total = current_weekly_total + proposed_day_hours
+    Args:
+        user: User object
+        week_start: Monday of the ISO week
+        daily_hours: Dict {date: hours} with the resulting hours of the week
+        leave_dates: Dates with approved/pending leave (excluded from the total)
+        work_hours_week: Weekly limit if already known (looked up otherwise)
+    
+    Returns:
+        Tuple of (is_valid, error_message, context_dict)
+    """
+    if work_hours_week is None:
+        work_hours_week = get_active_work_hours_week(user, week_start)
+    
+    if not work_hours_week:
+        return True, "", {}
+    
+    week_end = week_start + timedelta(days=6)
+    weekly_total = sum(
+        hours for day, hours in daily_hours.items()
+        if week_start <= day <= week_end and day not in leave_dates
+    )
     
     context = {
         'work_hours_week': work_hours_week,
-        'current_weekly_total': round(current_weekly_total, 2),
-        'proposed_day_hours': round(proposed_day_hours, 2),
-        'new_weekly_total': round(new_weekly_total, 2),
+        'new_weekly_total': round(weekly_total, 2),
         'week_start': week_start,
         'week_end': week_end
     }
     
-    # Validate against limit (allow small tolerance for rounding)
-    if new_weekly_total > work_hours_week + 0.1:  # 0.1h = 6min tolerance
+    if weekly_total > work_hours_week + 0.1:  # 0.1h = 6min tolerance
         error_msg = (
             f"Superato limite ore settimanali contrattuale. "
             f"Limite: {work_hours_week}h/settimana. "
             f"Totale settimana ({week_start.strftime('%d/%m')} - {week_end.strftime('%d/%m')}): "
-            f"{round(current_weekly_total, 2)}h già registrate + {round(proposed_day_hours, 2)}h proposte = "
-            f"{round(new_weekly_total, 2)}h (eccesso: {round(new_weekly_total - work_hours_week, 2)}h)"
+            f"{round(weekly_total, 2)}h (eccesso: {round(weekly_total - work_hours_week, 2)}h)"
         )
         return False, error_msg, context
     